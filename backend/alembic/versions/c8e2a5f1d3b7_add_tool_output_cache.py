@@ -0,0 +1,41 @@
+"""add_tool_output_cache
+
+Revision ID: c8e2a5f1d3b7
+Revises: b7f9c2d4e8a1
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8e2a5f1d3b7'
+down_revision: Union[str, None] = 'b7f9c2d4e8a1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'tool_output_cache',
+        sa.Column('id', postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column('cache_key', sa.String(length=64), nullable=False),
+        sa.Column('variant', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('tool_name', sa.String(), nullable=False),
+        sa.Column('output', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.UniqueConstraint('cache_key', 'variant', name='uq_tool_output_cache_variant'),
+    )
+    op.create_index('ix_tool_output_cache_cache_key', 'tool_output_cache', ['cache_key'])
+    op.create_index('ix_tool_output_cache_expires_at', 'tool_output_cache', ['expires_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tool_output_cache_expires_at', table_name='tool_output_cache')
+    op.drop_index('ix_tool_output_cache_cache_key', table_name='tool_output_cache')
+    op.drop_table('tool_output_cache')
@@ -0,0 +1,33 @@
+"""add_conversation_summaries
+
+Revision ID: d5a3e9b1c7f2
+Revises: c8e2a5f1d3b7
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a3e9b1c7f2'
+down_revision: Union[str, None] = 'c8e2a5f1d3b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('conversations', sa.Column('summary', sa.Text(), nullable=True))
+    op.add_column('conversations', sa.Column('summarized_through', sa.DateTime(), nullable=True))
+    op.add_column(
+        'conversations',
+        sa.Column('summary_message_count', sa.Integer(), nullable=False, server_default='0'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('conversations', 'summary_message_count')
+    op.drop_column('conversations', 'summarized_through')
+    op.drop_column('conversations', 'summary')
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from sqlalchemy import func
+import uuid
 from uuid import UUID
 from typing import List
 from datetime import datetime, timedelta
+from app.core.api_key_cache import api_key_cache
 from app.core.database import get_db
 from app.core.dependencies import get_current_user
 from app.core.security import generate_api_key, hash_api_key
@@ -57,14 +59,16 @@ async def create_api_key(
             )
         agent_slug = agent.slug
     
-    # Create API key record with temporary hash; the final key will embed the DB ID.
-    temp_plain = generate_api_key()
-    temp_hash = hash_api_key(temp_plain)
+    # Allocate the ID up front so the plain key can embed it and be hashed once.
+    # Format: ak_<uuidhex>_<random>
+    api_key_id = uuid.uuid4()
+    final_plain = f"ak_{api_key_id.hex}_{generate_api_key()}"
     
     api_key = ApiKey(
+        id=api_key_id,
         user_id=current_user.id,
         agent_id=api_key_data.agent_id,  # Can be None for universal keys
-        key_hash=temp_hash,
+        key_hash=hash_api_key(final_plain),
         name=api_key_data.name,
         expires_at=api_key_data.expires_at,
         rate_limit_per_minute=api_key_data.rate_limit_per_minute,
@@ -73,13 +77,6 @@ async def create_api_key(
     db.add(api_key)
     db.commit()
     db.refresh(api_key)
-
-    # Now that we have the DB ID, generate the final plain key and hash.
-    # Format: ak_<uuidhex>_<random>
-    final_plain = f"ak_{api_key.id.hex}_{generate_api_key()}"
-    api_key.key_hash = hash_api_key(final_plain)
-    db.commit()
-    db.refresh(api_key)
     
     # Return response with the plain key (only shown once)
     response = ApiKeyResponse(
@@ -154,6 +151,7 @@ async def delete_api_key(
     
     db.delete(api_key)
     db.commit()
+    api_key_cache.invalidate(api_key_id)
     
     return None
 
@@ -179,6 +177,7 @@ async def toggle_api_key(
     
     api_key.is_active = not api_key.is_active
     db.commit()
+    api_key_cache.invalidate(api_key.id)
     db.refresh(api_key)
     
     agent = db.query(Agent).filter(Agent.id == api_key.agent_id).first()
@@ -275,6 +274,7 @@ async def update_api_key(
         api_key.allowed_origins = update_data.allowed_origins if len(update_data.allowed_origins) > 0 else None
     
     db.commit()
+    api_key_cache.invalidate(api_key.id)
     db.refresh(api_key)
     
     agent = db.query(Agent).filter(Agent.id == api_key.agent_id).first()
@@ -1,37 +1,41 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from uuid import UUID
 from app.core.database import get_db
 from app.core.dependencies import get_current_user
+from app.core.observability import stage
 from app.models.user import User
 from app.models.agent import Agent
 from app.models.conversation import Conversation
-from app.models.message import Message, MessageRole
-from app.schemas.chat import ChatRequest, ChatResponse
+from app.schemas.chat import ChatRequest, ChatResponse, ChatUsage
 from app.schemas.pronunciation import PronunciationAssessmentRequest, PronunciationAssessmentResponse
+from app.services.chat_turns import ChatTurn, discard_user_turn, persist_assistant_reply, start_turn
+from app.services.concurrency_limiter import UpstreamOverloaded
+from app.services.conversation_summary import conversation_summarizer
 from app.services.langchain_client import LangchainAgentService
+from app.services.llm_metrics import track_prompt_usage
 from app.services.gemini import GeminiClient
-from datetime import datetime
 
 router = APIRouter()
 
 
-@router.post("/{agent_id}", response_model=ChatResponse)
-def chat(
+def begin_chat_turn(
+    db: Session,
+    current_user: User,
     agent_id: UUID,
     chat_request: ChatRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Send a message to an agent and get a response."""
+) -> ChatTurn:
+    """Authorize the agent/conversation and run phase one of the turn."""
     # Verify agent ownership or prebuilt access
-    agent = db.query(Agent).filter(
-        Agent.id == agent_id,
-        (
-            (Agent.user_id == current_user.id)
-            | (Agent.is_prebuilt.is_(True) & Agent.is_active.is_(True))
-        ),
-    ).first()
+    with stage("agent"):
+        agent = db.query(Agent).filter(
+            Agent.id == agent_id,
+            (
+                (Agent.user_id == current_user.id)
+                | (Agent.is_prebuilt.is_(True) & Agent.is_active.is_(True))
+            ),
+        ).first()
     
     if not agent:
         raise HTTPException(
@@ -39,114 +43,26 @@ def chat(
             detail="Agent not found"
         )
     
-    # Get or create conversation
     conversation = None
     if chat_request.conversation_id:
-        conversation = db.query(Conversation).filter(
-            Conversation.id == chat_request.conversation_id,
-            Conversation.user_id == current_user.id,
-            Conversation.agent_id == agent_id
-        ).first()
+        with stage("agent"):
+            conversation = db.query(Conversation).filter(
+                Conversation.id == chat_request.conversation_id,
+                Conversation.user_id == current_user.id,
+                Conversation.agent_id == agent_id
+            ).first()
         
         if not conversation:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Conversation not found"
             )
-    else:
-        # Create new conversation
-        conversation = Conversation(
-            agent_id=agent_id,
-            user_id=current_user.id,
-            title=chat_request.message[:50] if len(chat_request.message) > 50 else chat_request.message
-        )
-        db.add(conversation)
-        db.flush()
-        
-        # If agent has a greeting message, add it to the conversation
-        if agent.greeting_message:
-            greeting_message = Message(
-                conversation_id=conversation.id,
-                role=MessageRole.ASSISTANT,
-                content=agent.greeting_message,
-            )
-            db.add(greeting_message)
     
-    # Get recent message history BEFORE saving current message.
-    recent_messages = (
-        db.query(Message)
-        .filter(Message.conversation_id == conversation.id)
-        .order_by(Message.created_at.desc())
-        .limit(8)
-        .all()
-    )
-
-    # Reverse to get chronological order
-    recent_messages.reverse()
-
-    # Save user message AFTER getting history
-    user_message = Message(
-        conversation_id=conversation.id,
-        role=MessageRole.USER,
-        content=chat_request.message,
-    )
-    db.add(user_message)
-    db.flush()
-
-    # Generate response using LangChain + Gemini (tools enabled for prebuilt agents)
-    try:
-        agent_service = LangchainAgentService()
-        assistant_response = agent_service.generate_response(
-            agent=agent,
-            history=recent_messages,
-            latest_input=chat_request.message,
-        )
-        if not assistant_response or not isinstance(assistant_response, str):
-            raise ValueError(f"Invalid response type: {type(assistant_response)}")
-        
-        # Log response for debugging (first 200 chars)
-        print(f"Agent response preview: {assistant_response[:200]}...")
-        
-        # For quiz requests, ensure response is properly formatted
-        if "quiz" in chat_request.message.lower() or "question" in chat_request.message.lower():
-            # Check if response contains quiz format
-            if "**Question 1:**" not in assistant_response and "Question 1:" not in assistant_response:
-                print("WARNING: Quiz requested but response doesn't contain Question 1 format")
-                print(f"Full response: {assistant_response[:500]}")
-    except HTTPException:
-        raise
-    except Exception as e:
-        import traceback
-        error_trace = traceback.format_exc()
-        print(f"Error generating response: {error_trace}")  # Log to console for debugging
-        db.rollback()
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error generating response: {str(e)}",
-        )
-
-    # Save assistant message
-    assistant_message = Message(
-        conversation_id=conversation.id,
-        role=MessageRole.ASSISTANT,
-        content=assistant_response,
-    )
-    db.add(assistant_message)
-
-    conversation.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(user_message)
-    db.refresh(assistant_message)
-
-    return ChatResponse(
-        conversation_id=conversation.id,
-        message=assistant_response,
-        agent_id=agent_id,
-        user_message=user_message,
-        assistant_message=assistant_message,
-    )
+    # Commits and releases the pooled connection for the duration of the LLM call.
+    return start_turn(db, agent, current_user.id, conversation, chat_request.message)
 
 
+# Registered before "/{agent_id}", which would otherwise match this path.
 @router.post("/pronunciation-assessment", response_model=PronunciationAssessmentResponse)
 async def assess_pronunciation(
     assessment_request: PronunciationAssessmentRequest,
@@ -189,7 +105,7 @@ Focus on:
 
 Be encouraging but honest. Provide specific, actionable feedback."""
 
-        response = gemini_client.generate_response(
+        response = await gemini_client.agenerate_response(
             system_prompt="You are an expert language pronunciation assessor. Always respond with valid JSON in the exact format specified.",
             messages=[{"role": "user", "content": prompt}],
             model="gemini-2.5-pro",
@@ -239,6 +155,8 @@ Be encouraging but honest. Provide specific, actionable feedback."""
             phonetic_comparison=assessment_data.get("phonetic_comparison")
         )
         
+    except UpstreamOverloaded:
+        raise
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
@@ -247,3 +165,69 @@ Be encouraging but honest. Provide specific, actionable feedback."""
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error assessing pronunciation: {str(e)}",
         )
+
+
+@router.post("/{agent_id}", response_model=ChatResponse)
+async def chat(
+    agent_id: UUID,
+    chat_request: ChatRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Send a message to an agent and get a response."""
+    # DB work is short and synchronous, so it runs in the threadpool; the LLM
+    # call is awaited and holds neither a thread nor a connection.
+    turn = await run_in_threadpool(begin_chat_turn, db, current_user, agent_id, chat_request)
+
+    # Generate response using LangChain + Gemini (tools enabled for prebuilt agents)
+    try:
+        agent_service = LangchainAgentService()
+        with track_prompt_usage() as prompt_usage:
+            assistant_response = await agent_service.agenerate_response(
+                agent=turn.agent,
+                history=turn.history,
+                latest_input=chat_request.message,
+                summary=turn.summary,
+            )
+        if not assistant_response or not isinstance(assistant_response, str):
+            raise ValueError(f"Invalid response type: {type(assistant_response)}")
+        
+        # Log response for debugging (first 200 chars)
+        print(f"Agent response preview: {assistant_response[:200]}...")
+        
+        # For quiz requests, ensure response is properly formatted
+        if "quiz" in chat_request.message.lower() or "question" in chat_request.message.lower():
+            # Check if response contains quiz format
+            if "**Question 1:**" not in assistant_response and "Question 1:" not in assistant_response:
+                print("WARNING: Quiz requested but response doesn't contain Question 1 format")
+                print(f"Full response: {assistant_response[:500]}")
+    except (HTTPException, UpstreamOverloaded):
+        await run_in_threadpool(discard_user_turn, db, turn)
+        raise
+    except Exception as e:
+        import traceback
+        error_trace = traceback.format_exc()
+        print(f"Error generating response: {error_trace}")  # Log to console for debugging
+        await run_in_threadpool(discard_user_turn, db, turn)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error generating response: {str(e)}",
+        )
+
+    # Save assistant message on a freshly checked-out connection
+    assistant_message = await run_in_threadpool(
+        persist_assistant_reply, db, turn.conversation_id, assistant_response
+    )
+    # Fold older turns into the running summary after the response is sent.
+    conversation_summarizer.schedule(background_tasks, turn.conversation_id, len(turn.history) + 2)
+    usage = prompt_usage.report()
+
+    return ChatResponse(
+        conversation_id=turn.conversation_id,
+        message=assistant_response,
+        agent_id=agent_id,
+        user_message=turn.user_message,
+        assistant_message=assistant_message,
+        usage=ChatUsage(**usage) if usage else None,
+    )
@@ -1,15 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from uuid import UUID
+from app.api.v1.chat import begin_chat_turn
 from app.core.database import get_db
 from app.core.dependencies import get_current_user
+from app.core.metrics import track_stream
 from app.models.user import User
-from app.models.agent import Agent
-from app.models.conversation import Conversation
-from app.models.message import Message, MessageRole
 from app.schemas.chat import ChatRequest
+from app.services.chat_turns import discard_user_turn, persist_assistant_reply
+from app.services.conversation_summary import conversation_summarizer
 from app.services.langchain_client import LangchainAgentService
+from app.services.llm_metrics import track_prompt_usage
 import json
 from datetime import datetime
 
@@ -20,76 +23,15 @@ router = APIRouter()
 async def chat_stream(
     agent_id: UUID,
     chat_request: ChatRequest,
+    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Stream chat responses using Server-Sent Events (SSE) compatible with Vercel AI SDK."""
-    # Verify agent ownership or prebuilt access
-    agent = db.query(Agent).filter(
-        Agent.id == agent_id,
-        (
-            (Agent.user_id == current_user.id)
-            | (Agent.is_prebuilt.is_(True) & Agent.is_active.is_(True))
-        ),
-    ).first()
-    
-    if not agent:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Agent not found"
-        )
-    
-    # Get or create conversation
-    conversation = None
-    if chat_request.conversation_id:
-        conversation = db.query(Conversation).filter(
-            Conversation.id == chat_request.conversation_id,
-            Conversation.user_id == current_user.id,
-            Conversation.agent_id == agent_id
-        ).first()
-        
-        if not conversation:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Conversation not found"
-            )
-    else:
-        # Create new conversation
-        conversation = Conversation(
-            agent_id=agent_id,
-            user_id=current_user.id,
-            title=chat_request.message[:50] if len(chat_request.message) > 50 else chat_request.message
-        )
-        db.add(conversation)
-        db.flush()
-        
-        # If agent has a greeting message, add it to the conversation
-        if agent.greeting_message:
-            greeting_message = Message(
-                conversation_id=conversation.id,
-                role=MessageRole.ASSISTANT,
-                content=agent.greeting_message,
-            )
-            db.add(greeting_message)
-    
-    # Get recent message history
-    recent_messages = (
-        db.query(Message)
-        .filter(Message.conversation_id == conversation.id)
-        .order_by(Message.created_at.desc())
-        .limit(8)
-        .all()
-    )
-    recent_messages.reverse()
-    
-    # Save user message
-    user_message = Message(
-        conversation_id=conversation.id,
-        role=MessageRole.USER,
-        content=chat_request.message,
-    )
-    db.add(user_message)
-    db.flush()
+    # Phase one runs in the threadpool and releases the connection while the response streams.
+    turn = await run_in_threadpool(begin_chat_turn, db, current_user, agent_id, chat_request)
+    agent = turn.agent
+    conversation_id = turn.conversation_id
     
     # Generate streaming response
     agent_service = LangchainAgentService()
@@ -98,31 +40,33 @@ async def chat_stream(
     async def generate():
         nonlocal full_response
         try:
-            async for chunk in agent_service.stream_response(
-                agent=agent,
-                history=recent_messages,
-                latest_input=chat_request.message,
-            ):
-                if chunk:
-                    full_response += chunk
-                    # Format as SSE (Server-Sent Events) compatible with Vercel AI SDK
-                    # Format: data: {"id":"...","object":"chat.completion.chunk","choices":[{"delta":{"content":"chunk"}}]}
-                    data = {
-                        "id": str(conversation.id),
-                        "object": "chat.completion.chunk",
-                        "created": int(datetime.utcnow().timestamp()),
-                        "model": agent.model,
-                        "choices": [{
-                            "index": 0,
-                            "delta": {"content": chunk},
-                            "finish_reason": None
-                        }]
-                    }
-                    yield f"data: {json.dumps(data)}\n\n"
+            with track_prompt_usage() as prompt_usage:
+                async for chunk in agent_service.stream_response(
+                    agent=agent,
+                    history=turn.history,
+                    latest_input=chat_request.message,
+                    summary=turn.summary,
+                ):
+                    if chunk:
+                        full_response += chunk
+                        # Format as SSE (Server-Sent Events) compatible with Vercel AI SDK
+                        # Format: data: {"id":"...","object":"chat.completion.chunk","choices":[{"delta":{"content":"chunk"}}]}
+                        data = {
+                            "id": str(conversation_id),
+                            "object": "chat.completion.chunk",
+                            "created": int(datetime.utcnow().timestamp()),
+                            "model": agent.model,
+                            "choices": [{
+                                "index": 0,
+                                "delta": {"content": chunk},
+                                "finish_reason": None
+                            }]
+                        }
+                        yield f"data: {json.dumps(data)}\n\n"
             
             # Send final chunk with finish_reason
             final_data = {
-                "id": str(conversation.id),
+                "id": str(conversation_id),
                 "object": "chat.completion.chunk",
                 "created": int(datetime.utcnow().timestamp()),
                 "model": agent.model,
@@ -130,22 +74,19 @@ async def chat_stream(
                     "index": 0,
                     "delta": {},
                     "finish_reason": "stop"
-                }]
+                }],
+                "usage": prompt_usage.report(),
             }
             yield f"data: {json.dumps(final_data)}\n\n"
             yield "data: [DONE]\n\n"
             
             # Save assistant message after streaming completes
-            assistant_message = Message(
-                conversation_id=conversation.id,
-                role=MessageRole.ASSISTANT,
-                content=full_response,
-            )
-            db.add(assistant_message)
-            conversation.updated_at = datetime.utcnow()
-            db.commit()
+            await run_in_threadpool(persist_assistant_reply, db, conversation_id, full_response)
+            # Runs once the stream has been sent (the tasks are the response's background).
+            conversation_summarizer.schedule(background_tasks, conversation_id, len(turn.history) + 2)
             
         except Exception as e:
+            await run_in_threadpool(discard_user_turn, db, turn)
             error_data = {
                 "error": {
                     "message": str(e),
@@ -155,7 +96,7 @@ async def chat_stream(
             yield f"data: {json.dumps(error_data)}\n\n"
     
     return StreamingResponse(
-        generate(),
+        track_stream(generate()),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
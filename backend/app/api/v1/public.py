@@ -1,18 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Response, status
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from uuid import UUID
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple, Union
+from app.core.config import settings
 from app.core.database import get_db
-from app.core.dependencies import get_api_key_user
+from app.core.dependencies import charge_api_key, get_api_key_user, get_uncharged_api_key_user
+from app.core.observability import stage
 from app.models.user import User
 from app.models.agent import Agent
 from app.models.api_key import ApiKey
 from app.models.conversation import Conversation
 from app.models.message import Message, MessageRole
-from app.schemas.chat import ChatRequest, ChatResponse
+from app.schemas.chat import (
+    BatchChatItemResult,
+    BatchChatRequest,
+    BatchChatResponse,
+    ChatRequest,
+    ChatResponse,
+    ChatUsage,
+)
 from app.schemas.agent import AgentResponse
+from app.services.chat_turns import ChatTurn, discard_user_turn, persist_assistant_reply, start_turn
+from app.services.concurrency_limiter import UpstreamOverloaded
+from app.services.conversation_summary import conversation_summarizer
 from app.services.langchain_client import LangchainAgentService
-from datetime import datetime
+from app.services.llm_metrics import track_prompt_usage
 
 router = APIRouter()
 
@@ -75,17 +89,9 @@ def get_public_agent(
     return agent
 
 
-@router.post("/agents/{agent_slug}/chat", response_model=ChatResponse)
-def public_chat(
-    agent_slug: str,
-    chat_request: ChatRequest,
-    user_and_key: tuple[User, ApiKey] = Depends(get_api_key_user),
-    db: Session = Depends(get_db)
-):
-    """Send a message to an agent via public API (using agent slug)."""
-    current_user, api_key = user_and_key
-    
-    # Find the agent by slug
+@stage("agent")
+def _public_agent(db: Session, api_key: ApiKey, agent_slug: str) -> Agent:
+    """Find an active prebuilt agent by slug that ``api_key`` may use."""
     agent = db.query(Agent).filter(
         Agent.slug == agent_slug,
         Agent.is_prebuilt.is_(True),
@@ -104,102 +110,234 @@ def public_chat(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="API key is not authorized for this agent"
         )
-    
-    # Get or create conversation
+    return agent
+
+
+def _start_public_turn(
+    db: Session,
+    current_user: User,
+    agent: Agent,
+    chat_request: ChatRequest,
+) -> ChatTurn:
+    """Authorize the conversation (if any) and run phase one of the turn."""
     conversation = None
     if chat_request.conversation_id:
-        conversation = db.query(Conversation).filter(
-            Conversation.id == chat_request.conversation_id,
-            Conversation.user_id == current_user.id,
-            Conversation.agent_id == agent.id
-        ).first()
+        with stage("agent"):
+            conversation = db.query(Conversation).filter(
+                Conversation.id == chat_request.conversation_id,
+                Conversation.user_id == current_user.id,
+                Conversation.agent_id == agent.id
+            ).first()
         
         if not conversation:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Conversation not found"
             )
-    else:
-        # Create new conversation
-        conversation = Conversation(
-            agent_id=agent.id,
-            user_id=current_user.id,
-            title=chat_request.message[:50] if len(chat_request.message) > 50 else chat_request.message
-        )
-        db.add(conversation)
-        db.flush()
-        
-        # If agent has a greeting message, add it to the conversation
-        if agent.greeting_message:
-            greeting_message = Message(
-                conversation_id=conversation.id,
-                role=MessageRole.ASSISTANT,
-                content=agent.greeting_message,
-            )
-            db.add(greeting_message)
-    
-    # Get recent message history.
-    recent_messages = (
-        db.query(Message)
-        .filter(Message.conversation_id == conversation.id)
-        .order_by(Message.created_at.desc())
-        .limit(8)
-        .all()
-    )
     
-    # Reverse to get chronological order
-    recent_messages.reverse()
-    
-    # Save user message
-    user_message = Message(
-        conversation_id=conversation.id,
-        role=MessageRole.USER,
-        content=chat_request.message,
+    # Commits and releases the pooled connection for the duration of the LLM call.
+    return start_turn(db, agent, current_user.id, conversation, chat_request.message)
+
+
+def begin_public_chat_turn(
+    db: Session,
+    current_user: User,
+    api_key: ApiKey,
+    agent_slug: str,
+    chat_request: ChatRequest,
+) -> ChatTurn:
+    """Resolve and authorize the agent/conversation and run phase one of the turn."""
+    agent = _public_agent(db, api_key, agent_slug)
+    return _start_public_turn(db, current_user, agent, chat_request)
+
+
+@router.post("/agents/{agent_slug}/chat", response_model=ChatResponse)
+async def public_chat(
+    agent_slug: str,
+    chat_request: ChatRequest,
+    background_tasks: BackgroundTasks,
+    user_and_key: tuple[User, ApiKey] = Depends(get_api_key_user),
+    db: Session = Depends(get_db)
+):
+    """Send a message to an agent via public API (using agent slug)."""
+    current_user, api_key = user_and_key
+    turn = await run_in_threadpool(
+        begin_public_chat_turn, db, current_user, api_key, agent_slug, chat_request
     )
-    db.add(user_message)
-    db.flush()
     
     # Generate response using LangChain + Gemini (tools enabled for prebuilt agents)
     try:
         agent_service = LangchainAgentService()
-        assistant_response = agent_service.generate_response(
-            agent=agent,
-            history=recent_messages,
-            latest_input=chat_request.message,
-        )
+        with track_prompt_usage() as prompt_usage:
+            assistant_response = await agent_service.agenerate_response(
+                agent=turn.agent,
+                history=turn.history,
+                latest_input=chat_request.message,
+                summary=turn.summary,
+            )
         if not assistant_response or not isinstance(assistant_response, str):
             raise ValueError(f"Invalid response type: {type(assistant_response)}")
-    except HTTPException:
+    except (HTTPException, UpstreamOverloaded):
+        await run_in_threadpool(discard_user_turn, db, turn)
         raise
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
         print(f"Error generating response: {error_trace}")
-        db.rollback()
+        await run_in_threadpool(discard_user_turn, db, turn)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error generating response: {str(e)}",
         )
     
-    # Save assistant message
-    assistant_message = Message(
-        conversation_id=conversation.id,
-        role=MessageRole.ASSISTANT,
-        content=assistant_response,
+    # Save assistant message on a freshly checked-out connection
+    assistant_message = await run_in_threadpool(
+        persist_assistant_reply, db, turn.conversation_id, assistant_response
     )
-    db.add(assistant_message)
-    conversation.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(user_message)
-    db.refresh(assistant_message)
+    # Fold older turns into the running summary after the response is sent.
+    conversation_summarizer.schedule(background_tasks, turn.conversation_id, len(turn.history) + 2)
+    usage = prompt_usage.report()
     
     return ChatResponse(
-        conversation_id=conversation.id,
+        conversation_id=turn.conversation_id,
         message=assistant_response,
-        agent_id=agent.id,
-        user_message=user_message,
+        agent_id=turn.agent.id,
+        user_message=turn.user_message,
         assistant_message=assistant_message,
+        usage=ChatUsage(**usage) if usage else None,
+    )
+
+
+def _start_public_turns(
+    db: Session,
+    current_user: User,
+    agent: Agent,
+    items: List[ChatRequest],
+) -> List[Union[ChatTurn, HTTPException]]:
+    """Phase one for every batch item; an item that fails to start gets its error.
+
+    Any failure stays with its item, so the turns already started are still
+    answered (or discarded) by the batch.
+    """
+    turns: List[Union[ChatTurn, HTTPException]] = []
+    for item in items:
+        try:
+            turns.append(_start_public_turn(db, current_user, agent, item))
+        except HTTPException as e:
+            db.rollback()
+            turns.append(e)
+        except Exception as e:
+            db.rollback()
+            print(f"Error starting batch item: {e}")
+            turns.append(HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Error starting the conversation: {str(e)}",
+            ))
+    return turns
+
+
+def _batch_error(index: int, error: BaseException) -> BatchChatItemResult:
+    if isinstance(error, HTTPException):
+        return BatchChatItemResult(index=index, status_code=error.status_code, error=str(error.detail))
+    if isinstance(error, UpstreamOverloaded):
+        return BatchChatItemResult(
+            index=index,
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            error="The model is overloaded. Please retry shortly.",
+        )
+    return BatchChatItemResult(
+        index=index,
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        error=f"Error generating response: {str(error)}",
+    )
+
+
+@router.post("/agents/{agent_slug}/chat:batch", response_model=BatchChatResponse)
+async def public_chat_batch(
+    agent_slug: str,
+    batch_request: BatchChatRequest,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    user_and_key: tuple[User, ApiKey] = Depends(get_uncharged_api_key_user),
+    db: Session = Depends(get_db)
+):
+    """Send several independent messages to an agent in one request (public API).
+    
+    The key is authenticated and the agent resolved once, and the batch is
+    charged to the rate limit as one request per item. Items are generated
+    concurrently, so each conversation may appear at most once; each item
+    gets its own result or error, in request order.
+    """
+    current_user, api_key = user_and_key
+    items = batch_request.items
+    if len(items) > settings.PUBLIC_CHAT_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"A batch can contain at most {settings.PUBLIC_CHAT_BATCH_MAX_ITEMS} messages",
+        )
+    conversation_ids = [item.conversation_id for item in items if item.conversation_id]
+    if len(conversation_ids) != len(set(conversation_ids)):
+        # Items run concurrently, so two turns of one conversation would interleave.
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="A batch can contain at most one message per conversation",
+        )
+    charge_api_key(api_key, response, cost=len(items))
+    agent = await run_in_threadpool(_public_agent, db, api_key, agent_slug)
+    turns = await run_in_threadpool(_start_public_turns, db, current_user, agent, items)
+    
+    agent_service = LangchainAgentService()
+    semaphore = asyncio.Semaphore(max(1, settings.PUBLIC_CHAT_BATCH_CONCURRENCY))
+    
+    async def generate(turn: ChatTurn, message: str) -> Tuple[str, Optional[Dict[str, int]]]:
+        # Each item runs in its own task, so its prompt usage is tracked separately.
+        async with semaphore:
+            with track_prompt_usage() as prompt_usage:
+                reply = await agent_service.agenerate_response(
+                    agent=turn.agent,
+                    history=turn.history,
+                    latest_input=message,
+                    summary=turn.summary,
+                )
+        if not reply or not isinstance(reply, str):
+            raise ValueError(f"Invalid response type: {type(reply)}")
+        return reply, prompt_usage.report()
+    
+    started = [(index, turn) for index, turn in enumerate(turns) if isinstance(turn, ChatTurn)]
+    replies = await asyncio.gather(
+        *(generate(turn, items[index].message) for index, turn in started),
+        return_exceptions=True,
     )
+    outcomes = dict(zip((index for index, _ in started), replies))
+    
+    results: List[BatchChatItemResult] = []
+    for index, turn in enumerate(turns):
+        if isinstance(turn, HTTPException):
+            results.append(_batch_error(index, turn))
+            continue
+        outcome = outcomes[index]
+        if isinstance(outcome, BaseException):
+            await run_in_threadpool(discard_user_turn, db, turn)
+            results.append(_batch_error(index, outcome))
+            continue
+        reply, usage = outcome
+        assistant_message = await run_in_threadpool(
+            persist_assistant_reply, db, turn.conversation_id, reply
+        )
+        conversation_summarizer.schedule(background_tasks, turn.conversation_id, len(turn.history) + 2)
+        results.append(BatchChatItemResult(
+            index=index,
+            status_code=status.HTTP_200_OK,
+            response=ChatResponse(
+                conversation_id=turn.conversation_id,
+                message=reply,
+                agent_id=turn.agent.id,
+                user_message=turn.user_message,
+                assistant_message=assistant_message,
+                usage=ChatUsage(**usage) if usage else None,
+            ),
+        ))
+    return BatchChatResponse(results=results)
 
 
 @router.post("/agents/{agent_slug}/conversations", response_model=dict)
@@ -0,0 +1,104 @@
+import hashlib
+import hmac
+import secrets
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Set, Tuple
+from uuid import UUID
+
+from app.core.config import settings
+
+
+class VerifiedApiKeyCache:
+    """Bounded LRU/TTL cache of API keys that already passed hash verification.
+
+    Entries are keyed by an HMAC-SHA256 digest of the presented key (with a
+    per-process secret, so plain keys never sit in memory) and remember the stored
+    hash they were verified against. A hit only skips the slow hash check: the key
+    row is still loaded with its ``is_active``/``expires_at`` filters, so revocation
+    takes effect immediately on every worker.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        self._max_entries = max_entries
+        self._ttl_seconds = ttl_seconds
+        self._secret = secrets.token_bytes(32)
+        self._lock = Lock()
+        self._entries: "OrderedDict[str, Tuple[UUID, str, float]]" = OrderedDict()
+        self._digests_by_key: Dict[UUID, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _digest(self, plain_key: str) -> str:
+        return hmac.new(self._secret, plain_key.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def _drop(self, digest: str) -> None:
+        api_key_id, _, _ = self._entries.pop(digest)
+        digests = self._digests_by_key.get(api_key_id)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._digests_by_key[api_key_id]
+
+    def is_verified(self, plain_key: str, api_key_id: UUID, key_hash: str) -> bool:
+        """Return True if this exact key was recently verified against ``key_hash``."""
+        digest = self._digest(plain_key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                cached_id, cached_hash, expires_at = entry
+                if expires_at > now and cached_id == api_key_id and hmac.compare_digest(cached_hash, key_hash):
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                    return True
+                self._drop(digest)
+            self.misses += 1
+            return False
+
+    def remember(self, plain_key: str, api_key_id: UUID, key_hash: str) -> None:
+        """Record a successful verification."""
+        if self._max_entries <= 0:
+            return
+        digest = self._digest(plain_key)
+        expires_at = time.monotonic() + self._ttl_seconds
+        with self._lock:
+            if digest in self._entries:
+                self._drop(digest)
+            self._entries[digest] = (api_key_id, key_hash, expires_at)
+            self._digests_by_key.setdefault(api_key_id, set()).add(digest)
+            while len(self._entries) > self._max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, api_key_id: UUID) -> None:
+        """Forget every cached verification for an API key."""
+        with self._lock:
+            for digest in list(self._digests_by_key.get(api_key_id, ())):
+                self._drop(digest)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._digests_by_key.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+api_key_cache = VerifiedApiKeyCache(
+    max_entries=settings.API_KEY_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.API_KEY_CACHE_TTL_SECONDS,
+)
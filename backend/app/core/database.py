@@ -6,10 +6,20 @@ from app.core.config import settings
 # Engine configuration tuned for production-style performance and reliability.
 # - pool_pre_ping avoids using stale connections (recommended by SQLAlchemy docs)
 # - pool_recycle prevents idle connections from timing out at the DB/server level
+# - pool size/overflow/timeout are configurable per deployment (see Settings)
+_pool_options = {}
+if not settings.DATABASE_URL.startswith("sqlite"):
+    _pool_options = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+    }
+
 engine = create_engine(
     settings.DATABASE_URL,
     pool_pre_ping=True,
-    pool_recycle=1800,  # recycle connections every 30 minutes
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    **_pool_options,
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -17,6 +27,18 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+def dialect_insert(session):
+    """Return the dialect's ``insert`` construct (it supports ``on_conflict_do_*``)."""
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError(f"Upserts are not supported for the {dialect} dialect")
+    return insert
+
+
 def get_db():
     """Dependency for getting database session."""
     db = SessionLocal()
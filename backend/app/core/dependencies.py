@@ -1,23 +1,29 @@
-from fastapi import Depends, HTTPException, status, Header, Request
+from fastapi import Depends, HTTPException, status, Header, Request, Response
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from typing import Optional
-from datetime import datetime, timedelta
+from datetime import datetime
 from uuid import UUID
-from threading import Lock
-from collections import defaultdict
 from urllib.parse import urlparse
+from app.core.api_key_cache import api_key_cache
 from app.core.database import get_db
-from app.core.security import decode_access_token, verify_api_key
+from app.core.observability import stage
+from app.core.rate_limit import get_rate_limiter
+from app.core.usage_metering import usage_meter
+from app.core.security import (
+    api_key_needs_rehash,
+    decode_access_token,
+    hash_api_key,
+    verify_api_key,
+)
 from app.models.user import User
 from app.models.api_key import ApiKey
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login", auto_error=False)
-_rate_limit_lock = Lock()
-_rate_limit_state = defaultdict(lambda: {"window_start": None, "count": 0})
 
 
-async def get_current_user(
+@stage("auth")
+def get_current_user(
     request: Request,
     token: Optional[str] = Depends(oauth2_scheme),
     db: Session = Depends(get_db),
@@ -80,29 +86,31 @@ def _extract_request_origin(request: Request, origin_header: Optional[str]) -> O
         return None
 
 
-def _enforce_rate_limit(key_id: str, limit: int, now: datetime) -> None:
-    with _rate_limit_lock:
-        state = _rate_limit_state[key_id]
-        window_start = state["window_start"]
-        if not window_start or now - window_start >= timedelta(minutes=1):
-            state["window_start"] = now
-            state["count"] = 1
-            return
-        if state["count"] >= limit:
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="API key rate limit exceeded. Please slow down.",
-            )
-        state["count"] += 1
+def _enforce_rate_limit(api_key: ApiKey, response: Response, cost: int = 1) -> None:
+    """Charge ``cost`` requests to the key's shared budget and set X-RateLimit-* headers."""
+    decision = get_rate_limiter().hit(api_key.id, api_key.rate_limit_per_minute, cost)
+    if not decision.allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="API key rate limit exceeded. Please slow down.",
+            headers=decision.headers(),
+        )
+    response.headers.update(decision.headers())
 
 
-async def get_api_key_user(
+def charge_api_key(api_key: ApiKey, response: Response, cost: int = 1) -> None:
+    """Count ``cost`` requests against the key's rate limit and usage in one charge."""
+    _enforce_rate_limit(api_key, response, cost)
+    usage_meter.record(api_key.id, count=cost)
+
+
+def _verified_api_key(
     request: Request,
-    x_api_key: Optional[str] = Header(None, alias="X-API-Key"),
-    origin: Optional[str] = Header(None),
-    db: Session = Depends(get_db),
-):
-    """Validate API key and return (user, api_key)."""
+    x_api_key: Optional[str],
+    origin: Optional[str],
+    db: Session,
+) -> ApiKey:
+    """Return the active key matching ``x_api_key`` if it is allowed from this origin."""
     if not x_api_key:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -129,12 +137,24 @@ async def get_api_key_user(
         .first()
     )
 
-    if not matching_key or not verify_api_key(x_api_key, matching_key.key_hash):
+    if not matching_key:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API key",
         )
 
+    if not api_key_cache.is_verified(x_api_key, matching_key.id, matching_key.key_hash):
+        if not verify_api_key(x_api_key, matching_key.key_hash):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid API key",
+            )
+        if api_key_needs_rehash(matching_key.key_hash):
+            # Transparently migrate legacy bcrypt hashes to the current scheme.
+            matching_key.key_hash = hash_api_key(x_api_key)
+            db.commit()
+        api_key_cache.remember(x_api_key, matching_key.id, matching_key.key_hash)
+
     if not matching_key.is_origin_allowed(request_origin):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -144,13 +164,43 @@ async def get_api_key_user(
             ),
         )
 
-    _enforce_rate_limit(str(matching_key.id), matching_key.rate_limit_per_minute, now)
+    return matching_key
 
-    user = db.query(User).filter(User.id == matching_key.user_id).first()
+
+def _api_key_owner(db: Session, api_key: ApiKey) -> User:
+    user = db.query(User).filter(User.id == api_key.user_id).first()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User associated with API key not found",
         )
+    return user
+
+
+@stage("auth")
+def get_api_key_user(
+    request: Request,
+    response: Response,
+    x_api_key: Optional[str] = Header(None, alias="X-API-Key"),
+    origin: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Validate API key and return (user, api_key)."""
+    api_key = _verified_api_key(request, x_api_key, origin, db)
+    charge_api_key(api_key, response)
+    return _api_key_owner(db, api_key), api_key
+
+
+@stage("auth")
+def get_uncharged_api_key_user(
+    request: Request,
+    x_api_key: Optional[str] = Header(None, alias="X-API-Key"),
+    origin: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Like ``get_api_key_user``, for endpoints that call ``charge_api_key`` themselves.
 
-    return user, matching_key
+    Batch endpoints use it to charge all of a request's items at once.
+    """
+    api_key = _verified_api_key(request, x_api_key, origin, db)
+    return _api_key_owner(db, api_key), api_key
@@ -0,0 +1,135 @@
+"""Prometheus metrics served at ``/metrics``.
+
+Multi-worker: with ``PROMETHEUS_MULTIPROC_DIR`` set in the environment before
+the app is imported (e.g. under ``uvicorn --workers``), every worker writes its
+samples to files in that directory and ``/metrics`` on any worker aggregates
+all of them. Empty the directory whenever the server starts; gauges only count
+live workers. Without the variable the metrics are per process.
+
+Request latency is labelled with the route template (``/api/v1/chat/{agent_id}``),
+never the raw path, and LLM metrics with the model and agent slug ("none" for
+custom agents), so label cardinality stays bounded. Pool and threadpool gauges
+are sampled by each worker every ``METRICS_SAMPLE_INTERVAL_SECONDS``.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, AsyncIterator, MutableMapping, Tuple
+
+from anyio import to_thread
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+logger = logging.getLogger("app.metrics")
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+_TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time from request to the last response byte, by route template.",
+    ("method", "route", "status"),
+    buckets=_LATENCY_BUCKETS,
+)
+HTTP_HEADERS_SECONDS = Histogram(
+    "http_response_headers_seconds",
+    "Time from request to the response headers, by route template.",
+    ("method", "route", "status"),
+    buckets=_LATENCY_BUCKETS,
+)
+HTTP_RESPONSE_BYTES = Counter(
+    "http_response_bytes",
+    "Response body bytes sent, by route template.",
+    ("method", "route", "status"),
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "llm_request_duration_seconds",
+    "Duration of LLM calls (retries and hedges included).",
+    ("model", "agent", "outcome"),
+    buckets=_LATENCY_BUCKETS,
+)
+LLM_TTFT_SECONDS = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time to the first chunk of streamed LLM calls.",
+    ("model", "agent"),
+    buckets=_TTFT_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "llm_tokens",
+    "Estimated prompt and completion tokens of LLM calls.",
+    ("model", "agent", "kind"),
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections", "Connections checked out of the pool.", multiprocess_mode="livesum"
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_connections", "Connections open beyond the pool size.", multiprocess_mode="livesum"
+)
+THREADPOOL_BUSY = Gauge(
+    "threadpool_busy_threads", "Threadpool tokens in use (sync endpoints and run_in_threadpool).",
+    multiprocess_mode="livesum",
+)
+THREADPOOL_SIZE = Gauge("threadpool_max_threads", "Threadpool capacity.", multiprocess_mode="livesum")
+SSE_STREAMS = Gauge("sse_streams_in_flight", "Server-sent event streams being sent.", multiprocess_mode="livesum")
+
+
+def route_label(scope: MutableMapping[str, Any]) -> str:
+    """The matched route's path template, or "unmatched" (unknown paths are not labels)."""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def sample_runtime(pool: Any) -> None:
+    """Update the pool and threadpool gauges; call from the event loop."""
+    if hasattr(pool, "checkedout"):
+        DB_POOL_CHECKED_OUT.set(pool.checkedout())
+    if hasattr(pool, "overflow"):
+        # QueuePool counts overflow from -pool_size; only connections beyond the pool count.
+        DB_POOL_OVERFLOW.set(max(0, pool.overflow()))
+    limiter = to_thread.current_default_thread_limiter()
+    THREADPOOL_BUSY.set(limiter.borrowed_tokens)
+    THREADPOOL_SIZE.set(limiter.total_tokens)
+
+
+async def run_periodic_sampling(pool: Any, interval_seconds: float) -> None:
+    """Sample the runtime gauges every ``interval_seconds`` until cancelled."""
+    while True:
+        try:
+            sample_runtime(pool)
+        except Exception:
+            logger.exception("metrics_sample_failed")
+        await asyncio.sleep(interval_seconds)
+
+
+async def track_stream(chunks: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """Yield ``chunks`` while counting the stream as in flight."""
+    SSE_STREAMS.inc()
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        SSE_STREAMS.dec()
+
+
+def mark_worker_stopped() -> None:
+    """Drop this worker's live gauges from the shared directory on shutdown."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def render() -> Tuple[bytes, str]:
+    """The exposition text of all workers (or this process) and its content type."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
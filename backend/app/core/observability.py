@@ -1,25 +1,168 @@
+"""Request timing: total duration plus a per-stage breakdown of each request.
+
+``RequestTimingMiddleware`` puts a ``StageTimer`` in a context variable for the
+duration of the request; code anywhere below it (dependencies, endpoints,
+services, tools, and the threadpool, which copies the context) adds to it with
+``stage(name)`` or ``timed_stream(name, chunks)`` and records sizes with
+``count(...)``. A stage that runs more than once per request (two LLM calls, two
+commits) accumulates. Outside a request these helpers do nothing.
+
+Stages measured before the response headers are sent go into a ``Server-Timing``
+header (with ``X-Process-Time-Ms``, the time to headers); the log line is
+written once the last byte is sent, so it also carries the stages of streamed
+responses (LLM TTFT and total), the time to headers and the bytes sent. The same
+three go to the ``http_*`` metrics by route template.
+"""
 import logging
+import threading
 import time
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.metrics import HTTP_HEADERS_SECONDS, HTTP_REQUEST_SECONDS, HTTP_RESPONSE_BYTES, route_label
 
 logger = logging.getLogger("app.observability")
 
 
-class RequestTimingMiddleware(BaseHTTPMiddleware):
-    """Lightweight request timing for production latency tracking."""
+class StageTimer:
+    """Accumulated milliseconds per stage and size counters of one request."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds * 1000
+
+    def count(self, **amounts: int) -> None:
+        with self._lock:
+            for name, amount in amounts.items():
+                self.counts[name] = self.counts.get(name, 0) + amount
+
+    def server_timing(self, total_ms: float) -> str:
+        with self._lock:
+            entries = [f"{name};dur={ms:.2f}" for name, ms in self.stages.items()]
+        entries.append(f"total;dur={total_ms:.2f}")
+        return ", ".join(entries)
+
+    def log_fields(self) -> str:
+        with self._lock:
+            fields = [f"{name}_ms={ms:.2f}" for name, ms in self.stages.items()]
+            fields += [f"{name}={amount}" for name, amount in self.counts.items()]
+        return " ".join(fields)
+
+
+_current_timer: ContextVar[Optional[StageTimer]] = ContextVar("stage_timer", default=None)
+
+
+def current_timer() -> Optional[StageTimer]:
+    return _current_timer.get()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the block (or, used as a decorator, the call) as stage ``name``."""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+async def timed_stream(name: str, chunks: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """Yield ``chunks``, timing the first one as ``<name>_ttft`` and the whole stream as ``name``."""
+    timer = _current_timer.get()
+    if timer is None:
+        async for chunk in chunks:
+            yield chunk
+        return
+    started = time.perf_counter()
+    first = True
+    try:
+        async for chunk in chunks:
+            if first:
+                timer.add(f"{name}_ttft", time.perf_counter() - started)
+                first = False
+            yield chunk
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+def count(**amounts: int) -> None:
+    """Add to the current request's size counters (e.g. ``prompt_tokens``)."""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.count(**amounts)
+
+
+class RequestTimingMiddleware:
+    """Request timing as a plain ASGI middleware.
+
+    It only watches the messages the app sends: the body is not wrapped or
+    buffered, and no extra task is started, so streamed responses pass through
+    untouched and are timed until their last byte.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-    async def dispatch(self, request: Request, call_next):
         start = time.perf_counter()
-        response = await call_next(request)
-        elapsed_ms = (time.perf_counter() - start) * 1000
-        response.headers["X-Process-Time-Ms"] = f"{elapsed_ms:.2f}"
-
-        logger.info(
-            "request_timing method=%s path=%s status=%s duration_ms=%.2f",
-            request.method,
-            request.url.path,
-            response.status_code,
-            elapsed_ms,
-        )
-        return response
+        timer = StageTimer()
+        status_code = 500
+        headers_at: Optional[float] = None
+        last_byte_at: Optional[float] = None
+        bytes_sent = 0
+
+        async def send_timed(message: Message) -> None:
+            nonlocal status_code, headers_at, last_byte_at, bytes_sent
+            if message["type"] == "http.response.start":
+                headers_at = time.perf_counter()
+                status_code = message["status"]
+                headers_ms = (headers_at - start) * 1000
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Process-Time-Ms", f"{headers_ms:.2f}")
+                headers.append("Server-Timing", timer.server_timing(headers_ms))
+            elif message["type"] == "http.response.body":
+                bytes_sent += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    last_byte_at = time.perf_counter()
+            await send(message)
+
+        token = _current_timer.set(timer)
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _current_timer.reset(token)
+            # A client that disconnects mid-stream never gets the last byte.
+            finished = last_byte_at or time.perf_counter()
+            to_headers = (headers_at or finished) - start
+            route, method = route_label(scope), scope["method"]
+            HTTP_REQUEST_SECONDS.labels(method, route, str(status_code)).observe(finished - start)
+            HTTP_HEADERS_SECONDS.labels(method, route, str(status_code)).observe(to_headers)
+            HTTP_RESPONSE_BYTES.labels(method, route, str(status_code)).inc(bytes_sent)
+            logger.info(
+                "request_timing method=%s path=%s status=%s duration_ms=%.2f headers_ms=%.2f bytes=%d %s",
+                method,
+                scope["path"],
+                status_code,
+                (finished - start) * 1000,
+                to_headers * 1000,
+                bytes_sent,
+                timer.log_fields(),
+                extra={"stages_ms": dict(timer.stages), "bytes_sent": bytes_sent, **timer.counts},
+            )
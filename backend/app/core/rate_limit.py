@@ -0,0 +1,204 @@
+"""Per-API-key rate limiting.
+
+Both backends implement GCRA (the generic cell rate algorithm), which behaves
+exactly like a token bucket holding ``limit`` tokens that refills over
+``period`` seconds, but only needs a single timestamp of state per key: the
+"theoretical arrival time" (TAT) at which the bucket will be full again.
+"""
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Callable, Dict, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.api_key import ApiKey
+
+
+@dataclass(frozen=True)
+class RateLimitDecision:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: float
+    retry_after: float = 0.0
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+
+def _remaining(budget: float, interval: float) -> int:
+    # Tolerate float error: (now + 30.0) - now is not always exactly 30.0.
+    return max(0, int(budget / interval + 1e-9))
+
+
+def _gcra(
+    tat: Optional[float],
+    now: float,
+    limit: int,
+    period: float,
+    cost: int,
+) -> Tuple[RateLimitDecision, Optional[float]]:
+    """Evaluate one request and return (decision, new TAT or None if denied)."""
+    limit = max(1, limit)
+    interval = period / limit
+    base = max(tat if tat is not None else now, now)
+    new_tat = base + interval * cost
+    allow_at = new_tat - period
+    if allow_at > now:
+        decision = RateLimitDecision(
+            allowed=False,
+            limit=limit,
+            remaining=_remaining(period - (base - now), interval),
+            reset_after=base - now,
+            retry_after=allow_at - now,
+        )
+        return decision, None
+    decision = RateLimitDecision(
+        allowed=True,
+        limit=limit,
+        remaining=_remaining(period - (new_tat - now), interval),
+        reset_after=new_tat - now,
+    )
+    return decision, new_tat
+
+
+class RateLimiter(ABC):
+    """Backend interface: charge ``cost`` requests against a key's budget."""
+
+    def __init__(self, period_seconds: float = 60.0) -> None:
+        self.period_seconds = period_seconds
+
+    @abstractmethod
+    def hit(self, key_id: UUID, limit: int, cost: int = 1) -> RateLimitDecision:
+        """Charge the key and return whether the request is allowed."""
+
+
+class InMemoryRateLimiter(RateLimiter):
+    """Process-local limiter for tests and single-worker deployments.
+
+    Keys whose bucket has fully refilled carry no information and are dropped,
+    and the table is capped at ``max_keys`` (least recently used first).
+    """
+
+    def __init__(
+        self,
+        period_seconds: float = 60.0,
+        max_keys: int = 100_000,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        super().__init__(period_seconds)
+        self._max_keys = max_keys
+        self._clock = clock
+        self._lock = Lock()
+        self._tats: "OrderedDict[UUID, float]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._tats)
+
+    def _expire_idle(self, now: float) -> None:
+        while self._tats:
+            oldest_key, oldest_tat = next(iter(self._tats.items()))
+            if oldest_tat > now and len(self._tats) <= self._max_keys:
+                break
+            del self._tats[oldest_key]
+
+    def hit(self, key_id: UUID, limit: int, cost: int = 1) -> RateLimitDecision:
+        with self._lock:
+            now = self._clock()
+            decision, new_tat = _gcra(self._tats.get(key_id), now, limit, self.period_seconds, cost)
+            if new_tat is not None:
+                self._tats[key_id] = new_tat
+                self._tats.move_to_end(key_id)
+            self._expire_idle(now)
+            return decision
+
+
+class DatabaseRateLimiter(RateLimiter):
+    """Limiter shared by every worker and node through the ``api_keys`` row.
+
+    ``rate_limit_window_start`` stores the GCRA TAT and ``rate_limit_window_count``
+    the number of requests currently counted against the bucket. The row is locked
+    with ``SELECT ... FOR UPDATE`` in a short dedicated transaction, so the check is
+    atomic across processes and does not touch the request's session. Idle keys
+    need no cleanup: a TAT in the past simply means a full bucket.
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        period_seconds: float = 60.0,
+    ) -> None:
+        super().__init__(period_seconds)
+        if session_factory is None:
+            from app.core.database import SessionLocal
+
+            session_factory = SessionLocal
+        self._session_factory = session_factory
+
+    def hit(self, key_id: UUID, limit: int, cost: int = 1) -> RateLimitDecision:
+        with self._session_factory() as session:
+            stored_tat = session.execute(
+                select(ApiKey.rate_limit_window_start)
+                .where(ApiKey.id == key_id)
+                .with_for_update()
+            ).scalar_one_or_none()
+
+            now_dt = datetime.utcnow()
+            tat = (stored_tat - now_dt).total_seconds() if stored_tat else None
+            decision, new_tat = _gcra(tat, 0.0, limit, self.period_seconds, cost)
+            if new_tat is None:
+                session.rollback()
+                return decision
+
+            interval = self.period_seconds / max(1, limit)
+            session.execute(
+                update(ApiKey)
+                .where(ApiKey.id == key_id)
+                .values(
+                    rate_limit_window_start=now_dt + timedelta(seconds=new_tat),
+                    rate_limit_window_count=math.ceil(new_tat / interval),
+                )
+            )
+            session.commit()
+            return decision
+
+
+_rate_limiter: Optional[RateLimiter] = None
+
+
+def build_rate_limiter(backend: str) -> RateLimiter:
+    period = settings.RATE_LIMIT_PERIOD_SECONDS
+    if backend == "memory":
+        return InMemoryRateLimiter(period_seconds=period, max_keys=settings.RATE_LIMIT_MEMORY_MAX_KEYS)
+    if backend == "database":
+        return DatabaseRateLimiter(period_seconds=period)
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {backend}")
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the process-wide limiter configured by ``RATE_LIMIT_BACKEND``."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = build_rate_limiter(settings.RATE_LIMIT_BACKEND)
+    return _rate_limiter
+
+
+def set_rate_limiter(limiter: Optional[RateLimiter]) -> None:
+    """Override the process-wide limiter (``None`` rebuilds it from settings)."""
+    global _rate_limiter
+    _rate_limiter = limiter
@@ -1,5 +1,7 @@
 from datetime import datetime, timedelta
 from typing import Optional
+import hashlib
+import hmac
 import bcrypt
 from jose import JWTError, jwt
 from app.core.config import settings
@@ -53,16 +55,36 @@ def decode_access_token(token: str) -> Optional[dict]:
         return None
 
 
+# Versioned API key hash format. Keys are high-entropy random tokens, so a keyed
+# fast hash is as strong as bcrypt here; hashes without this prefix are legacy
+# bcrypt values that get upgraded after their next successful verification.
+API_KEY_HASH_PREFIX = "hmac-sha256$"
+
+
+def _api_key_pepper() -> bytes:
+    return (settings.API_KEY_PEPPER or settings.SECRET_KEY).encode("utf-8")
+
+
 def hash_api_key(api_key: str) -> str:
-    """Hash an API key for storage."""
-    return _safe_hash(api_key)
+    """Hash an API key for storage (peppered HMAC-SHA256)."""
+    digest = hmac.new(_api_key_pepper(), api_key.encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"{API_KEY_HASH_PREFIX}{digest}"
 
 
 def verify_api_key(plain_key: str, hashed_key: str) -> bool:
-    """Verify an API key against its hash."""
+    """Verify an API key against its hash (current or legacy bcrypt format)."""
+    if not hashed_key:
+        return False
+    if hashed_key.startswith(API_KEY_HASH_PREFIX):
+        return hmac.compare_digest(hash_api_key(plain_key), hashed_key)
     return _safe_check(plain_key, hashed_key)
 
 
+def api_key_needs_rehash(hashed_key: str) -> bool:
+    """Return True if a stored API key hash uses an outdated scheme."""
+    return not (hashed_key or "").startswith(API_KEY_HASH_PREFIX)
+
+
 def generate_api_key() -> str:
     """Generate a new API key."""
     import secrets
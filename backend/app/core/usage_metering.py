@@ -0,0 +1,133 @@
+"""Write-behind API key usage metering.
+
+Requests are counted in memory per worker and flushed periodically in one
+transaction: a single multi-row upsert into ``api_key_usage_daily`` and a
+single ``UPDATE`` of ``api_keys.total_requests``/``last_used_at``.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import date, datetime
+from threading import Lock
+from typing import Callable, Dict, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import case, select, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.database import dialect_insert
+from app.models.api_key import ApiKey
+from app.models.api_key_usage_daily import ApiKeyUsageDaily
+
+logger = logging.getLogger("app.usage_metering")
+
+
+class UsageMeter:
+    """Aggregates per-key request counts in memory until the next flush."""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._daily: Dict[Tuple[UUID, date], int] = {}
+        self._last_used: Dict[UUID, datetime] = {}
+
+    def record(self, api_key_id: UUID, now: Optional[datetime] = None, count: int = 1) -> None:
+        now = now or datetime.utcnow()
+        with self._lock:
+            bucket = (api_key_id, now.date())
+            self._daily[bucket] = self._daily.get(bucket, 0) + count
+            previous = self._last_used.get(api_key_id)
+            if previous is None or now > previous:
+                self._last_used[api_key_id] = now
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(self._daily.values())
+
+    def _drain(self) -> Tuple[Dict[Tuple[UUID, date], int], Dict[UUID, datetime]]:
+        with self._lock:
+            daily, last_used = self._daily, self._last_used
+            self._daily, self._last_used = {}, {}
+            return daily, last_used
+
+    def _restore(self, daily: Dict[Tuple[UUID, date], int], last_used: Dict[UUID, datetime]) -> None:
+        with self._lock:
+            for bucket, count in daily.items():
+                self._daily[bucket] = self._daily.get(bucket, 0) + count
+            for api_key_id, used_at in last_used.items():
+                previous = self._last_used.get(api_key_id)
+                if previous is None or used_at > previous:
+                    self._last_used[api_key_id] = used_at
+
+    def flush(self, session_factory: Optional[Callable[[], Session]] = None) -> int:
+        """Write pending counts to the database and return how many requests were flushed.
+
+        On failure the drained counts are merged back so they are retried later.
+        """
+        daily, last_used = self._drain()
+        if not daily:
+            return 0
+        if session_factory is None:
+            from app.core.database import SessionLocal
+
+            session_factory = SessionLocal
+
+        try:
+            with session_factory() as session:
+                # Keys deleted since the request was counted would violate the FK.
+                existing = set(
+                    session.scalars(select(ApiKey.id).where(ApiKey.id.in_(list(last_used.keys()))))
+                )
+                rows = [
+                    {"id": uuid.uuid4(), "api_key_id": api_key_id, "usage_date": usage_date, "request_count": count}
+                    for (api_key_id, usage_date), count in daily.items()
+                    if api_key_id in existing
+                ]
+                if rows:
+                    insert = dialect_insert(session)
+                    stmt = insert(ApiKeyUsageDaily).values(rows)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[ApiKeyUsageDaily.api_key_id, ApiKeyUsageDaily.usage_date],
+                        set_={"request_count": ApiKeyUsageDaily.request_count + stmt.excluded.request_count},
+                    )
+                    session.execute(stmt)
+
+                    totals: Dict[UUID, int] = {}
+                    for row in rows:
+                        totals[row["api_key_id"]] = totals.get(row["api_key_id"], 0) + row["request_count"]
+                    session.execute(
+                        update(ApiKey)
+                        .where(ApiKey.id.in_(list(totals.keys())))
+                        .values(
+                            total_requests=ApiKey.total_requests + case(totals, value=ApiKey.id, else_=0),
+                            last_used_at=case(
+                                {api_key_id: last_used[api_key_id] for api_key_id in totals},
+                                value=ApiKey.id,
+                                else_=ApiKey.last_used_at,
+                            ),
+                        )
+                        .execution_options(synchronize_session=False)
+                    )
+                session.commit()
+        except Exception:
+            self._restore(daily, last_used)
+            raise
+        return sum(daily.values())
+
+    def flush_safely(self) -> None:
+        try:
+            flushed = self.flush()
+            if flushed:
+                logger.debug("usage_flush requests=%s", flushed)
+        except Exception:
+            logger.exception("usage_flush_failed pending=%s", self.pending())
+
+
+usage_meter = UsageMeter()
+
+
+async def run_periodic_flush(meter: UsageMeter, interval_seconds: float) -> None:
+    """Flush ``meter`` every ``interval_seconds`` until cancelled."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        await run_in_threadpool(meter.flush_safely)
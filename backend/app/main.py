@@ -1,5 +1,8 @@
-from fastapi import FastAPI
+import asyncio
+from fastapi import FastAPI, HTTPException, Request, Response, status
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from app.api.v1 import (
     auth,
     agents,
@@ -11,9 +14,21 @@ from app.api.v1 import (
     tutor,
 )
 from app.core.config import settings
-from app.core.database import SessionLocal
+from app.core.database import SessionLocal, engine
+from app.core.metrics import mark_worker_stopped, render as render_metrics, run_periodic_sampling
 from app.core.observability import RequestTimingMiddleware
+from app.core.usage_metering import run_periodic_flush, usage_meter
+from app.models.agent import Agent
+from app.services.concurrency_limiter import UpstreamOverloaded, concurrency_limiter
+from app.services.conversation_summary import conversation_summarizer
+from app.services.llm_registry import llm_registry
+from app.services.model_router import model_router
 from app.services.prebuilt_agents import seed_prebuilt_agents
+from app.services.prompt_cache import prompt_cache, run_periodic_refresh
+from app.services.resilience import resilience
+from app.services.single_flight import single_flight
+from app.services.tool_cache import tool_cache
+from app.services.tool_calling import tool_calling
 
 app = FastAPI(
     title="Agentic Platform API",
@@ -48,6 +63,17 @@ else:
         expose_headers=["*"],
     )
 
+
+@app.exception_handler(UpstreamOverloaded)
+async def upstream_overloaded_handler(_request: Request, exc: UpstreamOverloaded) -> JSONResponse:
+    """Shed load with 503 + Retry-After when a model's concurrency queue is full."""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "The AI model is busy right now. Please retry shortly."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 # Include routers
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["auth"])
 app.include_router(agents.router, prefix="/api/v1/agents", tags=["agents"])
@@ -79,8 +105,152 @@ def startup_seed_prebuilt_agents() -> None:
         db.close()
 
 
+@app.on_event("startup")
+async def startup_llm_registry() -> None:
+    """Configure the Gemini SDK once and pre-build chains for the prebuilt agents."""
+    if settings.TESTING or (not settings.GEMINI_API_KEY and llm_registry.needs_api_key):
+        return
+
+    db = SessionLocal()
+    try:
+        pairs = (
+            db.query(Agent.model, Agent.temperature)
+            .filter(Agent.is_prebuilt.is_(True), Agent.is_active.is_(True))
+            .distinct()
+            .all()
+        )
+    finally:
+        db.close()
+    # Runs on the event loop so the shared async transport is created here too.
+    llm_registry.warm_up(pairs)
+
+
+@app.on_event("startup")
+async def startup_prompt_cache() -> None:
+    """Register the prebuilt agents' system prompts with the provider cache and keep them fresh."""
+    if settings.TESTING or not settings.PROMPT_CACHE_ENABLED or not settings.GEMINI_API_KEY:
+        return
+    if not llm_registry.needs_api_key:
+        # A local LLM backend answers inline prompts only.
+        return
+
+    db = SessionLocal()
+    try:
+        prompts = (
+            db.query(Agent.model, Agent.system_prompt)
+            .filter(Agent.is_prebuilt.is_(True), Agent.is_active.is_(True))
+            .distinct()
+            .all()
+        )
+    finally:
+        db.close()
+    llm_registry.configure(settings.GEMINI_API_KEY)
+    await run_in_threadpool(prompt_cache.register, prompts)
+    app.state.prompt_cache_task = asyncio.create_task(
+        run_periodic_refresh(prompt_cache, settings.PROMPT_CACHE_REFRESH_MARGIN_SECONDS / 2)
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown_prompt_cache() -> None:
+    task = getattr(app.state, "prompt_cache_task", None)
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    app.state.prompt_cache_task = None
+
+
+@app.on_event("startup")
+async def startup_tool_cache() -> None:
+    """Drop expired shared tool outputs left behind since the last start."""
+    if settings.TESTING or not settings.TOOL_CACHE_AGENT_SLUGS:
+        return
+    await run_in_threadpool(tool_cache.purge_expired)
+
+
+@app.on_event("startup")
+async def startup_usage_metering() -> None:
+    """Start the background flush of buffered API key usage counts."""
+    if settings.TESTING:
+        return
+    app.state.usage_flush_task = asyncio.create_task(
+        run_periodic_flush(usage_meter, settings.USAGE_FLUSH_INTERVAL_SECONDS)
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown_usage_metering() -> None:
+    """Stop the flush loop and persist whatever is still buffered."""
+    task = getattr(app.state, "usage_flush_task", None)
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    app.state.usage_flush_task = None
+    await run_in_threadpool(usage_meter.flush_safely)
+
+
+@app.on_event("startup")
+async def startup_metrics_sampling() -> None:
+    """Sample this worker's connection pool and threadpool gauges."""
+    if settings.TESTING or not settings.METRICS_ENABLED:
+        return
+    app.state.metrics_sample_task = asyncio.create_task(
+        run_periodic_sampling(engine.pool, settings.METRICS_SAMPLE_INTERVAL_SECONDS)
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown_metrics_sampling() -> None:
+    task = getattr(app.state, "metrics_sample_task", None)
+    if task is None:
+        return
+    mark_worker_stopped()
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    app.state.metrics_sample_task = None
+
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "version": "1.0.0"}
 
- 
+
+@app.get("/health/llm")
+async def llm_health_check():
+    """Live LLM client objects and LLM request counters for this worker.
+
+    The status is "degraded" while any model's circuit breaker is not closed.
+    Internal only: the nginx config proxies just ``= /health``.
+    """
+    return {
+        "status": "degraded" if resilience.open_circuits() else "healthy",
+        "clients": llm_registry.stats(),
+        "tool_cache": tool_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "model_routing": model_router.stats(),
+        "concurrency_limits": concurrency_limiter.stats(),
+        "circuit_breakers": resilience.stats(),
+        "conversation_summaries": conversation_summarizer.stats(),
+        "prompt_cache": prompt_cache.stats(),
+        "tool_calling": tool_calling.stats(),
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics, aggregated over all workers in multiprocess mode."""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    body, content_type = await run_in_threadpool(render_metrics)
+    return Response(content=body, media_type=content_type)
@@ -5,6 +5,7 @@ from app.models.message import Message
 from app.models.api_key import ApiKey
 from app.models.api_key_usage_daily import ApiKeyUsageDaily
 from app.models.user_state import UserState
+from app.models.tool_output_cache import ToolOutputCacheEntry
 
 __all__ = [
     "User",
@@ -14,4 +15,5 @@ __all__ = [
     "ApiKey",
     "ApiKeyUsageDaily",
     "UserState",
+    "ToolOutputCacheEntry",
 ]
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey
+from sqlalchemy import Column, String, DateTime, ForeignKey, Integer, Text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 import uuid
@@ -15,6 +15,11 @@ class Conversation(Base):
     title = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    # Running summary of the oldest turns; messages created after
+    # summarized_through are sent verbatim.
+    summary = Column(Text, nullable=True)
+    summarized_through = Column(DateTime, nullable=True)
+    summary_message_count = Column(Integer, default=0, nullable=False)
 
     # Relationships
     agent = relationship("Agent", back_populates="conversations")
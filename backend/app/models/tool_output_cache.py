@@ -0,0 +1,23 @@
+from sqlalchemy import Column, String, Integer, Text, DateTime, UniqueConstraint
+from sqlalchemy.dialects.postgresql import UUID
+import uuid
+from datetime import datetime
+from app.core.database import Base
+
+
+class ToolOutputCacheEntry(Base):
+    """Shared tier of the prebuilt tool output cache (one row per cached variant)."""
+
+    __tablename__ = "tool_output_cache"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    cache_key = Column(String(64), nullable=False, index=True)
+    variant = Column(Integer, nullable=False, default=0)
+    tool_name = Column(String, nullable=False)
+    output = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        UniqueConstraint("cache_key", "variant", name="uq_tool_output_cache_variant"),
+    )
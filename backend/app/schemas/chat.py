@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from uuid import UUID
-from typing import Optional
+from typing import List, Optional
 from app.schemas.message import MessageResponse
 
 
@@ -9,10 +9,31 @@ class ChatRequest(BaseModel):
     message: str
 
 
+class ChatUsage(BaseModel):
+    prompt_tokens: int
+    history_messages: int
+    dropped_messages: int = 0
+
+
 class ChatResponse(BaseModel):
     conversation_id: UUID
     message: str
     agent_id: UUID
     user_message: Optional[MessageResponse] = None
     assistant_message: Optional[MessageResponse] = None
+    usage: Optional[ChatUsage] = None
+
+
+class BatchChatRequest(BaseModel):
+    items: List[ChatRequest] = Field(..., min_length=1)
+
+
+class BatchChatItemResult(BaseModel):
+    index: int
+    status_code: int
+    response: Optional[ChatResponse] = None
+    error: Optional[str] = None
+
 
+class BatchChatResponse(BaseModel):
+    results: List[BatchChatItemResult]
@@ -0,0 +1,160 @@
+"""Transaction boundaries for a chat turn.
+
+A turn is persisted in two short transactions so no pooled connection is held
+while the LLM is generating:
+
+1. load and authorize, save the user message, then ``release_for_generation``;
+2. after generation, ``persist_assistant_reply`` (or ``discard_user_turn`` on
+   failure) checks a connection out again for the final write.
+
+Both phases are synchronous and short; async endpoints run them in the
+threadpool and only await the LLM in between.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+from uuid import UUID
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.observability import count, stage
+from app.models.agent import Agent
+from app.models.conversation import Conversation
+from app.models.message import Message, MessageRole
+from app.services.context_window import estimate_tokens
+
+
+@dataclass
+class ChatTurn:
+    """Detached state carried from phase one to phase two of a turn."""
+
+    agent: Agent
+    history: List[Message]
+    user_message: Message
+    conversation_id: UUID
+    created_conversation: bool
+    # Running summary of the messages before ``history`` (see conversation_summary).
+    summary: Optional[str] = None
+
+
+def start_turn(
+    db: Session,
+    agent: Agent,
+    user_id: UUID,
+    conversation: Optional[Conversation],
+    content: str,
+) -> ChatTurn:
+    """Phase one: get or create the conversation, load history and save the user message.
+
+    ``conversation`` is the already authorized conversation to continue, or None
+    to start a new one. The connection is released before returning.
+    """
+    created_conversation = False
+    if conversation is None:
+        conversation = Conversation(
+            agent_id=agent.id,
+            user_id=user_id,
+            title=content[:50] if len(content) > 50 else content
+        )
+        db.add(conversation)
+        db.flush()
+        created_conversation = True
+
+        # If agent has a greeting message, add it to the conversation
+        if agent.greeting_message:
+            greeting_message = Message(
+                conversation_id=conversation.id,
+                role=MessageRole.ASSISTANT,
+                content=agent.greeting_message,
+            )
+            db.add(greeting_message)
+
+    # Get recent message history BEFORE saving current message. This is only an
+    # upper bound; the agent's token budget decides how much of it is sent.
+    with stage("history"):
+        history_query = db.query(Message).filter(Message.conversation_id == conversation.id)
+        if conversation.summarized_through is not None:
+            history_query = history_query.filter(Message.created_at > conversation.summarized_through)
+        recent_messages = (
+            history_query
+            .order_by(Message.created_at.desc())
+            .limit(settings.CHAT_HISTORY_FETCH_LIMIT)
+            .all()
+        )
+    # Reverse to get chronological order
+    recent_messages.reverse()
+
+    user_message = Message(
+        conversation_id=conversation.id,
+        role=MessageRole.USER,
+        content=content,
+    )
+    db.add(user_message)
+    db.flush()
+
+    conversation_id = conversation.id
+    summary = conversation.summary
+    release_for_generation(db, agent, recent_messages, user_message)
+    return ChatTurn(
+        agent=agent,
+        history=recent_messages,
+        user_message=user_message,
+        conversation_id=conversation_id,
+        created_conversation=created_conversation,
+        summary=summary,
+    )
+
+
+@stage("commit")
+def release_for_generation(
+    db: Session,
+    agent: Agent,
+    history: List[Message],
+    user_message: Message,
+) -> None:
+    """Commit phase one and return the connection to the pool.
+
+    Everything the rest of the request reads is expunged first so it keeps its
+    loaded state instead of being expired by the commit; touching an expired
+    attribute would silently check a connection out again and hold it.
+    """
+    db.flush()
+    for obj in [agent, *history, user_message]:
+        if obj in db:
+            db.expunge(obj)
+    db.commit()
+
+
+@stage("commit")
+def persist_assistant_reply(db: Session, conversation_id: UUID, content: str) -> Message:
+    """Phase two: save the reply and bump the conversation in one short transaction."""
+    count(completion_chars=len(content), completion_tokens=estimate_tokens(content))
+    assistant_message = Message(
+        conversation_id=conversation_id,
+        role=MessageRole.ASSISTANT,
+        content=content,
+    )
+    db.add(assistant_message)
+    db.query(Conversation).filter(Conversation.id == conversation_id).update(
+        {Conversation.updated_at: datetime.utcnow()},
+        synchronize_session=False,
+    )
+    # id/created_at are client-side defaults, so the flushed object is complete
+    # and needs no refresh (which would reopen a transaction until teardown).
+    db.flush()
+    db.expunge(assistant_message)
+    db.commit()
+    return assistant_message
+
+
+def discard_user_turn(db: Session, turn: ChatTurn) -> None:
+    """Undo phase one after a failed generation, as the old single rollback did."""
+    db.rollback()
+    if turn.created_conversation:
+        conversation = db.get(Conversation, turn.conversation_id)
+        if conversation is not None:
+            db.delete(conversation)
+    else:
+        db.query(Message).filter(Message.id == turn.user_message.id).delete(synchronize_session=False)
+    db.commit()
@@ -0,0 +1,297 @@
+"""Adaptive (AIMD) concurrency limits for upstream LLM calls, per model.
+
+Bursts used to fan out unbounded parallel calls to Gemini, which answered with
+429s and timeouts, and the client's own retries made it worse. Every upstream
+call now takes a slot from its model's limiter first:
+
+* the limit grows additively (about +1 per ``limit`` successful calls) up to
+  ``max_limit``;
+* a 429 / quota / timeout response cuts it multiplicatively
+  (``decrease_factor``) down to ``min_limit``. Calls that started before the
+  last cut do not cut it again, so one burst of failures counts once;
+* calls over the limit queue (FIFO, shared by threads and coroutines) for at
+  most ``queue_timeout`` seconds; when the queue is full or the deadline
+  passes the call is shed with ``UpstreamOverloaded``, which the API turns
+  into a 503 with ``Retry-After``.
+
+Limits are per worker process.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, Iterator, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+from app.core.config import settings
+
+logger = logging.getLogger("app.concurrency_limiter")
+
+_OVERLOAD_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ServiceUnavailable,
+    TimeoutError,
+    asyncio.TimeoutError,
+)
+_OVERLOAD_MESSAGES = ("429", "resource has been exhausted", "quota", "deadline exceeded", "timed out")
+_MAX_RETRY_AFTER_SECONDS = 60
+
+
+class UpstreamOverloaded(Exception):
+    """A call was shed because the model's concurrency limit and queue are full."""
+
+    def __init__(self, model: str, retry_after: int, reason: str) -> None:
+        super().__init__(f"{model} is overloaded ({reason}); retry in {retry_after}s")
+        self.model = model
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """True for errors that mean "send less": 429s, quota and timeouts (also when wrapped)."""
+    seen = 0
+    current: Optional[BaseException] = error
+    while current is not None and seen < 5:
+        if isinstance(current, _OVERLOAD_ERRORS):
+            return True
+        message = str(current).lower()
+        if any(marker in message for marker in _OVERLOAD_MESSAGES):
+            return True
+        current = current.__cause__ or current.__context__
+        seen += 1
+    return False
+
+
+class _Waiter:
+    """A queued caller; ``granted`` is set (under the limiter lock) when it gets a slot."""
+
+    __slots__ = ("granted", "_event", "_loop", "_future")
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        self.granted = False
+        self._loop = loop
+        self._event = threading.Event() if loop is None else None
+        self._future: Optional["asyncio.Future[None]"] = loop.create_future() if loop is not None else None
+
+    def wake(self) -> None:
+        if self._event is not None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self._future.done():
+            self._future.set_result(None)
+
+    def wait(self, timeout: float) -> None:
+        self._event.wait(timeout)
+
+    async def await_(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class _Slot:
+    __slots__ = ("generation", "started")
+
+    def __init__(self, generation: int, started: float) -> None:
+        self.generation = generation
+        self.started = started
+
+
+class _ModelLimit:
+    """AIMD limit, in-flight count and wait queue for one model."""
+
+    def __init__(self, model: str, limiter: "ConcurrencyLimiter") -> None:
+        self.model = model
+        self.limiter = limiter
+        self.limit = float(limiter.initial_limit)
+        self.in_flight = 0
+        self.generation = 0
+        self.latency = 0.0
+        self.waiters: Deque[_Waiter] = deque()
+        self.counts = dict.fromkeys(("calls", "queued", "shed", "overloads", "decreases"), 0)
+
+    @property
+    def capacity(self) -> int:
+        return max(self.limiter.min_limit, int(self.limit))
+
+    def retry_after(self) -> int:
+        """Rough time for the current queue to drain, in whole seconds."""
+        per_call = self.latency or 1.0
+        drain = per_call * (len(self.waiters) + 1) / self.capacity
+        return max(1, min(_MAX_RETRY_AFTER_SECONDS, math.ceil(drain)))
+
+    def grant_waiters(self) -> None:
+        while self.waiters and self.in_flight < self.capacity:
+            waiter = self.waiters.popleft()
+            waiter.granted = True
+            self.in_flight += 1
+            waiter.wake()
+
+
+class ConcurrencyLimiter:
+    """Per-model AIMD concurrency limits for threads and coroutines."""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        decrease_factor: float = 0.5,
+        max_queue: int = 100,
+        queue_timeout: float = 10.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.enabled = enabled
+        self.initial_limit = initial_limit
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.decrease_factor = decrease_factor
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._models: Dict[str, _ModelLimit] = {}
+
+    def _model(self, model: str) -> _ModelLimit:
+        state = self._models.get(model)
+        if state is None:
+            state = self._models[model] = _ModelLimit(model, self)
+        return state
+
+    # Acquire / release ---------------------------------------------------------
+
+    def _try_acquire(self, model: str, waiter_factory: Callable[[], _Waiter]):
+        """Take a slot now, or enqueue a waiter; raises when the queue is full."""
+        with self._lock:
+            state = self._model(model)
+            state.counts["calls"] += 1
+            if not state.waiters and state.in_flight < state.capacity:
+                state.in_flight += 1
+                return state, None
+            if len(state.waiters) >= self.max_queue:
+                state.counts["shed"] += 1
+                retry_after = state.retry_after()
+            else:
+                waiter = waiter_factory()
+                state.waiters.append(waiter)
+                state.counts["queued"] += 1
+                return state, waiter
+        logger.warning("llm_shed model=%s reason=queue_full retry_after=%ss", model, retry_after)
+        raise UpstreamOverloaded(model, retry_after, "queue full")
+
+    def _abandon(self, state: _ModelLimit, waiter: _Waiter) -> bool:
+        """Give up a queued wait; False when the slot was granted in the meantime."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            state.waiters.remove(waiter)
+            state.counts["shed"] += 1
+            retry_after = state.retry_after()
+        logger.warning("llm_shed model=%s reason=queue_timeout retry_after=%ss", state.model, retry_after)
+        raise UpstreamOverloaded(state.model, retry_after, "queue timeout")
+
+    def _slot(self, state: _ModelLimit) -> _Slot:
+        return _Slot(state.generation, self._clock())
+
+    def _release(self, state: _ModelLimit, slot: _Slot, error: Optional[BaseException]) -> None:
+        with self._lock:
+            state.in_flight -= 1
+            if error is None:
+                elapsed = self._clock() - slot.started
+                state.latency = elapsed if not state.latency else 0.8 * state.latency + 0.2 * elapsed
+                state.limit = min(float(self.max_limit), state.limit + 1.0 / state.capacity)
+            elif isinstance(error, Exception) and is_overload_error(error):
+                state.counts["overloads"] += 1
+                if slot.generation == state.generation:
+                    state.generation += 1
+                    state.counts["decreases"] += 1
+                    state.limit = max(float(self.min_limit), state.limit * self.decrease_factor)
+                    logger.info("llm_limit_decrease model=%s limit=%.1f", state.model, state.limit)
+            state.grant_waiters()
+
+    @contextmanager
+    def slot(self, model: str) -> Iterator[None]:
+        """Hold one of ``model``'s slots for a blocking upstream call."""
+        if not self.enabled:
+            yield
+            return
+        state, waiter = self._try_acquire(model, _Waiter)
+        if waiter is not None:
+            waiter.wait(self.queue_timeout)
+            self._abandon(state, waiter)
+        slot = self._slot(state)
+        try:
+            yield
+        except BaseException as e:
+            self._release(state, slot, e)
+            raise
+        self._release(state, slot, None)
+
+    @asynccontextmanager
+    async def aslot(self, model: str) -> AsyncIterator[None]:
+        """Async counterpart of ``slot``; waiting does not block the event loop."""
+        if not self.enabled:
+            yield
+            return
+        loop = asyncio.get_running_loop()
+        state, waiter = self._try_acquire(model, lambda: _Waiter(loop))
+        if waiter is not None:
+            try:
+                await waiter.await_(self.queue_timeout)
+            except asyncio.CancelledError:
+                # Cancelled while queued: hand back a slot granted in the meantime.
+                with self._lock:
+                    if waiter.granted:
+                        state.in_flight -= 1
+                        state.grant_waiters()
+                    else:
+                        state.waiters.remove(waiter)
+                raise
+            self._abandon(state, waiter)
+        slot = self._slot(state)
+        try:
+            yield
+        except BaseException as e:
+            self._release(state, slot, e)
+            raise
+        self._release(state, slot, None)
+
+    # Metrics -----------------------------------------------------------------
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                model: {
+                    "limit": round(state.limit, 2),
+                    "in_flight": state.in_flight,
+                    "queue": len(state.waiters),
+                    **state.counts,
+                }
+                for model, state in self._models.items()
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+
+
+concurrency_limiter = ConcurrencyLimiter(
+    enabled=settings.LLM_CONCURRENCY_ENABLED,
+    initial_limit=settings.LLM_CONCURRENCY_INITIAL_LIMIT,
+    min_limit=settings.LLM_CONCURRENCY_MIN_LIMIT,
+    max_limit=settings.LLM_CONCURRENCY_MAX_LIMIT,
+    decrease_factor=settings.LLM_CONCURRENCY_DECREASE_FACTOR,
+    max_queue=settings.LLM_CONCURRENCY_MAX_QUEUE,
+    queue_timeout=settings.LLM_CONCURRENCY_QUEUE_TIMEOUT_SECONDS,
+)
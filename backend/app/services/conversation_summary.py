@@ -0,0 +1,195 @@
+"""Rolling summaries for long conversations.
+
+Once a conversation has more than ``threshold`` messages that are not yet
+summarized, all but the newest ``keep_recent`` of them are folded into the
+conversation's stored running summary (the previous summary plus the folded
+turns, summarized again by a fast model). Chat turns then send the summary
+plus the messages after ``Conversation.summarized_through``.
+
+Summaries are computed lazily: a turn that leaves the unsummarized tail above
+the threshold schedules a refresh as a background task after the response is
+sent, so summarization never adds latency to the request. Until it finishes
+(or if it fails) turns simply use the previous summary.
+"""
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from fastapi import BackgroundTasks
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.conversation import Conversation
+from app.models.message import Message, MessageRole
+from app.services.context_window import truncate_to_tokens
+
+logger = logging.getLogger("app.conversation_summary")
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a tutoring conversation so it can continue "
+    "without the full transcript. Keep the learner's goals, level, preferences, "
+    "facts they shared, topics covered, questions they struggled with and any open "
+    "tasks. Drop greetings and repetition. Write plain prose or short bullet points, "
+    "at most {max_words} words, with no preamble."
+)
+# Each folded message is cut to this many tokens in the summarization prompt.
+MAX_FOLDED_MESSAGE_TOKENS = 600
+
+
+class ConversationSummarizer:
+    """Folds the oldest turns of long conversations into a stored summary."""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        threshold: int = 16,
+        keep_recent: int = 8,
+        model: str = "gemini-2.5-flash",
+        max_words: int = 250,
+        session_factory: Optional[Callable[[], Session]] = None,
+    ) -> None:
+        self._enabled = enabled
+        self._threshold = threshold
+        self._keep_recent = min(keep_recent, threshold)
+        self._model = model
+        self._max_words = max_words
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        self._running: set = set()
+        self._counts = dict.fromkeys(("scheduled", "refreshed", "skipped", "errors"), 0)
+
+    def should_refresh(self, unsummarized_messages: int) -> bool:
+        return self._enabled and unsummarized_messages > self._threshold
+
+    def schedule(self, background_tasks: BackgroundTasks, conversation_id: UUID, unsummarized_messages: int) -> bool:
+        """Queue a refresh to run after the response when the tail is over the threshold."""
+        if not self.should_refresh(unsummarized_messages):
+            return False
+        with self._lock:
+            self._counts["scheduled"] += 1
+        background_tasks.add_task(self.refresh, conversation_id)
+        return True
+
+    def refresh(self, conversation_id: UUID) -> bool:
+        """Fold the conversation's oldest unsummarized turns into its summary.
+
+        Returns True when a new summary was stored. Errors are logged, never
+        raised: this runs after the response has been sent.
+        """
+        with self._lock:
+            if conversation_id in self._running:
+                self._counts["skipped"] += 1
+                return False
+            self._running.add(conversation_id)
+        try:
+            stored = self._refresh(conversation_id)
+            with self._lock:
+                self._counts["refreshed" if stored else "skipped"] += 1
+            return stored
+        except Exception as e:
+            with self._lock:
+                self._counts["errors"] += 1
+            logger.warning("conversation_summary_failed conversation=%s error=%s", conversation_id, e)
+            return False
+        finally:
+            with self._lock:
+                self._running.discard(conversation_id)
+
+    def _refresh(self, conversation_id: UUID) -> bool:
+        # The LLM call runs with no session open, so no pooled connection is
+        # held for its duration; the store is a conditional update afterwards.
+        with self._sessions()() as session:
+            conversation = session.get(Conversation, conversation_id)
+            if conversation is None:
+                return False
+            previous_summary = conversation.summary
+            previous_through = conversation.summarized_through
+            query = session.query(Message).filter(Message.conversation_id == conversation_id)
+            if previous_through is not None:
+                query = query.filter(Message.created_at > previous_through)
+            messages = query.order_by(Message.created_at).all()
+            if not self.should_refresh(len(messages)):
+                return False
+            folded = [
+                (m.role.value if hasattr(m.role, "value") else str(m.role), m.content)
+                for m in messages[: len(messages) - self._keep_recent]
+            ]
+            folded_through = messages[len(folded) - 1].created_at
+
+        summary = self._summarize(previous_summary, folded)
+        if not summary:
+            return False
+
+        with self._sessions()() as session:
+            through = Conversation.summarized_through
+            updated = (
+                session.query(Conversation)
+                .filter(
+                    Conversation.id == conversation_id,
+                    through.is_(None) if previous_through is None else through == previous_through,
+                )
+                .update(
+                    {
+                        Conversation.summary: summary,
+                        Conversation.summarized_through: folded_through,
+                        Conversation.summary_message_count: Conversation.summary_message_count + len(folded),
+                        # A summary is not activity; keep the conversation's position in lists.
+                        Conversation.updated_at: Conversation.updated_at,
+                    },
+                    synchronize_session=False,
+                )
+            )
+            session.commit()
+        if updated:
+            logger.info("conversation_summary_stored conversation=%s folded=%s", conversation_id, len(folded))
+        return bool(updated)
+
+    def _summarize(self, previous: Optional[str], turns: List[Tuple[str, Optional[str]]]) -> str:
+        lines: List[str] = []
+        for role, content in turns:
+            if not content or not content.strip() or role == MessageRole.SYSTEM.value:
+                continue
+            speaker = "Learner" if role == MessageRole.USER.value else "Tutor"
+            lines.append(f"{speaker}: {truncate_to_tokens(content.strip(), MAX_FOLDED_MESSAGE_TOKENS)}")
+
+        prompt = ""
+        if previous:
+            prompt += f"Summary of the conversation so far:\n{previous}\n\n"
+        prompt += "Newer turns to fold into the summary:\n" + "\n\n".join(lines)
+        prompt += "\n\nWrite the updated summary."
+
+        from app.services.gemini import GeminiClient
+
+        summary = GeminiClient().generate_response(
+            system_prompt=SUMMARY_SYSTEM_PROMPT.format(max_words=self._max_words),
+            messages=[{"role": "user", "content": prompt}],
+            model=self._model,
+            temperature=0.2,
+        )
+        return (summary or "").strip()
+
+    def _sessions(self) -> Callable[[], Session]:
+        if self._session_factory is None:
+            from app.core.database import SessionLocal
+
+            return SessionLocal
+        return self._session_factory
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counts, "running": len(self._running)}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._running.clear()
+            self._counts = dict.fromkeys(self._counts, 0)
+
+
+conversation_summarizer = ConversationSummarizer(
+    enabled=settings.CONVERSATION_SUMMARY_ENABLED,
+    threshold=settings.CONVERSATION_SUMMARY_THRESHOLD_MESSAGES,
+    keep_recent=settings.CONVERSATION_SUMMARY_KEEP_RECENT_MESSAGES,
+    model=settings.CONVERSATION_SUMMARY_MODEL,
+    max_words=settings.CONVERSATION_SUMMARY_MAX_WORDS,
+)
@@ -0,0 +1,551 @@
+"""Local stand-in for Gemini, and record/replay of real Gemini responses.
+
+With ``LLM_BACKEND=fake`` (or ``replay``) the registry hands out
+``FakeGenerativeModel`` and ``FakeChatModel`` objects in place of the SDK's and
+LangChain's Gemini clients, so ``GeminiClient``, ``LangchainAgentService`` and
+``TutorWorkspaceService`` run unchanged, without an API key or network.
+
+* Latency: the first chunk arrives after a TTFT drawn from a lognormal
+  distribution around ``ttft_ms``; the rest streams at a tokens/sec rate drawn
+  the same way. Non-streaming calls return once the whole response would have
+  streamed.
+* Failures: ``rate_limit_rate`` of the calls raise ``ResourceExhausted`` (429)
+  at once and ``error_rate`` raise ``ServiceUnavailable`` (503) after the TTFT:
+  the errors the real clients raise, so retries, breakers and the concurrency
+  limiter react as they do in production.
+* Determinism: every draw comes from an RNG seeded with (seed, request, how
+  often that request was seen before), so the same seed and requests give the
+  same responses, latencies and failures however the calls interleave.
+
+``LLM_BACKEND=record`` keeps the real clients and appends every response with
+its TTFT and total time to a JSONL cassette keyed by model and prompt;
+``replay`` serves recorded responses with their recorded timings (failures are
+still injected) and falls back to generated ones for prompts it has not seen.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from google.api_core import exceptions as google_exceptions
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.core.config import settings
+
+logger = logging.getLogger("app.fake_llm")
+
+BACKENDS = ("gemini", "fake", "record", "replay")
+LOCAL_BACKENDS = ("fake", "replay")
+
+# Tokens per streamed chunk (Gemini sends a few words per chunk).
+_CHUNK_TOKENS = 8
+_TOKEN_RE = re.compile(r"\S+\s*")
+_WORDS = (
+    "the", "a", "learning", "practice", "concept", "example", "review", "question", "answer",
+    "step", "first", "next", "then", "because", "therefore", "students", "notes", "summary",
+    "explain", "key", "idea", "topic", "exam", "focus", "understand", "apply", "check", "result",
+    "simple", "important", "method", "solve", "problem", "each", "with", "and", "of", "to", "in",
+)
+
+Turns = List[Tuple[str, str]]
+
+
+def cassette_key(model: str, turns: Sequence[Tuple[str, str]]) -> str:
+    """Stable key of a request: the model and its (role, text) turns."""
+    payload = json.dumps([model, [list(turn) for turn in turns]], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, (list, tuple)):
+        return "".join(_text(part) for part in content)
+    if isinstance(content, dict):
+        return _text(content.get("text") or content.get("parts") or "")
+    return str(getattr(content, "text", content))
+
+
+def _sdk_turns(history: Optional[Sequence[Any]], prompt: Any) -> Turns:
+    """(role, text) turns of an SDK call: chat history plus the new prompt."""
+    turns = []
+    for item in history or ():
+        if isinstance(item, dict):
+            turns.append((str(item.get("role", "")), _text(item.get("parts", ""))))
+        else:
+            turns.append((str(getattr(item, "role", "")), _text(getattr(item, "parts", ""))))
+    turns.append(("user", _text(prompt)))
+    return turns
+
+
+def _message_turns(messages: Sequence[BaseMessage]) -> Turns:
+    return [(message.type, _text(message.content)) for message in messages]
+
+
+def _chunks(text: str) -> List[str]:
+    tokens = _TOKEN_RE.findall(text) or [text]
+    return ["".join(tokens[i:i + _CHUNK_TOKENS]) for i in range(0, len(tokens), _CHUNK_TOKENS)]
+
+
+def _lognormal(rng: random.Random, median: float, sigma: float) -> float:
+    if median <= 0 or sigma <= 0:
+        return max(0.0, median)
+    return rng.lognormvariate(math.log(median), sigma)
+
+
+@dataclass
+class Recording:
+    model: str
+    text: str
+    ttft_ms: float
+    total_ms: float
+
+
+class Cassette:
+    """Recorded responses in a JSONL file, one ``{"key", ...Recording}`` per line."""
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._recordings: Optional[Dict[str, List[Recording]]] = None
+
+    def _load_locked(self) -> Dict[str, List[Recording]]:
+        if self._recordings is None:
+            self._recordings = defaultdict(list)
+            if self.path.exists():
+                with self.path.open(encoding="utf-8") as handle:
+                    for line in handle:
+                        if line.strip():
+                            entry = json.loads(line)
+                            key = entry.pop("key")
+                            self._recordings[key].append(Recording(**entry))
+        return self._recordings
+
+    def lookup(self, key: str, occurrence: int = 0) -> Optional[Recording]:
+        """The ``occurrence``-th recording of ``key`` (cycling), or None."""
+        with self._lock:
+            recordings = self._load_locked().get(key)
+        if not recordings:
+            return None
+        return recordings[occurrence % len(recordings)]
+
+    def append(self, key: str, recording: Recording) -> None:
+        with self._lock:
+            self._load_locked()[key].append(recording)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as handle:
+                handle.write(json.dumps({"key": key, **asdict(recording)}, ensure_ascii=False) + "\n")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(recordings) for recordings in self._load_locked().values())
+
+
+@dataclass
+class LatencyProfile:
+    ttft_ms: float = 400.0
+    ttft_sigma: float = 0.3
+    tokens_per_second: float = 80.0
+    tokens_per_second_sigma: float = 0.1
+    output_tokens: int = 200
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+
+
+@dataclass
+class _Reply:
+    chunks: List[str]
+    ttft: float
+    chunk_delays: List[float] = field(default_factory=list)
+    error: Optional[Exception] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+
+class FakeGemini:
+    """Produces deterministic responses, latencies and failures for fake models."""
+
+    def __init__(
+        self,
+        profile: Optional[LatencyProfile] = None,
+        seed: int = 0,
+        cassette: Optional[Cassette] = None,
+        sleep: Callable[[float], None] = time.sleep,
+        async_sleep: Callable[[float], Any] = asyncio.sleep,
+    ) -> None:
+        self.profile = profile or LatencyProfile()
+        self._seed = seed
+        self._cassette = cassette
+        self._sleep = sleep
+        self._async_sleep = async_sleep
+        self._lock = threading.Lock()
+        self._seen: Dict[str, int] = defaultdict(int)
+        self._counts = dict.fromkeys(("calls", "errors", "rate_limited", "replayed", "cassette_misses"), 0)
+
+    def reply(self, model: str, turns: Turns, json_mode: bool = False) -> _Reply:
+        """Plan the response to one call: its chunks, timings and failure, if any."""
+        key = cassette_key(model, turns)
+        with self._lock:
+            occurrence = self._seen[key]
+            self._seen[key] += 1
+        rng = random.Random(f"{self._seed}:{key}:{occurrence}")
+        profile = self.profile
+        roll = rng.random()
+        ttft = _lognormal(rng, profile.ttft_ms, profile.ttft_sigma) / 1000
+        tokens_per_second = _lognormal(rng, profile.tokens_per_second, profile.tokens_per_second_sigma)
+
+        recording = self._cassette.lookup(key, occurrence) if self._cassette is not None else None
+        if recording is not None:
+            chunks = _chunks(recording.text)
+            ttft = recording.ttft_ms / 1000
+            rest = max(0.0, recording.total_ms - recording.ttft_ms) / 1000
+            chunk_delays = [rest / (len(chunks) - 1)] * (len(chunks) - 1) if len(chunks) > 1 else []
+        else:
+            chunks = _chunks(self._synthesize(rng, model, json_mode))
+            chunk_delays = [
+                len(_TOKEN_RE.findall(chunk)) / tokens_per_second if tokens_per_second > 0 else 0.0
+                for chunk in chunks[1:]
+            ]
+
+        error: Optional[Exception] = None
+        if roll < profile.rate_limit_rate:
+            error = google_exceptions.ResourceExhausted("429 Resource has been exhausted (fake backend)")
+            ttft = 0.0
+        elif roll < profile.rate_limit_rate + profile.error_rate:
+            error = google_exceptions.ServiceUnavailable("503 The model is overloaded (fake backend)")
+        with self._lock:
+            self._counts["calls"] += 1
+            if isinstance(error, google_exceptions.ResourceExhausted):
+                self._counts["rate_limited"] += 1
+            elif error is not None:
+                self._counts["errors"] += 1
+            if self._cassette is not None:
+                self._counts["replayed" if recording is not None else "cassette_misses"] += 1
+        return _Reply(chunks, ttft, chunk_delays, error)
+
+    def _synthesize(self, rng: random.Random, model: str, json_mode: bool) -> str:
+        words = [rng.choice(_WORDS) for _ in range(max(1, self.profile.output_tokens))]
+        text = " ".join(words).capitalize() + "."
+        if json_mode:
+            return json.dumps({"summary": f"Fake {model} response.", "explanation": text})
+        return text
+
+    def complete(self, reply: _Reply) -> str:
+        if reply.error is not None:
+            self._sleep(reply.ttft)
+            raise reply.error
+        self._sleep(reply.ttft + sum(reply.chunk_delays))
+        return reply.text
+
+    async def acomplete(self, reply: _Reply) -> str:
+        if reply.error is not None:
+            await self._async_sleep(reply.ttft)
+            raise reply.error
+        await self._async_sleep(reply.ttft + sum(reply.chunk_delays))
+        return reply.text
+
+    def stream(self, reply: _Reply) -> Iterator[str]:
+        self._sleep(reply.ttft)
+        if reply.error is not None:
+            raise reply.error
+        for index, chunk in enumerate(reply.chunks):
+            if index:
+                self._sleep(reply.chunk_delays[index - 1])
+            yield chunk
+
+    async def astream(self, reply: _Reply) -> AsyncIterator[str]:
+        await self._async_sleep(reply.ttft)
+        if reply.error is not None:
+            raise reply.error
+        for index, chunk in enumerate(reply.chunks):
+            if index:
+                await self._async_sleep(reply.chunk_delays[index - 1])
+            yield chunk
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**asdict(self.profile), "seed": self._seed, **self._counts}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._seen.clear()
+            self._counts = dict.fromkeys(self._counts, 0)
+
+
+# SDK stand-ins ----------------------------------------------------------------
+
+
+class _Response:
+    """The part of ``GenerateContentResponse`` the services read."""
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+
+
+async def _aresponses(chunks: AsyncIterator[str]) -> AsyncIterator[_Response]:
+    async for chunk in chunks:
+        yield _Response(chunk)
+
+
+class FakeGenerativeModel:
+    """Stand-in for ``genai.GenerativeModel`` backed by ``FakeGemini``."""
+
+    def __init__(self, backend: FakeGemini, model_name: str, generation_config: Optional[Dict[str, Any]] = None) -> None:
+        self._backend = backend
+        self.model_name = model_name
+        self._json_mode = (generation_config or {}).get("response_mime_type") == "application/json"
+
+    def _reply(self, history: Optional[Sequence[Any]], contents: Any) -> _Reply:
+        return self._backend.reply(self.model_name, _sdk_turns(history, contents), self._json_mode)
+
+    def _respond(self, history: Optional[Sequence[Any]], contents: Any, stream: bool) -> Any:
+        reply = self._reply(history, contents)
+        if stream:
+            return (_Response(chunk) for chunk in self._backend.stream(reply))
+        return _Response(self._backend.complete(reply))
+
+    async def _arespond(self, history: Optional[Sequence[Any]], contents: Any, stream: bool) -> Any:
+        reply = self._reply(history, contents)
+        if stream:
+            return _aresponses(self._backend.astream(reply))
+        return _Response(await self._backend.acomplete(reply))
+
+    def generate_content(self, contents: Any, stream: bool = False, **_kwargs: Any) -> Any:
+        return self._respond(None, contents, stream)
+
+    async def generate_content_async(self, contents: Any, stream: bool = False, **_kwargs: Any) -> Any:
+        return await self._arespond(None, contents, stream)
+
+    def start_chat(self, history: Optional[Sequence[Any]] = None, **_kwargs: Any) -> "FakeChatSession":
+        return FakeChatSession(self, list(history or ()))
+
+
+class FakeChatSession:
+    def __init__(self, model: FakeGenerativeModel, history: List[Any]) -> None:
+        self.model = model
+        self.history = history
+
+    def send_message(self, content: Any, stream: bool = False, **_kwargs: Any) -> Any:
+        return self.model._respond(self.history, content, stream)
+
+    async def send_message_async(self, content: Any, stream: bool = False, **_kwargs: Any) -> Any:
+        return await self.model._arespond(self.history, content, stream)
+
+
+# LangChain stand-in -------------------------------------------------------------
+
+
+class FakeChatModel(BaseChatModel):
+    """Stand-in for ``ChatGoogleGenerativeAI`` backed by ``FakeGemini``."""
+
+    backend: Any
+    model: str
+    temperature: float = 0.7
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    def _reply(self, messages: List[BaseMessage]) -> _Reply:
+        return self.backend.reply(self.model, _message_turns(messages))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = self.backend.complete(self._reply(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        text = await self.backend.acomplete(self._reply(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        for text in self.backend.stream(self._reply(messages)):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        async for text in self.backend.astream(self._reply(messages)):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text))
+            if run_manager:
+                await run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any) -> "FakeChatModel":
+        # The fake never asks for tools, so a function-calling turn ends after one step.
+        return self
+
+
+# Recording --------------------------------------------------------------------
+
+
+class CassetteRecorder:
+    """Appends real Gemini responses, with their TTFT and total time, to a cassette."""
+
+    def __init__(self, cassette: Cassette, clock: Callable[[], float] = time.perf_counter) -> None:
+        self.cassette = cassette
+        self._clock = clock
+
+    def record(self, model: str, turns: Turns, text: str, started: float, first_chunk_at: Optional[float]) -> None:
+        ended = self._clock()
+        first = ended if first_chunk_at is None else first_chunk_at
+        try:
+            self.cassette.append(
+                cassette_key(model, turns),
+                Recording(model, text, round((first - started) * 1000, 1), round((ended - started) * 1000, 1)),
+            )
+        except OSError:
+            logger.exception("llm_cassette_write_failed path=%s", self.cassette.path)
+
+    @staticmethod
+    def _chunk_text(chunk: Any) -> str:
+        try:
+            return chunk.text or ""
+        except ValueError:
+            # Chunks carrying only a finish reason or safety ratings have no text.
+            return ""
+
+    def wrap_stream(self, model: str, turns: Turns, response: Any, started: float) -> Iterator[Any]:
+        parts: List[str] = []
+        first_chunk_at = None
+        for chunk in response:
+            if first_chunk_at is None:
+                first_chunk_at = self._clock()
+            parts.append(self._chunk_text(chunk))
+            yield chunk
+        self.record(model, turns, "".join(parts), started, first_chunk_at)
+
+    async def awrap_stream(self, model: str, turns: Turns, response: Any, started: float) -> AsyncIterator[Any]:
+        parts: List[str] = []
+        first_chunk_at = None
+        async for chunk in response:
+            if first_chunk_at is None:
+                first_chunk_at = self._clock()
+            parts.append(self._chunk_text(chunk))
+            yield chunk
+        self.record(model, turns, "".join(parts), started, first_chunk_at)
+
+    def generative_model(self, model: Any, model_name: str) -> "RecordingGenerativeModel":
+        return RecordingGenerativeModel(model, model_name, self)
+
+    def callback(self, model: str) -> "RecordingCallback":
+        return RecordingCallback(self, model)
+
+
+class RecordingGenerativeModel:
+    """Wraps a ``genai.GenerativeModel`` and records what it returns."""
+
+    def __init__(self, model: Any, model_name: str, recorder: CassetteRecorder) -> None:
+        self._model = model
+        self.model_name = model_name
+        self._recorder = recorder
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._model, name)
+
+    def _call(self, send: Callable[..., Any], turns: Turns, contents: Any, stream: bool, kwargs: Dict[str, Any]) -> Any:
+        started = self._recorder._clock()
+        response = send(contents, stream=stream, **kwargs)
+        if stream:
+            return self._recorder.wrap_stream(self.model_name, turns, response, started)
+        self._recorder.record(self.model_name, turns, response.text, started, None)
+        return response
+
+    async def _acall(self, send: Callable[..., Any], turns: Turns, contents: Any, stream: bool, kwargs: Dict[str, Any]) -> Any:
+        started = self._recorder._clock()
+        response = await send(contents, stream=stream, **kwargs)
+        if stream:
+            return self._recorder.awrap_stream(self.model_name, turns, response, started)
+        self._recorder.record(self.model_name, turns, response.text, started, None)
+        return response
+
+    def generate_content(self, contents: Any, stream: bool = False, **kwargs: Any) -> Any:
+        return self._call(self._model.generate_content, _sdk_turns(None, contents), contents, stream, kwargs)
+
+    async def generate_content_async(self, contents: Any, stream: bool = False, **kwargs: Any) -> Any:
+        return await self._acall(self._model.generate_content_async, _sdk_turns(None, contents), contents, stream, kwargs)
+
+    def start_chat(self, history: Optional[Sequence[Any]] = None, **kwargs: Any) -> "RecordingChatSession":
+        return RecordingChatSession(self, self._model.start_chat(history=history, **kwargs), list(history or ()))
+
+
+class RecordingChatSession:
+    def __init__(self, model: RecordingGenerativeModel, chat: Any, history: List[Any]) -> None:
+        self._model = model
+        self._chat = chat
+        self._history = history
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._chat, name)
+
+    def send_message(self, content: Any, stream: bool = False, **kwargs: Any) -> Any:
+        turns = _sdk_turns(self._history, content)
+        return self._model._call(self._chat.send_message, turns, content, stream, kwargs)
+
+    async def send_message_async(self, content: Any, stream: bool = False, **kwargs: Any) -> Any:
+        turns = _sdk_turns(self._history, content)
+        return await self._model._acall(self._chat.send_message_async, turns, content, stream, kwargs)
+
+
+class RecordingCallback(BaseCallbackHandler):
+    """LangChain callback recording the responses of one ``ChatGoogleGenerativeAI`` model."""
+
+    run_inline = True
+
+    def __init__(self, recorder: CassetteRecorder, model: str) -> None:
+        self._recorder = recorder
+        self._model = model
+        self._runs: Dict[Any, List[Any]] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+        self._runs[run_id] = [_message_turns(messages[0]), self._recorder._clock(), None]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs) -> None:
+        run = self._runs.get(run_id)
+        if run is not None and run[2] is None:
+            run[2] = self._recorder._clock()
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is not None and response.generations and response.generations[0]:
+            turns, started, first_chunk_at = run
+            self._recorder.record(self._model, turns, response.generations[0][0].text, started, first_chunk_at)
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        self._runs.pop(run_id, None)
+
+
+def backend_from_settings() -> Tuple[Optional[FakeGemini], Optional[CassetteRecorder]]:
+    """The (fake backend, recorder) for ``LLM_BACKEND``; (None, None) for plain Gemini."""
+    backend = settings.LLM_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"LLM_BACKEND must be one of {', '.join(BACKENDS)}, got {backend!r}")
+    if backend == "record":
+        return None, CassetteRecorder(Cassette(settings.LLM_CASSETTE_PATH))
+    if backend not in LOCAL_BACKENDS:
+        return None, None
+    profile = LatencyProfile(
+        ttft_ms=settings.LLM_FAKE_TTFT_MS,
+        ttft_sigma=settings.LLM_FAKE_TTFT_SIGMA,
+        tokens_per_second=settings.LLM_FAKE_TOKENS_PER_SECOND,
+        tokens_per_second_sigma=settings.LLM_FAKE_TOKENS_PER_SECOND_SIGMA,
+        output_tokens=settings.LLM_FAKE_OUTPUT_TOKENS,
+        error_rate=settings.LLM_FAKE_ERROR_RATE,
+        rate_limit_rate=settings.LLM_FAKE_RATE_LIMIT_RATE,
+    )
+    cassette = Cassette(settings.LLM_CASSETTE_PATH) if backend == "replay" else None
+    return FakeGemini(profile, seed=settings.LLM_FAKE_SEED, cassette=cassette), None
@@ -1,23 +1,170 @@
 import google.generativeai as genai
-from typing import List, Dict, Optional
+from typing import AsyncIterator, Iterator, List, Dict, Optional, Tuple
 from app.core.config import settings
 from app.models.message import MessageRole
+from app.services.concurrency_limiter import UpstreamOverloaded, concurrency_limiter
+from app.services.context_window import estimate_tokens
+from app.services.llm_metrics import llm_call, llm_stream
+from app.services.llm_registry import llm_registry
+from app.services.model_router import model_router
+from app.services.prompt_cache import prompt_cache
+from app.services.resilience import GeminiError, is_retryable, resilience
+from app.services.single_flight import request_key, single_flight
 
 
 class GeminiClient:
     """Client for interacting with Google Gemini API."""
     
     def __init__(self):
-        if not settings.GEMINI_API_KEY:
+        if not settings.GEMINI_API_KEY and llm_registry.needs_api_key:
             raise ValueError("GEMINI_API_KEY must be set in environment variables")
-        genai.configure(api_key=settings.GEMINI_API_KEY)
+        # Configures the SDK once per process instead of on every client.
+        llm_registry.configure(settings.GEMINI_API_KEY)
     
+    def _build_request(
+        self,
+        system_prompt: str,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float,
+        cache_system_prompt: bool = False,
+    ) -> Tuple["genai.GenerativeModel", Optional[List[Dict]], str]:
+        """Return (model, chat history or None for a one-shot call, prompt).
+
+        With ``cache_system_prompt`` the system prompt is sent as a cached
+        prefix when one is available (see ``app.services.prompt_cache``).
+        """
+        # Configure the model
+        generation_config = {
+            "temperature": temperature,
+            "top_p": 0.95,
+            "top_k": 40,
+            "max_output_tokens": 8192,
+        }
+        
+        # Build the conversation history
+        # Gemini uses a different format - we need to combine system prompt with history
+        conversation_parts = []
+        
+        # Add system prompt as the first user message with instruction
+        # Note: Gemini doesn't have a separate system role, so we prepend it
+        prefix = prompt_cache.prefix(model, system_prompt) if cache_system_prompt else None
+        full_system_context = "" if prefix is not None else f"{system_prompt}\n\n"
+        
+        # Convert messages to Gemini format
+        for msg in messages:
+            role = msg.get("role")
+            content = msg.get("content", "")
+            
+            # Handle both enum and string values
+            role_str = role.value if hasattr(role, 'value') else str(role)
+            
+            if role_str == MessageRole.USER.value or role_str == "user":
+                conversation_parts.append({"role": "user", "parts": [content]})
+            elif role_str == MessageRole.ASSISTANT.value or role_str == "assistant":
+                conversation_parts.append({"role": "model", "parts": [content]})
+            elif role_str == MessageRole.SYSTEM.value or role_str == "system":
+                # System messages are incorporated into context
+                full_system_context += f"{content}\n\n"
+        
+        # Initialize model
+        if prefix is not None:
+            model_instance = prompt_cache.model(prefix, generation_config)
+        else:
+            model_instance = llm_registry.generative_model(model, generation_config)
+        
+        # If we have conversation history, use chat
+        if len(conversation_parts) > 0:
+            # Prepend system context to first user message if exists
+            if full_system_context.strip() and conversation_parts[0]["role"] == "user":
+                conversation_parts[0]["parts"][0] = full_system_context.strip() + "\n\n" + conversation_parts[0]["parts"][0]
+            
+            history = conversation_parts[:-1] if len(conversation_parts) > 1 else []
+            # The last message is the current user message
+            prompt = conversation_parts[-1]["parts"][0] if conversation_parts[-1]["role"] == "user" else ""
+            return model_instance, history, prompt
+        
+        # No history, just send system prompt + first message
+        return model_instance, None, full_system_context.strip()
+
+    @staticmethod
+    def _flight_key(system_prompt: str, messages: List[Dict[str, str]], model: str, temperature: float) -> str:
+        """Identical (model, temperature, prompt) requests share one in-flight call."""
+        turns = []
+        for msg in messages:
+            role = msg.get("role")
+            turns.append([role.value if hasattr(role, 'value') else str(role), msg.get("content", "")])
+        return request_key("gemini", model, temperature, system_prompt, turns)
+
+    @staticmethod
+    def _prompt_tokens(
+        system_prompt: str, messages: List[Dict[str, str]], model: str, cache_system_prompt: bool
+    ) -> int:
+        """Estimated prompt size of a call; a cached system prompt is not sent."""
+        cached = cache_system_prompt and prompt_cache.prefix(model, system_prompt) is not None
+        return (0 if cached else estimate_tokens(system_prompt)) + sum(
+            estimate_tokens(msg.get("content", "")) for msg in messages
+        )
+
+    def _stream_chunks(
+        self,
+        system_prompt: str,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float,
+        cache_system_prompt: bool = False,
+    ) -> Iterator[str]:
+        model_instance, history, prompt = self._build_request(
+            system_prompt, messages, model, temperature, cache_system_prompt
+        )
+        with concurrency_limiter.slot(model):
+            if history is not None:
+                chat = model_instance.start_chat(history=history)
+                response = chat.send_message(prompt, stream=True)
+            else:
+                response = model_instance.generate_content(prompt, stream=True)
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks carrying only a finish reason or safety ratings have no text.
+                    continue
+                if text:
+                    yield text
+
+    async def _astream_chunks(
+        self,
+        system_prompt: str,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float,
+        cache_system_prompt: bool = False,
+    ) -> AsyncIterator[str]:
+        model_instance, history, prompt = self._build_request(
+            system_prompt, messages, model, temperature, cache_system_prompt
+        )
+        async with concurrency_limiter.aslot(model):
+            if history is not None:
+                chat = model_instance.start_chat(history=history)
+                response = await chat.send_message_async(prompt, stream=True)
+            else:
+                response = await model_instance.generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue
+                if text:
+                    yield text
+
     def generate_response(
         self,
         system_prompt: str,
         messages: List[Dict[str, str]],
         model: str = "gemini-2.5-pro",
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        agent_slug: Optional[str] = None,
+        cache_system_prompt: bool = False,
     ) -> str:
         """
         Generate a response from Gemini.
@@ -27,68 +174,123 @@ class GeminiClient:
             messages: List of message dicts with 'role' and 'content' keys
             model: Gemini model name
             temperature: Temperature for generation
+            agent_slug: Selects the agent's latency budget for hedged requests
+            cache_system_prompt: Send a static system prompt as a cached prefix
         
         Returns:
             Generated response text
         """
+        prompt_tokens = self._prompt_tokens(system_prompt, messages, model, cache_system_prompt)
+
+        def direct(routed_model: str) -> str:
+            model_instance, history, prompt = self._build_request(
+                system_prompt, messages, routed_model, temperature, cache_system_prompt
+            )
+            with concurrency_limiter.slot(routed_model):
+                if history is not None:
+                    chat = model_instance.start_chat(history=history)
+                    response = chat.send_message(prompt)
+                else:
+                    response = model_instance.generate_content(prompt)
+                return response.text
+
+        def attempt(routed_model: str) -> str:
+            return model_router.run(
+                model_router.plan(routed_model, agent_slug),
+                lambda hedge_model: self._stream_chunks(
+                    system_prompt, messages, hedge_model, temperature, cache_system_prompt
+                ),
+                direct=lambda: direct(routed_model),
+            )
+
         try:
-            # Configure the model
-            generation_config = {
-                "temperature": temperature,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 8192,
-            }
-            
-            # Build the conversation history
-            # Gemini uses a different format - we need to combine system prompt with history
-            conversation_parts = []
-            
-            # Add system prompt as the first user message with instruction
-            # Note: Gemini doesn't have a separate system role, so we prepend it
-            full_system_context = f"{system_prompt}\n\n"
-            
-            # Convert messages to Gemini format
-            for msg in messages:
-                role = msg.get("role")
-                content = msg.get("content", "")
-                
-                # Handle both enum and string values
-                role_str = role.value if hasattr(role, 'value') else str(role)
-                
-                if role_str == MessageRole.USER.value or role_str == "user":
-                    conversation_parts.append({"role": "user", "parts": [content]})
-                elif role_str == MessageRole.ASSISTANT.value or role_str == "assistant":
-                    conversation_parts.append({"role": "model", "parts": [content]})
-                elif role_str == MessageRole.SYSTEM.value or role_str == "system":
-                    # System messages are incorporated into context
-                    full_system_context += f"{content}\n\n"
-            
-            # Initialize model
-            model_instance = genai.GenerativeModel(
-                model_name=model,
-                generation_config=generation_config
+            with llm_call(model, agent_slug, prompt_tokens) as call:
+                return call.finished(single_flight.do(
+                    self._flight_key(system_prompt, messages, model, temperature),
+                    lambda: resilience.call(model, attempt),
+                ))
+        
+        except UpstreamOverloaded:
+            raise
+        except Exception as e:
+            raise GeminiError(
+                f"Error generating response from Gemini: {str(e)}", model, is_retryable(e)
+            ) from e
+
+    async def agenerate_response(
+        self,
+        system_prompt: str,
+        messages: List[Dict[str, str]],
+        model: str = "gemini-2.5-pro",
+        temperature: float = 0.7,
+        agent_slug: Optional[str] = None,
+        cache_system_prompt: bool = False,
+    ) -> str:
+        """Async variant of ``generate_response`` using the SDK's native async calls."""
+        prompt_tokens = self._prompt_tokens(system_prompt, messages, model, cache_system_prompt)
+
+        async def direct(routed_model: str) -> str:
+            model_instance, history, prompt = self._build_request(
+                system_prompt, messages, routed_model, temperature, cache_system_prompt
             )
-            
-            # If we have conversation history, use chat
-            if len(conversation_parts) > 0:
-                # Prepend system context to first user message if exists
-                if full_system_context.strip() and conversation_parts[0]["role"] == "user":
-                    conversation_parts[0]["parts"][0] = full_system_context.strip() + "\n\n" + conversation_parts[0]["parts"][0]
-                
-                # Start chat with history
-                chat = model_instance.start_chat(history=conversation_parts[:-1] if len(conversation_parts) > 1 else [])
-                # Send the last message (current user message)
-                response = chat.send_message(conversation_parts[-1]["parts"][0] if conversation_parts[-1]["role"] == "user" else "")
-            else:
-                # No history, just send system prompt + first message
-                prompt = full_system_context.strip()
-                if conversation_parts and conversation_parts[0]["role"] == "user":
-                    prompt += "\n\n" + conversation_parts[0]["parts"][0]
-                response = model_instance.generate_content(prompt)
-            
-            return response.text
+            async with concurrency_limiter.aslot(routed_model):
+                if history is not None:
+                    chat = model_instance.start_chat(history=history)
+                    response = await chat.send_message_async(prompt)
+                else:
+                    response = await model_instance.generate_content_async(prompt)
+                return response.text
+
+        async def attempt(routed_model: str) -> str:
+            return await model_router.arun(
+                model_router.plan(routed_model, agent_slug),
+                lambda hedge_model: self._astream_chunks(
+                    system_prompt, messages, hedge_model, temperature, cache_system_prompt
+                ),
+                direct=lambda: direct(routed_model),
+            )
+
+        try:
+            with llm_call(model, agent_slug, prompt_tokens) as call:
+                return call.finished(await single_flight.ado(
+                    self._flight_key(system_prompt, messages, model, temperature),
+                    lambda: resilience.acall(model, attempt),
+                ))
         
+        except UpstreamOverloaded:
+            raise
         except Exception as e:
-            raise Exception(f"Error generating response from Gemini: {str(e)}")
+            raise GeminiError(
+                f"Error generating response from Gemini: {str(e)}", model, is_retryable(e)
+            ) from e
 
+    async def astream(
+        self,
+        system_prompt: str,
+        messages: List[Dict[str, str]],
+        model: str = "gemini-2.5-pro",
+        temperature: float = 0.7,
+        agent_slug: Optional[str] = None,
+        cache_system_prompt: bool = False,
+    ) -> AsyncIterator[str]:
+        """Yield the response text chunk by chunk as Gemini produces it."""
+        prompt_tokens = self._prompt_tokens(system_prompt, messages, model, cache_system_prompt)
+        try:
+            stream = resilience.astream(
+                model,
+                lambda routed_model: model_router.astream(
+                    model_router.plan(routed_model, agent_slug),
+                    lambda hedge_model: self._astream_chunks(
+                        system_prompt, messages, hedge_model, temperature, cache_system_prompt
+                    ),
+                ),
+            )
+            async for text in llm_stream(model, agent_slug, prompt_tokens, stream):
+                yield text
+        
+        except UpstreamOverloaded:
+            raise
+        except Exception as e:
+            raise GeminiError(
+                f"Error generating response from Gemini: {str(e)}", model, is_retryable(e)
+            ) from e
@@ -0,0 +1,666 @@
+"""Declarative routing of chat messages to prebuilt agent tools.
+
+Each prebuilt agent slug maps to an ordered tuple of ``Intent``s. For a message,
+the intents registered for the agent's slug are tried in order: ``matches``
+looks at the lower-cased message, ``extract`` builds the tool kwargs from the
+raw message (or returns None to decline), and the named tool in
+``app.tools.prebuilt_agents`` is called with them. The first intent that
+produces output wins; anything else falls through to the LLM chain. Tool
+calls go through ``app.services.tool_cache``, which is a pass-through unless
+the agent opted in to caching.
+
+All patterns are compiled once at import and dispatch is a single dict lookup
+on the slug, so ordinary chat messages to custom agents cost nothing here.
+"""
+import json
+import re
+import traceback
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, FrozenSet, Iterator, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.observability import stage, timed_stream
+from app.models.agent import Agent
+from app.services.tool_cache import tool_cache
+from app.tools import prebuilt_agents
+from app.tools.prebuilt_agents import PREBUILT_AGENT_SLUGS
+
+Params = Dict[str, Any]
+
+
+@dataclass(frozen=True)
+class Intent:
+    name: str
+    matches: Callable[[str], bool]  # receives the lower-cased message
+    extract: Callable[[str], Optional[Params]]  # receives the raw message; None declines
+    handler: Callable[[Params], str]
+    # Called when the handler raises: a string is returned to the user, None
+    # falls through to the next intent. Without it the error propagates.
+    error_response: Optional[Callable[[Params, Exception], Optional[str]]] = None
+
+
+@dataclass(frozen=True)
+class ToolCall:
+    """Call ``app.tools.prebuilt_agents.<tool>(**params)``, resolved at call time."""
+    tool: str
+
+    def __call__(self, params: Params) -> str:
+        return getattr(prebuilt_agents, self.tool)(**params)
+
+
+def _tool(name: str) -> ToolCall:
+    return ToolCall(name)
+
+
+def _field(name: str) -> "re.Pattern[str]":
+    """``name: value`` / ``name "value"`` style parameter."""
+    return re.compile(name + r'[:\s]+"?([^",\n]+)"?', re.IGNORECASE)
+
+
+def _int_field(name: str) -> "re.Pattern[str]":
+    return re.compile(name + r'[:\s]+(\d+)', re.IGNORECASE)
+
+
+def _first(patterns: Tuple["re.Pattern[str]", ...], text: str) -> Optional["re.Match[str]"]:
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match:
+            return match
+    return None
+
+
+def _text(patterns: Tuple["re.Pattern[str]", ...], text: str, default: Optional[str]) -> Optional[str]:
+    match = _first(patterns, text)
+    return match.group(1).strip().strip('"') if match else default
+
+
+def _number(patterns: Tuple["re.Pattern[str]", ...], text: str, default: int) -> int:
+    match = _first(patterns, text)
+    return int(match.group(1)) if match else default
+
+
+def _contains_all(*words: str) -> Callable[[str], bool]:
+    return lambda text: all(word in text for word in words)
+
+
+def _contains_any(*words: str) -> Callable[[str], bool]:
+    return lambda text: any(word in text for word in words)
+
+
+_DIFFICULTY_LEVEL = re.compile(r'(easy|medium|hard|beginner|intermediate|advanced)', re.IGNORECASE)
+_DIFFICULTY_ALIASES = {"beginner": "easy", "intermediate": "medium", "advanced": "hard"}
+
+
+def _difficulty(patterns: Tuple["re.Pattern[str]", ...], text: str) -> str:
+    match = _first(patterns, text)
+    difficulty = match.group(1).strip().lower().strip('"') if match else "medium"
+    return _DIFFICULTY_ALIASES.get(difficulty, difficulty)
+
+
+def _logged_failure(label: str) -> Callable[[Params, Exception], None]:
+    """Log the failure and fall through to the next intent (ultimately the LLM)."""
+    def report(_params: Params, _error: Exception) -> None:
+        print(f"❌ {label} tool failed: {traceback.format_exc()}")
+    return report
+
+
+# --- Exam prep ------------------------------------------------------------------
+
+_EXAM_TYPE = (_field("exam_type"), re.compile(r'(?:for|in)\s+([A-Z][A-Z\s]+?)(?:\s+exam|\s+in|$)', re.IGNORECASE))
+_EXAM_SUBJECT = (_field("subject"), re.compile(r'(?:in|for)\s+([A-Z][a-z\s]+?)(?:\s+on|\s+with|\s+exam|$)', re.IGNORECASE))
+_QUESTION_COUNT = re.compile(r'(\d+)\s*(?:questions?|questions)', re.IGNORECASE)
+_MINUTES = re.compile(r'(\d+)\s*(?:minutes?|mins?)', re.IGNORECASE)
+_DIFFICULTY = (_field("difficulty"), _DIFFICULTY_LEVEL)
+_EXAM_QUESTIONS = (_int_field("num_questions"), _QUESTION_COUNT)
+_EXAM_TIME_LIMIT = (_int_field("time_limit"), _MINUTES)
+
+
+def _is_exam_request(text: str) -> bool:
+    return (
+        "practice exam" in text
+        or "create_practice_exam" in text
+        or ("generate" in text and "exam" in text and "practice" in text)
+    )
+
+
+def _exam_params(text: str) -> Params:
+    return {
+        "exam_type": _text(_EXAM_TYPE, text, "General Exam"),
+        "subject": _text(_EXAM_SUBJECT, text, "General Knowledge"),
+        "num_questions": _number(_EXAM_QUESTIONS, text, 20),
+        "time_limit": _number(_EXAM_TIME_LIMIT, text, 60),
+        "difficulty": _difficulty(_DIFFICULTY, text),
+    }
+
+
+_EXAM_DATE = (_field("exam_date"),)
+_SUBJECTS = (_field("subjects"),)
+_HOURS_PER_DAY = (_int_field("hours_per_day"),)
+_CURRENT_LEVEL = (_field("current_level"),)
+
+
+def _schedule_params(text: str) -> Optional[Params]:
+    exam_date = _text(_EXAM_DATE, text, None)
+    if not exam_date:
+        return None
+    return {
+        "exam_date": exam_date,
+        "subjects": _text(_SUBJECTS, text, "General"),
+        "hours_per_day": _number(_HOURS_PER_DAY, text, 2),
+        "current_level": _text(_CURRENT_LEVEL, text, "intermediate"),
+    }
+
+
+_SUBJECT = (_field("subject"),)
+_PRACTICE_RESULTS = (
+    re.compile(r'practice_results[:\s]+"([^"]+)"', re.IGNORECASE | re.DOTALL),
+    # Without quotes - capture until next parameter or end
+    re.compile(r'practice_results[:\s]+(.+?)(?=\n- [a-z_]+:|$)', re.IGNORECASE | re.DOTALL),
+    re.compile(r'practice_results[:\s]+(.+)', re.IGNORECASE | re.DOTALL),
+)
+_EXAM_TYPE_FIELD = (_field("exam_type"),)
+
+
+def _weak_areas_params(text: str) -> Params:
+    return {
+        "subject": _text(_SUBJECT, text, "General"),
+        "practice_results": _text(_PRACTICE_RESULTS, text, "No results provided"),
+        "exam_type": _text(_EXAM_TYPE_FIELD, text, "general"),
+    }
+
+
+_TOPIC = (_field("topic"),)
+_DIFFICULTY_FIELD = (_field("difficulty"),)
+_REVIEW_TYPE = (_field("review_type"),)
+
+
+def _topic_review_params(text: str) -> Params:
+    return {
+        "topic": _text(_TOPIC, text, "General Topic"),
+        "difficulty": _text(_DIFFICULTY_FIELD, text, "medium"),
+        "review_type": _text(_REVIEW_TYPE, text, "comprehensive"),
+    }
+
+
+# --- Micro learning -------------------------------------------------------------
+
+_LESSON_TOPIC = (_field("topic"), re.compile(r'(?:about|on|for)\s+([^,\.\n]+)', re.IGNORECASE))
+_LESSON_MINUTES = (_int_field("time_minutes"), _MINUTES)
+
+
+def _is_micro_lesson_request(text: str) -> bool:
+    return "generate_micro_lesson" in text or (
+        ("micro-lesson" in text or "micro lesson" in text) and "lesson" in text
+    )
+
+
+def _micro_lesson_params(text: str) -> Params:
+    return {
+        "topic": _text(_LESSON_TOPIC, text, "General Topic"),
+        "time_minutes": _number(_LESSON_MINUTES, text, 10),
+        "difficulty": _difficulty(_DIFFICULTY, text),
+    }
+
+
+# --- Quiz (tutor, course creation, language practice) ---------------------------
+
+_QUIZ_TOPIC = re.compile(r'(?:about|on|for)\s+([^,\.\?]+?)(?:\s+with|\s+at|\s+of|$)', re.IGNORECASE)
+_QUIZ_COUNT = re.compile(r'(\d+)\s*(?:questions?|mcqs?)', re.IGNORECASE)
+
+
+def _is_quiz_request(text: str) -> bool:
+    return (
+        "quiz" in text
+        or ("generate" in text and ("question" in text or "mcq" in text))
+        or "multiple choice" in text
+    )
+
+
+def _quiz_params(text: str) -> Params:
+    topic_match = _QUIZ_TOPIC.search(text)
+    difficulty_match = _DIFFICULTY_LEVEL.search(text)
+    difficulty = difficulty_match.group(1).lower() if difficulty_match else "medium"
+    return {
+        "topic": topic_match.group(1).strip() if topic_match else "general knowledge",
+        "difficulty": _DIFFICULTY_ALIASES.get(difficulty, difficulty),
+        "num_questions": _number((_QUIZ_COUNT,), text, 5),
+    }
+
+
+def _quiz_failed(_params: Params, error: Exception) -> None:
+    print(f"Quiz generation tool failed, falling back to normal generation: {str(error)}")
+
+
+# --- Course creation ------------------------------------------------------------
+
+_COURSE_TITLE = re.compile(r'(?:course\s+title|for\s+course|about)\s*[:\-"]?\s*([^"\n,]+)', re.IGNORECASE)
+_OBJECTIVES = re.compile(r'(?:learning objectives?|objectives?)\s*[:\-]\s*(.+)', re.IGNORECASE)
+_WEEKS = re.compile(r'(?:duration|weeks?)\s*[:\-]?\s*(\d+)', re.IGNORECASE)
+_ASSESSMENT_TOPIC = re.compile(r'(?:topic|for)\s*[:\-"]?\s*([^"\n,]+)', re.IGNORECASE)
+_ASSESSMENT_TYPE = re.compile(r'(diagnostic|formative|summative|comprehensive)', re.IGNORECASE)
+_ASSESSMENT_COUNT = re.compile(r'(\d+)\s*(?:questions?|items?)', re.IGNORECASE)
+_MAIN_CONCEPT = re.compile(r'(?:main concept|for)\s*[:\-"]?\s*([^"\n,]+)', re.IGNORECASE)
+_RELATED_CONCEPTS = re.compile(r'(?:related concepts?|subtopics?)\s*[:\-]\s*(.+)', re.IGNORECASE)
+_WORKFLOW_NAME = re.compile(r'(?:workflow name|for workflow|workflow)\s*[:\-"]?\s*([^"\n,]+)', re.IGNORECASE)
+_WORKFLOW_STEPS = re.compile(r'(?:steps?)\s*[:\-]\s*(.+)', re.IGNORECASE)
+_WORKFLOW_TYPE = re.compile(r'(learning|assessment|content_creation|course_delivery)', re.IGNORECASE)
+_MEETING_TYPE = re.compile(r'(course_planning|review|assessment_design)', re.IGNORECASE)
+_PARTICIPANTS = re.compile(r'(?:participants?)\s*[:\-]\s*(.+)', re.IGNORECASE)
+_COURSE_BODY = re.compile(r'(?:course structure|outline|description)\s*[:\-]\s*(.+)', re.IGNORECASE | re.DOTALL)
+_VALIDATION_CRITERIA = re.compile(r'(comprehensive|accessibility|learning_objectives|assessment_alignment)', re.IGNORECASE)
+
+
+def _group(pattern: "re.Pattern[str]", text: str, default: str, lower: bool = False) -> str:
+    match = pattern.search(text)
+    if not match:
+        return default
+    value = match.group(1)
+    return value.lower() if lower else value.strip()
+
+
+def _course_structure_params(text: str) -> Params:
+    course_title = _group(_COURSE_TITLE, text, text[:80])
+    return {
+        "course_title": course_title,
+        "learning_objectives": _group(_OBJECTIVES, text, course_title),
+        "duration_weeks": _number((_WEEKS,), text, 8),
+    }
+
+
+def _learning_assessment_params(text: str) -> Params:
+    return {
+        "topic": _group(_ASSESSMENT_TOPIC, text, "General Topic"),
+        "assessment_type": _group(_ASSESSMENT_TYPE, text, "comprehensive", lower=True),
+        "num_questions": _number((_ASSESSMENT_COUNT,), text, 10),
+    }
+
+
+def _concept_map_params(text: str) -> Params:
+    return {
+        "main_concept": _group(_MAIN_CONCEPT, text, "Main Concept"),
+        "related_concepts": _group(_RELATED_CONCEPTS, text, ""),
+    }
+
+
+def _workflow_params(text: str) -> Params:
+    return {
+        "workflow_name": _group(_WORKFLOW_NAME, text, "Course Creation Workflow"),
+        "steps": _group(_WORKFLOW_STEPS, text, "Plan course,Design modules,Create lessons,Publish course"),
+        "automation_type": _group(_WORKFLOW_TYPE, text, "learning", lower=True),
+    }
+
+
+def _meeting_notes_params(text: str) -> Params:
+    return {
+        "meeting_type": _group(_MEETING_TYPE, text, "course_planning", lower=True),
+        "participants": _group(_PARTICIPANTS, text, ""),
+    }
+
+
+def _course_validation_params(text: str) -> Params:
+    return {
+        "course_structure": _group(_COURSE_BODY, text, text),
+        "validation_criteria": _group(_VALIDATION_CRITERIA, text, "comprehensive", lower=True),
+    }
+
+
+def _course_intent(name: str, tool: str, keywords: Tuple[str, ...], extract) -> Intent:
+    # Course creation tools are deterministic templates; errors propagate.
+    return Intent(name, _contains_any(*keywords), extract, _tool(tool))
+
+
+# --- Structured JSON workflows (skill gap, fitness, career, resume) -------------
+
+def _structured_payload(text: str, marker: str) -> Tuple[Any, bool]:
+    """Parse ``MARKER {json}`` (or a bare JSON message); returns (payload, marker_used)."""
+    text = text or ""
+    marker_used = marker in text
+    if marker_used:
+        json_start = text.find("{", text.find(marker))
+        if json_start == -1:
+            return {}, True
+        source = text[json_start:].strip()
+    else:
+        source = text
+        if not source.lstrip().startswith("{"):
+            # Only a JSON object can carry an action; skip the failing parse.
+            return {}, False
+    try:
+        return json.loads(source), marker_used
+    except Exception:
+        return {}, marker_used
+
+
+def _action_extractor(
+    marker: str,
+    actions: FrozenSet[str],
+    merge_top_level: bool,
+) -> Callable[[str], Optional[Params]]:
+    def extract(text: str) -> Optional[Params]:
+        payload, _ = _structured_payload(text, marker)
+        if not isinstance(payload, dict):
+            return None
+        action = str(payload.get("action") or "").strip().lower()
+        if action not in actions:
+            return None
+        if isinstance(payload.get("payload"), dict):
+            action_payload = dict(payload.get("payload") or {})
+            if merge_top_level:
+                # Allow mixed payloads where some fields are still top-level.
+                for key, value in payload.items():
+                    if key in {"action", "payload"}:
+                        continue
+                    action_payload.setdefault(key, value)
+        else:
+            action_payload = dict(payload)
+            action_payload.pop("action", None)
+        return {"action": action, "payload": action_payload}
+    return extract
+
+
+def _action_error(label: str) -> Callable[[Params, Exception], str]:
+    def respond(params: Params, error: Exception) -> str:
+        print(f"{label} tool failed: {traceback.format_exc()}")
+        return (
+            '{"action":"'
+            + params["action"]
+            + '","status":"error","error":"internal_error","message":"'
+            + str(error).replace('"', '\\"')
+            + '"}'
+        )
+    return respond
+
+
+def _invalid_marker_intent(marker: str) -> Intent:
+    """A marker with no valid action fails fast instead of reaching the LLM."""
+    body = (
+        '{"action":"unknown","status":"error","error":"invalid_payload",'
+        f'"message":"{marker} must include a valid action."}}'
+    )
+    return Intent(
+        name="invalid_request",
+        matches=lambda _text: True,
+        extract=lambda text: {} if marker in (text or "") else None,
+        handler=lambda _params: body,
+    )
+
+
+def _structured_intents(
+    marker: str,
+    actions: Tuple[str, ...],
+    tool: str,
+    label: str,
+    merge_top_level: bool,
+) -> Tuple[Intent, ...]:
+    return (
+        Intent(
+            name="structured_action",
+            matches=lambda _text: True,
+            extract=_action_extractor(marker, frozenset(actions), merge_top_level),
+            handler=_tool(tool),
+            error_response=_action_error(label),
+        ),
+        _invalid_marker_intent(marker),
+    )
+
+
+def _resume_review_params(text: str) -> Optional[Params]:
+    payload, _ = _structured_payload(text, "RESUME_REVIEW_REQUEST")
+    if not isinstance(payload, dict) or str(payload.get("action") or "").lower() != "review_resume":
+        return None
+    return {
+        "resume_text": str(payload.get("resume_text") or "").strip(),
+        "job_description": str(payload.get("job_description") or "").strip(),
+        "target_role": str(payload.get("target_role") or "").strip(),
+        "seniority": str(payload.get("seniority") or "mid").strip().lower(),
+    }
+
+
+def _resume_review_error(_params: Params, error: Exception) -> str:
+    print(f"❌ Resume review tool failed: {traceback.format_exc()}")
+    return (
+        '{"error":"internal_error",'
+        f'"message":"Unexpected error while generating resume review: {str(error)}","overall_score":0,"ats_score":0}}'
+    )
+
+
+# --- Registry -------------------------------------------------------------------
+
+_QUIZ = Intent(
+    "quiz",
+    _is_quiz_request,
+    _quiz_params,
+    _tool("_generate_quiz"),
+    error_response=_quiz_failed,
+)
+
+
+def _exam_failed(_params: Params, error: Exception) -> None:
+    print(f"❌ Exam generation tool failed: {traceback.format_exc()}")
+    print(f"Exam generation tool failed, falling back to normal generation: {str(error)}")
+
+
+INTENTS_BY_SLUG: Dict[str, Tuple[Intent, ...]] = {
+    PREBUILT_AGENT_SLUGS["exam_prep_agent"]: (
+        Intent("practice_exam", _is_exam_request, _exam_params, _tool("_create_practice_exam"), _exam_failed),
+        Intent(
+            "study_schedule",
+            lambda text: "create_study_schedule" in text or ("study" in text and "schedule" in text),
+            _schedule_params,
+            _tool("_create_study_schedule"),
+            _logged_failure("Schedule generation"),
+        ),
+        Intent(
+            "weak_areas",
+            lambda text: "identify_weak_areas" in text or _contains_all("weak", "area", "analysis")(text),
+            _weak_areas_params,
+            _tool("_identify_weak_areas"),
+            _logged_failure("Weak areas analysis"),
+        ),
+        Intent(
+            "topic_review",
+            lambda text: "generate_topic_review" in text or ("topic" in text and "review" in text),
+            _topic_review_params,
+            _tool("_generate_topic_review"),
+            _logged_failure("Topic review"),
+        ),
+    ),
+    PREBUILT_AGENT_SLUGS["micro_learning_agent"]: (
+        Intent(
+            "micro_lesson",
+            _is_micro_lesson_request,
+            _micro_lesson_params,
+            _tool("_generate_micro_lesson"),
+            _logged_failure("Micro-lesson"),
+        ),
+    ),
+    PREBUILT_AGENT_SLUGS["personal_tutor"]: (_QUIZ,),
+    PREBUILT_AGENT_SLUGS["language_practice_agent"]: (_QUIZ,),
+    PREBUILT_AGENT_SLUGS["course_creation_agent"]: (
+        _QUIZ,
+        _course_intent(
+            "course_structure",
+            "_create_course_structure",
+            ("course structure", "course outline", "create_course_structure"),
+            _course_structure_params,
+        ),
+        _course_intent(
+            "learning_assessment",
+            "_create_learning_assessment",
+            ("learning assessment", "assessment", "create_learning_assessment"),
+            _learning_assessment_params,
+        ),
+        _course_intent(
+            "concept_map",
+            "_create_concept_map",
+            ("concept map", "concept mapping", "create_concept_map"),
+            _concept_map_params,
+        ),
+        _course_intent(
+            "workflow_automation",
+            "_create_workflow_automation",
+            ("workflow", "automation", "create_workflow_automation"),
+            _workflow_params,
+        ),
+        _course_intent(
+            "meeting_notes",
+            "_create_meeting_notes_template",
+            ("meeting notes", "notes template", "create_meeting_notes_template"),
+            _meeting_notes_params,
+        ),
+        _course_intent(
+            "course_validation",
+            "_validate_course_content",
+            ("validate course", "course validation", "validate_course_content"),
+            _course_validation_params,
+        ),
+    ),
+    PREBUILT_AGENT_SLUGS["skill_gap_agent"]: _structured_intents(
+        "SKILL_GAP_REQUEST",
+        (
+            "profile_baseline",
+            "identify_skill_gaps",
+            "build_development_plan",
+            "weekly_progress_checkin",
+            "readiness_assessment",
+        ),
+        "_generate_skill_gap_agent_response",
+        "Skill gap",
+        merge_top_level=False,
+    ),
+    PREBUILT_AGENT_SLUGS["fitness_coach_agent"]: _structured_intents(
+        "FITNESS_COACH_REQUEST",
+        (
+            "profile_baseline",
+            "generate_adaptive_plan",
+            "quick_workout_burst",
+            "log_workout_feedback",
+            "challenge_mode",
+            "progress_reassessment",
+        ),
+        "_generate_fitness_coach_response",
+        "Fitness coach",
+        merge_top_level=True,
+    ),
+    PREBUILT_AGENT_SLUGS["career_coach_agent"]: _structured_intents(
+        "CAREER_COACH_REQUEST",
+        (
+            "intake_assessment",
+            "opportunity_strategy",
+            "skill_gap_analysis",
+            "build_roadmap",
+            "weekly_checkin",
+            "interview_readiness",
+        ),
+        "_generate_career_coach_response",
+        "Career coach",
+        merge_top_level=True,
+    ),
+    PREBUILT_AGENT_SLUGS["resume_review_agent"]: (
+        Intent(
+            "review_resume",
+            lambda _text: True,
+            _resume_review_params,
+            _tool("_generate_resume_review"),
+            _resume_review_error,
+        ),
+    ),
+}
+
+
+def intents_for(agent: Agent) -> Tuple[Intent, ...]:
+    if not agent.is_prebuilt or not agent.slug:
+        return ()
+    return INTENTS_BY_SLUG.get(agent.slug, ())
+
+
+def candidates(agent: Agent, latest_input: str) -> Iterator[Tuple[Intent, Params]]:
+    """Yield (intent, params) for every intent that claims the message, in priority order."""
+    intents = intents_for(agent)
+    if not intents:
+        return
+    latest_lower = latest_input.lower() if latest_input else ""
+    for intent in intents:
+        if not intent.matches(latest_lower):
+            continue
+        params = intent.extract(latest_input)
+        if params is not None:
+            yield intent, params
+
+
+def _run(agent: Agent, intent: Intent, params: Params) -> str:
+    handler = intent.handler
+    with stage("tool"):
+        if isinstance(handler, ToolCall):
+            return tool_cache.call(agent.slug, handler.tool, params, lambda: handler(params))
+        return handler(params)
+
+
+def _handle_error(intent: Intent, params: Params, error: Exception) -> Optional[str]:
+    """The intent's answer to ``error``: a string for the user, or None to fall through."""
+    if intent.error_response is None:
+        raise error
+    return intent.error_response(params, error)
+
+
+def dispatch(agent: Agent, latest_input: str) -> Optional[str]:
+    """Run the first matching intent's tool; None means the message goes to the LLM chain."""
+    for intent, params in candidates(agent, latest_input):
+        try:
+            return _run(agent, intent, params)
+        except Exception as e:
+            response = _handle_error(intent, params, e)
+            if response is not None:
+                return response
+    return None
+
+
+# Tools with an async streaming variant in ``app.tools.prebuilt_agents``.
+STREAMING_TOOLS: Dict[str, str] = {
+    "_generate_quiz": "_astream_quiz",
+    "_create_practice_exam": "_astream_practice_exam",
+    "_generate_micro_lesson": "_astream_micro_lesson",
+}
+
+
+async def _single_chunk(text: str) -> AsyncIterator[str]:
+    yield text
+
+
+async def _prepend(first: str, rest: AsyncIterator[str]) -> AsyncIterator[str]:
+    yield first
+    async for chunk in rest:
+        yield chunk
+
+
+async def astream(agent: Agent, latest_input: str) -> Optional[AsyncIterator[str]]:
+    """Streaming counterpart of ``dispatch``; None means the message goes to the LLM.
+
+    An intent whose tool has a streaming variant is streamed while it is
+    generated; other intents run in the threadpool and arrive as a single
+    chunk. A tool that fails before its first chunk goes through the intent's
+    ``error_response`` exactly as in ``dispatch``; later failures propagate to
+    the caller, as they do for a streamed LLM reply.
+    """
+    if not intents_for(agent):
+        return None
+    for intent, params in candidates(agent, latest_input):
+        handler = intent.handler
+        try:
+            if isinstance(handler, ToolCall) and handler.tool in STREAMING_TOOLS:
+                stream_tool = getattr(prebuilt_agents, STREAMING_TOOLS[handler.tool])
+                stream = timed_stream(
+                    "tool", tool_cache.astream(agent.slug, handler.tool, params, lambda: stream_tool(**params))
+                )
+                try:
+                    first = await stream.__anext__()
+                except StopAsyncIteration:
+                    return _single_chunk("")
+                return _prepend(first, stream)
+            return _single_chunk(await run_in_threadpool(_run, agent, intent, params))
+        except Exception as e:
+            response = _handle_error(intent, params, e)
+            if response is not None:
+                return _single_chunk(response)
+    return None
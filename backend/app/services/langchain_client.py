@@ -1,87 +1,91 @@
-from typing import List, Any
+from typing import AsyncIterator, Dict, Iterator, List, Any, Optional, Tuple
 import warnings
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import HumanMessage, AIMessage
+from starlette.concurrency import run_in_threadpool
 from app.core.config import settings
+from app.core.observability import stage
 from app.models.agent import Agent
 from app.models.message import Message
+from app.services import intent_router
+from app.services.concurrency_limiter import UpstreamOverloaded, concurrency_limiter
+from app.services.context_window import ContextWindow, context_for_agent, estimate_tokens
+from app.services.llm_metrics import llm_call, llm_stream, note_context_window
+from app.services.llm_registry import llm_registry
+from app.services.model_router import model_router
+from app.services.prompt_cache import prompt_cache
+from app.services.resilience import GeminiError, is_retryable, resilience
+from app.services.single_flight import request_key, single_flight
+from app.services.tool_calling import tool_calling
 
 # Suppress specific warnings from langchain/google libraries
 warnings.filterwarnings('ignore', message='.*Unrecognized FinishReason enum value.*')
 warnings.filterwarnings('ignore', message='.*Unrecognized role.*')
 warnings.filterwarnings('ignore', message='.*Gemini produced an empty response.*')
 
-MAX_HISTORY_MESSAGES = 8
-MAX_MESSAGE_CHARS = 4000
-MAX_INPUT_CHARS = 8000
-
 
 class LangchainAgentService:
   """Simplified LangChain wrapper around Gemini - uses simple chain for all agents."""
 
   def __init__(self) -> None:
-    if not settings.GEMINI_API_KEY:
+    if not settings.GEMINI_API_KEY and llm_registry.needs_api_key:
       raise ValueError("GEMINI_API_KEY must be set in environment variables")
     self._api_key = settings.GEMINI_API_KEY
 
   def _build_llm(self, agent: Agent) -> ChatGoogleGenerativeAI:
-    """Build the ChatGoogleGenerativeAI LLM instance."""
-    return ChatGoogleGenerativeAI(
-      model=agent.model,
-      temperature=agent.temperature,
-      google_api_key=self._api_key,
-      max_retries=1,
-      timeout=45,
-    )
+    """Return the shared ChatGoogleGenerativeAI instance for this agent's settings."""
+    return llm_registry.chat_model(agent.model, agent.temperature)
 
   def _build_chain(self, agent: Agent) -> Any:
-    """Build a simple chain for all agents."""
-    llm = self._build_llm(agent)
-    # Gemini chat history does not support system-role messages. Always use
-    # user/assistant history and inject system instructions into the input.
-    prompt = ChatPromptTemplate.from_messages(
-      [
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", "{input}"),
-      ]
-    )
-    
-    chain = prompt | llm
-    return chain
-
-  def _history_to_messages(self, history: List[Message], latest_input: str = None) -> List[Any]:
-    """Convert database Message objects to LangChain message objects.
+    """Return the shared simple chain used for all agents."""
+    return llm_registry.chain(agent.model, agent.temperature)
+
+  @staticmethod
+  def _chunk_text(chunk: Any) -> str:
+    return chunk.content if hasattr(chunk, "content") else str(chunk)
+
+  def _chain_chunks(self, model: str, temperature: float, payload: Dict[str, Any]) -> Iterator[str]:
+    """Stream the shared chain for ``model`` (used for hedged requests)."""
+    with concurrency_limiter.slot(model):
+      for chunk in llm_registry.chain(model, temperature).stream(payload):
+        text = self._chunk_text(chunk)
+        if text:
+          yield text
+
+  async def _achain_chunks(self, model: str, temperature: float, payload: Dict[str, Any]) -> AsyncIterator[str]:
+    async with concurrency_limiter.aslot(model):
+      async for chunk in llm_registry.chain(model, temperature).astream(payload):
+        text = self._chunk_text(chunk)
+        if text:
+          yield text
+
+  @staticmethod
+  def _routed_chain(agent: Agent, chain: Any, model: str) -> Any:
+    """``chain`` for the agent's model, or the shared chain of the model a call was rerouted to."""
+    return chain if model == agent.model else llm_registry.chain(model, agent.temperature)
+
+  @staticmethod
+  def _invoke(chain: Any, model: str, payload: Dict[str, Any]) -> Any:
+    """Invoke ``chain`` within ``model``'s upstream concurrency limit."""
+    with concurrency_limiter.slot(model):
+      return chain.invoke(payload)
+
+  @staticmethod
+  async def _ainvoke(chain: Any, model: str, payload: Dict[str, Any]) -> Any:
+    async with concurrency_limiter.aslot(model):
+      return await chain.ainvoke(payload)
+
+  def _history_to_messages(self, window: ContextWindow) -> List[Any]:
+    """Convert a turn's context window to LangChain message objects.
     
     Merges consecutive messages from the same role (Gemini requirement).
-    If latest_input is provided, it's merged with the last user message if present.
-    Filters out invalid messages (empty content or invalid roles).
+    The latest input is merged with the last user message if present.
+    Which history fits (and how much of it) is decided by the token budget,
+    see ``app.services.context_window``.
     """
-    # Limit history size and content to control latency and memory usage.
-    recent_history = history[-MAX_HISTORY_MESSAGES:] if len(history) > MAX_HISTORY_MESSAGES else history
-    
     messages: List[Any] = []
     
-    # Process history messages - filter out invalid ones
-    for m in recent_history:
-      # Skip messages with empty or invalid content
-      if not m.content or not m.content.strip():
-        continue
-      content = m.content.strip()[:MAX_MESSAGE_CHARS]
-      
-      # Validate role
-      try:
-        current_role = m.role.value if hasattr(m.role, 'value') else str(m.role)
-        if not current_role or current_role not in ['user', 'assistant', 'system']:
-          continue
-      except (AttributeError, ValueError):
-        # Skip messages with invalid roles
-        continue
-      
-      # Skip system messages (they're handled separately)
-      if current_role == "system":
-        continue
-      
+    for current_role, content in window.turns:
       # Add new message or merge with last if same role
       if messages and messages[-1].__class__.__name__ == ("HumanMessage" if current_role == "user" else "AIMessage"):
         # Merge with last message of same type
@@ -93,755 +97,351 @@ class LangchainAgentService:
         elif current_role == "assistant":
           messages.append(AIMessage(content=content))
     
-    # If latest_input is provided, merge with last user message or add as new
-    if latest_input and latest_input.strip():
-      truncated_input = latest_input.strip()[:MAX_INPUT_CHARS]
+    # Merge the latest input with the last user message or add it as new
+    if window.latest_input:
       if messages and isinstance(messages[-1], HumanMessage):
         # Merge with last user message
-        messages[-1].content += f"\n\n{truncated_input}"
+        messages[-1].content += f"\n\n{window.latest_input}"
       else:
         # Add as new user message
-        messages.append(HumanMessage(content=truncated_input))
+        messages.append(HumanMessage(content=window.latest_input))
     
     return messages
 
+  def _intercept_tools(self, agent: Agent, latest_input: str) -> Optional[str]:
+    """Route recognised tool intents straight to the prebuilt tool functions.
+
+    Returns the tool output, or None when the message should go through the chain.
+    See ``app.services.intent_router`` for the per-agent intents.
+    """
+    return intent_router.dispatch(agent, latest_input)
+
+  @stage("prompt")
+  def _prepare_chain_input(
+    self,
+    agent: Agent,
+    history: List[Message],
+    latest_input: str,
+    summary: Optional[str] = None,
+    include_system_prompt: bool = True,
+  ) -> Tuple[str, List[Any]]:
+    """Build the (current_input, chat_history) pair sent to the chain.
+
+    ``include_system_prompt=False`` leaves the agent's system prompt out (it
+    is sent separately as a cached prefix).
+    """
+    # Build messages with latest_input merged properly, within the agent's token budget
+    window = context_for_agent(agent, history, latest_input, summary)
+    note_context_window(window)
+    chat_history = self._history_to_messages(window)
+
+    # Extract the latest input from merged messages
+    if chat_history and isinstance(chat_history[-1], HumanMessage):
+      current_input = chat_history[-1].content
+      # Remove it from history for the chain
+      history_for_chain = chat_history[:-1]
+    else:
+      current_input = latest_input
+      history_for_chain = chat_history
+
+    # Defensive: ensure only Human/AI messages are passed to Gemini.
+    history_for_chain = [
+      msg for msg in history_for_chain
+      if isinstance(msg, (HumanMessage, AIMessage))
+    ]
+
+    # Inject system instructions into the current input to avoid system-role messages.
+    instructions = self._instructions(agent, window, include_system_prompt)
+    if instructions:
+      current_input = f"{instructions}\n\n{current_input}" if current_input else instructions
+    return current_input or "", history_for_chain
+
+  @staticmethod
+  def _instructions(agent: Agent, window: ContextWindow, include_system_prompt: bool = True) -> str:
+    """The agent's system prompt plus the running summary of earlier turns, if any."""
+    parts = [agent.system_prompt] if agent.system_prompt and include_system_prompt else []
+    if window.summary:
+      parts.append(f"Summary of the earlier conversation:\n{window.summary}")
+    return "\n\n".join(parts)
+
+  @staticmethod
+  def _uses_prompt_cache(agent: Agent) -> bool:
+    """True when the agent's system prompt is registered with the provider cache.
+
+    LangChain cannot reference a cached prefix, so these agents are served
+    through the SDK client, which sends only the handle plus the turn.
+    """
+    return prompt_cache.prefix(agent.model, agent.system_prompt) is not None
+
+  @staticmethod
+  def _flight_key(agent: Agent, current_input: str, history_for_chain: List[Any]) -> str:
+    """Concurrent identical chain calls (same model, temperature and prompt) share one request."""
+    turns = [[msg.type, msg.content] for msg in history_for_chain]
+    return request_key("chain", agent.model, agent.temperature, current_input, turns)
+
+  @staticmethod
+  def _prompt_tokens(current_input: str, history_for_chain: List[Any]) -> int:
+    """Estimated prompt size of a call, for the request timings and metrics."""
+    return estimate_tokens(current_input) + sum(
+      estimate_tokens(str(msg.content)) for msg in history_for_chain
+    )
+
+  @staticmethod
+  def _clean_output(result: Any) -> str:
+    output = result.content if hasattr(result, 'content') else str(result)
+
+    # Clean quiz output if present - only remove preamble, keep answers for validation
+    if "**Question 1:**" in output or "Question 1:" in output:
+      quiz_start = output.find("**Question 1:**")
+      if quiz_start == -1:
+        quiz_start = output.find("Question 1:")
+      if quiz_start > 0:
+        output = output[quiz_start:].strip()
+    return output
+
+  @staticmethod
+  def _is_finish_reason_error(error: Exception) -> bool:
+    error_str = str(error).lower()
+    return "'int' object has no attribute 'name'" in error_str or "finish_reason" in error_str
+
+  @staticmethod
+  def _fallback_messages(history_for_chain: List[Any], current_input: str) -> List[dict]:
+    message_payload = []
+    for msg in history_for_chain:
+      if isinstance(msg, HumanMessage):
+        message_payload.append({"role": "user", "content": msg.content})
+      elif isinstance(msg, AIMessage):
+        message_payload.append({"role": "assistant", "content": msg.content})
+    message_payload.append({"role": "user", "content": current_input})
+    return message_payload
+
+  def _tool_loop_messages(
+    self,
+    agent: Agent,
+    history: List[Message],
+    latest_input: str,
+    summary: Optional[str],
+  ) -> List[Any]:
+    current_input, history_for_chain = self._prepare_chain_input(agent, history, latest_input, summary)
+    return history_for_chain + [HumanMessage(content=current_input)]
+
   def generate_response(
     self,
     agent: Agent,
     history: List[Message],
     latest_input: str,
+    summary: Optional[str] = None,
   ) -> str:
     """
     Simplified LangChain agent - uses simple chain for all agents.
     Merges history properly to avoid consecutive same-role messages.
+    ``summary`` is the conversation's running summary of turns older than ``history``.
     
     For quiz/exam requests, intercepts and generates directly in a single call.
+    Agents with native function calling let the model pick their tools instead
+    (see ``app.services.tool_calling``).
     """
-    # Check if this is a quiz/exam request - intercept and generate directly
-    latest_lower = latest_input.lower() if latest_input else ""
-    is_quiz_request = (
-      "quiz" in latest_lower or 
-      "generate" in latest_lower and ("question" in latest_lower or "mcq" in latest_lower) or
-      "multiple choice" in latest_lower
-    )
-    
-    is_exam_request = (
-      "practice exam" in latest_lower or
-      "create_practice_exam" in latest_lower or
-      ("generate" in latest_lower and "exam" in latest_lower and "practice" in latest_lower)
-    )
-    
-    # If it's an exam request for exam prep agent, generate directly
-    if is_exam_request and agent.is_prebuilt:
-      from app.tools.prebuilt_agents import PREBUILT_AGENT_SLUGS, _create_practice_exam
-      if agent.slug == PREBUILT_AGENT_SLUGS["exam_prep_agent"]:
-        # Extract exam parameters from the request - handle multiple formats
-        import re
-        
-        # Try to extract from structured format first (exam_type: "value")
-        exam_type_match = re.search(r'exam_type[:\s]+"?([^",\n]+)"?', latest_input, re.IGNORECASE)
-        if not exam_type_match:
-          # Try to extract from natural language (e.g., "for SAT exam", "for GRE")
-          exam_type_match = re.search(r'(?:for|in)\s+([A-Z][A-Z\s]+?)(?:\s+exam|\s+in|$)', latest_input, re.IGNORECASE)
-        exam_type = exam_type_match.group(1).strip().strip('"') if exam_type_match else "General Exam"
-        
-        # Try to extract subject
-        subject_match = re.search(r'subject[:\s]+"?([^",\n]+)"?', latest_input, re.IGNORECASE)
-        if not subject_match:
-          # Try to extract from natural language (e.g., "in Mathematics", "in Math")
-          subject_match = re.search(r'(?:in|for)\s+([A-Z][a-z\s]+?)(?:\s+on|\s+with|\s+exam|$)', latest_input, re.IGNORECASE)
-        subject = subject_match.group(1).strip().strip('"') if subject_match else "General Knowledge"
-        
-        # Extract num_questions
-        num_questions_match = re.search(r'num_questions[:\s]+(\d+)', latest_input, re.IGNORECASE)
-        if not num_questions_match:
-          num_questions_match = re.search(r'(\d+)\s*(?:questions?|questions)', latest_input, re.IGNORECASE)
-        num_questions = int(num_questions_match.group(1)) if num_questions_match else 20
-        
-        # Extract time_limit
-        time_limit_match = re.search(r'time_limit[:\s]+(\d+)', latest_input, re.IGNORECASE)
-        if not time_limit_match:
-          time_limit_match = re.search(r'(\d+)\s*(?:minutes?|mins?)', latest_input, re.IGNORECASE)
-        time_limit = int(time_limit_match.group(1)) if time_limit_match else 60
-        
-        # Extract difficulty
-        difficulty_match = re.search(r'difficulty[:\s]+"?([^",\n]+)"?', latest_input, re.IGNORECASE)
-        if not difficulty_match:
-          difficulty_match = re.search(r'(easy|medium|hard|beginner|intermediate|advanced)', latest_input, re.IGNORECASE)
-        difficulty = difficulty_match.group(1).strip().lower().strip('"') if difficulty_match else "medium"
-        if difficulty in ["beginner"]:
-          difficulty = "easy"
-        elif difficulty in ["intermediate"]:
-          difficulty = "medium"
-        elif difficulty in ["advanced"]:
-          difficulty = "hard"
-        
-        # Generate exam directly using the tool (single API call)
-        try:
-          print(f"🎯 Intercepting exam request: exam_type={exam_type}, subject={subject}, num_questions={num_questions}, difficulty={difficulty}")
-          exam_output = _create_practice_exam(
-            exam_type=exam_type,
-            subject=subject,
-            num_questions=num_questions,
-            time_limit=time_limit,
-            difficulty=difficulty
-          )
-          print(f"✅ Exam generated successfully, length: {len(exam_output)} chars")
-          print(f"📝 Exam preview: {exam_output[:300]}...")
-          return exam_output
-        except Exception as e:
-          import traceback
-          print(f"❌ Exam generation tool failed: {traceback.format_exc()}")
-          # Fallback to normal generation if tool fails
-          print(f"Exam generation tool failed, falling back to normal generation: {str(e)}")
-    
-    # Check for schedule, weak areas, and topic review requests - intercept and generate directly
-    is_schedule_request = (
-      "create_study_schedule" in latest_lower or
-      ("study" in latest_lower and "schedule" in latest_lower)
-    )
-    
-    is_weak_areas_request = (
-      "identify_weak_areas" in latest_lower or
-      ("weak" in latest_lower and "area" in latest_lower and "analysis" in latest_lower)
-    )
-    
-    is_topic_review_request = (
-      "generate_topic_review" in latest_lower or
-      ("topic" in latest_lower and "review" in latest_lower)
-    )
-
-    is_micro_lesson_request = (
-      "generate_micro_lesson" in latest_lower or
-      ("micro-lesson" in latest_lower or "micro lesson" in latest_lower) and "lesson" in latest_lower
-    )
-    
-    # If it's a schedule request for exam prep agent, generate directly
-    if is_schedule_request and agent.is_prebuilt:
-      from app.tools.prebuilt_agents import PREBUILT_AGENT_SLUGS, _create_study_schedule
-      if agent.slug == PREBUILT_AGENT_SLUGS["exam_prep_agent"]:
-        import re
-        # Extract parameters
-        exam_date_match = re.search(r'exam_date[:\s]+"?([^",\n]+)"?', latest_input, re.IGNORECASE)
-        exam_date = exam_date_match.group(1).strip().strip('"') if exam_date_match else None
-        
-        subjects_match = re.search(r'subjects[:\s]+"?([^",\n]+)"?', latest_input, re.IGNORECASE)
-        subjects = subjects_match.group(1).strip().strip('"') if subjects_match else "General"
-        
-        hours_match = re.search(r'hours_per_day[:\s]+(\d+)', latest_input, re.IGNORECASE)
-        hours_per_day = int(hours_match.group(1)) if hours_match else 2
-        
-        level_match = re.search(r'current_level[:\s]+"?([^",\n]+)"?', latest_input, re.IGNORECASE)
-        current_level = level_match.group(1).strip().strip('"') if level_match else "intermediate"
-        
-        if exam_date:
-          try:
-            print(f"🎯 Intercepting schedule request: exam_date={exam_date}, subjects={subjects}, hours_per_day={hours_per_day}, current_level={current_level}")
-            schedule_output = _create_study_schedule(
-              exam_date=exam_date,
-              subjects=subjects,
-              hours_per_day=hours_per_day,
-              current_level=current_level
-            )
-            print(f"✅ Schedule generated successfully, length: {len(schedule_output)} chars")
-            return schedule_output
-          except Exception as e:
-            import traceback
-            print(f"❌ Schedule generation tool failed: {traceback.format_exc()}")
-    
-    # If it's a weak areas request for exam prep agent, generate directly
-    if is_weak_areas_request and agent.is_prebuilt:
-      from app.tools.prebuilt_agents import PREBUILT_AGENT_SLUGS, _identify_weak_areas
-      if agent.slug == PREBUILT_AGENT_SLUGS["exam_prep_agent"]:
-        import re
-        # Extract parameters
-        subject_match = re.search(r'subject[:\s]+"?([^",\n]+)"?', latest_input, re.IGNORECASE)
-        subject = subject_match.group(1).strip().strip('"') if subject_match else "General"
-        
-        # Extract practice_results - handle multi-line content
-        practice_results_match = re.search(r'practice_results[:\s]+"([^"]+)"', latest_input, re.IGNORECASE | re.DOTALL)
-        if not practice_results_match:
-          # Try without quotes - capture until next parameter or end
-          practice_results_match = re.search(r'practice_results[:\s]+(.+?)(?=\n- [a-z_]+:|$)', latest_input, re.IGNORECASE | re.DOTALL)
-        if not practice_results_match:
-          # Try to find any practice results text in the message
-          practice_results_match = re.search(r'practice_results[:\s]+(.+)', latest_input, re.IGNORECASE | re.DOTALL)
-        practice_results = practice_results_match.group(1).strip().strip('"') if practice_results_match else "No results provided"
-        
-        exam_type_match = re.search(r'exam_type[:\s]+"?([^",\n]+)"?', latest_input, re.IGNORECASE)
-        exam_type = exam_type_match.group(1).strip().strip('"') if exam_type_match else "general"
-        
-        try:
-          print(f"🎯 Intercepting weak areas request: subject={subject}, exam_type={exam_type}")
-          weak_areas_output = _identify_weak_areas(
-            subject=subject,
-            practice_results=practice_results,
-            exam_type=exam_type
-          )
-          print(f"✅ Weak areas analysis generated successfully, length: {len(weak_areas_output)} chars")
-          return weak_areas_output
-        except Exception as e:
-          import traceback
-          print(f"❌ Weak areas analysis tool failed: {traceback.format_exc()}")
-    
-    # If it's a topic review request for exam prep agent, generate directly
-    if is_topic_review_request and agent.is_prebuilt:
-      from app.tools.prebuilt_agents import PREBUILT_AGENT_SLUGS, _generate_topic_review
-      if agent.slug == PREBUILT_AGENT_SLUGS["exam_prep_agent"]:
-        import re
-        # Extract parameters
-        topic_match = re.search(r'topic[:\s]+"?([^",\n]+)"?', latest_input, re.IGNORECASE)
-        topic = topic_match.group(1).strip().strip('"') if topic_match else "General Topic"
-        
-        difficulty_match = re.search(r'difficulty[:\s]+"?([^",\n]+)"?', latest_input, re.IGNORECASE)
-        difficulty = difficulty_match.group(1).strip().strip('"') if difficulty_match else "medium"
-        
-        review_type_match = re.search(r'review_type[:\s]+"?([^",\n]+)"?', latest_input, re.IGNORECASE)
-        review_type = review_type_match.group(1).strip().strip('"') if review_type_match else "comprehensive"
-        
-        try:
-          print(f"🎯 Intercepting topic review request: topic={topic}, difficulty={difficulty}, review_type={review_type}")
-          topic_review_output = _generate_topic_review(
-            topic=topic,
-            difficulty=difficulty,
-            review_type=review_type
-          )
-          print(f"✅ Topic review generated successfully, length: {len(topic_review_output)} chars")
-          return topic_review_output
-        except Exception as e:
-          import traceback
-          print(f"❌ Topic review tool failed: {traceback.format_exc()}")
-
-    # If it's a micro-lesson request for micro learning agent, generate directly
-    if is_micro_lesson_request and agent.is_prebuilt:
-      from app.tools.prebuilt_agents import PREBUILT_AGENT_SLUGS, _generate_micro_lesson
-      if agent.slug == PREBUILT_AGENT_SLUGS["micro_learning_agent"]:
-        import re
-        # Extract parameters
-        topic_match = re.search(r'topic[:\s]+"?([^",\n]+)"?', latest_input, re.IGNORECASE)
-        if not topic_match:
-          topic_match = re.search(r'(?:about|on|for)\s+([^,\.\n]+)', latest_input, re.IGNORECASE)
-        topic = topic_match.group(1).strip().strip('"') if topic_match else "General Topic"
-
-        minutes_match = re.search(r'time_minutes[:\s]+(\d+)', latest_input, re.IGNORECASE)
-        if not minutes_match:
-          minutes_match = re.search(r'(\d+)\s*(?:minutes?|mins?)', latest_input, re.IGNORECASE)
-        time_minutes = int(minutes_match.group(1)) if minutes_match else 10
-
-        difficulty_match = re.search(r'difficulty[:\s]+"?([^",\n]+)"?', latest_input, re.IGNORECASE)
-        if not difficulty_match:
-          difficulty_match = re.search(r'(easy|medium|hard|beginner|intermediate|advanced)', latest_input, re.IGNORECASE)
-        difficulty = difficulty_match.group(1).strip().lower().strip('"') if difficulty_match else "medium"
-        if difficulty in ["beginner"]:
-          difficulty = "easy"
-        elif difficulty in ["intermediate"]:
-          difficulty = "medium"
-        elif difficulty in ["advanced"]:
-          difficulty = "hard"
-
-        try:
-          print(f"🎯 Intercepting micro-lesson request: topic={topic}, time_minutes={time_minutes}, difficulty={difficulty}")
-          lesson_output = _generate_micro_lesson(
-            topic=topic,
-            time_minutes=time_minutes,
-            difficulty=difficulty
-          )
-          print(f"✅ Micro-lesson generated successfully, length: {len(lesson_output)} chars")
-          return lesson_output
-        except Exception as e:
-          import traceback
-          print(f"❌ Micro-lesson tool failed: {traceback.format_exc()}")
+    if tool_calling.enabled_for(agent):
+      try:
+        result = tool_calling.run(agent, self._tool_loop_messages(agent, history, latest_input, summary))
+        return self._clean_output(result.output)
+      except UpstreamOverloaded:
+        raise
+      except Exception as e:
+        raise GeminiError(f"Error generating response: {str(e)}", agent.model, is_retryable(e)) from e
+
+    intercepted = self._intercept_tools(agent, latest_input)
+    if intercepted is not None:
+      return intercepted
+
+    if self._uses_prompt_cache(agent):
+      current_input, history_for_chain = self._prepare_chain_input(
+        agent, history, latest_input, summary, include_system_prompt=False
+      )
+      try:
+        from app.services.gemini import GeminiClient
+        return self._clean_output(GeminiClient().generate_response(
+          system_prompt=agent.system_prompt,
+          messages=self._fallback_messages(history_for_chain, current_input),
+          model=agent.model,
+          temperature=agent.temperature,
+          agent_slug=agent.slug,
+          cache_system_prompt=True,
+        ))
+      except UpstreamOverloaded:
+        raise
+      except Exception as e:
+        raise GeminiError(f"Error generating response: {str(e)}", agent.model, is_retryable(e)) from e
+
+    current_input, history_for_chain = self._prepare_chain_input(agent, history, latest_input, summary)
+    chain = self._build_chain(agent)
     
-    # If it's a quiz request for prebuilt agents, generate directly
-    if is_quiz_request and agent.is_prebuilt:
-      from app.tools.prebuilt_agents import PREBUILT_AGENT_SLUGS
-      if agent.slug in [PREBUILT_AGENT_SLUGS["personal_tutor"], 
-                        PREBUILT_AGENT_SLUGS["course_creation_agent"],
-                        PREBUILT_AGENT_SLUGS["language_practice_agent"]]:
-        # Extract quiz parameters from the request
-        import re
-        topic_match = re.search(r'(?:about|on|for)\s+([^,\.\?]+?)(?:\s+with|\s+at|\s+of|$)', latest_input, re.IGNORECASE)
-        topic = topic_match.group(1).strip() if topic_match else "general knowledge"
-        
-        difficulty_match = re.search(r'(easy|medium|hard|beginner|intermediate|advanced)', latest_input, re.IGNORECASE)
-        difficulty = difficulty_match.group(1).lower() if difficulty_match else "medium"
-        if difficulty in ["beginner"]:
-          difficulty = "easy"
-        elif difficulty in ["intermediate"]:
-          difficulty = "medium"
-        elif difficulty in ["advanced"]:
-          difficulty = "hard"
-        
-        num_match = re.search(r'(\d+)\s*(?:questions?|mcqs?)', latest_input, re.IGNORECASE)
-        num_questions = int(num_match.group(1)) if num_match else 5
-        
-        # Generate quiz directly using the tool (single API call)
-        from app.tools.prebuilt_agents import _generate_quiz
-        try:
-          quiz_output = _generate_quiz(topic=topic, difficulty=difficulty, num_questions=num_questions)
-          # Keep answers in the response - they're needed for validation
-          # Answers will be hidden in the UI but available for validation
-          return quiz_output
-        except Exception as e:
-          # Fallback to normal generation if tool fails
-          print(f"Quiz generation tool failed, falling back to normal generation: {str(e)}")
+    payload = {
+      "input": current_input,
+      "chat_history": history_for_chain,
+    }
     
-    # Tool-wired flow for Course Creation Agent: intercept common intents and delegate
-    # directly to the prebuilt tools for fast, deterministic behavior.
-    from app.tools.prebuilt_agents import PREBUILT_AGENT_SLUGS
-    if agent.is_prebuilt and agent.slug == PREBUILT_AGENT_SLUGS["course_creation_agent"]:
-      import re
-      from app.tools.prebuilt_agents import (
-        _create_course_structure,
-        _create_learning_assessment,
-        _create_concept_map,
-        _create_workflow_automation,
-        _create_meeting_notes_template,
-        _validate_course_content,
-      )
-
-      text = latest_lower
-
-      # 1) Course structure / outline
-      if ("course structure" in text or "course outline" in text or "create_course_structure" in text):
-        # Try to extract course title, objectives, and duration
-        title_match = re.search(r'(?:course\s+title|for\s+course|about)\s*[:\-"]?\s*([^"\n,]+)', latest_input, re.IGNORECASE)
-        course_title = title_match.group(1).strip() if title_match else latest_input[:80]
-
-        objectives_match = re.search(r'(?:learning objectives?|objectives?)\s*[:\-]\s*(.+)', latest_input, re.IGNORECASE)
-        if objectives_match:
-          learning_objectives = objectives_match.group(1).strip()
-        else:
-          learning_objectives = course_title
-
-        weeks_match = re.search(r'(?:duration|weeks?)\s*[:\-]?\s*(\d+)', latest_input, re.IGNORECASE)
-        duration_weeks = int(weeks_match.group(1)) if weeks_match else 8
-
-        return _create_course_structure(
-          course_title=course_title,
-          learning_objectives=learning_objectives,
-          duration_weeks=duration_weeks,
-        )
-
-      # 2) Learning assessment
-      if ("learning assessment" in text or "assessment" in text or "create_learning_assessment" in text):
-        topic_match = re.search(r'(?:topic|for)\s*[:\-"]?\s*([^"\n,]+)', latest_input, re.IGNORECASE)
-        topic = topic_match.group(1).strip() if topic_match else "General Topic"
-
-        assessment_type_match = re.search(r'(diagnostic|formative|summative|comprehensive)', latest_input, re.IGNORECASE)
-        assessment_type = assessment_type_match.group(1).lower() if assessment_type_match else "comprehensive"
-
-        num_q_match = re.search(r'(\d+)\s*(?:questions?|items?)', latest_input, re.IGNORECASE)
-        num_questions = int(num_q_match.group(1)) if num_q_match else 10
-
-        return _create_learning_assessment(
-          topic=topic,
-          assessment_type=assessment_type,
-          num_questions=num_questions,
-        )
-
-      # 3) Concept map
-      if ("concept map" in text or "concept mapping" in text or "create_concept_map" in text):
-        main_match = re.search(r'(?:main concept|for)\s*[:\-"]?\s*([^"\n,]+)', latest_input, re.IGNORECASE)
-        main_concept = main_match.group(1).strip() if main_match else "Main Concept"
-
-        related_match = re.search(r'(?:related concepts?|subtopics?)\s*[:\-]\s*(.+)', latest_input, re.IGNORECASE)
-        related_concepts = related_match.group(1).strip() if related_match else ""
-
-        return _create_concept_map(
-          main_concept=main_concept,
-          related_concepts=related_concepts,
-        )
-
-      # 4) Workflow automation
-      if ("workflow" in text or "automation" in text or "create_workflow_automation" in text):
-        wf_name_match = re.search(r'(?:workflow name|for workflow|workflow)\s*[:\-"]?\s*([^"\n,]+)', latest_input, re.IGNORECASE)
-        workflow_name = wf_name_match.group(1).strip() if wf_name_match else "Course Creation Workflow"
-
-        steps_match = re.search(r'(?:steps?)\s*[:\-]\s*(.+)', latest_input, re.IGNORECASE)
-        steps = steps_match.group(1).strip() if steps_match else "Plan course,Design modules,Create lessons,Publish course"
-
-        wf_type_match = re.search(r'(learning|assessment|content_creation|course_delivery)', latest_input, re.IGNORECASE)
-        automation_type = wf_type_match.group(1).lower() if wf_type_match else "learning"
-
-        return _create_workflow_automation(
-          workflow_name=workflow_name,
-          steps=steps,
-          automation_type=automation_type,
-        )
-
-      # 5) Meeting notes templates
-      if ("meeting notes" in text or "notes template" in text or "create_meeting_notes_template" in text):
-        mt_type_match = re.search(r'(course_planning|review|assessment_design)', latest_input, re.IGNORECASE)
-        meeting_type = mt_type_match.group(1).lower() if mt_type_match else "course_planning"
-
-        participants_match = re.search(r'(?:participants?)\s*[:\-]\s*(.+)', latest_input, re.IGNORECASE)
-        participants = participants_match.group(1).strip() if participants_match else ""
-
-        return _create_meeting_notes_template(
-          meeting_type=meeting_type,
-          participants=participants,
-        )
-
-      # 6) Course validation
-      if ("validate course" in text or "course validation" in text or "validate_course_content" in text):
-        structure_match = re.search(r'(?:course structure|outline|description)\s*[:\-]\s*(.+)', latest_input, re.IGNORECASE | re.DOTALL)
-        course_structure = structure_match.group(1).strip() if structure_match else latest_input
-
-        criteria_match = re.search(r'(comprehensive|accessibility|learning_objectives|assessment_alignment)', latest_input, re.IGNORECASE)
-        validation_criteria = criteria_match.group(1).lower() if criteria_match else "comprehensive"
-
-        return _validate_course_content(
-          course_structure=course_structure,
-          validation_criteria=validation_criteria,
+    prompt_tokens = self._prompt_tokens(current_input, history_for_chain)
+    try:
+      with llm_call(agent.model, agent.slug, prompt_tokens) as call:
+        result = single_flight.do(
+          self._flight_key(agent, current_input, history_for_chain),
+          lambda: resilience.call(
+            agent.model,
+            lambda routed: model_router.run(
+              model_router.plan(routed, agent.slug),
+              lambda model: self._chain_chunks(model, agent.temperature, payload),
+              direct=lambda: self._invoke(self._routed_chain(agent, chain, routed), routed, payload),
+            ),
+          ),
         )
-
-    # Structured, tool-driven flow for Skill Gap Agent.
-    # The frontend sends workflow actions in JSON payloads using:
-    #   SKILL_GAP_REQUEST
-    #   { "action": "...", "payload": { ... } }
-    if agent.is_prebuilt and agent.slug == PREBUILT_AGENT_SLUGS.get("skill_gap_agent"):
-      import json
-      from app.tools.prebuilt_agents import _generate_skill_gap_agent_response
-
-      text = latest_input or ""
-      marker = "SKILL_GAP_REQUEST"
-      marker_used = marker in text
-
-      if marker_used:
-        json_start = text.find("{", text.find(marker))
-        if json_start != -1:
-          payload_str = text[json_start:].strip()
-          try:
-            payload = json.loads(payload_str)
-          except Exception:
-            payload = {}
-        else:
-          payload = {}
-      else:
-        try:
-          payload = json.loads(text)
-        except Exception:
-          payload = {}
-
-      action = ""
-      action_payload = {}
-      if isinstance(payload, dict):
-        action = str(payload.get("action") or "").strip().lower()
-        if isinstance(payload.get("payload"), dict):
-          action_payload = dict(payload.get("payload") or {})
-        else:
-          action_payload = dict(payload)
-          action_payload.pop("action", None)
-
-      if action in {
-        "profile_baseline",
-        "identify_skill_gaps",
-        "build_development_plan",
-        "weekly_progress_checkin",
-        "readiness_assessment",
-      }:
+        call.finished(result)
+      return self._clean_output(result)
+      
+    except UpstreamOverloaded:
+      raise
+    except Exception as e:
+      if self._is_finish_reason_error(e):
+        print("Warning: Gemini finish_reason parsing failed in LangChain, using deterministic SDK fallback...")
         try:
-          return _generate_skill_gap_agent_response(action=action, payload=action_payload)
-        except Exception as e:
-          import traceback
-          print(f"Skill gap tool failed: {traceback.format_exc()}")
-          return (
-            '{"action":"'
-            + action
-            + '","status":"error","error":"internal_error","message":"'
-            + str(e).replace('"', '\\"')
-            + '"}'
+          from app.services.gemini import GeminiClient
+          return GeminiClient().generate_response(
+            system_prompt=agent.system_prompt or "",
+            messages=self._fallback_messages(history_for_chain, current_input),
+            model=agent.model,
+            temperature=agent.temperature,
+            agent_slug=agent.slug,
           )
+        except Exception as fallback_error:
+          raise Exception(
+            f"Error generating response (finish_reason parsing issue): {str(fallback_error)}"
+          ) from e
+      
+      raise GeminiError(f"Error generating response: {str(e)}", agent.model, is_retryable(e)) from e
 
-      if marker_used:
-        return (
-          '{"action":"unknown","status":"error","error":"invalid_payload",'
-          '"message":"SKILL_GAP_REQUEST must include a valid action."}'
-        )
-
-    # Structured, tool-driven flow for Fitness Coach Agent.
-    # The frontend sends workflow actions in JSON payloads using:
-    #   FITNESS_COACH_REQUEST
-    #   { "action": "...", "payload": { ... } }
-    if agent.is_prebuilt and agent.slug == PREBUILT_AGENT_SLUGS.get("fitness_coach_agent"):
-      import json
-      from app.tools.prebuilt_agents import _generate_fitness_coach_response
-
-      text = latest_input or ""
-      marker = "FITNESS_COACH_REQUEST"
-      marker_used = marker in text
-
-      if marker_used:
-        json_start = text.find("{", text.find(marker))
-        if json_start != -1:
-          payload_str = text[json_start:].strip()
-          try:
-            payload = json.loads(payload_str)
-          except Exception:
-            payload = {}
-        else:
-          payload = {}
-      else:
-        try:
-          payload = json.loads(text)
-        except Exception:
-          payload = {}
-
-      action = ""
-      action_payload = {}
-      if isinstance(payload, dict):
-        action = str(payload.get("action") or "").strip().lower()
-        if isinstance(payload.get("payload"), dict):
-          action_payload = dict(payload.get("payload") or {})
-          for key, value in payload.items():
-            if key in {"action", "payload"}:
-              continue
-            action_payload.setdefault(key, value)
-        else:
-          action_payload = dict(payload)
-          action_payload.pop("action", None)
-
-      if action in {
-        "profile_baseline",
-        "generate_adaptive_plan",
-        "quick_workout_burst",
-        "log_workout_feedback",
-        "challenge_mode",
-        "progress_reassessment",
-      }:
-        try:
-          return _generate_fitness_coach_response(action=action, payload=action_payload)
-        except Exception as e:
-          import traceback
-          print(f"Fitness coach tool failed: {traceback.format_exc()}")
-          return (
-            '{"action":"'
-            + action
-            + '","status":"error","error":"internal_error","message":"'
-            + str(e).replace('"', '\\"')
-            + '"}'
-          )
+  async def agenerate_response(
+    self,
+    agent: Agent,
+    history: List[Message],
+    latest_input: str,
+    summary: Optional[str] = None,
+  ) -> str:
+    """Async variant of ``generate_response`` for async endpoints.
 
-      if marker_used:
-        return (
-          '{"action":"unknown","status":"error","error":"invalid_payload",'
-          '"message":"FITNESS_COACH_REQUEST must include a valid action."}'
-        )
+    The chain and SDK fallback are awaited without holding a thread; tool
+    interception (sync tool functions) runs in the threadpool.
+    """
+    if tool_calling.enabled_for(agent):
+      try:
+        result = await tool_calling.arun(agent, self._tool_loop_messages(agent, history, latest_input, summary))
+        return self._clean_output(result.output)
+      except UpstreamOverloaded:
+        raise
+      except Exception as e:
+        raise GeminiError(f"Error generating response: {str(e)}", agent.model, is_retryable(e)) from e
+
+    intercepted = await run_in_threadpool(self._intercept_tools, agent, latest_input)
+    if intercepted is not None:
+      return intercepted
+
+    if self._uses_prompt_cache(agent):
+      current_input, history_for_chain = self._prepare_chain_input(
+        agent, history, latest_input, summary, include_system_prompt=False
+      )
+      try:
+        from app.services.gemini import GeminiClient
+        return self._clean_output(await GeminiClient().agenerate_response(
+          system_prompt=agent.system_prompt,
+          messages=self._fallback_messages(history_for_chain, current_input),
+          model=agent.model,
+          temperature=agent.temperature,
+          agent_slug=agent.slug,
+          cache_system_prompt=True,
+        ))
+      except UpstreamOverloaded:
+        raise
+      except Exception as e:
+        raise GeminiError(f"Error generating response: {str(e)}", agent.model, is_retryable(e)) from e
+
+    current_input, history_for_chain = self._prepare_chain_input(agent, history, latest_input, summary)
+    chain = self._build_chain(agent)
 
-    # Structured, tool-driven flow for Career Coach Agent.
-    # The frontend sends workflow actions in JSON payloads using:
-    #   CAREER_COACH_REQUEST
-    #   { "action": "...", "payload": { ... } }
-    # Backward-compatible flat payloads are also accepted.
-    if agent.is_prebuilt and agent.slug == PREBUILT_AGENT_SLUGS.get("career_coach_agent"):
-      import json
-      from app.tools.prebuilt_agents import _generate_career_coach_response
-
-      text = latest_input or ""
-      marker = "CAREER_COACH_REQUEST"
-      marker_used = marker in text
-
-      if marker_used:
-        json_start = text.find("{", text.find(marker))
-        if json_start != -1:
-          payload_str = text[json_start:].strip()
-          try:
-            payload = json.loads(payload_str)
-          except Exception:
-            payload = {}
-        else:
-          payload = {}
-      else:
-        # Fallback for direct JSON requests.
-        try:
-          payload = json.loads(text)
-        except Exception:
-          payload = {}
-
-      action = ""
-      action_payload = {}
-      if isinstance(payload, dict):
-        action = str(payload.get("action") or "").strip().lower()
-        if isinstance(payload.get("payload"), dict):
-          action_payload = dict(payload.get("payload") or {})
-          # Allow mixed payloads where some fields are still top-level.
-          for key, value in payload.items():
-            if key in {"action", "payload"}:
-              continue
-            action_payload.setdefault(key, value)
-        else:
-          action_payload = dict(payload)
-          action_payload.pop("action", None)
-
-      if action in {
-        "intake_assessment",
-        "opportunity_strategy",
-        "skill_gap_analysis",
-        "build_roadmap",
-        "weekly_checkin",
-        "interview_readiness",
-      }:
-        try:
-          return _generate_career_coach_response(action=action, payload=action_payload)
-        except Exception as e:
-          import traceback
-          print(f"Career coach tool failed: {traceback.format_exc()}")
-          return (
-            '{"action":"'
-            + action
-            + '","status":"error","error":"internal_error","message":"'
-            + str(e).replace('"', '\\"')
-            + '"}'
-          )
+    payload = {
+      "input": current_input,
+      "chat_history": history_for_chain,
+    }
 
-      # If user sent the structured marker but payload/action is invalid, fail fast.
-      if marker_used:
-        return (
-          '{"action":"unknown","status":"error","error":"invalid_payload",'
-          '"message":"CAREER_COACH_REQUEST must include a valid action."}'
+    prompt_tokens = self._prompt_tokens(current_input, history_for_chain)
+    try:
+      with llm_call(agent.model, agent.slug, prompt_tokens) as call:
+        result = await single_flight.ado(
+          self._flight_key(agent, current_input, history_for_chain),
+          lambda: resilience.acall(
+            agent.model,
+            lambda routed: model_router.arun(
+              model_router.plan(routed, agent.slug),
+              lambda model: self._achain_chunks(model, agent.temperature, payload),
+              direct=lambda: self._ainvoke(self._routed_chain(agent, chain, routed), routed, payload),
+            ),
+          ),
         )
+        call.finished(result)
+      return self._clean_output(result)
 
-    # Structured, tool-driven flow for Resume Review Agent.
-    # This agent is NOT a free-form chatbot: the frontend sends structured payloads
-    # (JSON) and we delegate directly to the resume review tool for deterministic output.
-    if agent.is_prebuilt and agent.slug == PREBUILT_AGENT_SLUGS.get("resume_review_agent"):
-      import json
-      from app.tools.prebuilt_agents import _generate_resume_review
-
-      text = latest_input or ""
-
-      # Primary contract: a marker followed by a JSON payload.
-      # Example:
-      #   RESUME_REVIEW_REQUEST
-      #   { "action": "review_resume", "resume_text": "...", ... }
-      marker = "RESUME_REVIEW_REQUEST"
-      if marker in text:
-        json_start = text.find("{", text.find(marker))
-        if json_start != -1:
-          payload_str = text[json_start:].strip()
-          try:
-            payload = json.loads(payload_str)
-          except Exception:
-            payload = {}
-        else:
-          payload = {}
-      else:
-        # Fallback: try to interpret the whole text as JSON if possible.
-        try:
-          payload = json.loads(text)
-        except Exception:
-          payload = {}
-
-      action = ""
-      if isinstance(payload, dict):
-        action = str(payload.get("action") or "").lower()
-
-      if action == "review_resume":
-        resume_text = str(payload.get("resume_text") or "").strip()
-        job_description = str(payload.get("job_description") or "").strip()
-        target_role = str(payload.get("target_role") or "").strip()
-        seniority = str(payload.get("seniority") or "mid").strip().lower()
-
-        try:
-          return _generate_resume_review(
-            resume_text=resume_text,
-            job_description=job_description,
-            target_role=target_role,
-            seniority=seniority,
-          )
-        except Exception as e:
-          import traceback
-          print(f"❌ Resume review tool failed: {traceback.format_exc()}")
-          return (
-            '{"error":"internal_error",'
-            f'"message":"Unexpected error while generating resume review: {str(e)}","overall_score":0,"ats_score":0}}'
-          )
-    # Build messages with latest_input merged properly
-    chat_history = self._history_to_messages(history, latest_input)
-    
-    # Use simple chain for all agents
-    chain = self._build_chain(agent)
-    
-    try:
-      # Extract the latest input from merged messages
-      if chat_history and isinstance(chat_history[-1], HumanMessage):
-        current_input = chat_history[-1].content
-        # Remove it from history for the chain
-        history_for_chain = chat_history[:-1]
-      else:
-        current_input = latest_input
-        history_for_chain = chat_history
-
-      # Defensive: ensure only Human/AI messages are passed to Gemini.
-      history_for_chain = [
-        msg for msg in history_for_chain
-        if isinstance(msg, (HumanMessage, AIMessage))
-      ]
-
-      # Inject system instructions into the current input to avoid system-role messages.
-      if agent.system_prompt:
-        current_input = f"{agent.system_prompt}\n\n{current_input}" if current_input else agent.system_prompt
-      current_input = (current_input or "")[:MAX_INPUT_CHARS]
-      
-      result = chain.invoke(
-        {
-          "input": current_input,
-          "chat_history": history_for_chain,
-        }
-      )
-      output = result.content if hasattr(result, 'content') else str(result)
-      
-      # Clean quiz output if present - only remove preamble, keep answers for validation
-      if "**Question 1:**" in output or "Question 1:" in output:
-        quiz_start = output.find("**Question 1:**")
-        if quiz_start == -1:
-          quiz_start = output.find("Question 1:")
-        if quiz_start > 0:
-          output = output[quiz_start:].strip()
-      
-      return output
-      
+    except UpstreamOverloaded:
+      raise
     except Exception as e:
-      error_str = str(e).lower()
-      if "'int' object has no attribute 'name'" in error_str or "finish_reason" in error_str:
+      if self._is_finish_reason_error(e):
         print("Warning: Gemini finish_reason parsing failed in LangChain, using deterministic SDK fallback...")
         try:
           from app.services.gemini import GeminiClient
-          gemini_client = GeminiClient()
-          message_payload = []
-          for msg in history_for_chain:
-            if isinstance(msg, HumanMessage):
-              message_payload.append({"role": "user", "content": msg.content})
-            elif isinstance(msg, AIMessage):
-              message_payload.append({"role": "assistant", "content": msg.content})
-          message_payload.append({"role": "user", "content": current_input})
-          output = gemini_client.generate_response(
+          return await GeminiClient().agenerate_response(
             system_prompt=agent.system_prompt or "",
-            messages=message_payload,
+            messages=self._fallback_messages(history_for_chain, current_input),
             model=agent.model,
             temperature=agent.temperature,
+            agent_slug=agent.slug,
           )
-          return output
         except Exception as fallback_error:
           raise Exception(
             f"Error generating response (finish_reason parsing issue): {str(fallback_error)}"
           ) from e
-      
-      raise Exception(f"Error generating response: {str(e)}") from e
+
+      raise GeminiError(f"Error generating response: {str(e)}", agent.model, is_retryable(e)) from e
 
   async def stream_response(
     self,
     agent: Agent,
     history: List[Message],
     latest_input: str,
+    summary: Optional[str] = None,
   ):
-    """Generate streaming response - optimized to avoid extra chain overhead."""
-    chat_history = self._history_to_messages(history, latest_input)
+    """Generate streaming response - optimized to avoid extra chain overhead.
+
+    Tool intents are routed like ``generate_response``; quiz, practice exam and
+    micro-lesson output is streamed as the tool generates it.
+    """
+    with stage("prompt"):
+      window = context_for_agent(agent, history, latest_input, summary)
+      chat_history = self._history_to_messages(window)
 
     # Build simple text prompt from history and latest input, similar to the
     # non-streaming fallback path, to minimize LangChain pipeline overhead.
     try:
+      if tool_calling.enabled_for(agent):
+        # Tool results are only known once the loop finishes: sent as one chunk.
+        result = await tool_calling.arun(agent, self._tool_loop_messages(agent, history, latest_input, summary))
+        yield self._clean_output(result.output)
+        return
+
+      tool_stream = await intent_router.astream(agent, latest_input)
+      if tool_stream is not None:
+        async for chunk in tool_stream:
+          if chunk:
+            yield chunk
+        return
+
+      note_context_window(window)
       if chat_history and isinstance(chat_history[-1], HumanMessage):
         current_input = chat_history[-1].content
         history_for_prompt = chat_history[:-1]
@@ -849,7 +449,23 @@ class LangchainAgentService:
         current_input = latest_input
         history_for_prompt = chat_history
 
-      llm = self._build_llm(agent)
+      if self._uses_prompt_cache(agent):
+        from app.services.gemini import GeminiClient
+        summary_block = self._instructions(agent, window, include_system_prompt=False)
+        stream = GeminiClient().astream(
+          system_prompt=agent.system_prompt,
+          messages=self._fallback_messages(
+            history_for_prompt,
+            f"{summary_block}\n\n{current_input}" if summary_block else current_input,
+          ),
+          model=agent.model,
+          temperature=agent.temperature,
+          agent_slug=agent.slug,
+          cache_system_prompt=True,
+        )
+        async for content in stream:
+          yield content
+        return
 
       prompt_parts = []
       for msg in history_for_prompt:
@@ -862,13 +478,26 @@ class LangchainAgentService:
       prompt_parts.append("Assistant:")
 
       full_prompt = "\n".join(prompt_parts)
-      if agent.system_prompt:
-        full_prompt = f"{agent.system_prompt}\n\n{full_prompt}"
-
-      async for chunk in llm.astream(full_prompt):
-        content = chunk.content if hasattr(chunk, "content") else str(chunk)
-        if content:
-          yield content
+      instructions = self._instructions(agent, window)
+      if instructions:
+        full_prompt = f"{instructions}\n\n{full_prompt}"
+
+      async def llm_chunks(model: str) -> AsyncIterator[str]:
+        llm = self._build_llm(agent) if model == agent.model else llm_registry.chat_model(model, agent.temperature)
+        async with concurrency_limiter.aslot(model):
+          async for chunk in llm.astream(full_prompt):
+            content = self._chunk_text(chunk)
+            if content:
+              yield content
+
+      # Retried before the first chunk and hedged against the fallback model
+      # when the agent has a latency budget.
+      stream = resilience.astream(
+        agent.model,
+        lambda routed: model_router.astream(model_router.plan(routed, agent.slug), llm_chunks),
+      )
+      async for content in llm_stream(agent.model, agent.slug, estimate_tokens(full_prompt), stream):
+        yield content
     except Exception as e:
       # Surface a concise error message to the streaming client.
       yield f"Error: {str(e)}"
@@ -0,0 +1,134 @@
+"""Instrumentation shared by every LLM call site.
+
+``llm_call`` and ``llm_stream`` time a call as the request's ``llm`` stage
+(``app.core.observability``) and record its duration, TTFT and estimated
+token counts in the Prometheus metrics (``app.core.metrics``) by model and
+agent slug.
+
+``track_prompt_usage`` collects the prompts actually sent while answering one
+chat turn (every LLM call, tool loop steps and tool generations included) for
+the ``usage`` reported with the reply.
+"""
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from app.core.metrics import LLM_REQUEST_SECONDS, LLM_TOKENS, LLM_TTFT_SECONDS
+from app.core.observability import count, stage, timed_stream
+from app.services.context_window import ContextWindow, estimate_tokens
+
+
+class PromptUsage:
+    """Prompt tokens sent, and the conversation window used, for one chat turn."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.window: Optional[ContextWindow] = None
+
+    def add(self, prompt_tokens: int) -> None:
+        with self._lock:
+            self.llm_calls += 1
+            self.prompt_tokens += prompt_tokens
+
+    def report(self) -> Optional[Dict[str, int]]:
+        """The ``usage`` of the reply, or None when no prompt was sent."""
+        if not self.llm_calls:
+            return None
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "history_messages": self.window.history_messages if self.window else 0,
+            "dropped_messages": self.window.dropped_messages if self.window else 0,
+        }
+
+
+_current_usage: ContextVar[Optional[PromptUsage]] = ContextVar("prompt_usage", default=None)
+
+
+@contextmanager
+def track_prompt_usage() -> Iterator[PromptUsage]:
+    """Collect the LLM calls made in the block (threadpool work included)."""
+    usage = PromptUsage()
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+def note_context_window(window: ContextWindow) -> None:
+    """Record the conversation window the current turn's prompt was built from."""
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.window = window
+
+
+def _agent_label(agent_slug: Optional[str]) -> str:
+    # Custom agents have no slug; their ids would be unbounded label values.
+    return agent_slug or "none"
+
+
+def _start(model: str, agent: str, prompt_tokens: int) -> None:
+    count(llm_calls=1, prompt_tokens=prompt_tokens)
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add(prompt_tokens)
+    LLM_TOKENS.labels(model, agent, "prompt").inc(prompt_tokens)
+
+
+class LLMCall:
+    """Handle of a call made inside ``llm_call``."""
+
+    def __init__(self, model: str, agent: str) -> None:
+        self.model = model
+        self.agent = agent
+        self.outcome = "error"
+
+    def finished(self, result: Any) -> Any:
+        """Record the completion (text or LangChain message) and return it unchanged."""
+        content = getattr(result, "content", result)
+        if isinstance(content, str):
+            LLM_TOKENS.labels(self.model, self.agent, "completion").inc(estimate_tokens(content))
+        self.outcome = "ok"
+        return result
+
+
+@contextmanager
+def llm_call(model: str, agent_slug: Optional[str], prompt_tokens: int) -> Iterator[LLMCall]:
+    """Instrument the LLM call made in the block; pass its result to ``finished``."""
+    call = LLMCall(model, _agent_label(agent_slug))
+    _start(model, call.agent, prompt_tokens)
+    started = time.perf_counter()
+    try:
+        with stage("llm"):
+            yield call
+    finally:
+        LLM_REQUEST_SECONDS.labels(model, call.agent, call.outcome).observe(time.perf_counter() - started)
+
+
+async def llm_stream(
+    model: str, agent_slug: Optional[str], prompt_tokens: int, chunks: AsyncIterator[str]
+) -> AsyncIterator[str]:
+    """Yield the text ``chunks`` of a streamed LLM call, instrumenting it like ``llm_call``."""
+    agent = _agent_label(agent_slug)
+    _start(model, agent, prompt_tokens)
+    started = time.perf_counter()
+    parts: List[str] = []
+    outcome = "error"
+    try:
+        async for chunk in timed_stream("llm", chunks):
+            if not parts:
+                LLM_TTFT_SECONDS.labels(model, agent).observe(time.perf_counter() - started)
+            parts.append(chunk)
+            yield chunk
+        outcome = "ok"
+    except (GeneratorExit, asyncio.CancelledError):
+        outcome = "cancelled"
+        raise
+    finally:
+        LLM_TOKENS.labels(model, agent, "completion").inc(estimate_tokens("".join(parts)))
+        LLM_REQUEST_SECONDS.labels(model, agent, outcome).observe(time.perf_counter() - started)
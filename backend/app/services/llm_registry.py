@@ -0,0 +1,249 @@
+"""Process-wide cache of LLM client objects.
+
+Building a ``ChatGoogleGenerativeAI`` opens a new gRPC channel and calling
+``genai.configure`` again throws away the SDK's pooled clients, so doing either
+per request loses connection reuse and TLS session resumption. The registry
+configures the SDK once per API key and hands out cached LangChain models,
+chains and ``GenerativeModel`` objects keyed by their configuration; every
+LangChain model shares one generative service transport.
+
+``LLM_BACKEND`` can swap the Gemini clients for the local stand-ins in
+``app.services.fake_llm`` (``fake``/``replay``), or wrap them so their
+responses are recorded (``record``); callers do not notice the difference.
+"""
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+import google.generativeai as genai
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from app.core.config import settings
+from app.services.fake_llm import (
+    CassetteRecorder,
+    FakeChatModel,
+    FakeGemini,
+    FakeGenerativeModel,
+    backend_from_settings,
+)
+
+logger = logging.getLogger("app.llm_registry")
+
+
+def _loop_running() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _config_key(generation_config: Optional[Dict[str, Any]]) -> str:
+    return json.dumps(generation_config or {}, sort_keys=True, default=str)
+
+
+class LLMClientRegistry:
+    """Caches configured clients per (model, temperature, generation_config)."""
+
+    def __init__(self, max_entries: int = 64) -> None:
+        self._max_entries = max_entries
+        self._lock = Lock()
+        self._api_key: Optional[str] = None
+        self._transport: Optional[Any] = None
+        self._async_transport: Optional[Any] = None
+        self._entries: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._fake: Optional[FakeGemini] = None
+        self._recorder: Optional[CassetteRecorder] = None
+
+    def use_backend(self, fake: Optional[FakeGemini] = None, recorder: Optional[CassetteRecorder] = None) -> None:
+        """Serve fake models from ``fake``, or record real responses with ``recorder``."""
+        with self._lock:
+            self._reset_locked()
+            self._fake = fake
+            self._recorder = recorder
+
+    @property
+    def needs_api_key(self) -> bool:
+        """False when a local stand-in answers instead of Gemini."""
+        return self._fake is None
+
+    def configure(self, api_key: str) -> None:
+        """Configure the Gemini SDK once; a different key resets every cached client."""
+        if self._fake is not None:
+            return
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY must be set in environment variables")
+        with self._lock:
+            if api_key == self._api_key:
+                return
+            self._reset_locked()
+            genai.configure(api_key=api_key)
+            self._api_key = api_key
+
+    def _ensure_configured(self) -> str:
+        api_key = self._api_key
+        if api_key is None:
+            self.configure(settings.GEMINI_API_KEY)
+            api_key = self._api_key
+        return api_key
+
+    def _get_or_build(self, key: Tuple, build) -> Any:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return cached
+            self._misses += 1
+            value = build()
+            self._entries[key] = value
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+            return value
+
+    def _share_transport(self, llm: ChatGoogleGenerativeAI) -> None:
+        # Callers hold self._lock.
+        if self._transport is None:
+            self._transport = llm.client
+        else:
+            llm.client = self._transport
+        # The async client can only be built while an event loop is running, so
+        # adopt the first one seen and attach it to models built in the threadpool.
+        if self._async_transport is None:
+            self._async_transport = llm.async_client
+        else:
+            llm.async_client = self._async_transport
+
+    def chat_model(self, model: str, temperature: float) -> ChatGoogleGenerativeAI:
+        """Return the shared LangChain chat model for ``model``/``temperature``."""
+        fake = self._fake
+        if fake is not None:
+            return self._get_or_build(
+                ("chat_model", model, temperature),
+                lambda: FakeChatModel(backend=fake, model=model, temperature=temperature),
+            )
+        api_key = self._ensure_configured()
+        recorder = self._recorder
+
+        def build() -> ChatGoogleGenerativeAI:
+            llm = ChatGoogleGenerativeAI(
+                model=model,
+                temperature=temperature,
+                google_api_key=api_key,
+                max_retries=settings.LLM_MAX_RETRIES,
+                timeout=settings.LLM_TIMEOUT_SECONDS,
+                callbacks=[recorder.callback(model)] if recorder is not None else None,
+            )
+            self._share_transport(llm)
+            return llm
+
+        llm = self._get_or_build(("chat_model", model, temperature), build)
+        if llm.async_client is None and _loop_running():
+            # Built off the event loop (e.g. in the threadpool): attach an async
+            # transport now so ainvoke does not fall back to a worker thread.
+            with self._lock:
+                if self._async_transport is None:
+                    self._async_transport = ChatGoogleGenerativeAI(
+                        model=model,
+                        temperature=temperature,
+                        google_api_key=api_key,
+                    ).async_client
+                llm.async_client = self._async_transport
+        return llm
+
+    def chain(self, model: str, temperature: float) -> Any:
+        """Return the shared ``history + input -> model`` chain used by every agent."""
+        llm = self.chat_model(model, temperature)
+
+        def build() -> Any:
+            # Gemini chat history does not support system-role messages. Always use
+            # user/assistant history and inject system instructions into the input.
+            prompt = ChatPromptTemplate.from_messages(
+                [
+                    MessagesPlaceholder(variable_name="chat_history"),
+                    ("human", "{input}"),
+                ]
+            )
+            return prompt | llm
+
+        return self._get_or_build(("chain", model, temperature), build)
+
+    def tool_model(self, model: str, temperature: float, slug: str, tools: Sequence[Any]) -> Any:
+        """Return the chat model for ``model``/``temperature`` with ``slug``'s tools bound.
+
+        Binding converts every tool schema to a function declaration, so it is
+        done once per agent slug rather than on every call.
+        """
+        llm = self.chat_model(model, temperature)
+        return self._get_or_build(("tool_model", model, temperature, slug), lambda: llm.bind_tools(list(tools)))
+
+    def generative_model(
+        self,
+        model: str,
+        generation_config: Optional[Dict[str, Any]] = None,
+    ) -> "genai.GenerativeModel":
+        """Return a cached SDK ``GenerativeModel`` (these use the SDK's shared clients)."""
+        fake, recorder = self._fake, self._recorder
+
+        def build() -> Any:
+            if fake is not None:
+                return FakeGenerativeModel(fake, model, generation_config)
+            instance = genai.GenerativeModel(model_name=model, generation_config=generation_config)
+            return recorder.generative_model(instance, model) if recorder is not None else instance
+
+        if fake is None:
+            self._ensure_configured()
+        return self._get_or_build(("generative_model", model, _config_key(generation_config)), build)
+
+    def warm_up(self, models: Iterable[Tuple[str, float]]) -> int:
+        """Pre-build chains for the given (model, temperature) pairs; returns how many."""
+        warmed = 0
+        for model, temperature in models:
+            try:
+                self.chain(model, temperature)
+                warmed += 1
+            except Exception:
+                logger.exception("llm_warm_up_failed model=%s temperature=%s", model, temperature)
+        return warmed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            kinds: Dict[str, int] = {}
+            for key in self._entries:
+                kinds[key[0]] = kinds.get(key[0], 0) + 1
+            return {
+                "backend": "fake" if self._fake is not None else "record" if self._recorder is not None else "gemini",
+                "configured": self._api_key is not None or self._fake is not None,
+                "chat_models": kinds.get("chat_model", 0),
+                "chains": kinds.get("chain", 0),
+                "tool_models": kinds.get("tool_model", 0),
+                "generative_models": kinds.get("generative_model", 0),
+                "shared_transport": self._transport is not None,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "fake_backend": self._fake.stats() if self._fake is not None else None,
+            }
+
+    def _reset_locked(self) -> None:
+        self._api_key = None
+        self._transport = None
+        self._async_transport = None
+        self._entries.clear()
+        self._hits = self._misses = self._evictions = 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset_locked()
+
+
+llm_registry = LLMClientRegistry(max_entries=settings.LLM_CLIENT_CACHE_MAX_ENTRIES)
+llm_registry.use_backend(*backend_from_settings())
@@ -0,0 +1,315 @@
+"""Latency-budget routing between a primary model and its faster fallback.
+
+Prebuilt agents and tools use ``gemini-2.5-pro``, whose tail latency sets our
+p99. A ``RoutePlan`` gives a request a latency budget: if the primary model
+has not produced its first token within the budget, the same request is sent
+to the fallback model (``LLM_FALLBACK_MODELS``) and the first to finish wins;
+the loser is cancelled (coroutines) or abandoned at its next chunk (threads).
+For streamed responses the first model to produce a token wins instead, since
+text already sent cannot be taken back.
+
+Budgets are looked up by agent slug, then by model, then
+``LLM_HEDGE_DEFAULT_BUDGET_SECONDS``; a budget of 0 disables hedging. Every
+decision is counted per primary model and logged.
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Mapping, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger("app.model_router")
+
+_OUTCOMES = (
+    "requests",
+    "unhedged",
+    "within_budget",
+    "hedged",
+    "primary_wins",
+    "fallback_wins",
+    "primary_errors",
+    "fallback_errors",
+)
+
+
+@dataclass(frozen=True)
+class RoutePlan:
+    primary: str
+    fallback: Optional[str] = None
+    budget_seconds: float = 0.0
+
+    @property
+    def hedges(self) -> bool:
+        return bool(self.fallback) and self.fallback != self.primary and self.budget_seconds > 0
+
+
+class _Abandoned(Exception):
+    """Raised inside a losing thread to stop consuming its stream."""
+
+
+class ModelRouter:
+    """Plans and runs hedged LLM requests and records what happened."""
+
+    def __init__(
+        self,
+        fallback_models: Mapping[str, str],
+        budgets: Mapping[str, float],
+        default_budget_seconds: float = 0.0,
+        max_workers: int = 32,
+    ) -> None:
+        self._fallback_models = dict(fallback_models)
+        self._budgets = dict(budgets)
+        self._default_budget = default_budget_seconds
+        self._max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def plan(self, model: str, agent_slug: Optional[str] = None) -> RoutePlan:
+        budget = self._budgets.get(agent_slug) if agent_slug else None
+        if budget is None:
+            budget = self._budgets.get(model, self._default_budget)
+        return RoutePlan(model, self._fallback_models.get(model), float(budget or 0.0))
+
+    # Metrics -----------------------------------------------------------------
+
+    def _record(self, plan: RoutePlan, outcome: str) -> None:
+        with self._lock:
+            counts = self._counts.setdefault(plan.primary, dict.fromkeys(_OUTCOMES, 0))
+            counts[outcome] += 1
+        if outcome in ("hedged", "primary_wins", "fallback_wins"):
+            logger.info(
+                "llm_route outcome=%s primary=%s fallback=%s budget=%.2fs",
+                outcome, plan.primary, plan.fallback, plan.budget_seconds,
+            )
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {model: dict(counts) for model, counts in self._counts.items()}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+    # Coroutines --------------------------------------------------------------
+
+    async def arun(
+        self,
+        plan: RoutePlan,
+        stream: Callable[[str], AsyncIterator[str]],
+        direct: Optional[Callable[[], Awaitable[Any]]] = None,
+    ) -> Any:
+        """Return the full text of the first model to finish.
+
+        ``stream(model)`` yields a model's response chunks; ``direct()`` makes
+        the plain call used when the plan does not hedge (by default the
+        primary stream is collected).
+        """
+        self._record(plan, "requests")
+        if not plan.hedges:
+            self._record(plan, "unhedged")
+            return await direct() if direct is not None else await _collect(stream(plan.primary))
+
+        first_token = asyncio.Event()
+        primary = asyncio.ensure_future(_collect(stream(plan.primary), first_token))
+        if await _first_token_within(primary, first_token, plan.budget_seconds):
+            self._record(plan, "within_budget")
+            return await self._settle(plan, primary, is_primary=True)
+
+        self._record(plan, "hedged")
+        fallback = asyncio.ensure_future(_collect(stream(plan.fallback)))
+        done, _ = await asyncio.wait({primary, fallback}, return_when=asyncio.FIRST_COMPLETED)
+        # On a tie the primary (the better model) wins.
+        first = primary if primary in done else fallback
+        second = fallback if first is primary else primary
+        if first.exception() is None:
+            _discard(second)
+            return await self._settle(plan, first, is_primary=first is primary)
+        self._record(plan, "primary_errors" if first is primary else "fallback_errors")
+        return await self._settle(plan, second, is_primary=second is primary, other_error=first.exception())
+
+    async def astream(self, plan: RoutePlan, stream: Callable[[str], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Stream from the first model to produce a token; the other one is cancelled."""
+        self._record(plan, "requests")
+        if not plan.hedges:
+            self._record(plan, "unhedged")
+            async for chunk in stream(plan.primary):
+                yield chunk
+            return
+
+        primary_stream = stream(plan.primary)
+        primary = asyncio.ensure_future(_next_chunk(primary_stream))
+        done, _ = await asyncio.wait({primary}, timeout=plan.budget_seconds)
+        streams = {primary: primary_stream}
+        winner = primary
+        if done:
+            self._record(plan, "within_budget")
+        else:
+            self._record(plan, "hedged")
+            fallback_stream = stream(plan.fallback)
+            fallback = asyncio.ensure_future(_next_chunk(fallback_stream))
+            streams[fallback] = fallback_stream
+            done, _ = await asyncio.wait({primary, fallback}, return_when=asyncio.FIRST_COMPLETED)
+            # On a tie the primary (the better model) wins.
+            first = primary if primary in done else fallback
+            other = fallback if first is primary else primary
+            if first.exception() is None:
+                winner = first
+                await _cancel(other, streams[other])
+            else:
+                self._record(plan, "primary_errors" if first is primary else "fallback_errors")
+                winner = other
+        is_primary = winner is primary
+
+        try:
+            first_chunk = await winner
+        except Exception:
+            self._record(plan, "primary_errors" if is_primary else "fallback_errors")
+            raise
+        self._record(plan, "primary_wins" if is_primary else "fallback_wins")
+        if first_chunk is not None:
+            yield first_chunk
+            async for chunk in streams[winner]:
+                yield chunk
+
+    async def _settle(
+        self,
+        plan: RoutePlan,
+        task: "asyncio.Future[str]",
+        is_primary: bool,
+        other_error: Optional[BaseException] = None,
+    ) -> str:
+        try:
+            result = await task
+        except Exception:
+            self._record(plan, "primary_errors" if is_primary else "fallback_errors")
+            if other_error is not None:
+                raise other_error
+            raise
+        self._record(plan, "primary_wins" if is_primary else "fallback_wins")
+        return result
+
+    # Threads -----------------------------------------------------------------
+
+    def run(
+        self,
+        plan: RoutePlan,
+        stream: Callable[[str], Iterator[str]],
+        direct: Optional[Callable[[], Any]] = None,
+    ) -> Any:
+        """Blocking counterpart of ``arun`` for sync callers (tools in the threadpool)."""
+        self._record(plan, "requests")
+        if not plan.hedges:
+            self._record(plan, "unhedged")
+            return direct() if direct is not None else "".join(stream(plan.primary))
+
+        abandon = {plan.primary: threading.Event(), plan.fallback: threading.Event()}
+        first_token = threading.Event()
+
+        def consume(model: str, started: Optional[threading.Event]) -> str:
+            parts: List[str] = []
+            for chunk in stream(model):
+                if abandon[model].is_set():
+                    raise _Abandoned(model)
+                if started is not None:
+                    started.set()
+                parts.append(chunk)
+            return "".join(parts)
+
+        executor = self._threads()
+        primary = executor.submit(consume, plan.primary, first_token)
+        primary.add_done_callback(lambda _f: first_token.set())
+        if first_token.wait(plan.budget_seconds):
+            self._record(plan, "within_budget")
+            return self._settle_thread(plan, primary, is_primary=True)
+
+        self._record(plan, "hedged")
+        fallback = executor.submit(consume, plan.fallback, None)
+        done, _ = wait({primary, fallback}, return_when=FIRST_COMPLETED)
+        first = primary if primary in done else fallback
+        second = fallback if first is primary else primary
+        if first.exception() is None:
+            abandon[plan.fallback if first is primary else plan.primary].set()
+            return self._settle_thread(plan, first, is_primary=first is primary)
+        self._record(plan, "primary_errors" if first is primary else "fallback_errors")
+        return self._settle_thread(plan, second, is_primary=second is primary, other_error=first.exception())
+
+    def _settle_thread(
+        self,
+        plan: RoutePlan,
+        future: Future,
+        is_primary: bool,
+        other_error: Optional[BaseException] = None,
+    ) -> str:
+        try:
+            result = future.result()
+        except Exception:
+            self._record(plan, "primary_errors" if is_primary else "fallback_errors")
+            if other_error is not None:
+                raise other_error
+            raise
+        self._record(plan, "primary_wins" if is_primary else "fallback_wins")
+        return result
+
+    def _threads(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._max_workers, thread_name_prefix="llm-hedge"
+                )
+            return self._executor
+
+
+async def _collect(chunks: AsyncIterator[str], first_token: Optional[asyncio.Event] = None) -> str:
+    parts: List[str] = []
+    async for chunk in chunks:
+        if first_token is not None:
+            first_token.set()
+        parts.append(chunk)
+    return "".join(parts)
+
+
+async def _first_token_within(task: "asyncio.Future[str]", first_token: asyncio.Event, budget: float) -> bool:
+    """True when ``task`` produced a token (or finished, or failed) within ``budget`` seconds."""
+    waiter = asyncio.ensure_future(first_token.wait())
+    try:
+        done, _ = await asyncio.wait({task, waiter}, timeout=budget, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        waiter.cancel()
+    return bool(done)
+
+
+def _discard(task: "asyncio.Future[Any]") -> None:
+    """Cancel a losing task without leaving an unretrieved exception behind."""
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+async def _next_chunk(chunks: AsyncIterator[str]) -> Optional[str]:
+    """The first chunk of ``chunks`` (None when the stream is empty)."""
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def _cancel(task: "asyncio.Future[Optional[str]]", chunks: AsyncIterator[str]) -> None:
+    """Cancel the loser's pending read, then close its stream."""
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    close = getattr(chunks, "aclose", None)
+    if close is not None:
+        try:
+            await close()
+        except Exception:
+            pass
+
+
+model_router = ModelRouter(
+    fallback_models=settings.LLM_FALLBACK_MODELS,
+    budgets=settings.LLM_HEDGE_BUDGETS,
+    default_budget_seconds=settings.LLM_HEDGE_DEFAULT_BUDGET_SECONDS,
+)
@@ -0,0 +1,285 @@
+"""Provider-side caching of agents' static system prompts.
+
+Prebuilt agents carry system prompts of several thousand tokens that used to
+be sent in front of every turn. ``PromptPrefixCache`` registers each
+(model, system prompt) pair once with the provider's context cache and hands
+out a ``CachedPrefix``; turns then send only the cache handle plus their
+dynamic content (summary, history, input) and the provider bills the cached
+prefix at the reduced cached-token rate.
+
+* Only prompts registered up front (the prebuilt agents', at startup) are
+  cached; every other prompt, and any registered one without a live prefix,
+  is sent inline. The lookup on the request path never calls the provider.
+* Prompts shorter than ``min_tokens`` are not registered (the provider has a
+  minimum cacheable size).
+* The periodic refresh extends a prefix, or re-creates it if that fails, once
+  it is within ``refresh_margin_seconds`` of expiry, but only if it was used
+  within the last TTL, so idle agents stop paying for cache storage.
+* A failed registration is retried by the refresh after ``retry_after_seconds``.
+
+``GeminiContextCacheBackend`` talks to the Gemini API; ``LocalPrefixBackend``
+is an in-process stand-in for tests and local development.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, replace
+from datetime import timedelta
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import google.generativeai as genai
+from google.generativeai import caching
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.services.context_window import estimate_tokens
+
+logger = logging.getLogger("app.prompt_cache")
+
+
+@dataclass(frozen=True)
+class CachedPrefix:
+    """A registered system prompt: the provider handle and what it saves per use."""
+
+    name: str
+    model: str
+    tokens: int
+    expires_at: float
+    resource: Any = None
+
+
+class LocalPrefixBackend:
+    """In-process stand-in for the provider cache (tests and local development).
+
+    Models are built with the stored prompt as their system instruction, so
+    requests behave like cached ones without any API calls for the cache.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time) -> None:
+        self._clock = clock
+        self.prompts: Dict[str, str] = {}
+        self.created = 0
+
+    def create(self, model: str, system_prompt: str, ttl_seconds: float) -> CachedPrefix:
+        self.created += 1
+        name = f"local/{self.created}"
+        self.prompts[name] = system_prompt
+        return CachedPrefix(name, model, estimate_tokens(system_prompt), self._clock() + ttl_seconds)
+
+    def extend(self, prefix: CachedPrefix, ttl_seconds: float) -> CachedPrefix:
+        if prefix.name not in self.prompts:
+            raise LookupError(f"{prefix.name} has expired")
+        return replace(prefix, expires_at=self._clock() + ttl_seconds)
+
+    def model(self, prefix: CachedPrefix, generation_config: Optional[Dict[str, Any]]) -> "genai.GenerativeModel":
+        return genai.GenerativeModel(
+            model_name=prefix.model,
+            generation_config=generation_config,
+            system_instruction=self.prompts[prefix.name],
+        )
+
+
+class GeminiContextCacheBackend:
+    """Gemini API context caching (``cachedContents``)."""
+
+    def __init__(self, clock: Callable[[], float] = time.time) -> None:
+        self._clock = clock
+
+    def create(self, model: str, system_prompt: str, ttl_seconds: float) -> CachedPrefix:
+        cached = caching.CachedContent.create(
+            model=model,
+            display_name=f"prefix-{_prompt_hash(system_prompt)[:16]}",
+            system_instruction=system_prompt,
+            ttl=timedelta(seconds=ttl_seconds),
+        )
+        tokens = getattr(cached.usage_metadata, "total_token_count", 0) or estimate_tokens(system_prompt)
+        return CachedPrefix(cached.name, model, tokens, self._clock() + ttl_seconds, cached)
+
+    def extend(self, prefix: CachedPrefix, ttl_seconds: float) -> CachedPrefix:
+        prefix.resource.update(ttl=timedelta(seconds=ttl_seconds))
+        return replace(prefix, expires_at=self._clock() + ttl_seconds)
+
+    def model(self, prefix: CachedPrefix, generation_config: Optional[Dict[str, Any]]) -> "genai.GenerativeModel":
+        return genai.GenerativeModel.from_cached_content(prefix.resource, generation_config=generation_config)
+
+
+def _prompt_hash(system_prompt: str) -> str:
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("model", "system_prompt", "prefix", "last_used", "failed_at", "lock")
+
+    def __init__(self, model: str, system_prompt: str) -> None:
+        self.model = model
+        self.system_prompt = system_prompt
+        self.prefix: Optional[CachedPrefix] = None
+        self.last_used = 0.0
+        self.failed_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+
+class PromptPrefixCache:
+    """Registers static system prompts once per model and keeps them fresh."""
+
+    def __init__(
+        self,
+        backend: Any,
+        enabled: bool = True,
+        ttl_seconds: float = 3600.0,
+        refresh_margin_seconds: float = 300.0,
+        min_tokens: int = 1024,
+        retry_after_seconds: float = 300.0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.backend = backend
+        self.enabled = enabled
+        self._ttl = ttl_seconds
+        self._margin = min(refresh_margin_seconds, ttl_seconds / 2)
+        self._min_tokens = min_tokens
+        self._retry_after = retry_after_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], _Entry] = {}
+        self._models: Dict[Tuple[str, str], "genai.GenerativeModel"] = {}
+        self._counts = dict.fromkeys(
+            ("hits", "created", "refreshed", "errors", "too_short", "tokens_saved"), 0
+        )
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counts[name] += amount
+
+    def prefix(self, model: str, system_prompt: Optional[str]) -> Optional[CachedPrefix]:
+        """The live cached prefix for a registered ``system_prompt`` on ``model``, or None to send it inline."""
+        if not self.enabled or not system_prompt:
+            return None
+        with self._lock:
+            entry = self._entries.get((model, _prompt_hash(system_prompt)))
+        if entry is None:
+            return None
+        entry.last_used = self._clock()
+        return self._live(entry.prefix)
+
+    def _ensure(self, entry: _Entry) -> Optional[CachedPrefix]:
+        """Create or extend ``entry``'s prefix (a provider round trip; never on the request path)."""
+        if not entry.lock.acquire(blocking=False):
+            return self._live(entry.prefix)
+        try:
+            now = self._clock()
+            current = entry.prefix
+            if current is not None and current.expires_at - now > self._margin:
+                return current
+            if entry.failed_at is not None and now - entry.failed_at < self._retry_after:
+                return self._live(current)
+            try:
+                if self._live(current) is not None:
+                    try:
+                        entry.prefix = self.backend.extend(current, self._ttl)
+                        self._count("refreshed")
+                        return entry.prefix
+                    except Exception:
+                        logger.info("prompt_prefix_extend_failed name=%s; re-creating", current.name)
+                entry.prefix = self.backend.create(entry.model, entry.system_prompt, self._ttl)
+            except Exception as e:
+                entry.failed_at = now
+                self._count("errors")
+                logger.warning("prompt_prefix_failed model=%s error=%s", entry.model, e)
+                return self._live(current)
+            entry.failed_at = None
+            if current is not None:
+                self._forget_models(current.name)
+            self._count("created")
+            logger.info(
+                "prompt_prefix_created model=%s name=%s tokens=%s",
+                entry.model, entry.prefix.name, entry.prefix.tokens,
+            )
+            return entry.prefix
+        finally:
+            entry.lock.release()
+
+    def _live(self, prefix: Optional[CachedPrefix]) -> Optional[CachedPrefix]:
+        return prefix if prefix is not None and prefix.expires_at > self._clock() else None
+
+    def model(self, prefix: CachedPrefix, generation_config: Optional[Dict[str, Any]]) -> "genai.GenerativeModel":
+        """A model bound to ``prefix``; counts the prefix tokens this request does not send."""
+        key = (prefix.name, json.dumps(generation_config or {}, sort_keys=True, default=str))
+        with self._lock:
+            model = self._models.get(key)
+        if model is None:
+            model = self.backend.model(prefix, generation_config)
+            with self._lock:
+                self._models[key] = model
+        with self._lock:
+            self._counts["hits"] += 1
+            self._counts["tokens_saved"] += prefix.tokens
+        return model
+
+    def _forget_models(self, name: str) -> None:
+        with self._lock:
+            for key in [key for key in self._models if key[0] == name]:
+                del self._models[key]
+
+    def register(self, prompts: Iterable[Tuple[str, str]]) -> int:
+        """Register (model, system_prompt) pairs with the provider; returns how many are cached."""
+        if not self.enabled:
+            return 0
+        registered = 0
+        for model, system_prompt in prompts:
+            if not system_prompt or estimate_tokens(system_prompt) < self._min_tokens:
+                self._count("too_short")
+                continue
+            key = (model, _prompt_hash(system_prompt))
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = self._entries[key] = _Entry(model, system_prompt)
+            entry.last_used = self._clock()
+            if self._ensure(entry) is not None:
+                registered += 1
+        return registered
+
+    def refresh_due(self) -> int:
+        """Extend prefixes close to expiry, and retry failed registrations, used within the last TTL."""
+        now = self._clock()
+        with self._lock:
+            due = [
+                entry for entry in self._entries.values()
+                if now - entry.last_used < self._ttl
+                and (entry.prefix is None or entry.prefix.expires_at - now <= self._margin)
+            ]
+        return sum(1 for entry in due if self._ensure(entry) is not None)
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        with self._lock:
+            live = sum(1 for e in self._entries.values() if e.prefix is not None and e.prefix.expires_at > now)
+            return {"enabled": self.enabled, "prefixes": live, **self._counts}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._models.clear()
+            self._counts = dict.fromkeys(self._counts, 0)
+
+
+async def run_periodic_refresh(cache: PromptPrefixCache, interval_seconds: float) -> None:
+    """Refresh ``cache``'s prefixes nearing expiry every ``interval_seconds`` until cancelled."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await run_in_threadpool(cache.refresh_due)
+        except Exception:
+            logger.exception("prompt_prefix_refresh_failed")
+
+
+prompt_cache = PromptPrefixCache(
+    backend=LocalPrefixBackend() if settings.PROMPT_CACHE_BACKEND == "local" else GeminiContextCacheBackend(),
+    enabled=settings.PROMPT_CACHE_ENABLED,
+    ttl_seconds=settings.PROMPT_CACHE_TTL_SECONDS,
+    refresh_margin_seconds=settings.PROMPT_CACHE_REFRESH_MARGIN_SECONDS,
+    min_tokens=settings.PROMPT_CACHE_MIN_TOKENS,
+)
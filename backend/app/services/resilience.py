@@ -0,0 +1,360 @@
+"""Retries and per-model circuit breakers for upstream LLM calls.
+
+Errors are classified first: transient upstream failures (5xx, 429, deadline
+exceeded, timeouts, dropped connections) are retryable; everything else (bad
+requests, blocked prompts, auth, our own load shedding) fails immediately.
+
+* Retryable failures are retried with capped, fully jittered exponential
+  backoff, at most ``max_attempts`` times and only while the next attempt can
+  start before the request's ``deadline_seconds``.
+* Every model has a circuit breaker. ``failure_threshold`` consecutive
+  retryable failures open it for ``open_seconds``; after that one probe call is
+  let through (half-open) and its outcome closes or re-opens the breaker.
+* While a model's breaker is open its calls go to its fallback model
+  (``LLM_FALLBACK_MODELS``) if that breaker is closed, or fail fast with
+  ``CircuitOpen`` (a 503 with ``Retry-After``, like other shed calls).
+
+Streams are only retried before their first chunk: text already sent cannot
+be taken back. Breakers are per worker process.
+"""
+import asyncio
+import logging
+import math
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Mapping, Optional, TypeVar
+
+from google.api_core import exceptions as google_exceptions
+
+from app.core.config import settings
+from app.services.concurrency_limiter import UpstreamOverloaded
+
+logger = logging.getLogger("app.resilience")
+
+T = TypeVar("T")
+
+_RETRYABLE_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.Aborted,
+    TimeoutError,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+_FATAL_ERRORS = (
+    google_exceptions.InvalidArgument,
+    google_exceptions.PermissionDenied,
+    google_exceptions.Unauthenticated,
+    google_exceptions.NotFound,
+    google_exceptions.FailedPrecondition,
+    UpstreamOverloaded,
+)
+_RETRYABLE_MESSAGES = (
+    "429",
+    "500 internal",
+    "503",
+    "504",
+    "resource has been exhausted",
+    "service unavailable",
+    "deadline exceeded",
+    "timed out",
+    "connection reset",
+)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class GeminiError(Exception):
+    """A Gemini call failed; ``retryable`` says whether the failure was transient."""
+
+    def __init__(self, message: str, model: str, retryable: bool = False) -> None:
+        super().__init__(message)
+        self.model = model
+        self.retryable = retryable
+
+
+class CircuitOpen(UpstreamOverloaded):
+    """The model's (and its fallback's) circuit breaker is open: the call was not sent."""
+
+    def __init__(self, model: str, retry_after: int) -> None:
+        super().__init__(model, retry_after, "circuit open")
+
+
+def is_retryable(error: BaseException) -> bool:
+    """True for transient upstream failures (also when wrapped by another exception)."""
+    seen = 0
+    current: Optional[BaseException] = error
+    while current is not None and seen < 5:
+        if isinstance(current, GeminiError):
+            return current.retryable
+        if isinstance(current, _FATAL_ERRORS):
+            return False
+        if isinstance(current, _RETRYABLE_ERRORS):
+            return True
+        message = str(current).lower()
+        if any(marker in message for marker in _RETRYABLE_MESSAGES):
+            return True
+        current = current.__cause__ or current.__context__
+        seen += 1
+    return False
+
+
+class _Breaker:
+    __slots__ = ("state", "failures", "opened_at", "probing", "counts")
+
+    def __init__(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.counts = dict.fromkeys(("successes", "failures", "retries", "opened", "rejected", "rerouted"), 0)
+
+
+class ResilientCaller:
+    """Retries transient failures and keeps a circuit breaker per model."""
+
+    def __init__(
+        self,
+        fallback_models: Mapping[str, str],
+        enabled: bool = True,
+        max_attempts: int = 3,
+        base_delay_seconds: float = 0.5,
+        max_delay_seconds: float = 8.0,
+        deadline_seconds: float = 60.0,
+        failure_threshold: int = 5,
+        open_seconds: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        async_sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ) -> None:
+        self._fallback_models = dict(fallback_models)
+        self.enabled = enabled
+        self._max_attempts = max(1, max_attempts)
+        self._base_delay = base_delay_seconds
+        self._max_delay = max_delay_seconds
+        self._deadline = deadline_seconds
+        self._failure_threshold = max(1, failure_threshold)
+        self._open_seconds = open_seconds
+        self._clock = clock
+        self._sleep = sleep
+        self._async_sleep = async_sleep
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, _Breaker] = {}
+
+    # Breakers ------------------------------------------------------------------
+
+    def _breaker(self, model: str) -> _Breaker:
+        # Callers hold self._lock.
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = self._breakers[model] = _Breaker()
+        return breaker
+
+    def _admit_locked(self, model: str, now: float) -> bool:
+        breaker = self._breaker(model)
+        if breaker.state == OPEN and now - breaker.opened_at >= self._open_seconds:
+            breaker.state = HALF_OPEN
+            breaker.probing = False
+        if breaker.state == CLOSED:
+            return True
+        if breaker.state == HALF_OPEN and not breaker.probing:
+            breaker.probing = True
+            return True
+        return False
+
+    def _route(self, model: str) -> str:
+        """The model to call: ``model``, its fallback while it is open, or CircuitOpen."""
+        with self._lock:
+            now = self._clock()
+            if self._admit_locked(model, now):
+                return model
+            breaker = self._breaker(model)
+            fallback = self._fallback_models.get(model)
+            if fallback and fallback != model and self._admit_locked(fallback, now):
+                breaker.counts["rerouted"] += 1
+                return fallback
+            breaker.counts["rejected"] += 1
+            retry_after = max(1, math.ceil(breaker.opened_at + self._open_seconds - now))
+        raise CircuitOpen(model, retry_after)
+
+    def _succeeded(self, model: str) -> None:
+        with self._lock:
+            breaker = self._breaker(model)
+            breaker.counts["successes"] += 1
+            breaker.failures = 0
+            breaker.probing = False
+            if breaker.state != CLOSED:
+                logger.info("circuit_closed model=%s", model)
+            breaker.state = CLOSED
+
+    def _failed(self, model: str, error: BaseException) -> bool:
+        """Record a failed call; returns whether it is worth retrying."""
+        if isinstance(error, UpstreamOverloaded):
+            # Shed locally before reaching the model: nothing learned about it.
+            self._abandoned(model)
+            return False
+        retryable = is_retryable(error)
+        with self._lock:
+            breaker = self._breaker(model)
+            breaker.probing = False
+            if not retryable:
+                # The model answered: a bad request says nothing about its health.
+                if breaker.state == HALF_OPEN:
+                    breaker.state = CLOSED
+                    breaker.failures = 0
+                return False
+            breaker.counts["failures"] += 1
+            breaker.failures += 1
+            if breaker.state == HALF_OPEN or (
+                breaker.state == CLOSED and breaker.failures >= self._failure_threshold
+            ):
+                breaker.state = OPEN
+                breaker.opened_at = self._clock()
+                breaker.counts["opened"] += 1
+                logger.warning(
+                    "circuit_opened model=%s failures=%s error=%s", model, breaker.failures, error
+                )
+        return True
+
+    def _abandoned(self, model: str) -> None:
+        """The call ended without an outcome (cancelled, shed): free the half-open probe."""
+        with self._lock:
+            self._breaker(model).probing = False
+
+    # Retries -------------------------------------------------------------------
+
+    def _backoff(self, attempt: int, started: float) -> Optional[float]:
+        """Delay before attempt ``attempt + 1``, or None when there is no attempt left."""
+        if attempt >= self._max_attempts:
+            return None
+        delay = random.uniform(0, min(self._max_delay, self._base_delay * 2 ** (attempt - 1)))
+        if self._clock() + delay - started >= self._deadline:
+            return None
+        return delay
+
+    def _retrying(self, model: str) -> None:
+        with self._lock:
+            self._breaker(model).counts["retries"] += 1
+
+    def call(self, model: str, fn: Callable[[str], T]) -> T:
+        """Call ``fn(routed_model)``, retrying transient failures."""
+        if not self.enabled:
+            return fn(model)
+        started = self._clock()
+        attempt = 0
+        while True:
+            target = self._route(model)
+            attempt += 1
+            try:
+                result = fn(target)
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    self._abandoned(target)
+                    raise
+                delay = self._backoff(attempt, started) if self._failed(target, e) else None
+                if delay is None:
+                    raise
+                self._retrying(target)
+                logger.info("llm_retry model=%s attempt=%s delay=%.2fs error=%s", target, attempt, delay, e)
+                self._sleep(delay)
+                continue
+            self._succeeded(target)
+            return result
+
+    async def acall(self, model: str, fn: Callable[[str], Awaitable[T]]) -> T:
+        """Async variant of ``call``."""
+        if not self.enabled:
+            return await fn(model)
+        started = self._clock()
+        attempt = 0
+        while True:
+            target = self._route(model)
+            attempt += 1
+            try:
+                result = await fn(target)
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    self._abandoned(target)
+                    raise
+                delay = self._backoff(attempt, started) if self._failed(target, e) else None
+                if delay is None:
+                    raise
+                self._retrying(target)
+                logger.info("llm_retry model=%s attempt=%s delay=%.2fs error=%s", target, attempt, delay, e)
+                await self._async_sleep(delay)
+                continue
+            self._succeeded(target)
+            return result
+
+    async def astream(self, model: str, stream: Callable[[str], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Yield ``stream(routed_model)``; failures before the first chunk are retried."""
+        if not self.enabled:
+            async for chunk in stream(model):
+                yield chunk
+            return
+        started = self._clock()
+        attempt = 0
+        while True:
+            target = self._route(model)
+            attempt += 1
+            sent = False
+            try:
+                async for chunk in stream(target):
+                    sent = True
+                    yield chunk
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    self._abandoned(target)
+                    raise
+                retry = self._failed(target, e) and not sent
+                delay = self._backoff(attempt, started) if retry else None
+                if delay is None:
+                    raise
+                self._retrying(target)
+                logger.info("llm_retry model=%s attempt=%s delay=%.2fs error=%s", target, attempt, delay, e)
+                await self._async_sleep(delay)
+                continue
+            self._succeeded(target)
+            return
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = self._clock()
+            return {
+                model: {
+                    "state": breaker.state,
+                    "consecutive_failures": breaker.failures,
+                    "open_for_seconds": (
+                        max(0.0, round(breaker.opened_at + self._open_seconds - now, 1))
+                        if breaker.state == OPEN else 0.0
+                    ),
+                    **breaker.counts,
+                }
+                for model, breaker in self._breakers.items()
+            }
+
+    def open_circuits(self) -> int:
+        with self._lock:
+            return sum(1 for breaker in self._breakers.values() if breaker.state != CLOSED)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._breakers.clear()
+
+
+resilience = ResilientCaller(
+    fallback_models=settings.LLM_FALLBACK_MODELS,
+    enabled=settings.LLM_RETRY_ENABLED,
+    max_attempts=settings.LLM_RETRY_MAX_ATTEMPTS,
+    base_delay_seconds=settings.LLM_RETRY_BASE_DELAY_SECONDS,
+    max_delay_seconds=settings.LLM_RETRY_MAX_DELAY_SECONDS,
+    deadline_seconds=settings.LLM_RETRY_DEADLINE_SECONDS,
+    failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+    open_seconds=settings.LLM_CIRCUIT_OPEN_SECONDS,
+)
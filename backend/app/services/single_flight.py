@@ -0,0 +1,164 @@
+"""Coalesce identical in-flight LLM requests.
+
+When many users ask for the same thing at once (a class generating the same
+quiz), every request would otherwise make its own identical upstream call.
+``SingleFlight`` lets the first caller for a key (the leader) make the call
+while concurrent callers with the same key (followers) wait for and share its
+result. A leader's exception is re-raised in every follower. Followers stop
+waiting after ``timeout`` seconds with ``SingleFlightTimeout``; the leader's
+call is not cancelled. Nothing is cached: once the leader finishes, the next
+caller starts a new flight.
+
+Threads (sync SDK calls from the threadpool) and coroutines (``ainvoke``)
+coalesce separately because they cannot wait on each other's primitives.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from app.core.config import settings
+
+logger = logging.getLogger("app.single_flight")
+
+T = TypeVar("T")
+
+
+class SingleFlightTimeout(TimeoutError):
+    """A follower gave up waiting for the leader's result."""
+
+
+def request_key(*parts: Any) -> str:
+    """Stable hash of the parts that determine an LLM response (model, temperature, prompt...)."""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "followers")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Per-key coalescing of concurrent calls, for threads and coroutines."""
+
+    def __init__(self, follower_timeout: float = 60.0, enabled: bool = True) -> None:
+        self._follower_timeout = follower_timeout
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._async_flights: Dict[str, "asyncio.Future[Any]"] = {}
+        self._leaders = 0
+        self._followers = 0
+        self._timeouts = 0
+
+    def do(self, key: str, fn: Callable[[], T], timeout: Optional[float] = None) -> T:
+        """Run ``fn`` once for all threads calling concurrently with ``key``."""
+        if not self._enabled:
+            return fn()
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._leaders += 1
+            else:
+                flight.followers += 1
+                self._followers += 1
+
+        if not leader:
+            if not flight.done.wait(self._timeout(timeout)):
+                with self._lock:
+                    self._timeouts += 1
+                raise SingleFlightTimeout(f"Timed out waiting for an identical in-flight request ({key[:12]})")
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+            if flight.followers:
+                logger.debug("single_flight_shared key=%s followers=%s", key[:12], flight.followers)
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        """Await ``fn()`` once for all coroutines calling concurrently with ``key``."""
+        if not self._enabled:
+            return await fn()
+        with self._lock:
+            future = self._async_flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._async_flights[key] = asyncio.get_running_loop().create_future()
+                self._leaders += 1
+            else:
+                self._followers += 1
+
+        if not leader:
+            try:
+                # shield: a follower timing out must not cancel the shared future.
+                return await asyncio.wait_for(asyncio.shield(future), self._timeout(timeout))
+            except asyncio.TimeoutError:
+                with self._lock:
+                    self._timeouts += 1
+                raise SingleFlightTimeout(
+                    f"Timed out waiting for an identical in-flight request ({key[:12]})"
+                ) from None
+
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # The leader's client went away; followers still deserve an answer,
+            # but there is none to give, so fail them rather than hang.
+            future.set_exception(SingleFlightTimeout("The in-flight request was cancelled"))
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._async_flights.pop(key, None)
+            # Mark the exception as retrieved when nobody followed.
+            if future.done() and not future.cancelled():
+                future.exception()
+
+    def _timeout(self, timeout: Optional[float]) -> float:
+        return self._follower_timeout if timeout is None else timeout
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "in_flight": len(self._flights) + len(self._async_flights),
+                "leaders": self._leaders,
+                "followers": self._followers,
+                "follower_timeouts": self._timeouts,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._flights.clear()
+            self._async_flights.clear()
+            self._leaders = self._followers = self._timeouts = 0
+
+
+single_flight = SingleFlight(
+    follower_timeout=settings.SINGLE_FLIGHT_FOLLOWER_TIMEOUT_SECONDS,
+    enabled=settings.SINGLE_FLIGHT_ENABLED,
+)
@@ -0,0 +1,431 @@
+"""Cache for prebuilt tool generations that depend only on their parameters.
+
+Quizzes, practice exams, topic reviews, micro-lessons, flashcards and exam
+strategies are single ``gemini-2.5-pro`` calls whose prompt is fully
+determined by a few parameters, so a popular topic does not need to be
+regenerated for every user. Outputs are keyed by a fingerprint of the
+normalized parameters (case/whitespace-folded text, integers clamped the way
+the tool clamps them) and kept in a per-worker LRU tier bounded by entry count
+and bytes, backed by the shared ``tool_output_cache`` table.
+
+Caching is opt-in per agent slug (``TOOL_CACHE_AGENT_SLUGS``). With
+``TOOL_CACHE_VARIANTS`` > 1 up to that many generations are kept per key and
+one is served at random, so repeated requests still vary. Error messages and
+template fallbacks are never cached.
+"""
+import functools
+import hashlib
+import json
+import logging
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from threading import Lock
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.database import dialect_insert
+from app.models.tool_output_cache import ToolOutputCacheEntry
+
+logger = logging.getLogger("app.tool_cache")
+
+Params = Dict[str, Any]
+
+# Bump when prompts change so stale generations are not served.
+CACHE_VERSION = 1
+
+# Substrings of the tools' error messages and empty-response fallbacks.
+_UNCACHEABLE_MARKERS = (
+    "Please try again",
+    "[Question text]",
+    "[Key concepts for",
+    "[List of common mistakes]",
+    "is an important concept to learn",
+    "A brief overview of",
+)
+
+
+def _text(value: Any, default: str) -> str:
+    text = " ".join(str(value).split()).lower() if value is not None else ""
+    return text or default
+
+
+def _clamped(value: Any, default: int, low: int, high: int) -> int:
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        number = default
+    return max(low, min(high, number))
+
+
+@dataclass(frozen=True)
+class CacheableTool:
+    """How to fingerprint one tool's parameters and vet its output."""
+
+    normalize: Callable[[Params], Params]
+    required_marker: Optional[str] = None
+    min_chars: int = 200
+
+    def is_cacheable(self, output: Any) -> bool:
+        if not isinstance(output, str) or len(output.strip()) < self.min_chars:
+            return False
+        if output.lstrip().startswith("Error"):
+            return False
+        if any(marker in output for marker in _UNCACHEABLE_MARKERS):
+            return False
+        return self.required_marker is None or self.required_marker in output
+
+
+CACHEABLE_TOOLS: Dict[str, CacheableTool] = {
+    "_generate_quiz": CacheableTool(
+        lambda p: {
+            "topic": _text(p.get("topic"), "general knowledge"),
+            "difficulty": _text(p.get("difficulty"), "medium"),
+            "num_questions": _clamped(p.get("num_questions", 5), 5, 1, 20),
+        },
+        required_marker="Question 1",
+    ),
+    "_create_practice_exam": CacheableTool(
+        lambda p: {
+            "exam_type": _text(p.get("exam_type"), "general exam"),
+            "subject": _text(p.get("subject"), "general subject"),
+            "num_questions": _clamped(p.get("num_questions", 50), 50, 10, 100),
+            "time_limit": _clamped(p.get("time_limit", 60), 60, 15, 300),
+            "difficulty": _text(p.get("difficulty"), "medium"),
+        },
+        required_marker="Question 1",
+    ),
+    "_generate_topic_review": CacheableTool(
+        lambda p: {
+            "topic": _text(p.get("topic"), "general topic"),
+            "difficulty": _text(p.get("difficulty"), "medium"),
+            "review_type": _text(p.get("review_type"), "comprehensive"),
+        },
+    ),
+    "_generate_micro_lesson": CacheableTool(
+        lambda p: {
+            "topic": _text(p.get("topic"), "general topic"),
+            "time_minutes": _clamped(p.get("time_minutes", 5), 5, 5, 15),
+            "difficulty": _text(p.get("difficulty"), "medium"),
+        },
+    ),
+    "_create_flashcards": CacheableTool(
+        lambda p: {
+            "topic": _text(p.get("topic"), "general topic"),
+            "num_cards": _clamped(p.get("num_cards", 5), 5, 3, 10),
+        },
+        required_marker="Card 1",
+    ),
+    "_create_exam_strategies": CacheableTool(
+        lambda p: {
+            "exam_type": _text(p.get("exam_type"), "general exam"),
+            "subject": _text(p.get("subject"), "general subject"),
+            "question_format": _text(p.get("question_format"), "mixed"),
+        },
+    ),
+}
+
+# Positional argument order, for LangChain tools invoked with a single string.
+_TOOL_ARGUMENTS: Dict[str, Tuple[str, ...]] = {
+    "_generate_quiz": ("topic", "difficulty", "num_questions"),
+    "_create_practice_exam": ("exam_type", "subject", "num_questions", "time_limit", "difficulty"),
+    "_generate_topic_review": ("topic", "difficulty", "review_type"),
+    "_generate_micro_lesson": ("topic", "time_minutes", "difficulty"),
+    "_create_flashcards": ("topic", "num_cards"),
+    "_create_exam_strategies": ("exam_type", "subject", "question_format"),
+}
+
+
+def fingerprint(tool_name: str, normalized: Params) -> str:
+    payload = json.dumps(
+        {"tool": tool_name, "params": normalized, "version": CACHE_VERSION},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class _MemoryEntry:
+    expires_at: float
+    outputs: List[str]
+    size: int
+
+
+class ToolOutputCache:
+    """Two-tier (process LRU + shared table) cache of tool outputs."""
+
+    def __init__(
+        self,
+        agent_slugs: Iterable[str] = (),
+        ttl_seconds: int = 86400,
+        variants: int = 1,
+        max_entries: int = 1000,
+        max_bytes: int = 50_000_000,
+        shared: bool = True,
+        session_factory: Optional[Callable[[], Session]] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self._agent_slugs = frozenset(agent_slugs)
+        self._ttl = ttl_seconds
+        self._variants = max(1, variants)
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._shared = shared
+        self._session_factory = session_factory
+        self._clock = clock
+        self._lock = Lock()
+        self._entries: "OrderedDict[str, _MemoryEntry]" = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._rejected = 0
+        self._evictions = 0
+
+    def enabled_for(self, slug: Optional[str], tool_name: str) -> bool:
+        return bool(slug) and slug in self._agent_slugs and tool_name in CACHEABLE_TOOLS
+
+    def call(self, slug: Optional[str], tool_name: str, params: Params, produce: Callable[[], str]) -> str:
+        """Return a cached output for ``tool_name(**params)`` or run ``produce`` and cache it."""
+        if not self.enabled_for(slug, tool_name):
+            return produce()
+        spec = CACHEABLE_TOOLS[tool_name]
+        key = fingerprint(tool_name, spec.normalize(params))
+
+        outputs = self._lookup(key)
+        if len(outputs) >= self._variants:
+            with self._lock:
+                self._hits += 1
+            return random.choice(outputs)
+
+        with self._lock:
+            self._misses += 1
+        output = produce()
+        if spec.is_cacheable(output):
+            self._store(key, tool_name, len(outputs), output)
+        else:
+            with self._lock:
+                self._rejected += 1
+        return output
+
+    async def astream(
+        self,
+        slug: Optional[str],
+        tool_name: str,
+        params: Params,
+        produce: Callable[[], AsyncIterator[str]],
+    ) -> AsyncIterator[str]:
+        """Streaming counterpart of ``call``.
+
+        A hit is sent as a single chunk; a miss is streamed through and stored
+        once the stream has completed.
+        """
+        if not self.enabled_for(slug, tool_name):
+            async for chunk in produce():
+                yield chunk
+            return
+        spec = CACHEABLE_TOOLS[tool_name]
+        key = fingerprint(tool_name, spec.normalize(params))
+
+        outputs = await run_in_threadpool(self._lookup, key)
+        if len(outputs) >= self._variants:
+            with self._lock:
+                self._hits += 1
+            yield random.choice(outputs)
+            return
+
+        with self._lock:
+            self._misses += 1
+        parts: List[str] = []
+        async for chunk in produce():
+            parts.append(chunk)
+            yield chunk
+        output = "".join(parts)
+        if spec.is_cacheable(output):
+            await run_in_threadpool(self._store, key, tool_name, len(outputs), output)
+        else:
+            with self._lock:
+                self._rejected += 1
+
+    def wrap_tool(self, slug: str, tool: Any) -> Any:
+        """Route a LangChain ``Tool`` built around a cacheable function through the cache."""
+        func = getattr(tool, "func", None)
+        tool_name = getattr(func, "__name__", None)
+        if func is None or not self.enabled_for(slug, tool_name):
+            return tool
+        argument_names = _TOOL_ARGUMENTS[tool_name]
+
+        def cached(*args: Any, **kwargs: Any) -> str:
+            params = dict(zip(argument_names, args))
+            params.update(kwargs)
+            return self.call(slug, tool_name, params, lambda: func(*args, **kwargs))
+
+        # Keeps the name and the signature, which structured tools build their schema from.
+        functools.update_wrapper(cached, func)
+        tool.func = cached
+        return tool
+
+    # Memory tier -----------------------------------------------------------
+
+    def _memory_get(self, key: str, now: float) -> List[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return []
+            if entry.expires_at <= now:
+                self._drop_locked(key)
+                return []
+            self._entries.move_to_end(key)
+            return list(entry.outputs)
+
+    def _memory_put(self, key: str, outputs: List[str], expires_at: float) -> None:
+        size = sum(len(output.encode("utf-8")) for output in outputs)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            self._drop_locked(key)
+            self._entries[key] = _MemoryEntry(expires_at, list(outputs), size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self._max_entries or self._bytes > self._max_bytes):
+                oldest = next(iter(self._entries))
+                self._drop_locked(oldest)
+                self._evictions += 1
+
+    def _drop_locked(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    # Shared tier -----------------------------------------------------------
+
+    def _sessions(self) -> Callable[[], Session]:
+        if self._session_factory is None:
+            from app.core.database import SessionLocal
+
+            return SessionLocal
+        return self._session_factory
+
+    def _shared_get(self, key: str, now: float) -> Tuple[List[str], Optional[float]]:
+        try:
+            with self._sessions()() as session:
+                rows = session.execute(
+                    select(ToolOutputCacheEntry.output, ToolOutputCacheEntry.expires_at)
+                    .where(
+                        ToolOutputCacheEntry.cache_key == key,
+                        ToolOutputCacheEntry.expires_at > datetime.utcfromtimestamp(now),
+                    )
+                    .order_by(ToolOutputCacheEntry.variant)
+                ).all()
+        except Exception:
+            logger.exception("tool_cache_read_failed key=%s", key)
+            return [], None
+        if not rows:
+            return [], None
+        expires_at = min(row.expires_at for row in rows)
+        return [row.output for row in rows], (expires_at - datetime(1970, 1, 1)).total_seconds()
+
+    def _shared_put(self, key: str, tool_name: str, variant: int, output: str, now: float) -> None:
+        created_at = datetime.utcfromtimestamp(now)
+        try:
+            with self._sessions()() as session:
+                # Expired rows would otherwise block their (cache_key, variant) slot.
+                session.execute(
+                    delete(ToolOutputCacheEntry).where(
+                        ToolOutputCacheEntry.cache_key == key,
+                        ToolOutputCacheEntry.expires_at <= created_at,
+                    )
+                )
+                insert = dialect_insert(session)
+                session.execute(
+                    insert(ToolOutputCacheEntry)
+                    .values(
+                        cache_key=key,
+                        variant=variant,
+                        tool_name=tool_name,
+                        output=output,
+                        created_at=created_at,
+                        expires_at=datetime.utcfromtimestamp(now + self._ttl),
+                    )
+                    .on_conflict_do_nothing(index_elements=["cache_key", "variant"])
+                )
+                session.commit()
+        except Exception:
+            logger.exception("tool_cache_write_failed key=%s", key)
+
+    # Tiers together --------------------------------------------------------
+
+    def _lookup(self, key: str) -> List[str]:
+        now = self._clock()
+        outputs = self._memory_get(key, now)
+        if len(outputs) >= self._variants or not self._shared:
+            return outputs
+        shared_outputs, expires_at = self._shared_get(key, now)
+        if len(shared_outputs) > len(outputs):
+            self._memory_put(key, shared_outputs, expires_at)
+            return shared_outputs
+        return outputs
+
+    def _store(self, key: str, tool_name: str, variant: int, output: str) -> None:
+        now = self._clock()
+        with self._lock:
+            self._stores += 1
+            entry = self._entries.get(key)
+            existing = list(entry.outputs) if entry is not None and entry.expires_at > now else []
+            expires_at = entry.expires_at if existing else now + self._ttl
+        self._memory_put(key, (existing + [output])[: self._variants], expires_at)
+        if self._shared:
+            self._shared_put(key, tool_name, variant, output, now)
+
+    def purge_expired(self) -> int:
+        """Delete expired rows from the shared tier; returns how many were removed."""
+        if not self._shared:
+            return 0
+        try:
+            with self._sessions()() as session:
+                result = session.execute(
+                    delete(ToolOutputCacheEntry).where(
+                        ToolOutputCacheEntry.expires_at <= datetime.utcfromtimestamp(self._clock())
+                    )
+                )
+                session.commit()
+                return result.rowcount or 0
+        except Exception:
+            logger.exception("tool_cache_purge_failed")
+            return 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "agent_slugs": sorted(self._agent_slugs),
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "stores": self._stores,
+                "rejected": self._rejected,
+                "evictions": self._evictions,
+            }
+
+    def clear(self) -> None:
+        """Drop the in-memory tier and counters (the shared table is left alone)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._hits = self._misses = self._stores = self._rejected = self._evictions = 0
+
+
+tool_cache = ToolOutputCache(
+    agent_slugs=settings.TOOL_CACHE_AGENT_SLUGS,
+    ttl_seconds=settings.TOOL_CACHE_TTL_SECONDS,
+    variants=settings.TOOL_CACHE_VARIANTS,
+    max_entries=settings.TOOL_CACHE_MAX_ENTRIES,
+    max_bytes=settings.TOOL_CACHE_MAX_BYTES,
+    shared=settings.TOOL_CACHE_SHARED,
+)
@@ -0,0 +1,264 @@
+"""Native function calling for prebuilt agents.
+
+For agents listed in ``AGENT_TOOL_CALLING_SLUGS`` the model is given the
+agent's tools (``get_structured_tools_for_agent_slug``) and picks which to
+call, instead of the regex intents in ``app.services.intent_router`` guessing
+from the message. Each step sends the conversation to the model; when it
+asks for tools, all calls of that step run concurrently (worker threads on
+the sync path, the threadpool on the async path) and their results are sent
+back for the next step. After ``max_steps`` steps that called tools the model
+is asked once more with function calling turned off, so a turn always ends
+with text.
+
+Tool errors and timeouts are returned to the model as the tool's result so it
+can recover or explain; they do not fail the turn. The model and tool latency
+of every step is logged and returned in ``ToolLoopResult.steps``.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage, ToolMessage
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.observability import stage
+from app.models.agent import Agent
+from app.services.concurrency_limiter import concurrency_limiter
+from app.services.context_window import estimate_tokens
+from app.services.llm_metrics import llm_call
+from app.services.llm_registry import llm_registry
+from app.services.resilience import resilience
+from app.tools.prebuilt_agents import get_structured_tools_for_agent_slug
+
+logger = logging.getLogger("app.tool_calling")
+
+# Final step: answer from the tool results, no further calls.
+NO_TOOL_CALLS = {"function_calling_config": {"mode": "NONE"}}
+
+
+@dataclass
+class ToolCallTiming:
+    name: str
+    seconds: float
+    error: Optional[str] = None
+
+
+@dataclass
+class ToolStep:
+    index: int
+    model_seconds: float
+    tool_calls: List[ToolCallTiming] = field(default_factory=list)
+
+
+@dataclass
+class ToolLoopResult:
+    output: Any
+    steps: List[ToolStep]
+    max_steps_reached: bool = False
+
+
+class ToolCallingLoop:
+    """Runs the model/tool loop for agents that opted in to function calling."""
+
+    def __init__(
+        self,
+        agent_slugs: Iterable[str] = (),
+        max_steps: int = 4,
+        tool_timeout_seconds: float = 120.0,
+        max_parallel_tools: int = 4,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        self._agent_slugs = frozenset(agent_slugs)
+        self._max_steps = max(1, max_steps)
+        self._tool_timeout = tool_timeout_seconds
+        self._max_parallel = max(1, max_parallel_tools)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(
+            ("turns", "steps", "tool_calls", "tool_errors", "tool_timeouts", "max_steps_reached"), 0
+        )
+
+    def enabled_for(self, agent: Agent) -> bool:
+        return bool(agent.slug) and agent.slug in self._agent_slugs and bool(self._tools(agent.slug))
+
+    @staticmethod
+    def _tools(slug: str) -> Dict[str, Any]:
+        return {tool.name: tool for tool in get_structured_tools_for_agent_slug(slug)}
+
+    def _model(self, agent: Agent, model: str) -> Any:
+        tools = get_structured_tools_for_agent_slug(agent.slug)
+        return llm_registry.tool_model(model, agent.temperature, agent.slug, tools)
+
+    @staticmethod
+    def _step_kwargs(final: bool) -> Dict[str, Any]:
+        return {"tool_config": NO_TOOL_CALLS} if final else {}
+
+    def _invoke(self, agent: Agent, model: str, messages: List[BaseMessage], final: bool) -> Any:
+        with concurrency_limiter.slot(model):
+            return self._model(agent, model).invoke(messages, **self._step_kwargs(final))
+
+    async def _ainvoke(self, agent: Agent, model: str, messages: List[BaseMessage], final: bool) -> Any:
+        async with concurrency_limiter.aslot(model):
+            return await self._model(agent, model).ainvoke(messages, **self._step_kwargs(final))
+
+    @staticmethod
+    def _prompt_tokens(messages: List[BaseMessage]) -> int:
+        return sum(estimate_tokens(str(m.content)) for m in messages)
+
+    def _count(self, **amounts: int) -> None:
+        with self._lock:
+            for name, amount in amounts.items():
+                self._counts[name] += amount
+
+    def run(self, agent: Agent, messages: List[BaseMessage]) -> ToolLoopResult:
+        """Run the loop for ``messages`` (history plus the current input)."""
+        tools = self._tools(agent.slug)
+        messages = list(messages)
+        steps: List[ToolStep] = []
+        while True:
+            final = len(steps) == self._max_steps
+            started = self._clock()
+            with llm_call(agent.model, agent.slug, self._prompt_tokens(messages)) as call:
+                response = call.finished(resilience.call(
+                    agent.model, lambda model: self._invoke(agent, model, messages, final)
+                ))
+            step = ToolStep(len(steps), self._clock() - started)
+            steps.append(step)
+            if final or not response.tool_calls:
+                return self._finish(agent, response, steps, final)
+            messages.append(response)
+            with stage("tool"):
+                results = self._run_calls(agent.slug, tools, response.tool_calls)
+            self._record(agent, step, messages, results)
+
+    async def arun(self, agent: Agent, messages: List[BaseMessage]) -> ToolLoopResult:
+        """Async variant of ``run``; tool calls of a step run concurrently in the threadpool."""
+        tools = self._tools(agent.slug)
+        messages = list(messages)
+        steps: List[ToolStep] = []
+        while True:
+            final = len(steps) == self._max_steps
+            started = self._clock()
+            with llm_call(agent.model, agent.slug, self._prompt_tokens(messages)) as call:
+                response = call.finished(await resilience.acall(
+                    agent.model, lambda model: self._ainvoke(agent, model, messages, final)
+                ))
+            step = ToolStep(len(steps), self._clock() - started)
+            steps.append(step)
+            if final or not response.tool_calls:
+                return self._finish(agent, response, steps, final)
+            messages.append(response)
+            with stage("tool"):
+                results = await self._arun_calls(tools, response.tool_calls)
+            self._record(agent, step, messages, results)
+
+    def _run_calls(
+        self, slug: str, tools: Dict[str, Any], calls: List[Dict[str, Any]]
+    ) -> List[Tuple[ToolMessage, ToolCallTiming]]:
+        executor = ThreadPoolExecutor(
+            max_workers=min(len(calls), self._max_parallel), thread_name_prefix=f"tools-{slug}"
+        )
+        try:
+            # Copied contexts keep LLM calls made by tools in the turn's usage and timings.
+            futures = [
+                executor.submit(contextvars.copy_context().run, self._execute, tools, call) for call in calls
+            ]
+            wait(futures, timeout=self._tool_timeout)
+            return [
+                future.result() if future.done() else self._timed_out(call)
+                for future, call in zip(futures, calls)
+            ]
+        finally:
+            # A timed out tool keeps its thread until it returns; the turn does not wait for it.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _arun_calls(
+        self, tools: Dict[str, Any], calls: List[Dict[str, Any]]
+    ) -> List[Tuple[ToolMessage, ToolCallTiming]]:
+        semaphore = asyncio.Semaphore(self._max_parallel)
+
+        async def run_one(call: Dict[str, Any]) -> Tuple[ToolMessage, ToolCallTiming]:
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(
+                        run_in_threadpool(self._execute, tools, call), self._tool_timeout
+                    )
+                except asyncio.TimeoutError:
+                    return self._timed_out(call)
+
+        return list(await asyncio.gather(*(run_one(call) for call in calls)))
+
+    def _execute(self, tools: Dict[str, Any], call: Dict[str, Any]) -> Tuple[ToolMessage, ToolCallTiming]:
+        name = call.get("name", "")
+        started = self._clock()
+        error = None
+        tool = tools.get(name)
+        if tool is None:
+            error = f"Unknown tool: {name}"
+            content = f"Error: {error}"
+        else:
+            try:
+                content = str(tool.invoke(call.get("args") or {}))
+            except Exception as e:
+                error = str(e)
+                content = f"Error: {name} failed: {error}"
+        timing = ToolCallTiming(name, self._clock() - started, error)
+        return ToolMessage(content=content, tool_call_id=call.get("id") or name, name=name), timing
+
+    def _timed_out(self, call: Dict[str, Any]) -> Tuple[ToolMessage, ToolCallTiming]:
+        name = call.get("name", "")
+        message = ToolMessage(
+            content=f"Error: {name} did not finish within {self._tool_timeout:g} seconds.",
+            tool_call_id=call.get("id") or name,
+            name=name,
+        )
+        return message, ToolCallTiming(name, self._tool_timeout, "timeout")
+
+    def _record(
+        self,
+        agent: Agent,
+        step: ToolStep,
+        messages: List[BaseMessage],
+        results: List[Tuple[ToolMessage, ToolCallTiming]],
+    ) -> None:
+        for message, timing in results:
+            messages.append(message)
+            step.tool_calls.append(timing)
+        timeouts = sum(1 for _, timing in results if timing.error == "timeout")
+        errors = sum(1 for _, timing in results if timing.error) - timeouts
+        self._count(steps=1, tool_calls=len(results), tool_errors=errors, tool_timeouts=timeouts)
+        logger.info(
+            "tool_step slug=%s step=%s model_ms=%.0f tools=%s",
+            agent.slug,
+            step.index,
+            step.model_seconds * 1000,
+            ",".join(f"{t.name}:{t.seconds * 1000:.0f}ms{'!' if t.error else ''}" for t in step.tool_calls),
+        )
+
+    def _finish(self, agent: Agent, response: Any, steps: List[ToolStep], final: bool) -> ToolLoopResult:
+        self._count(turns=1, max_steps_reached=int(final))
+        if final:
+            logger.warning("tool_loop_max_steps slug=%s steps=%s", agent.slug, self._max_steps)
+        return ToolLoopResult(response, steps, max_steps_reached=final)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"agents": sorted(self._agent_slugs), **self._counts}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counts = dict.fromkeys(self._counts, 0)
+
+
+tool_calling = ToolCallingLoop(
+    agent_slugs=settings.AGENT_TOOL_CALLING_SLUGS,
+    max_steps=settings.AGENT_TOOL_CALLING_MAX_STEPS,
+    tool_timeout_seconds=settings.AGENT_TOOL_CALLING_TOOL_TIMEOUT_SECONDS,
+    max_parallel_tools=settings.AGENT_TOOL_CALLING_MAX_PARALLEL_TOOLS,
+)
@@ -3,10 +3,10 @@ from datetime import datetime
 from typing import Any, Dict, Optional
 from uuid import UUID
 
-import google.generativeai as genai
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
+from app.core.observability import count, stage
 from app.models.user_state import UserState
 from app.schemas.tutor import (
     TutorAcademicLevel,
@@ -23,6 +23,11 @@ from app.schemas.tutor import (
     TutorSourceKind,
     TutorWorkspaceState,
 )
+from app.services.concurrency_limiter import concurrency_limiter
+from app.services.context_window import estimate_tokens
+from app.services.llm_metrics import llm_call
+from app.services.llm_registry import llm_registry
+from app.tools.prebuilt_agents import PREBUILT_AGENT_SLUGS
 
 
 class TutorWorkspaceService:
@@ -35,12 +40,14 @@ class TutorWorkspaceService:
     def __init__(self) -> None:
         self._configured = False
 
+    @stage("history")
     def get_workspace(self, db: Session, user_id: UUID, agent_id: UUID) -> TutorWorkspaceState:
         state = self._get_state_row(db, user_id, agent_id)
         if not state:
             return TutorWorkspaceState()
         return self._normalize_workspace_state(state.data or {})
 
+    @stage("commit")
     def save_workspace(
         self,
         db: Session,
@@ -123,9 +130,9 @@ class TutorWorkspaceService:
     ) -> Dict[str, Any]:
         self._ensure_client()
         prompt = self._build_prompt(request=request, source_text=source_text)
-        model = genai.GenerativeModel(
-            model_name=self.FLASH_MODEL,
-            generation_config={
+        model = llm_registry.generative_model(
+            self.FLASH_MODEL,
+            {
                 "temperature": 0.4,
                 "top_p": 0.9,
                 "top_k": 32,
@@ -133,8 +140,11 @@ class TutorWorkspaceService:
                 "response_mime_type": "application/json",
             },
         )
-        response = model.generate_content(prompt)
-        raw = response.text if hasattr(response, "text") else str(response)
+        with llm_call(self.FLASH_MODEL, PREBUILT_AGENT_SLUGS["personal_tutor"], estimate_tokens(prompt)) as call, \
+                concurrency_limiter.slot(self.FLASH_MODEL):
+            response = model.generate_content(prompt)
+            raw = call.finished(response.text if hasattr(response, "text") else str(response))
+        count(completion_chars=len(raw), completion_tokens=estimate_tokens(raw))
         return self._parse_json_payload(raw)
 
     def _build_prompt(self, request: TutorExecuteRequest, source_text: str) -> str:
@@ -219,9 +229,9 @@ Requirements:
     def _ensure_client(self) -> None:
         if self._configured:
             return
-        if not settings.GEMINI_API_KEY:
+        if not settings.GEMINI_API_KEY and llm_registry.needs_api_key:
             raise ValueError("GEMINI_API_KEY must be set in environment variables")
-        genai.configure(api_key=settings.GEMINI_API_KEY)
+        llm_registry.configure(settings.GEMINI_API_KEY)
         self._configured = True
 
     def _normalize_execute_response(
@@ -1,8 +1,7 @@
 from app.tools.prebuilt_agents import (
+  get_structured_tools_for_agent_slug,
   get_tools_for_agent_slug,
   PREBUILT_AGENT_SLUGS,
 )
 
-__all__ = ["get_tools_for_agent_slug", "PREBUILT_AGENT_SLUGS"]
-
-
+__all__ = ["get_structured_tools_for_agent_slug", "get_tools_for_agent_slug", "PREBUILT_AGENT_SLUGS"]
@@ -1,6 +1,12 @@
+import asyncio
+import contextvars
 import json
-from typing import List
-from langchain_core.tools import Tool
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, FrozenSet, List, Optional, Tuple
+from langchain_core.tools import StructuredTool, Tool
+from app.core.config import settings
 
 
 PREBUILT_AGENT_SLUGS = {
@@ -17,40 +23,111 @@ PREBUILT_AGENT_SLUGS = {
 }
 
 
-def _generate_quiz(topic: str, difficulty: str = "medium", num_questions: int = 5) -> str:
-  """Generate a complete quiz directly using Gemini API in a single call.
-  
-  This function directly calls Gemini to generate ALL quiz questions at once,
-  avoiding multiple API calls. The agent should use this tool when quiz is requested.
-  
-  Args:
-    topic: The subject/topic for the quiz
-    difficulty: Difficulty level (easy, medium, hard)
-    num_questions: Number of questions to generate (default: 5)
-  
-  Returns:
-    Complete quiz with all questions in the exact format specified.
+_FIRST_QUESTION_RE = re.compile(r"(?:\*\*)?Question\s+1[:\-]", re.IGNORECASE)
+_ANSWER_RE = re.compile(r"(?:\*\*)?Answer:")
+
+
+class _QuestionStreamCleaner:
+  """Streaming counterpart of the quiz/exam output cleanup.
+
+  Drops a preamble before **Question 1:** (only when it is longer than
+  ``preamble_limit`` characters) and keeps ``tail_lines`` lines after the last
+  **Answer:** marker. Text before the latest answer marker can never be
+  trimmed, so it is released as soon as it arrives; only the current tail is
+  held back until the next answer marker (or the end of the stream).
   """
-  try:
-    # Ensure num_questions is an integer (handle type conversion safely)
-    if isinstance(num_questions, str):
-      try:
-        num_questions = int(num_questions)
-      except (ValueError, TypeError):
-        num_questions = 5
-    elif not isinstance(num_questions, (int, float)):
+
+  _MAX_PREAMBLE = 4000
+  _MARKER_LEN = len("**Answer:**")
+
+  def __init__(self, preamble_limit: int = 0, tail_lines: int = 1) -> None:
+    self._preamble_limit = preamble_limit
+    self._tail_lines = tail_lines
+    self._text = ""
+    self._emitted = 0
+    self._in_body = False
+
+  def feed(self, chunk: str) -> str:
+    self._text += chunk
+    if not self._in_body:
+      match = _FIRST_QUESTION_RE.search(self._text)
+      if match is None and len(self._text) <= self._MAX_PREAMBLE:
+        return ""
+      if match is not None and match.start() > self._preamble_limit:
+        self._text = self._text[match.start():]
+      self._in_body = True
+    last_answer = self._last_answer()
+    # Without a marker, hold back a few characters in case one is half received.
+    end = last_answer if last_answer is not None else len(self._text) - self._MARKER_LEN
+    return self._release(end)
+
+  def finish(self) -> str:
+    if not self._in_body:
+      match = _FIRST_QUESTION_RE.search(self._text)
+      if match is not None and match.start() > self._preamble_limit:
+        self._text = self._text[match.start():].strip()
+    last_answer = self._last_answer()
+    if last_answer is not None and last_answer > 0:
+      tail = self._text[last_answer:].split('\n')[:self._tail_lines]
+      tail_text = tail[0].strip() if self._tail_lines == 1 else '\n'.join(tail)
+      self._text = self._text[:last_answer] + tail_text
+    return self._release(len(self._text))
+
+  def _last_answer(self) -> Optional[int]:
+    # Released text always ends before the latest marker, so search from there.
+    last = None
+    for match in _ANSWER_RE.finditer(self._text, self._emitted):
+      last = match.start()
+    return last
+
+  def _release(self, end: int) -> str:
+    if end <= self._emitted:
+      return ""
+    text = self._text[self._emitted:end]
+    self._emitted = end
+    return text
+
+
+async def _astream_cleaned(
+  system_prompt: str,
+  prompt: str,
+  cleaner: Optional[_QuestionStreamCleaner],
+) -> AsyncIterator[str]:
+  """Stream a gemini-2.5-pro generation, through ``cleaner`` when given."""
+  from app.services.gemini import GeminiClient
+  stream = GeminiClient().astream(
+    system_prompt=system_prompt,
+    messages=[{"role": "user", "content": prompt}],
+    model="gemini-2.5-pro",
+    temperature=0.7,
+  )
+  async for chunk in stream:
+    text = cleaner.feed(chunk) if cleaner is not None else chunk
+    if text:
+      yield text
+  if cleaner is not None:
+    text = cleaner.finish()
+    if text:
+      yield text
+
+
+def _quiz_request(topic: str, difficulty: str, num_questions: int) -> Tuple[str, str, str]:
+  """Normalize the quiz parameters and return (system prompt, prompt, empty-response fallback)."""
+  # Ensure num_questions is an integer (handle type conversion safely)
+  if isinstance(num_questions, str):
+    try:
+      num_questions = int(num_questions)
+    except (ValueError, TypeError):
       num_questions = 5
-    
-    difficulty = str(difficulty).lower() if difficulty else "medium"
-    topic = str(topic) if topic else "general knowledge"
-    num_questions = max(1, min(20, int(num_questions)))  # Limit between 1-20
-    
-    # Import Gemini client to generate quiz directly
-    from app.services.gemini import GeminiClient
-    gemini_client = GeminiClient()
-    
-    # Create a focused prompt for quiz generation
-    quiz_prompt = f"""Generate a complete multiple-choice quiz with {num_questions} questions about "{topic}" at {difficulty} difficulty level.
+  elif not isinstance(num_questions, (int, float)):
+    num_questions = 5
+  
+  difficulty = str(difficulty).lower() if difficulty else "medium"
+  topic = str(topic) if topic else "general knowledge"
+  num_questions = max(1, min(20, int(num_questions)))  # Limit between 1-20
+
+  # Create a focused prompt for quiz generation
+  quiz_prompt = f"""Generate a complete multiple-choice quiz with {num_questions} questions about "{topic}" at {difficulty} difficulty level.
 
 CRITICAL REQUIREMENTS - FOLLOW EXACTLY:
 1. ALL questions MUST be specifically about "{topic}" - do NOT include questions about unrelated topics
@@ -81,10 +158,35 @@ D) [Fourth option]
 [Continue for all {num_questions} questions...]
 
 Generate the complete quiz now:"""
+  system_prompt = "You are a quiz generator. Generate complete multiple-choice quizzes following the exact format specified."
+  fallback = f"**Question 1:** Quiz generation failed. Please try again.\nA) Option A\nB) Option B\nC) Option C\nD) Option D\n**Answer:** A"
+  return system_prompt, quiz_prompt, fallback
+
+
+def _generate_quiz(topic: str, difficulty: str = "medium", num_questions: int = 5) -> str:
+  """Generate a complete quiz directly using Gemini API in a single call.
+  
+  This function directly calls Gemini to generate ALL quiz questions at once,
+  avoiding multiple API calls. The agent should use this tool when quiz is requested.
+  
+  Args:
+    topic: The subject/topic for the quiz
+    difficulty: Difficulty level (easy, medium, hard)
+    num_questions: Number of questions to generate (default: 5)
+  
+  Returns:
+    Complete quiz with all questions in the exact format specified.
+  """
+  try:
+    system_prompt, quiz_prompt, fallback = _quiz_request(topic, difficulty, num_questions)
+    
+    # Import Gemini client to generate quiz directly
+    from app.services.gemini import GeminiClient
+    gemini_client = GeminiClient()
     
     # Generate quiz in a single API call using GeminiClient
     quiz_content = gemini_client.generate_response(
-      system_prompt="You are a quiz generator. Generate complete multiple-choice quizzes following the exact format specified.",
+      system_prompt=system_prompt,
       messages=[{"role": "user", "content": quiz_prompt}],
       model="gemini-2.5-pro",
       temperature=0.7
@@ -115,7 +217,7 @@ Generate the complete quiz now:"""
           answer_line = lines[0].strip()
           quiz_content = quiz_content[:last_answer_pos] + answer_line
     
-    return quiz_content if quiz_content else f"**Question 1:** Quiz generation failed. Please try again.\nA) Option A\nB) Option B\nC) Option C\nD) Option D\n**Answer:** A"
+    return quiz_content if quiz_content else fallback
     
   except Exception as e:
     # Fallback: return a template if direct generation fails
@@ -129,6 +231,21 @@ Generate the complete quiz now:"""
     return f"**Question 1:** Error generating quiz. Please try again.\nA) Option A\nB) Option B\nC) Option C\nD) Option D\n**Answer:** A"
 
 
+async def _astream_quiz(topic: str, difficulty: str = "medium", num_questions: int = 5) -> AsyncIterator[str]:
+  """Streaming variant of ``_generate_quiz``: yields the quiz while Gemini writes it.
+
+  Errors are raised, not written into the stream, so the calling intent's
+  error handling applies (see ``app.services.intent_router.astream``).
+  """
+  system_prompt, quiz_prompt, fallback = _quiz_request(topic, difficulty, num_questions)
+  produced = False
+  async for text in _astream_cleaned(system_prompt, quiz_prompt, _QuestionStreamCleaner(preamble_limit=0, tail_lines=1)):
+    produced = produced or bool(text.strip())
+    yield text
+  if not produced:
+    yield fallback
+
+
 def _build_study_plan(goal: str, weeks: int = 4) -> str:
   """Create a high-level weekly study plan outline."""
   weeks = max(1, min(52, int(weeks)))
@@ -778,45 +895,28 @@ YOU MUST NOW GENERATE THE COMPLETE ASSESSMENT FOLLOWING THIS FORMAT:
   return template
 
 
-def _generate_micro_lesson(topic: str, time_minutes: int = 5, difficulty: str = "medium") -> str:
-  """Generate a focused micro-lesson (5-15 minutes) on a specific topic.
-  
-  This function generates bite-sized lessons optimized for busy learners.
-  Lessons are structured, focused, and time-efficient.
+def _micro_lesson_request(topic: str, time_minutes: int, difficulty: str) -> Tuple[str, str, str]:
+  """Normalize the lesson parameters and return (system prompt, prompt, empty-response fallback)."""
+  # Validate and normalize inputs
+  time_minutes = max(5, min(15, int(time_minutes))) if isinstance(time_minutes, (int, float, str)) else 5
+  if isinstance(time_minutes, str):
+    try:
+      time_minutes = int(time_minutes)
+    except (ValueError, TypeError):
+      time_minutes = 5
+  time_minutes = max(5, min(15, time_minutes))
   
-  Args:
-    topic: The subject/topic for the lesson
-    time_minutes: Available time in minutes (5, 10, or 15)
-    difficulty: Difficulty level (easy, medium, hard)
+  difficulty = str(difficulty).lower() if difficulty else "medium"
+  topic = str(topic) if topic else "general knowledge"
+
+  # Create lesson prompt based on time
+  depth_map = {
+    5: "brief overview with 1-2 key concepts",
+    10: "detailed explanation with 2-3 key concepts and examples",
+    15: "comprehensive lesson with 3-4 concepts, multiple examples, and practical applications"
+  }
   
-  Returns:
-    Complete micro-lesson with concept, explanation, examples, and key takeaways.
-  """
-  try:
-    # Validate and normalize inputs
-    time_minutes = max(5, min(15, int(time_minutes))) if isinstance(time_minutes, (int, float, str)) else 5
-    if isinstance(time_minutes, str):
-      try:
-        time_minutes = int(time_minutes)
-      except (ValueError, TypeError):
-        time_minutes = 5
-    time_minutes = max(5, min(15, time_minutes))
-    
-    difficulty = str(difficulty).lower() if difficulty else "medium"
-    topic = str(topic) if topic else "general knowledge"
-    
-    # Import Gemini client
-    from app.services.gemini import GeminiClient
-    gemini_client = GeminiClient()
-    
-    # Create lesson prompt based on time
-    depth_map = {
-      5: "brief overview with 1-2 key concepts",
-      10: "detailed explanation with 2-3 key concepts and examples",
-      15: "comprehensive lesson with 3-4 concepts, multiple examples, and practical applications"
-    }
-    
-    lesson_prompt = f"""Generate a focused {time_minutes}-minute micro-lesson about "{topic}" at {difficulty} difficulty level.
+  lesson_prompt = f"""Generate a focused {time_minutes}-minute micro-lesson about "{topic}" at {difficulty} difficulty level.
 
 CRITICAL REQUIREMENTS:
 1. Keep the lesson focused and time-efficient ({depth_map.get(time_minutes, 'brief overview')})
@@ -844,15 +944,40 @@ OUTPUT FORMAT:
 [Add more as needed]
 
 Generate the lesson now:"""
+  system_prompt = "You are a micro-learning expert. Create focused, time-efficient lessons for busy learners."
+  fallback = f"**Concept:** {topic}\n\n**Explanation:**\nA brief overview of {topic}.\n\n**Key Takeaways:**\n• Understanding {topic} is important\n• Practice helps mastery"
+  return system_prompt, lesson_prompt, fallback
+
+
+def _generate_micro_lesson(topic: str, time_minutes: int = 5, difficulty: str = "medium") -> str:
+  """Generate a focused micro-lesson (5-15 minutes) on a specific topic.
+  
+  This function generates bite-sized lessons optimized for busy learners.
+  Lessons are structured, focused, and time-efficient.
+  
+  Args:
+    topic: The subject/topic for the lesson
+    time_minutes: Available time in minutes (5, 10, or 15)
+    difficulty: Difficulty level (easy, medium, hard)
+  
+  Returns:
+    Complete micro-lesson with concept, explanation, examples, and key takeaways.
+  """
+  try:
+    system_prompt, lesson_prompt, fallback = _micro_lesson_request(topic, time_minutes, difficulty)
+    
+    # Import Gemini client
+    from app.services.gemini import GeminiClient
+    gemini_client = GeminiClient()
     
     lesson_content = gemini_client.generate_response(
-      system_prompt="You are a micro-learning expert. Create focused, time-efficient lessons for busy learners.",
+      system_prompt=system_prompt,
       messages=[{"role": "user", "content": lesson_prompt}],
       model="gemini-2.5-pro",
       temperature=0.7
     )
     
-    return lesson_content if lesson_content else f"**Concept:** {topic}\n\n**Explanation:**\nA brief overview of {topic}.\n\n**Key Takeaways:**\n• Understanding {topic} is important\n• Practice helps mastery"
+    return lesson_content if lesson_content else fallback
     
   except Exception as e:
     import traceback
@@ -860,6 +985,17 @@ Generate the lesson now:"""
     return f"Error generating lesson: {str(e)}. Please try again."
 
 
+async def _astream_micro_lesson(topic: str, time_minutes: int = 5, difficulty: str = "medium") -> AsyncIterator[str]:
+  """Streaming variant of ``_generate_micro_lesson``; errors are raised, as in ``_astream_quiz``."""
+  system_prompt, lesson_prompt, fallback = _micro_lesson_request(topic, time_minutes, difficulty)
+  produced = False
+  async for text in _astream_cleaned(system_prompt, lesson_prompt, None):
+    produced = produced or bool(text.strip())
+    yield text
+  if not produced:
+    yield fallback
+
+
 def _create_flashcards(topic: str, num_cards: int = 5) -> str:
   """Create flashcards for spaced repetition learning.
   
@@ -928,44 +1064,284 @@ Generate the flashcards now:"""
 
 
 # Exam Prep Agent Tools
-def _create_practice_exam(exam_type: str, subject: str, num_questions: int = 50, time_limit: int = 60, difficulty: str = "medium") -> str:
-  """Create a full-length practice exam with various question types.
+def _normalize_exam_params(
+  exam_type: str,
+  subject: str,
+  num_questions: int,
+  time_limit: int,
+  difficulty: str,
+) -> Tuple[str, str, int, int, str]:
+  """Clamp and default the practice exam parameters."""
+  num_questions = max(10, min(100, int(num_questions))) if isinstance(num_questions, (int, float, str)) else 50
+  if isinstance(num_questions, str):
+    try:
+      num_questions = int(num_questions)
+    except (ValueError, TypeError):
+      num_questions = 50
+  num_questions = max(10, min(100, num_questions))
   
-  Args:
-    exam_type: Type of exam (SAT, GRE, Certification, Final Exam, etc.)
-    subject: Subject/topic for the exam
-    num_questions: Number of questions (default: 50)
-    time_limit: Time limit in minutes (default: 60)
-    difficulty: Difficulty level (easy, medium, hard, default: "medium")
+  time_limit = max(15, min(300, int(time_limit))) if isinstance(time_limit, (int, float, str)) else 60
+  if isinstance(time_limit, str):
+    try:
+      time_limit = int(time_limit)
+    except (ValueError, TypeError):
+      time_limit = 60
+  time_limit = max(15, min(300, time_limit))
   
-  Returns:
-    Complete practice exam with questions, answer key, and scoring rubric.
+  difficulty = str(difficulty).lower() if difficulty else "medium"
+  exam_type = str(exam_type) if exam_type else "General Exam"
+  subject = str(subject) if subject else "General Knowledge"
+  return exam_type, subject, num_questions, time_limit, difficulty
+
+
+_QUESTION_MARKER_RE = re.compile(r"(?:\*\*)?Question\s+\d+\s*[:\-](?:\*\*)?", re.IGNORECASE)
+# Share of common word bigrams above which two question stems count as the same question.
+_DUPLICATE_QUESTION_SIMILARITY = 0.7
+_MAX_AVOID_STEMS = 40
+
+
+def _exam_section_sizes(num_questions: int, section_size: int) -> List[int]:
+  """Split an exam into near-equal sections of at most ``section_size`` (and at least 10) questions."""
+  sections = min(-(-num_questions // max(1, section_size)), max(1, num_questions // 10))
+  base, extra = divmod(num_questions, sections)
+  return [base + (1 if i < extra else 0) for i in range(sections)]
+
+
+def _split_exam_questions(content: str) -> List[str]:
+  """Return the bodies of the answered questions in ``content``, without their numbers."""
+  markers = list(_QUESTION_MARKER_RE.finditer(content or ""))
+  blocks = []
+  for i, marker in enumerate(markers):
+    end = markers[i + 1].start() if i + 1 < len(markers) else len(content)
+    block = content[marker.end():end].strip()
+    answer = _ANSWER_RE.search(block)
+    if answer is None:
+      # Usually a question cut off by the output token limit.
+      continue
+    if i + 1 == len(markers):
+      # Keep the answer line and any explanation lines directly under it (up to 3
+      # lines, as in the single-call cleanup); a blank line starts closing text.
+      tail = block[answer.start():].split('\n\n', 1)[0]
+      block = block[:answer.start()] + '\n'.join(tail.split('\n')[:3])
+    blocks.append(block.strip())
+  return blocks
+
+
+def _question_words(block: str) -> FrozenSet:
+  """Word bigrams of the question stem (order-sensitive, unlike a bag of words)."""
+  words = re.findall(r"[a-z0-9]+", block.split('\n', 1)[0].lower())
+  return frozenset(zip(words, words[1:])) if len(words) > 1 else frozenset(words)
+
+
+def _is_duplicate_question(words: FrozenSet, seen: List[FrozenSet]) -> bool:
+  for other in seen:
+    union = len(words | other)
+    if union and len(words & other) / union >= _DUPLICATE_QUESTION_SIMILARITY:
+      return True
+  return False
+
+
+def _exam_section_note(index: int, total: int, size: int, subject: str) -> str:
+  return (
+    f"SECTION {index} OF {total}: this exam is written in {total} independent sections. "
+    f"Write only this section's {size} questions, numbered from 1. Split the main topics of {subject} "
+    f"into {total} roughly equal parts in their usual order and cover only part {index}, so that "
+    f"sections do not repeat each other."
+  )
+
+
+class _ExamQuestions:
+  """Questions merged from exam sections: near-identical ones are dropped, at most ``limit`` kept."""
+
+  def __init__(self, limit: int):
+    self.limit = limit
+    self.blocks: List[str] = []
+    self._seen: List[FrozenSet] = []
+
+  @property
+  def missing(self) -> int:
+    return self.limit - len(self.blocks)
+
+  def add(self, content: str) -> str:
+    """Add the questions of a section; return the accepted ones, numbered on from the previous ones."""
+    accepted = []
+    for block in _split_exam_questions(content):
+      if len(self.blocks) >= self.limit:
+        break
+      words = _question_words(block)
+      if _is_duplicate_question(words, self._seen):
+        continue
+      self._seen.append(words)
+      self.blocks.append(block)
+      accepted.append(f"**Question {len(self.blocks)}:** {block}")
+    return "\n\n".join(accepted)
+
+  def record(self, content: str) -> None:
+    """Count questions already sent as written (a streamed section) so later ones number on."""
+    for block in _split_exam_questions(content)[:self.missing]:
+      self._seen.append(_question_words(block))
+      self.blocks.append(block)
+
+  def top_up_note(self) -> str:
+    stems = [block.split('\n', 1)[0][:150] for block in self.blocks[-_MAX_AVOID_STEMS:]]
+    avoid = "\n".join(f"- {stem}" for stem in stems)
+    return f"ADDITIONAL QUESTIONS: write {self.missing} new questions that do not repeat any of these:\n{avoid}"
+
+
+def _generate_exam_in_sections(
+  gemini_client,
+  exam_type: str,
+  subject: str,
+  num_questions: int,
+  time_limit: int,
+  difficulty: str,
+  section_sizes: List[int],
+  concurrency: int,
+) -> str:
+  """Generate an exam as concurrent sections and merge them into one **Question N:** list.
+
+  Near-identical questions across sections are dropped; one extra request
+  tops the exam up if sections failed or duplicates were removed.
+  """
+  total = len(section_sizes)
+
+  def generate(size: int, note: str) -> str:
+    system_prompt, exam_prompt, _ = _practice_exam_request(exam_type, subject, size, time_limit, difficulty)
+    return gemini_client.generate_response(
+      system_prompt=system_prompt,
+      messages=[{"role": "user", "content": f"{exam_prompt}\n\n{note}"}],
+      model="gemini-2.5-pro",
+      temperature=0.7
+    )
+
+  outputs: List[str] = []
+  errors: List[Exception] = []
+  with ThreadPoolExecutor(max_workers=max(1, min(concurrency, total))) as pool:
+    # Each section runs in a copy of the caller's context, so its LLM call is
+    # counted in the request's prompt usage and stage timings.
+    futures = [
+      pool.submit(contextvars.copy_context().run, generate, size, _exam_section_note(i + 1, total, size, subject))
+      for i, size in enumerate(section_sizes)
+    ]
+    for future in futures:
+      try:
+        outputs.append(future.result())
+      except Exception as e:
+        print(f"Error in exam section: {e}")
+        errors.append(e)
+  if not outputs:
+    raise errors[0]
+
+  questions = _ExamQuestions(num_questions)
+  parts = [questions.add(output) for output in outputs]
+  if questions.missing > 0 and questions.blocks:
+    try:
+      parts.append(questions.add(generate(questions.missing, questions.top_up_note())))
+    except Exception as e:
+      print(f"Error topping up exam sections: {e}")
+
+  return "\n\n".join(part for part in parts if part)
+
+
+async def _astream_exam_in_sections(
+  gemini_client,
+  exam_type: str,
+  subject: str,
+  num_questions: int,
+  time_limit: int,
+  difficulty: str,
+  section_sizes: List[int],
+  concurrency: int,
+) -> AsyncIterator[str]:
+  """Streaming variant of ``_generate_exam_in_sections``.
+
+  Section 1 is streamed as Gemini writes it while the other sections are
+  generated concurrently (at most ``concurrency`` calls in flight, section 1
+  included); each of those is then sent, renumbered, in order.
   """
+  total = len(section_sizes)
+  limit = asyncio.Semaphore(max(1, concurrency))
+
+  def request(size: int, note: str) -> Dict[str, Any]:
+    system_prompt, exam_prompt, _ = _practice_exam_request(exam_type, subject, size, time_limit, difficulty)
+    return {
+      "system_prompt": system_prompt,
+      "messages": [{"role": "user", "content": f"{exam_prompt}\n\n{note}"}],
+      "model": "gemini-2.5-pro",
+      "temperature": 0.7,
+    }
+
+  async def generate(size: int, note: str) -> str:
+    async with limit:
+      return await gemini_client.agenerate_response(**request(size, note))
+
+  questions = _ExamQuestions(num_questions)
+  first_error: Optional[Exception] = None
+  streamed = ""
+  tasks: List["asyncio.Future[str]"] = []
   try:
-    num_questions = max(10, min(100, int(num_questions))) if isinstance(num_questions, (int, float, str)) else 50
-    if isinstance(num_questions, str):
+    async with limit:
+      tasks = [
+        asyncio.ensure_future(generate(size, _exam_section_note(i + 2, total, size, subject)))
+        for i, size in enumerate(section_sizes[1:])
+      ]
+      first = request(section_sizes[0], _exam_section_note(1, total, section_sizes[0], subject))
+      cleaner = _QuestionStreamCleaner(preamble_limit=0, tail_lines=3)
       try:
-        num_questions = int(num_questions)
-      except (ValueError, TypeError):
-        num_questions = 50
-    num_questions = max(10, min(100, num_questions))
-    
-    time_limit = max(15, min(300, int(time_limit))) if isinstance(time_limit, (int, float, str)) else 60
-    if isinstance(time_limit, str):
+        async for chunk in gemini_client.astream(**first):
+          text = cleaner.feed(chunk)
+          if text:
+            streamed += text
+            yield text
+      except Exception as e:
+        print(f"Error in exam section: {e}")
+        first_error = e
+      # Only the answer of the last question, not closing text or a cut-off next question.
+      text = cleaner.finish().split('\n\n', 1)[0]
+      if text:
+        streamed += text
+        yield text
+    questions.record(streamed)
+
+    for task in tasks:
       try:
-        time_limit = int(time_limit)
-      except (ValueError, TypeError):
-        time_limit = 60
-    time_limit = max(15, min(300, time_limit))
-    
-    difficulty = str(difficulty).lower() if difficulty else "medium"
-    exam_type = str(exam_type) if exam_type else "General Exam"
-    subject = str(subject) if subject else "General Knowledge"
-    
-    from app.services.gemini import GeminiClient
-    gemini_client = GeminiClient()
-    
-    exam_prompt = f"""Create a complete practice exam for {exam_type} in {subject}.
+        text = questions.add(await task)
+      except Exception as e:
+        print(f"Error in exam section: {e}")
+        first_error = first_error or e
+        continue
+      if text:
+        yield f"\n\n{text}" if streamed.strip() else text
+        streamed += text
+  finally:
+    for task in tasks:
+      task.cancel()
+  if not questions.blocks:
+    if first_error is not None:
+      raise first_error
+    return
+  if questions.missing > 0:
+    try:
+      text = questions.add(await generate(questions.missing, questions.top_up_note()))
+      if text:
+        yield f"\n\n{text}"
+    except Exception as e:
+      print(f"Error topping up exam sections: {e}")
+
+
+def _practice_exam_request(
+  exam_type: str,
+  subject: str,
+  num_questions: int,
+  time_limit: int,
+  difficulty: str,
+) -> Tuple[str, str, str]:
+  """Normalize the exam parameters and return (system prompt, prompt, empty-response fallback)."""
+  exam_type, subject, num_questions, time_limit, difficulty = _normalize_exam_params(
+    exam_type, subject, num_questions, time_limit, difficulty
+  )
+
+  exam_prompt = f"""Create a complete practice exam for {exam_type} in {subject}.
 
 CRITICAL REQUIREMENTS - FOLLOW EXACTLY:
 1. Generate ALL {num_questions} questions in ONE response
@@ -1013,9 +1389,41 @@ STRICT REQUIREMENTS:
 - NO phrases like 'Of course', 'I can help', 'Here is', 'Excellent', etc.
 
 Generate the complete exam now starting with **Question 1:**"""
+  system_prompt = "You are an exam creation expert. Create comprehensive practice exams following the exact format specified. DO NOT add any preamble, introduction, or conversational text. Start directly with the exam format."
+  fallback = f"# Practice Exam: {exam_type} - {subject}\n\n## Exam Instructions\n- Time Limit: {time_limit} minutes\n- Total Questions: {num_questions}\n\n## Questions\n**Question 1:** [Question text]\nA) Option A\nB) Option B\nC) Option C\nD) Option D\n\n## Answer Key\n**Question 1:** A - [Explanation]"
+  return system_prompt, exam_prompt, fallback
+
+
+def _create_practice_exam(exam_type: str, subject: str, num_questions: int = 50, time_limit: int = 60, difficulty: str = "medium") -> str:
+  """Create a full-length practice exam with various question types.
+  
+  Args:
+    exam_type: Type of exam (SAT, GRE, Certification, Final Exam, etc.)
+    subject: Subject/topic for the exam
+    num_questions: Number of questions (default: 50)
+    time_limit: Time limit in minutes (default: 60)
+    difficulty: Difficulty level (easy, medium, hard, default: "medium")
+  
+  Returns:
+    Complete practice exam with questions, answer key, and scoring rubric.
+  """
+  try:
+    system_prompt, exam_prompt, fallback = _practice_exam_request(exam_type, subject, num_questions, time_limit, difficulty)
+    
+    from app.services.gemini import GeminiClient
+    gemini_client = GeminiClient()
+    
+    # Large exams are generated as parallel sections (see EXAM_SECTION_SIZE).
+    normalized = _normalize_exam_params(exam_type, subject, num_questions, time_limit, difficulty)
+    section_sizes = _exam_section_sizes(normalized[2], settings.EXAM_SECTION_SIZE) if settings.EXAM_SECTION_SIZE > 0 else []
+    if len(section_sizes) > 1:
+      exam_content = _generate_exam_in_sections(
+        gemini_client, *normalized, section_sizes=section_sizes, concurrency=settings.EXAM_SECTION_CONCURRENCY
+      )
+      return exam_content if exam_content else fallback
     
     exam_content = gemini_client.generate_response(
-      system_prompt="You are an exam creation expert. Create comprehensive practice exams following the exact format specified. DO NOT add any preamble, introduction, or conversational text. Start directly with the exam format.",
+      system_prompt=system_prompt,
       messages=[{"role": "user", "content": exam_prompt}],
       model="gemini-2.5-pro",
       temperature=0.7
@@ -1029,8 +1437,7 @@ Generate the complete exam now starting with **Question 1:**"""
         question_start = exam_content.find("Question 1:")
       if question_start == -1:
         # Try to find any numbered question
-        import re
-        first_question_match = re.search(r'(?:Question|**Question)\s+1[:\-]', exam_content, re.IGNORECASE)
+        first_question_match = _FIRST_QUESTION_RE.search(exam_content)
         if first_question_match:
           question_start = first_question_match.start()
       
@@ -1061,7 +1468,7 @@ Generate the complete exam now starting with **Question 1:**"""
           answer_section = '\n'.join(lines[:3])
           exam_content = exam_content[:last_answer_pos] + answer_section
     
-    return exam_content if exam_content else f"# Practice Exam: {exam_type} - {subject}\n\n## Exam Instructions\n- Time Limit: {time_limit} minutes\n- Total Questions: {num_questions}\n\n## Questions\n**Question 1:** [Question text]\nA) Option A\nB) Option B\nC) Option C\nD) Option D\n\n## Answer Key\n**Question 1:** A - [Explanation]"
+    return exam_content if exam_content else fallback
     
   except Exception as e:
     import traceback
@@ -1069,6 +1476,40 @@ Generate the complete exam now starting with **Question 1:**"""
     return f"Error creating practice exam: {str(e)}. Please try again."
 
 
+async def _astream_practice_exam(
+  exam_type: str,
+  subject: str,
+  num_questions: int = 50,
+  time_limit: int = 60,
+  difficulty: str = "medium",
+) -> AsyncIterator[str]:
+  """Streaming variant of ``_create_practice_exam``: questions are sent as Gemini writes them.
+
+  Large exams are generated in sections, as in the batch tool: the first one
+  is streamed while the rest are generated, then sent in order.
+
+  The trailing scoring rubric special case of the batch cleanup is not applied;
+  up to three lines after the last answer are kept. Errors are raised, as in
+  ``_astream_quiz``.
+  """
+  system_prompt, exam_prompt, fallback = _practice_exam_request(exam_type, subject, num_questions, time_limit, difficulty)
+  normalized = _normalize_exam_params(exam_type, subject, num_questions, time_limit, difficulty)
+  section_sizes = _exam_section_sizes(normalized[2], settings.EXAM_SECTION_SIZE) if settings.EXAM_SECTION_SIZE > 0 else []
+  if len(section_sizes) > 1:
+    from app.services.gemini import GeminiClient
+    stream = _astream_exam_in_sections(
+      GeminiClient(), *normalized, section_sizes=section_sizes, concurrency=settings.EXAM_SECTION_CONCURRENCY
+    )
+  else:
+    stream = _astream_cleaned(system_prompt, exam_prompt, _QuestionStreamCleaner(preamble_limit=500, tail_lines=3))
+  produced = False
+  async for text in stream:
+    produced = produced or bool(text.strip())
+    yield text
+  if not produced:
+    yield fallback
+
+
 def _create_study_schedule(exam_date: str, subjects: str, hours_per_day: int = 2, current_level: str = "intermediate") -> str:
   """Create a personalized study schedule leading up to the exam date.
   
@@ -4144,4 +4585,20 @@ def get_tools_for_agent_slug(slug: str) -> List[Tool]:
       )
     )
 
-  return tools
+  # Cacheable generators (quiz, exam, lesson, ...) are served from the tool
+  # output cache when this agent opted in; other tools are returned untouched.
+  from app.services.tool_cache import tool_cache
+  return [tool_cache.wrap_tool(slug, tool) for tool in tools]
+
+
+@lru_cache(maxsize=None)
+def get_structured_tools_for_agent_slug(slug: str) -> Tuple[StructuredTool, ...]:
+  """Return the agent's tools with argument schemas, for native function calling.
+
+  Built once per slug: the schemas are inferred from the tool functions'
+  signatures, which is too slow to repeat on every turn.
+  """
+  return tuple(
+    StructuredTool.from_function(func=tool.func, name=tool.name, description=tool.description)
+    for tool in get_tools_for_agent_slug(slug)
+  )
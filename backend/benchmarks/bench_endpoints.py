@@ -0,0 +1,375 @@
+"""Load test: latency, TTFT and throughput of the chat, streaming, public and tutor endpoints.
+
+The app runs in this process, startup hooks included, against ``DATABASE_URL``
+and the LLM backend selected by ``LLM_BACKEND`` (``fake`` or ``replay``; see
+``app.services.fake_llm``). Requests go straight to the ASGI app, so the numbers
+include middleware, auth, the database and the model but not an HTTP server or
+the network. Each virtual user keeps one conversation per endpoint, so history
+grows over the run as it does for real users.
+
+    cd backend && LLM_BACKEND=fake DATABASE_URL=postgresql://... \\
+        python -m benchmarks.bench_endpoints [--concurrency 16] [--requests 200] \\
+        [--endpoints chat,stream,public,tutor] [--output run.json] [--baseline old.json]
+
+Per endpoint it reports p50/p95/p99 latency, TTFT (first response body chunk),
+throughput, the time spent checking out a pooled DB connection and the process
+CPU use (CPU seconds per wall second, benchmark driver included). Results are
+written as JSON; with ``--baseline`` the run is compared with an earlier one and
+the exit status is 1 when a p95 latency regressed by more than
+``--max-regression``.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.database import Base, SessionLocal, engine
+from app.core.security import create_access_token, generate_api_key, get_password_hash, hash_api_key
+from app.main import app
+from app.models.agent import Agent
+from app.models.api_key import ApiKey
+from app.models.user import User
+from app.services.llm_registry import llm_registry
+from app.tools.prebuilt_agents import PREBUILT_AGENT_SLUGS
+
+ENDPOINTS = ("chat", "stream", "public", "tutor")
+QUESTIONS = [
+    "Can you explain how photosynthesis converts light into chemical energy?",
+    "What's the difference between a list and a tuple in Python?",
+    "How should I plan my revision for the last two weeks before finals?",
+    "Why does the moon always show the same face to the Earth?",
+]
+
+
+@dataclass
+class Sample:
+    status: int
+    seconds: float
+    ttft: Optional[float]
+    body: bytes
+
+
+async def asgi_request(method: str, path: str, headers: Dict[str, str], payload: Any) -> Sample:
+    """Send one request to the app and time its first and last body chunks."""
+    body = json.dumps(payload).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        + [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        "client": ("127.0.0.1", 50000),
+        "server": ("benchmark", 80),
+    }
+    done = asyncio.Event()
+    sent_request = False
+    status = 0
+    ttft: Optional[float] = None
+    chunks: List[bytes] = []
+    started = time.perf_counter()
+
+    async def receive() -> Dict[str, Any]:
+        nonlocal sent_request
+        if not sent_request:
+            sent_request = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+        nonlocal status, ttft
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            if message.get("body"):
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                chunks.append(message["body"])
+            if not message.get("more_body", False):
+                done.set()
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        done.set()
+    return Sample(status, time.perf_counter() - started, ttft, b"".join(chunks))
+
+
+class PoolWaitMeter:
+    """Times every checkout from the engine's connection pool."""
+
+    def __init__(self, pool: Any) -> None:
+        self._pool = pool
+        self._connect = pool.connect
+        self.samples: List[float] = []
+
+    def __enter__(self) -> "PoolWaitMeter":
+        def timed_connect() -> Any:
+            started = time.perf_counter()
+            try:
+                return self._connect()
+            finally:
+                self.samples.append(time.perf_counter() - started)
+
+        self._pool.connect = timed_connect
+        return self
+
+    def __exit__(self, *_exc: Any) -> None:
+        del self._pool.connect
+
+
+@dataclass
+class Fixture:
+    user_headers: Dict[str, str]
+    api_key_headers: Dict[str, str]
+    agent_id: str
+    tutor_agent_id: str
+    public_slug: str
+
+
+def setup_fixture() -> Fixture:
+    """Create a user, a custom agent and an API key for this run."""
+    db = SessionLocal()
+    try:
+        user = User(email=f"bench-{uuid.uuid4().hex[:12]}@example.com", password_hash=get_password_hash("benchmark"))
+        db.add(user)
+        db.flush()
+        agent = Agent(
+            user_id=user.id,
+            name="Benchmark Assistant",
+            system_prompt="You are a helpful study assistant. Answer clearly and concisely.",
+            model="gemini-2.5-flash",
+            temperature=0.7,
+        )
+        db.add(agent)
+        public_slug = PREBUILT_AGENT_SLUGS["personal_tutor"]
+        tutor = db.query(Agent).filter(Agent.slug == public_slug, Agent.is_prebuilt.is_(True)).first()
+        if tutor is None:
+            raise SystemExit(f"Prebuilt agent {public_slug} is missing: start the app once to seed it.")
+        key_id = uuid.uuid4()
+        plain_key = f"ak_{key_id.hex}_{generate_api_key()}"
+        # High enough that the benchmark measures the endpoint, not the rate limiter.
+        db.add(ApiKey(id=key_id, user_id=user.id, key_hash=hash_api_key(plain_key), name="benchmark", rate_limit_per_minute=1_000_000))
+        db.commit()
+        return Fixture(
+            user_headers={"Authorization": f"Bearer {create_access_token({'sub': str(user.id)})}"},
+            api_key_headers={"X-API-Key": plain_key},
+            agent_id=str(agent.id),
+            tutor_agent_id=str(tutor.id),
+            public_slug=public_slug,
+        )
+    finally:
+        db.close()
+
+
+def _conversation_id(name: str, sample: Sample) -> Optional[str]:
+    if sample.status != 200:
+        return None
+    if name == "stream":
+        for line in sample.body.decode(errors="replace").splitlines():
+            if line.startswith("data: {"):
+                return json.loads(line[6:]).get("id")
+        return None
+    if name in ("chat", "public"):
+        return json.loads(sample.body).get("conversation_id")
+    return None
+
+
+def request_for(name: str, fixture: Fixture, user: int, turn: int, conversation_id: Optional[str]) -> Tuple[str, Dict[str, str], Any]:
+    """(path, headers, payload) of virtual ``user``'s ``turn``-th request to ``name``."""
+    message = QUESTIONS[(user + turn) % len(QUESTIONS)]
+    chat = {"message": message, "conversation_id": conversation_id}
+    if name == "chat":
+        return f"/api/v1/chat/{fixture.agent_id}", fixture.user_headers, chat
+    if name == "stream":
+        return f"/api/v1/chat/{fixture.agent_id}/stream", fixture.user_headers, chat
+    if name == "public":
+        return f"/api/v1/public/agents/{fixture.public_slug}/chat", fixture.api_key_headers, chat
+    return f"/api/v1/tutor/{fixture.tutor_agent_id}/execute", fixture.user_headers, {
+        "action": "ask_question",
+        "learning_mode": "concept_simplifier",
+        "subject": "Biology",
+        "academic_level": "college",
+        "prompt": message,
+    }
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99/mean/max in milliseconds (linear interpolation between ranks)."""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(values)
+
+    def at(q: float) -> float:
+        rank = q * (len(ordered) - 1)
+        low = int(rank)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+    summary = {f"p{int(q * 100)}": at(q) for q in (0.5, 0.95, 0.99)}
+    summary.update(mean=sum(ordered) / len(ordered), max=ordered[-1])
+    return {name: round(value * 1000, 2) for name, value in summary.items()}
+
+
+async def run_endpoint(name: str, fixture: Fixture, concurrency: int, requests: int, warmup: int) -> Dict[str, Any]:
+    conversations: Dict[int, Optional[str]] = {}
+    turns: Dict[int, int] = {}
+
+    async def one(user: int) -> Sample:
+        turn = turns.get(user, 0)
+        turns[user] = turn + 1
+        path, headers, payload = request_for(name, fixture, user, turn, conversations.get(user))
+        sample = await asgi_request("POST", path, headers, payload)
+        conversations[user] = _conversation_id(name, sample) or conversations.get(user)
+        return sample
+
+    for i in range(warmup):
+        await one(i % concurrency)
+
+    samples: List[Sample] = []
+    remaining = requests
+
+    async def virtual_user(user: int) -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            samples.append(await one(user))
+
+    with PoolWaitMeter(engine.pool) as pool_wait:
+        cpu_started, wall_started = time.process_time(), time.perf_counter()
+        await asyncio.gather(*(virtual_user(user) for user in range(concurrency)))
+        cpu, wall = time.process_time() - cpu_started, time.perf_counter() - wall_started
+
+    ok = [s for s in samples if 200 <= s.status < 300]
+    status_codes: Dict[str, int] = {}
+    for sample in samples:
+        status_codes[str(sample.status)] = status_codes.get(str(sample.status), 0) + 1
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "status_codes": status_codes,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 2) if wall else None,
+        "latency_ms": percentiles([s.seconds for s in ok]),
+        "ttft_ms": percentiles([s.ttft for s in ok if s.ttft is not None]),
+        "db_pool_wait_ms": {**percentiles(pool_wait.samples), "checkouts": len(pool_wait.samples)},
+        "cpu_utilization": round(cpu / wall, 3) if wall else None,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(endpoints: List[str], concurrency: int, requests: int, warmup: int) -> Dict[str, Any]:
+    # A no-op on a migrated database; lets a fresh one be used directly.
+    Base.metadata.create_all(bind=engine)
+    await app.router.startup()
+    try:
+        fixture = setup_fixture()
+        results = {}
+        for name in endpoints:
+            results[name] = await run_endpoint(name, fixture, concurrency, requests, warmup)
+    finally:
+        await app.router.shutdown()
+    return {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "database": engine.dialect.name,
+            "db_pool_size": engine.pool.size() if hasattr(engine.pool, "size") else None,
+            "llm_backend": settings.LLM_BACKEND,
+            "llm": llm_registry.stats().get("fake_backend"),
+            "concurrency": concurrency,
+            "requests": requests,
+            "warmup": warmup,
+        },
+        "endpoints": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """Endpoints whose p95 latency grew by more than ``max_regression`` (a fraction)."""
+    regressions = []
+    for name, result in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name, {}).get("latency_ms", {}).get("p95")
+        after = result["latency_ms"]["p95"]
+        if before and after and after > before * (1 + max_regression):
+            regressions.append(f"{name}: p95 {before:.1f}ms -> {after:.1f}ms")
+    return regressions
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def _print(results: Dict[str, Any]) -> None:
+    print(f"{'endpoint':<8} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'ttft p50':>9} {'pool p95':>9} {'cpu':>6} errors")
+    for name, r in results["endpoints"].items():
+        latency, ttft, pool = r["latency_ms"], r["ttft_ms"], r["db_pool_wait_ms"]
+        print(
+            f"{name:<8} {_fmt(r['throughput_rps']):>8} {_fmt(latency['p50']):>9} {_fmt(latency['p95']):>9} "
+            f"{_fmt(latency['p99']):>9} {_fmt(ttft['p50']):>9} {_fmt(pool['p95']):>9} {_fmt(r['cpu_utilization']):>6} {r['errors']}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma-separated subset of " + ",".join(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests per endpoint")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="allowed p95 growth (fraction)")
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    if llm_registry.needs_api_key and settings.LLM_BACKEND != "record":
+        parser.error("set LLM_BACKEND=fake or replay (or record, to spend real Gemini quota on purpose)")
+
+    logging.basicConfig(level=logging.WARNING)
+    # Some tools print progress; keep the report readable.
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = asyncio.run(run(endpoints, max(1, args.concurrency), args.requests, args.warmup))
+    _print(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            regressions = compare(results, json.load(handle), args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Microbenchmark: per-message cost of routing a chat message to a prebuilt tool.
+
+Only routing and parameter extraction are measured; every tool function is
+replaced by a stub so no LLM call is made.
+
+    cd backend && python -m benchmarks.bench_intent_router [--iterations N]
+"""
+import argparse
+import contextlib
+import io
+import time
+from unittest.mock import patch
+
+from app.models.agent import Agent
+from app.services.langchain_client import LangchainAgentService
+from app.tools import prebuilt_agents
+from app.tools.prebuilt_agents import PREBUILT_AGENT_SLUGS
+
+STUBBED_TOOLS = [
+    "_generate_quiz",
+    "_create_practice_exam",
+    "_create_study_schedule",
+    "_identify_weak_areas",
+    "_generate_topic_review",
+    "_generate_micro_lesson",
+    "_create_course_structure",
+    "_create_learning_assessment",
+    "_create_concept_map",
+    "_create_workflow_automation",
+    "_create_meeting_notes_template",
+    "_validate_course_content",
+    "_generate_skill_gap_agent_response",
+    "_generate_fitness_coach_response",
+    "_generate_career_coach_response",
+    "_generate_resume_review",
+]
+
+CHAT = [
+    "Can you explain how photosynthesis converts light into chemical energy?",
+    "I'm feeling stuck on my project, any advice on staying motivated this week?",
+    "What's the difference between a list and a tuple in Python?",
+]
+
+SCENARIOS = {
+    # Ordinary conversation on prebuilt agents: every check runs and falls through.
+    "prebuilt_chat_miss": [
+        (slug_key, message)
+        for slug_key in (
+            "exam_prep_agent",
+            "course_creation_agent",
+            "personal_tutor",
+            "micro_learning_agent",
+            "career_coach_agent",
+            "fitness_coach_agent",
+            "resume_review_agent",
+        )
+        for message in CHAT
+    ],
+    "tool_hit": [
+        ("exam_prep_agent", "Generate a practice exam for SAT exam in Mathematics with 20 questions, 60 minutes, hard"),
+        ("exam_prep_agent", "create_study_schedule exam_date: 2026-12-01 subjects: Math, Physics hours_per_day: 3"),
+        ("exam_prep_agent", "Please do a topic review. topic: Derivatives difficulty: hard"),
+        ("personal_tutor", "Generate a quiz about the French Revolution with 5 questions at medium level"),
+        ("micro_learning_agent", "generate_micro_lesson about recursion, 5 minutes, beginner"),
+        ("course_creation_agent", "Create a course outline for course title: Intro to Data, duration 6 weeks"),
+        ("course_creation_agent", "Build a concept map for Machine Learning. related concepts: supervised, unsupervised"),
+        ("career_coach_agent", 'CAREER_COACH_REQUEST {"action": "weekly_checkin", "payload": {"wins": []}}'),
+        ("fitness_coach_agent", '{"action": "quick_workout_burst", "payload": {"minutes": 10}}'),
+    ],
+    "custom_agent": [(None, message) for message in CHAT],
+}
+
+
+def _agent(slug_key):
+    if slug_key is None:
+        return Agent(name="Custom", is_prebuilt=False, slug=None)
+    return Agent(name=slug_key, is_prebuilt=True, slug=PREBUILT_AGENT_SLUGS[slug_key])
+
+
+def run(iterations: int) -> dict:
+    service = LangchainAgentService.__new__(LangchainAgentService)
+    results = {}
+    with contextlib.ExitStack() as stack:
+        for name in STUBBED_TOOLS:
+            stack.enter_context(patch.object(prebuilt_agents, name, lambda *a, **kw: "stub"))
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        for scenario, cases in SCENARIOS.items():
+            prepared = [(_agent(slug_key), message) for slug_key, message in cases]
+            for agent, message in prepared:  # warm up
+                service._intercept_tools(agent, message)
+            started = time.perf_counter()
+            for _ in range(iterations):
+                for agent, message in prepared:
+                    service._intercept_tools(agent, message)
+            elapsed = time.perf_counter() - started
+            results[scenario] = elapsed / (iterations * len(prepared)) * 1e6
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    for scenario, micros in run(args.iterations).items():
+        print(f"{scenario:<22} {micros:8.2f} us/message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Microbenchmark: per-request overhead of the request timing middleware.
+
+The app runs in this process with a zero-latency fake LLM (see
+``app.services.fake_llm``), so a request costs only the framework, auth and
+database work, and the middleware's share of it is visible. Each route is
+measured with three middleware stacks, interleaved over several rounds:
+
+- ``none``: no timing middleware (the floor),
+- ``base_http``: the previous ``BaseHTTPMiddleware`` implementation (kept below
+  for reference; it runs ``call_next`` in a task and relays the body through a
+  memory stream),
+- ``asgi``: the current pure ASGI ``RequestTimingMiddleware``.
+
+    cd backend && DATABASE_URL=postgresql://... \\
+        python -m benchmarks.bench_middleware [--requests 500] [--rounds 5] [--routes health,chat,stream]
+
+Requests are sent one at a time; per stack it reports the mean and p50 latency,
+CPU microseconds per request and the overhead over ``none``.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.core.database import Base, engine
+from app.core.metrics import HTTP_REQUEST_SECONDS, route_label
+from app.core.observability import RequestTimingMiddleware, StageTimer, _current_timer
+from app.main import app
+from app.services.fake_llm import FakeGemini, LatencyProfile
+from app.services.llm_registry import llm_registry
+from benchmarks.bench_endpoints import asgi_request, percentiles, request_for, setup_fixture
+
+ROUTES = ("health", "chat", "stream")
+STACKS = ("none", "base_http", "asgi")
+
+logger = logging.getLogger("app.observability")
+
+
+class BaseHTTPTimingMiddleware(BaseHTTPMiddleware):
+    """The timing middleware as it was before the pure ASGI rewrite."""
+
+    async def dispatch(self, request, call_next):
+        start = time.perf_counter()
+        timer = StageTimer()
+        token = _current_timer.set(timer)
+        try:
+            response = await call_next(request)
+        finally:
+            _current_timer.reset(token)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        response.headers["X-Process-Time-Ms"] = f"{elapsed_ms:.2f}"
+        response.headers["Server-Timing"] = timer.server_timing(elapsed_ms)
+
+        body = response.body_iterator
+
+        async def logged_body() -> AsyncIterator[bytes]:
+            try:
+                async for chunk in body:
+                    yield chunk
+            finally:
+                elapsed = time.perf_counter() - start
+                HTTP_REQUEST_SECONDS.labels(
+                    request.method, route_label(request.scope), str(response.status_code)
+                ).observe(elapsed)
+                logger.info(
+                    "request_timing method=%s path=%s status=%s duration_ms=%.2f %s",
+                    request.method,
+                    request.url.path,
+                    response.status_code,
+                    elapsed * 1000,
+                    timer.log_fields(),
+                    extra={"stages_ms": dict(timer.stages), **timer.counts},
+                )
+
+        response.body_iterator = logged_body()
+        return response
+
+
+def use_stack(name: str) -> None:
+    """Swap the timing middleware of ``app`` for stack ``name`` and rebuild it."""
+    classes = {"base_http": BaseHTTPTimingMiddleware, "asgi": RequestTimingMiddleware}
+    stack = [
+        entry for entry in app.user_middleware
+        if entry.cls not in (RequestTimingMiddleware, BaseHTTPTimingMiddleware)
+    ]
+    if name in classes:
+        # Innermost, where main.py adds it.
+        stack.append(Middleware(classes[name]))
+    app.user_middleware = stack
+    app.middleware_stack = None
+
+
+async def measure(route: str, fixture: Any, requests: int) -> Dict[str, List[float]]:
+    latencies: List[float] = []
+    cpu_started = time.process_time()
+    for turn in range(requests):
+        if route == "health":
+            sample = await asgi_request("GET", "/health", {}, None)
+        else:
+            # A fresh conversation each time keeps the history, and the work, constant.
+            path, headers, payload = request_for(route, fixture, 0, turn, None)
+            sample = await asgi_request("POST", path, headers, payload)
+        if sample.status != 200:
+            raise SystemExit(f"{route}: HTTP {sample.status} {sample.body[:200]!r}")
+        latencies.append(sample.seconds)
+    return {"latency": latencies, "cpu": [(time.process_time() - cpu_started) / requests]}
+
+
+async def run(routes: List[str], requests: int, rounds: int, warmup: int) -> Dict[str, Dict[str, Dict[str, Optional[float]]]]:
+    Base.metadata.create_all(bind=engine)
+    llm_registry.use_backend(fake=FakeGemini(LatencyProfile(ttft_ms=0, tokens_per_second=0, output_tokens=50)))
+    await app.router.startup()
+    try:
+        fixture = setup_fixture()
+        results: Dict[str, Dict[str, Dict[str, Optional[float]]]] = {}
+        for route in routes:
+            collected = {stack: {"latency": [], "cpu": []} for stack in STACKS}
+            for stack in STACKS:
+                use_stack(stack)
+                await measure(route, fixture, warmup)
+            for _ in range(rounds):
+                for stack in STACKS:
+                    use_stack(stack)
+                    measured = await measure(route, fixture, requests)
+                    for key, values in measured.items():
+                        collected[stack][key].extend(values)
+            results[route] = {
+                stack: {
+                    **percentiles(values["latency"]),
+                    "cpu_us": round(sum(values["cpu"]) / len(values["cpu"]) * 1e6, 1),
+                }
+                for stack, values in collected.items()
+            }
+    finally:
+        use_stack("asgi")
+        await app.router.shutdown()
+        llm_registry.use_backend()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--routes", default=",".join(ROUTES), help="comma-separated subset of " + ",".join(ROUTES))
+    parser.add_argument("--requests", type=int, default=500, help="requests per stack and round")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=50)
+    args = parser.parse_args()
+
+    routes = [name.strip() for name in args.routes.split(",") if name.strip()]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+
+    logging.basicConfig(level=logging.WARNING)
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = asyncio.run(run(routes, args.requests, args.rounds, args.warmup))
+
+    print(f"{'route':<8} {'stack':<10} {'mean ms':>9} {'p50 ms':>9} {'cpu us':>9} {'overhead us':>12}")
+    for route, stacks in results.items():
+        floor = stacks["none"]
+        for stack, r in stacks.items():
+            overhead = "" if stack == "none" else f"{(r['mean'] - floor['mean']) * 1000:+.1f}"
+            print(f"{route:<8} {stack:<10} {r['mean']:>9.3f} {r['p50']:>9.3f} {r['cpu_us']:>9.1f} {overhead:>12}")
+
+
+if __name__ == "__main__":
+    main()
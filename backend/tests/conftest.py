@@ -8,8 +8,17 @@ from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from app.main import app
 from app.core.config import settings
 from app.core.database import Base, get_db
+from app.core.rate_limit import InMemoryRateLimiter, set_rate_limiter
 from app.models.user import User
 from app.core.security import get_password_hash
+from app.services.concurrency_limiter import concurrency_limiter
+from app.services.conversation_summary import conversation_summarizer
+from app.services.llm_registry import llm_registry
+from app.services.model_router import model_router
+from app.services.prompt_cache import prompt_cache
+from app.services.resilience import resilience
+from app.services.single_flight import single_flight
+from app.services.tool_calling import tool_calling
 
 # Allow PostgreSQL UUID columns to compile under SQLite test DB.
 @compiles(PG_UUID, "sqlite")
@@ -27,6 +36,28 @@ engine = create_engine(
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+SERVICE_SINGLETONS = (
+    llm_registry,
+    single_flight,
+    model_router,
+    concurrency_limiter,
+    conversation_summarizer,
+    prompt_cache,
+    tool_calling,
+    resilience,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_service_singletons():
+    """Cached LLM clients and counters must not leak (possibly mocked) state between tests."""
+    for service in SERVICE_SINGLETONS:
+        service.clear()
+    yield
+    for service in SERVICE_SINGLETONS:
+        service.clear()
+
+
 @pytest.fixture(scope="function")
 def db_session():
     """Create a fresh database for each test."""
@@ -51,9 +82,11 @@ def client(db_session):
             pass
 
     app.dependency_overrides[get_db] = override_get_db
+    set_rate_limiter(InMemoryRateLimiter())
     with TestClient(app) as test_client:
         yield test_client
     app.dependency_overrides.clear()
+    set_rate_limiter(None)
     settings.TESTING = False
 
 
@@ -0,0 +1,131 @@
+import uuid
+
+import pytest
+
+from app.core.api_key_cache import VerifiedApiKeyCache, api_key_cache
+
+
+@pytest.fixture(autouse=True)
+def reset_api_key_cache():
+    api_key_cache.clear()
+    yield
+    api_key_cache.clear()
+
+
+@pytest.fixture
+def api_key(client, auth_headers):
+    """Create a universal API key and return its JSON payload (including the plain key)."""
+    response = client.post(
+        "/api/v1/api-keys",
+        json={"name": "Integration key"},
+        headers=auth_headers,
+    )
+    assert response.status_code == 201
+    return response.json()
+
+
+def test_repeat_requests_hit_verification_cache(client, api_key):
+    """Only the first request with a key pays for the hash check."""
+    headers = {"X-API-Key": api_key["key"]}
+
+    assert client.get("/api/v1/public/agents", headers=headers).status_code == 200
+    assert client.get("/api/v1/public/agents", headers=headers).status_code == 200
+    assert client.get("/api/v1/public/agents", headers=headers).status_code == 200
+
+    stats = api_key_cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 2
+    assert stats["entries"] == 1
+
+
+def test_wrong_secret_for_valid_key_id_is_rejected(client, api_key):
+    """A cached verification must not authorize a different secret for the same key id."""
+    headers = {"X-API-Key": api_key["key"]}
+    assert client.get("/api/v1/public/agents", headers=headers).status_code == 200
+
+    key_id_hex = api_key["key"].split("_", 2)[1]
+    forged = {"X-API-Key": f"ak_{key_id_hex}_not-the-real-secret"}
+    assert client.get("/api/v1/public/agents", headers=forged).status_code == 401
+
+
+def test_toggle_revokes_cached_key_immediately(client, auth_headers, api_key):
+    headers = {"X-API-Key": api_key["key"]}
+    assert client.get("/api/v1/public/agents", headers=headers).status_code == 200
+
+    response = client.patch(f"/api/v1/api-keys/{api_key['id']}/toggle", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["is_active"] is False
+    assert api_key_cache.stats()["entries"] == 0
+
+    assert client.get("/api/v1/public/agents", headers=headers).status_code == 401
+
+
+def test_delete_invalidates_cached_key(client, auth_headers, api_key):
+    headers = {"X-API-Key": api_key["key"]}
+    assert client.get("/api/v1/public/agents", headers=headers).status_code == 200
+
+    response = client.delete(f"/api/v1/api-keys/{api_key['id']}", headers=auth_headers)
+    assert response.status_code == 204
+    assert api_key_cache.stats()["entries"] == 0
+
+    assert client.get("/api/v1/public/agents", headers=headers).status_code == 401
+
+
+def test_cache_evicts_least_recently_used_entry():
+    cache = VerifiedApiKeyCache(max_entries=2, ttl_seconds=60)
+    first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+
+    cache.remember("key-1", first, "hash-1")
+    cache.remember("key-2", second, "hash-2")
+    assert cache.is_verified("key-1", first, "hash-1")
+    cache.remember("key-3", third, "hash-3")
+
+    assert not cache.is_verified("key-2", second, "hash-2")
+    assert cache.is_verified("key-1", first, "hash-1")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cache_entries_expire_and_track_stored_hash():
+    cache = VerifiedApiKeyCache(max_entries=10, ttl_seconds=0)
+    key_id = uuid.uuid4()
+    cache.remember("key", key_id, "hash")
+    assert not cache.is_verified("key", key_id, "hash")
+
+    cache = VerifiedApiKeyCache(max_entries=10, ttl_seconds=60)
+    cache.remember("key", key_id, "hash")
+    assert not cache.is_verified("key", key_id, "rotated-hash")
+
+
+def test_new_keys_use_hmac_hash(db_session, api_key):
+    from app.core.security import API_KEY_HASH_PREFIX, verify_api_key
+    from app.models.api_key import ApiKey
+
+    stored = db_session.query(ApiKey).filter(ApiKey.id == uuid.UUID(api_key["id"])).one()
+    assert stored.key_hash.startswith(API_KEY_HASH_PREFIX)
+    assert api_key["key"].startswith(f"ak_{stored.id.hex}_")
+    assert verify_api_key(api_key["key"], stored.key_hash)
+    assert not verify_api_key(api_key["key"] + "x", stored.key_hash)
+
+
+def test_legacy_bcrypt_hash_is_upgraded_after_verification(client, db_session, test_user):
+    import bcrypt
+    from app.core.security import API_KEY_HASH_PREFIX, generate_api_key, verify_api_key
+    from app.models.api_key import ApiKey
+
+    key_id = uuid.uuid4()
+    plain_key = f"ak_{key_id.hex}_{generate_api_key()}"
+    legacy_hash = bcrypt.hashpw(plain_key.encode("utf-8"), bcrypt.gensalt(rounds=4)).decode("utf-8")
+    db_session.add(ApiKey(id=key_id, user_id=test_user.id, key_hash=legacy_hash, name="Legacy key"))
+    db_session.commit()
+
+    response = client.get("/api/v1/public/agents", headers={"X-API-Key": plain_key})
+    assert response.status_code == 200
+
+    stored = db_session.query(ApiKey).filter(ApiKey.id == key_id).one()
+    db_session.refresh(stored)
+    assert stored.key_hash.startswith(API_KEY_HASH_PREFIX)
+    assert verify_api_key(plain_key, stored.key_hash)
+
+    # The upgraded hash keeps working on subsequent requests.
+    response = client.get("/api/v1/public/agents", headers={"X-API-Key": plain_key})
+    assert response.status_code == 200
@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 from app.models.agent import Agent
 from app.models.conversation import Conversation
 from app.models.message import Message, MessageRole
@@ -26,7 +26,7 @@ def test_send_message_new_conversation(mock_langchain_service, client, auth_head
     """Test sending a message creates a new conversation."""
     # Mock LangChain response
     mock_instance = Mock()
-    mock_instance.generate_response.return_value = "This is a test response."
+    mock_instance.agenerate_response = AsyncMock(return_value="This is a test response.")
     mock_langchain_service.return_value = mock_instance
     
     response = client.post(
@@ -48,7 +48,7 @@ def test_send_message_new_conversation(mock_langchain_service, client, auth_head
     assert data["assistant_message"]["content"] == "This is a test response."
     
     # Verify LangChain service was called
-    mock_instance.generate_response.assert_called_once()
+    mock_instance.agenerate_response.assert_called_once()
 
 
 @patch("app.api.v1.chat.LangchainAgentService")
@@ -67,7 +67,7 @@ def test_send_message_existing_conversation(
     
     # Mock LangChain response
     mock_instance = Mock()
-    mock_instance.generate_response.return_value = "Response to existing conversation."
+    mock_instance.agenerate_response = AsyncMock(return_value="Response to existing conversation.")
     mock_langchain_service.return_value = mock_instance
     
     response = client.post(
@@ -114,7 +114,7 @@ def test_send_message_with_history(
     
     # Mock LangChain response
     mock_instance = Mock()
-    mock_instance.generate_response.return_value = "Second response."
+    mock_instance.agenerate_response = AsyncMock(return_value="Second response.")
     mock_langchain_service.return_value = mock_instance
     
     response = client.post(
@@ -129,7 +129,7 @@ def test_send_message_with_history(
     assert response.status_code == 200
     
     # Verify LangChain service was called with history
-    call_args = mock_instance.generate_response.call_args
+    call_args = mock_instance.agenerate_response.call_args
     assert call_args is not None
     history = call_args.kwargs["history"]
     assert len(history) >= 2  # Should include previous messages
@@ -178,3 +178,42 @@ def test_send_message_unauthorized_agent(client, auth_headers, db_session):
     
     assert response.status_code == 404
 
+
+
+@patch("app.api.v1.chat.LangchainAgentService")
+def test_failed_generation_discards_user_turn(
+    mock_langchain_service, client, auth_headers, db_session, test_agent
+):
+    """A failed LLM call leaves no half-written conversation behind."""
+    mock_instance = Mock()
+    mock_instance.agenerate_response = AsyncMock(side_effect=RuntimeError("upstream unavailable"))
+    mock_langchain_service.return_value = mock_instance
+
+    response = client.post(
+        f"/api/v1/chat/{test_agent.id}",
+        json={"message": "Hello?"},
+        headers=auth_headers
+    )
+
+    assert response.status_code == 500
+    assert db_session.query(Conversation).count() == 0
+    assert db_session.query(Message).count() == 0
+
+
+@patch("app.api.v1.chat.GeminiClient")
+def test_pronunciation_assessment_uses_async_client(mock_gemini_client, client, auth_headers):
+    """The assessment awaits the async Gemini call instead of blocking the event loop."""
+    mock_instance = Mock()
+    mock_instance.agenerate_response = AsyncMock(return_value='{"overall_score": 88, "feedback": "Clear."}')
+    mock_gemini_client.return_value = mock_instance
+
+    response = client.post(
+        "/api/v1/chat/pronunciation-assessment",
+        json={"word_or_phrase": "bonjour", "user_transcript": "bonjour", "language": "French"},
+        headers=auth_headers
+    )
+
+    assert response.status_code == 200
+    assert response.json()["overall_score"] == 88
+    mock_instance.agenerate_response.assert_awaited_once()
+    mock_instance.generate_response.assert_not_called()
@@ -0,0 +1,96 @@
+"""Load test: chat concurrency must not be bounded by the DB connection pool.
+
+The app runs against a file-backed SQLite engine with a single pooled
+connection and a short pool timeout, while the LLM call is mocked to take
+``LLM_LATENCY`` seconds. If a request kept its connection checked out while
+waiting on the LLM, the other requests would queue behind it and time out
+waiting for the pool.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from app.core.database import Base, get_db
+from app.core.security import get_password_hash
+from app.main import app
+from app.core.config import settings
+from app.models.agent import Agent
+from app.models.user import User
+
+CONCURRENT_CHATS = 8
+LLM_LATENCY = 0.5
+
+
+@pytest.fixture
+def pooled_client(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'chat.db'}",
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=1,
+    )
+    Base.metadata.create_all(bind=engine)
+    PooledSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    with PooledSession() as db:
+        user = User(email="load@example.com", password_hash=get_password_hash("loadpassword123"))
+        db.add(user)
+        db.flush()
+        agent = Agent(user_id=user.id, name="Load Agent", system_prompt="You are helpful.")
+        db.add(agent)
+        db.commit()
+        agent_id = agent.id
+
+    def override_get_db():
+        db = PooledSession()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    settings.TESTING = True
+    app.dependency_overrides[get_db] = override_get_db
+    with TestClient(app) as client:
+        token = client.post(
+            "/api/v1/auth/login",
+            data={"username": "load@example.com", "password": "loadpassword123"},
+        ).json()["access_token"]
+        yield client, {"Authorization": f"Bearer {token}"}, agent_id
+    app.dependency_overrides.clear()
+    settings.TESTING = False
+    engine.dispose()
+
+
+async def _slow_reply(**_kwargs):
+    await asyncio.sleep(LLM_LATENCY)
+    return "Slow but steady."
+
+
+@patch("app.api.v1.chat.LangchainAgentService")
+def test_concurrent_chats_exceed_pool_size(mock_service, pooled_client):
+    client, headers, agent_id = pooled_client
+    mock_instance = Mock()
+    mock_instance.agenerate_response = AsyncMock(side_effect=_slow_reply)
+    mock_service.return_value = mock_instance
+
+    def send(i: int):
+        return client.post(f"/api/v1/chat/{agent_id}", json={"message": f"Hello {i}"}, headers=headers)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONCURRENT_CHATS) as pool:
+        responses = list(pool.map(send, range(CONCURRENT_CHATS)))
+    elapsed = time.perf_counter() - started
+
+    assert [r.status_code for r in responses] == [200] * CONCURRENT_CHATS
+    assert all(r.json()["message"] == "Slow but steady." for r in responses)
+    # Serialized on the single connection this would take CONCURRENT_CHATS * LLM_LATENCY.
+    assert elapsed < CONCURRENT_CHATS * LLM_LATENCY / 2
@@ -0,0 +1,143 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+from google.api_core.exceptions import InvalidArgument, ResourceExhausted
+
+from app.models.conversation import Conversation
+from app.services.concurrency_limiter import ConcurrencyLimiter, UpstreamOverloaded, is_overload_error
+
+
+def _call(limiter: ConcurrencyLimiter, error: Exception = None):
+    with limiter.slot("gemini-2.5-pro"):
+        if error is not None:
+            raise error
+
+
+def test_limit_grows_additively_and_halves_on_429():
+    limiter = ConcurrencyLimiter(initial_limit=4, max_limit=6)
+    for _ in range(4):
+        _call(limiter)
+    assert limiter.stats()["gemini-2.5-pro"]["limit"] == 5.0
+
+    with pytest.raises(ResourceExhausted):
+        _call(limiter, ResourceExhausted("429 Resource has been exhausted"))
+    assert limiter.stats()["gemini-2.5-pro"]["limit"] == 2.5
+
+    with pytest.raises(InvalidArgument):
+        _call(limiter, InvalidArgument("bad request"))
+    stats = limiter.stats()["gemini-2.5-pro"]
+    assert stats["limit"] == 2.5
+    assert stats["overloads"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_failures_from_one_burst_cut_the_limit_once():
+    limiter = ConcurrencyLimiter(initial_limit=8)
+    slots = [limiter.slot("gemini-2.5-pro") for _ in range(3)]
+    for slot in slots:
+        slot.__enter__()
+    for slot in slots:
+        # Each call fails with a timeout; the exception is not swallowed.
+        assert slot.__exit__(TimeoutError, TimeoutError("Deadline exceeded"), None) is False
+
+    stats = limiter.stats()["gemini-2.5-pro"]
+    assert stats["limit"] == 4.0
+    assert (stats["overloads"], stats["decreases"]) == (3, 1)
+
+
+def test_excess_threads_queue_until_a_slot_frees():
+    limiter = ConcurrencyLimiter(initial_limit=1, queue_timeout=5)
+    release = threading.Event()
+    order = []
+
+    def call(name):
+        with limiter.slot("gemini-2.5-pro"):
+            order.append(name)
+            if name == "first":
+                release.wait(5)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(call, "first")
+        while limiter.stats().get("gemini-2.5-pro", {}).get("in_flight") != 1:
+            pass
+        second = pool.submit(call, "second")
+        while limiter.stats()["gemini-2.5-pro"]["queue"] != 1:
+            pass
+        assert order == ["first"]
+        release.set()
+        first.result()
+        second.result()
+
+    assert order == ["first", "second"]
+
+
+def test_full_queue_and_queue_deadline_shed_with_retry_after():
+    limiter = ConcurrencyLimiter(initial_limit=1, max_queue=0)
+    with limiter.slot("gemini-2.5-pro"):
+        with pytest.raises(UpstreamOverloaded) as shed:
+            _call(limiter)
+    assert shed.value.reason == "queue full"
+    assert shed.value.retry_after >= 1
+
+    limiter = ConcurrencyLimiter(initial_limit=1, queue_timeout=0.01)
+    with limiter.slot("gemini-2.5-pro"):
+        with pytest.raises(UpstreamOverloaded, match="queue timeout"):
+            _call(limiter)
+    stats = limiter.stats()["gemini-2.5-pro"]
+    assert (stats["queue"], stats["shed"], stats["in_flight"]) == (0, 1, 0)
+
+
+async def test_coroutines_never_exceed_the_limit():
+    limiter = ConcurrencyLimiter(initial_limit=2, max_limit=2)
+    active = peak = 0
+
+    async def call():
+        nonlocal active, peak
+        async with limiter.aslot("gemini-2.5-flash"):
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+    await asyncio.gather(*(call() for _ in range(6)))
+
+    assert peak == 2
+    stats = limiter.stats()["gemini-2.5-flash"]
+    assert (stats["calls"], stats["queued"], stats["in_flight"]) == (6, 4, 0)
+
+
+def test_overload_errors_are_recognised_when_wrapped():
+    try:
+        try:
+            raise ResourceExhausted("quota")
+        except ResourceExhausted as e:
+            raise Exception("Error generating response: upstream failed") from e
+    except Exception as wrapped:
+        assert is_overload_error(wrapped)
+    assert is_overload_error(Exception("429 Too Many Requests"))
+    assert not is_overload_error(ValueError("Invalid response type"))
+
+
+@patch("app.api.v1.chat.LangchainAgentService")
+def test_shed_chat_request_returns_503_with_retry_after(
+    mock_langchain_service, client, auth_headers, db_session, test_user
+):
+    from app.models.agent import Agent
+
+    agent = Agent(user_id=test_user.id, name="Busy Agent", system_prompt="Hi", model="gemini-2.5-pro")
+    db_session.add(agent)
+    db_session.commit()
+    mock_instance = Mock()
+    mock_instance.agenerate_response = AsyncMock(
+        side_effect=UpstreamOverloaded("gemini-2.5-pro", 7, "queue full")
+    )
+    mock_langchain_service.return_value = mock_instance
+
+    response = client.post(f"/api/v1/chat/{agent.id}", json={"message": "Hello?"}, headers=auth_headers)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+    assert db_session.query(Conversation).count() == 0
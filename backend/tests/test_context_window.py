@@ -0,0 +1,120 @@
+from unittest.mock import AsyncMock, Mock, patch
+
+from app.core.config import settings
+from app.models.agent import Agent
+from app.models.message import Message, MessageRole
+from app.services.context_window import (
+    build_context_window,
+    context_for_agent,
+    estimate_tokens,
+    token_budget,
+)
+from app.services.fake_llm import FakeGemini, LatencyProfile
+from app.services.langchain_client import LangchainAgentService
+from app.services.llm_registry import llm_registry
+
+
+def _history(*contents):
+    roles = [MessageRole.USER, MessageRole.ASSISTANT]
+    return [Message(role=roles[i % 2], content=content) for i, content in enumerate(contents)]
+
+
+def test_estimate_tokens_counts_words_digits_and_punctuation():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("Hello, world!") == 4
+    assert estimate_tokens("2024") == 4
+    assert estimate_tokens("photosynthesis") == 3
+    long_text = "The mitochondria is the powerhouse of the cell. " * 100
+    assert 0.7 < estimate_tokens(long_text) / (len(long_text) / 4) < 1.3
+
+
+def test_short_turns_beyond_the_old_message_cap_are_kept():
+    history = _history(*[f"turn {i}" for i in range(12)])
+
+    window = build_context_window(history, "And now?", "Be brief.", budget=1000)
+
+    assert window.history_messages == 12
+    assert window.dropped_messages == 0
+    assert window.turns[0] == ("user", "turn 0")
+    assert window.prompt_tokens == estimate_tokens("Be brief.") + sum(
+        estimate_tokens(text) + 4 for text in ["And now?"] + [f"turn {i}" for i in range(12)]
+    )
+
+
+def test_long_old_messages_are_truncated_then_dropped():
+    exam = "**Question 1:** What is a cell? A) a B) b C) c D) d " * 200
+    history = _history("Make an exam", exam, "Thanks", "You're welcome")
+
+    window = build_context_window(history, "Explain question 1", None, budget=500)
+
+    assert [role for role, _ in window.turns] == ["assistant", "user", "assistant"]
+    assert window.turns[0][1].startswith("**Question 1:**")
+    assert len(window.turns[0][1]) < len(exam)
+    assert window.dropped_messages == 1
+    assert window.prompt_tokens <= 500
+
+
+def test_oversized_input_is_cut_to_the_budget():
+    window = build_context_window(_history("hi"), "word " * 5000, "System.", budget=1000)
+
+    assert window.prompt_tokens <= 1000
+    assert window.latest_input.startswith("word word")
+    assert window.turns == []
+
+
+def test_budget_is_looked_up_by_slug_then_model(monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_CONTEXT_TOKEN_BUDGET", 8000)
+    monkeypatch.setattr(settings, "CHAT_CONTEXT_TOKEN_BUDGETS", {"exam-prep": 16000, "gemini-2.5-flash": 4000})
+
+    assert token_budget(Agent(slug="exam-prep", model="gemini-2.5-flash")) == 16000
+    assert token_budget(Agent(slug="other", model="gemini-2.5-flash")) == 4000
+    assert token_budget(Agent(model="gemini-2.5-pro")) == 8000
+
+
+def test_chain_input_uses_the_token_budget(monkeypatch):
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(settings, "CHAT_CONTEXT_TOKEN_BUDGETS", {"gemini-2.5-flash": 60})
+    agent = Agent(name="Tiny", system_prompt="Be brief.", model="gemini-2.5-flash")
+    history = _history("first question " * 20, "first answer", "second question")
+
+    current_input, chain_history = LangchainAgentService()._prepare_chain_input(agent, history, "third")
+
+    assert [msg.content for msg in chain_history] == ["first answer"]
+    assert current_input == "Be brief.\n\nsecond question\n\nthird"
+    assert context_for_agent(agent, history, "third").dropped_messages == 1
+
+
+def test_chat_response_reports_the_prompt_actually_sent(client, auth_headers, db_session, test_user, monkeypatch):
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "")
+    llm_registry.use_backend(fake=FakeGemini(LatencyProfile(ttft_ms=0, tokens_per_second=0, output_tokens=10)))
+    try:
+        agent = Agent(user_id=test_user.id, name="Counter", system_prompt="You are helpful.", model="gemini-2.5-pro")
+        db_session.add(agent)
+        db_session.commit()
+
+        response = client.post(f"/api/v1/chat/{agent.id}", json={"message": "Hello there"}, headers=auth_headers)
+    finally:
+        llm_registry.use_backend()
+
+    assert response.status_code == 200
+    assert response.json()["usage"] == {
+        "prompt_tokens": estimate_tokens("You are helpful.\n\nHello there"),
+        "history_messages": 0,
+        "dropped_messages": 0,
+    }
+
+
+@patch("app.api.v1.chat.LangchainAgentService")
+def test_chat_response_without_a_prompt_reports_no_usage(mock_langchain_service, client, auth_headers, db_session, test_user):
+    agent = Agent(user_id=test_user.id, name="Counter", system_prompt="You are helpful.", model="gemini-2.5-pro")
+    db_session.add(agent)
+    db_session.commit()
+    mock_instance = Mock()
+    # Like a tool intent answered from the cache: no LLM call is made.
+    mock_instance.agenerate_response = AsyncMock(return_value="Hi there.")
+    mock_langchain_service.return_value = mock_instance
+
+    response = client.post(f"/api/v1/chat/{agent.id}", json={"message": "Hello there"}, headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.json()["usage"] is None
@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from app.core.config import settings
+from app.models.agent import Agent
+from app.models.conversation import Conversation
+from app.models.message import Message, MessageRole
+from app.services.chat_turns import start_turn
+from app.services.conversation_summary import ConversationSummarizer, conversation_summarizer
+from app.services.langchain_client import LangchainAgentService
+from tests.conftest import TestingSessionLocal
+
+
+@pytest.fixture
+def conversation(db_session, test_user):
+    agent = Agent(user_id=test_user.id, name="Tutor", system_prompt="You are a tutor.", model="gemini-2.5-flash")
+    db_session.add(agent)
+    db_session.flush()
+    conversation = Conversation(agent_id=agent.id, user_id=test_user.id, title="Cells")
+    db_session.add(conversation)
+    db_session.commit()
+    return conversation
+
+
+def _add_messages(db_session, conversation, count, start=0):
+    base = datetime(2026, 1, 1)
+    messages = [
+        Message(
+            conversation_id=conversation.id,
+            role=MessageRole.USER if i % 2 == 0 else MessageRole.ASSISTANT,
+            content=f"message {i}",
+            created_at=base + timedelta(minutes=i),
+        )
+        for i in range(start, start + count)
+    ]
+    db_session.add_all(messages)
+    db_session.commit()
+    return messages
+
+
+def _summarizer():
+    return ConversationSummarizer(threshold=16, keep_recent=8, session_factory=TestingSessionLocal)
+
+
+def test_refresh_folds_all_but_recent_turns_into_the_summary(db_session, conversation):
+    messages = _add_messages(db_session, conversation, 20)
+    summarizer = _summarizer()
+
+    with patch("app.services.gemini.GeminiClient") as gemini:
+        gemini.return_value.generate_response.return_value = "Learner is studying cell biology."
+        assert summarizer.refresh(conversation.id) is True
+        prompt = gemini.return_value.generate_response.call_args.kwargs["messages"][0]["content"]
+
+    assert "Learner: message 0" in prompt
+    assert "Tutor: message 11" in prompt
+    assert "message 12" not in prompt
+    db_session.refresh(conversation)
+    assert conversation.summary == "Learner is studying cell biology."
+    assert conversation.summarized_through == messages[11].created_at
+    assert conversation.summary_message_count == 12
+
+    # Only 8 unsummarized messages are left: nothing to do until the tail grows again.
+    assert summarizer.refresh(conversation.id) is False
+
+
+def test_no_session_is_held_during_the_summary_call(db_session, conversation):
+    _add_messages(db_session, conversation, 20)
+    sessions = []
+
+    def session_factory():
+        sessions.append(TestingSessionLocal())
+        return sessions[-1]
+
+    def summarize(**kwargs):
+        assert sessions and not any(session.in_transaction() for session in sessions)
+        return "Learner is studying cell biology."
+
+    summarizer = ConversationSummarizer(threshold=16, keep_recent=8, session_factory=session_factory)
+    with patch("app.services.gemini.GeminiClient") as gemini:
+        gemini.return_value.generate_response.side_effect = summarize
+        assert summarizer.refresh(conversation.id) is True
+
+    assert summarizer.stats()["errors"] == 0
+
+
+def test_next_fold_builds_on_the_previous_summary(db_session, conversation):
+    _add_messages(db_session, conversation, 20)
+    summarizer = _summarizer()
+    with patch("app.services.gemini.GeminiClient") as gemini:
+        gemini.return_value.generate_response.side_effect = ["First summary.", "Second summary."]
+        summarizer.refresh(conversation.id)
+        _add_messages(db_session, conversation, 10, start=20)
+        assert summarizer.refresh(conversation.id) is True
+        prompt = gemini.return_value.generate_response.call_args.kwargs["messages"][0]["content"]
+
+    assert prompt.startswith("Summary of the conversation so far:\nFirst summary.")
+    assert "message 11" not in prompt and "Learner: message 12" in prompt
+    db_session.refresh(conversation)
+    assert (conversation.summary, conversation.summary_message_count) == ("Second summary.", 22)
+
+
+def test_failed_summary_is_logged_and_keeps_the_old_state(db_session, conversation):
+    _add_messages(db_session, conversation, 20)
+    summarizer = _summarizer()
+
+    with patch("app.services.gemini.GeminiClient") as gemini:
+        gemini.return_value.generate_response.side_effect = RuntimeError("quota exceeded")
+        assert summarizer.refresh(conversation.id) is False
+
+    db_session.refresh(conversation)
+    assert conversation.summary is None
+    assert summarizer.stats()["errors"] == 1
+
+
+def test_turns_send_the_summary_plus_unsummarized_messages(db_session, conversation, monkeypatch):
+    messages = _add_messages(db_session, conversation, 12)
+    conversation.summary = "Learner is studying cell biology."
+    conversation.summarized_through = messages[5].created_at
+    db_session.commit()
+
+    turn = start_turn(db_session, conversation.agent, conversation.user_id, conversation, "What next?")
+
+    assert [m.content for m in turn.history] == [f"message {i}" for i in range(6, 12)]
+    assert turn.summary == "Learner is studying cell biology."
+
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "test-key")
+    current_input, _history = LangchainAgentService()._prepare_chain_input(
+        turn.agent, turn.history, "What next?", turn.summary
+    )
+    assert current_input.startswith(
+        "You are a tutor.\n\nSummary of the earlier conversation:\nLearner is studying cell biology."
+    )
+
+
+@patch("app.api.v1.chat.LangchainAgentService")
+def test_long_conversation_schedules_a_background_refresh(
+    mock_langchain_service, client, auth_headers, db_session, conversation, monkeypatch
+):
+    _add_messages(db_session, conversation, 16)
+    monkeypatch.setattr(conversation_summarizer, "_session_factory", TestingSessionLocal)
+    mock_instance = Mock()
+    mock_instance.agenerate_response = AsyncMock(return_value="Mitosis comes next.")
+    mock_langchain_service.return_value = mock_instance
+
+    with patch("app.services.gemini.GeminiClient") as gemini:
+        gemini.return_value.generate_response.return_value = "Learner is studying cell biology."
+        response = client.post(
+            f"/api/v1/chat/{conversation.agent_id}",
+            json={"conversation_id": str(conversation.id), "message": "What next?"},
+            headers=auth_headers,
+        )
+
+    assert response.status_code == 200
+    assert conversation_summarizer.stats()["refreshed"] == 1
+    db_session.expire_all()
+    stored = db_session.get(Conversation, conversation.id)
+    assert stored.summary == "Learner is studying cell biology."
+    assert stored.summary_message_count == 10
@@ -0,0 +1,145 @@
+import json
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+from langchain_core.messages import HumanMessage
+
+from app.core.config import settings
+from app.models.agent import Agent
+from app.services.fake_llm import (
+    Cassette,
+    CassetteRecorder,
+    FakeChatModel,
+    FakeGemini,
+    FakeGenerativeModel,
+    LatencyProfile,
+)
+from app.services.llm_registry import llm_registry
+from app.services.resilience import GeminiError, resilience
+
+FLASH = "gemini-2.5-flash"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    async def async_sleep(self, seconds):
+        self.sleep(seconds)
+
+
+def _fake(clock, seed=0, cassette=None, **profile):
+    options = dict(ttft_ms=200, ttft_sigma=0.5, tokens_per_second=50, tokens_per_second_sigma=0.2, output_tokens=40)
+    options.update(profile)
+    return FakeGemini(LatencyProfile(**options), seed, cassette, sleep=clock.sleep, async_sleep=clock.async_sleep)
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "")
+    clock = FakeClock()
+    backend = _fake(clock, output_tokens=20)
+    llm_registry.use_backend(fake=backend)
+    yield backend
+    llm_registry.use_backend()
+
+
+def test_replies_are_deterministic_per_seed_and_request():
+    first, second, other = FakeClock(), FakeClock(), FakeClock()
+    turns = [("user", "Explain photosynthesis")]
+
+    texts = []
+    for clock in (first, second):
+        backend = _fake(clock, seed=1)
+        texts.append(list(backend.stream(backend.reply(FLASH, turns))))
+    assert texts[0] == texts[1]
+    assert first.sleeps == second.sleeps
+    assert first.sleeps[0] > 0 and len(first.sleeps) == len(texts[0])
+
+    backend = _fake(other, seed=2)
+    again = [backend.reply(FLASH, turns).text for _ in range(2)]
+    # The same request seen again gets its next draw, not a copy of the first.
+    assert again[0] != again[1]
+    assert again[0] != "".join(texts[0])
+
+
+def test_error_and_rate_limit_rates():
+    backend = _fake(FakeClock(), error_rate=0.2, rate_limit_rate=0.1)
+
+    outcomes = [backend.reply(FLASH, [("user", f"question {i}")]).error for i in range(2000)]
+
+    rate_limited = sum(isinstance(e, google_exceptions.ResourceExhausted) for e in outcomes)
+    unavailable = sum(isinstance(e, google_exceptions.ServiceUnavailable) for e in outcomes)
+    assert 150 < rate_limited < 250 and 330 < unavailable < 470
+    stats = backend.stats()
+    assert (stats["calls"], stats["rate_limited"], stats["errors"]) == (2000, rate_limited, unavailable)
+
+
+async def test_services_run_against_the_fake_backend(fake_backend):
+    from app.services.gemini import GeminiClient
+    from app.services.langchain_client import LangchainAgentService
+
+    client = GeminiClient()
+    reply = client.generate_response("Be brief.", [{"role": "user", "content": "Hi"}], model=FLASH)
+    chunks = [c async for c in client.astream("Be brief.", [{"role": "user", "content": "Hi"}], model=FLASH)]
+    assert reply and "".join(chunks) and len(chunks) > 1
+
+    agent = Agent(name="Tutor", slug="fake.tutor", model=FLASH, temperature=0.7, system_prompt="Teach.")
+    assert await LangchainAgentService().agenerate_response(agent, [], "What is a cell?")
+
+    # The tutor asks for JSON and gets JSON.
+    model = llm_registry.generative_model(FLASH, {"response_mime_type": "application/json"})
+    assert isinstance(model, FakeGenerativeModel)
+    assert "explanation" in json.loads(model.generate_content("Explain cells").text)
+    assert llm_registry.stats()["backend"] == "fake"
+    assert fake_backend.stats()["calls"] == 4
+
+
+def test_fake_failures_go_through_retries(fake_backend, monkeypatch):
+    from app.services.gemini import GeminiClient
+
+    monkeypatch.setattr(fake_backend.profile, "error_rate", 1.0)
+    monkeypatch.setattr(resilience, "_sleep", lambda _seconds: None)
+
+    with pytest.raises(GeminiError) as excinfo:
+        GeminiClient().generate_response("Be brief.", [{"role": "user", "content": "Hi"}], model=FLASH)
+
+    assert excinfo.value.retryable
+    assert resilience.stats()[FLASH]["retries"] == 2
+
+
+async def test_recorded_responses_are_replayed_with_their_timings(tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    clock = FakeClock()
+    recorder = CassetteRecorder(Cassette(path), clock=clock)
+    # Stands in for the real Gemini models: the recorder only sees their responses.
+    upstream = _fake(clock, seed=7, ttft_sigma=0)
+
+    sdk_model = recorder.generative_model(FakeGenerativeModel(upstream, FLASH), FLASH)
+    recorded_sdk = "".join(chunk.text for chunk in sdk_model.start_chat(history=[]).send_message("Hi", stream=True))
+    chat_model = FakeChatModel(backend=upstream, model=FLASH, callbacks=[recorder.callback(FLASH)])
+    recorded_chat = (await chat_model.ainvoke([HumanMessage(content="Hello")])).content
+
+    entries = [json.loads(line) for line in open(path)]
+    assert [e["text"] for e in entries] == [recorded_sdk, recorded_chat]
+    assert entries[0]["ttft_ms"] == 200.0 and entries[0]["total_ms"] > 200.0
+    assert entries[1]["ttft_ms"] == entries[1]["total_ms"]
+
+    replay_clock = FakeClock()
+    replay = _fake(replay_clock, seed=99, cassette=Cassette(path))
+    chat = FakeGenerativeModel(replay, FLASH).start_chat(history=[])
+    assert "".join(chunk.text for chunk in chat.send_message("Hi", stream=True)) == recorded_sdk
+    assert replay_clock.sleeps[0] == pytest.approx(0.2)
+    assert sum(replay_clock.sleeps) == pytest.approx(entries[0]["total_ms"] / 1000)
+    assert (await FakeChatModel(backend=replay, model=FLASH).ainvoke([HumanMessage(content="Hello")])).content == recorded_chat
+
+    FakeGenerativeModel(replay, FLASH).generate_content("never recorded")
+    assert (replay.stats()["replayed"], replay.stats()["cassette_misses"]) == (2, 1)
@@ -1,19 +1,21 @@
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import AsyncMock, Mock, patch, MagicMock
 from app.services.gemini import GeminiClient
 from app.models.message import MessageRole
 
 
-@patch('app.services.gemini.genai')
+@patch('app.services.llm_registry.genai')
 def test_gemini_client_initialization(mock_genai):
     """Test Gemini client initialization."""
     with patch('app.services.gemini.settings') as mock_settings:
         mock_settings.GEMINI_API_KEY = "test-key"
         GeminiClient()
+        GeminiClient()
+        # The SDK is configured once per process, not once per client.
         mock_genai.configure.assert_called_once_with(api_key="test-key")
 
 
-@patch('app.services.gemini.genai')
+@patch('app.services.llm_registry.genai')
 def test_gemini_client_missing_api_key(mock_genai):
     """Test Gemini client raises error when API key is missing."""
     with patch('app.services.gemini.settings') as mock_settings:
@@ -22,7 +24,7 @@ def test_gemini_client_missing_api_key(mock_genai):
             GeminiClient()
 
 
-@patch('app.services.gemini.genai')
+@patch('app.services.llm_registry.genai')
 def test_generate_response_simple(mock_genai):
     """Test generating a simple response."""
     with patch('app.services.gemini.settings') as mock_settings:
@@ -51,7 +53,7 @@ def test_generate_response_simple(mock_genai):
         mock_chat.send_message.assert_called_once()
 
 
-@patch('app.services.gemini.genai')
+@patch('app.services.llm_registry.genai')
 def test_generate_response_with_history(mock_genai):
     """Test generating response with conversation history."""
     with patch('app.services.gemini.settings') as mock_settings:
@@ -83,3 +85,28 @@ def test_generate_response_with_history(mock_genai):
         assert result == "Response with history"
         mock_chat.send_message.assert_called_once()
 
+
+
+@patch('app.services.llm_registry.genai')
+async def test_agenerate_response_uses_async_sdk_calls(mock_genai):
+    """The async variant awaits the SDK instead of blocking a thread."""
+    with patch('app.services.gemini.settings') as mock_settings:
+        mock_settings.GEMINI_API_KEY = "test-key"
+
+        mock_model = MagicMock()
+        mock_chat = MagicMock()
+        mock_response = MagicMock()
+        mock_response.text = "Async response"
+        mock_chat.send_message_async = AsyncMock(return_value=mock_response)
+        mock_model.start_chat.return_value = mock_chat
+        mock_genai.GenerativeModel.return_value = mock_model
+
+        client = GeminiClient()
+        result = await client.agenerate_response(
+            system_prompt="You are helpful.",
+            messages=[{"role": "user", "content": "Hello"}],
+        )
+
+        assert result == "Async response"
+        mock_chat.send_message_async.assert_awaited_once()
+        mock_chat.send_message.assert_not_called()
@@ -0,0 +1,183 @@
+import json
+from unittest.mock import Mock
+
+import pytest
+
+from app.models.agent import Agent
+from app.services import intent_router
+from app.tools import prebuilt_agents
+from app.tools.prebuilt_agents import PREBUILT_AGENT_SLUGS
+
+
+def _prebuilt(slug_key: str) -> Agent:
+    return Agent(name=slug_key, is_prebuilt=True, slug=PREBUILT_AGENT_SLUGS[slug_key])
+
+
+@pytest.fixture
+def tool(monkeypatch):
+    """Replace a prebuilt tool with a Mock and return it."""
+    def replace(name: str, **kwargs) -> Mock:
+        mock = Mock(**kwargs)
+        monkeypatch.setattr(prebuilt_agents, name, mock)
+        return mock
+    return replace
+
+
+def test_custom_agents_are_never_routed(tool):
+    quiz = tool("_generate_quiz", return_value="quiz")
+    agent = Agent(name="Custom", is_prebuilt=False, slug=None)
+
+    assert intent_router.dispatch(agent, "Generate a quiz about cells") is None
+    quiz.assert_not_called()
+
+
+def test_exam_request_extracts_parameters(tool):
+    exam = tool("_create_practice_exam", return_value="exam")
+
+    result = intent_router.dispatch(
+        _prebuilt("exam_prep_agent"),
+        'create_practice_exam\nexam_type: "SAT"\nsubject: Mathematics\nnum_questions: 12\ntime_limit: 45\ndifficulty: advanced',
+    )
+
+    assert result == "exam"
+    exam.assert_called_once_with(
+        exam_type="SAT",
+        subject="Mathematics",
+        num_questions=12,
+        time_limit=45,
+        difficulty="hard",
+    )
+
+
+def test_failed_exam_falls_through_to_next_intent(tool):
+    tool("_create_practice_exam", side_effect=RuntimeError("boom"))
+    schedule = tool("_create_study_schedule", return_value="schedule")
+
+    result = intent_router.dispatch(
+        _prebuilt("exam_prep_agent"),
+        "Generate a practice exam and a study schedule. exam_date: 2026-12-01",
+    )
+
+    assert result == "schedule"
+    assert schedule.call_args.kwargs["exam_date"] == "2026-12-01"
+
+
+def test_schedule_without_exam_date_goes_to_llm(tool):
+    schedule = tool("_create_study_schedule", return_value="schedule")
+
+    assert intent_router.dispatch(_prebuilt("exam_prep_agent"), "Make me a study schedule") is None
+    schedule.assert_not_called()
+
+
+def test_quiz_takes_precedence_for_course_creation(tool):
+    quiz = tool("_generate_quiz", return_value="quiz")
+    assessment = tool("_create_learning_assessment", return_value="assessment")
+
+    result = intent_router.dispatch(
+        _prebuilt("course_creation_agent"),
+        "Generate a quiz assessment about Photosynthesis with 7 questions, beginner",
+    )
+
+    assert result == "quiz"
+    quiz.assert_called_once_with(topic="Photosynthesis", difficulty="easy", num_questions=7)
+    assessment.assert_not_called()
+
+
+def test_course_tool_errors_propagate(tool):
+    tool("_create_concept_map", side_effect=ValueError("bad map"))
+
+    with pytest.raises(ValueError, match="bad map"):
+        intent_router.dispatch(_prebuilt("course_creation_agent"), "Build a concept map for Biology")
+
+
+def test_structured_action_merges_top_level_fields(tool):
+    coach = tool("_generate_career_coach_response", return_value='{"status":"ok"}')
+
+    result = intent_router.dispatch(
+        _prebuilt("career_coach_agent"),
+        'CAREER_COACH_REQUEST {"action": "Weekly_Checkin", "payload": {"wins": ["shipped"]}, "week": 3}',
+    )
+
+    assert result == '{"status":"ok"}'
+    coach.assert_called_once_with(action="weekly_checkin", payload={"wins": ["shipped"], "week": 3})
+
+
+def test_structured_marker_without_valid_action_fails_fast(tool):
+    coach = tool("_generate_fitness_coach_response", return_value="unused")
+
+    result = json.loads(
+        intent_router.dispatch(_prebuilt("fitness_coach_agent"), 'FITNESS_COACH_REQUEST {"action": "dance"}')
+    )
+
+    assert result["error"] == "invalid_payload"
+    coach.assert_not_called()
+    assert intent_router.dispatch(_prebuilt("fitness_coach_agent"), "How do I warm up?") is None
+
+
+def test_structured_tool_error_is_returned_as_payload(tool):
+    tool("_generate_skill_gap_agent_response", side_effect=RuntimeError('quota "exceeded"'))
+
+    result = json.loads(
+        intent_router.dispatch(_prebuilt("skill_gap_agent"), '{"action": "profile_baseline", "payload": {}}')
+    )
+
+    assert result == {
+        "action": "profile_baseline",
+        "status": "error",
+        "error": "internal_error",
+        "message": 'quota "exceeded"',
+    }
+
+
+async def test_stream_falls_back_to_dispatch_for_non_streaming_tools(tool):
+    schedule = tool("_create_study_schedule", return_value="schedule")
+
+    stream = await intent_router.astream(
+        _prebuilt("exam_prep_agent"), "Make me a study schedule, exam_date: 2026-12-01"
+    )
+
+    assert [chunk async for chunk in stream] == ["schedule"]
+    schedule.assert_called_once()
+    assert await intent_router.astream(_prebuilt("exam_prep_agent"), "How are you?") is None
+    assert await intent_router.astream(Agent(name="Custom", is_prebuilt=False), "Generate a quiz") is None
+
+
+@pytest.mark.parametrize(
+    "slug, message, batch_tool, stream_tool",
+    [
+        ("exam_prep_agent", "Create a practice exam for SAT with 50 questions", "_create_practice_exam", "_astream_practice_exam"),
+        ("micro_learning_agent", "Teach me a micro lesson about atoms", "_generate_micro_lesson", "_astream_micro_lesson"),
+    ],
+)
+async def test_streaming_tool_failing_before_its_first_chunk_matches_dispatch(
+    tool, slug, message, batch_tool, stream_tool, monkeypatch
+):
+    async def failing(**_params):
+        raise RuntimeError("quota exceeded")
+        yield  # pragma: no cover
+
+    tool(batch_tool, side_effect=RuntimeError("quota exceeded"))
+    monkeypatch.setattr(prebuilt_agents, stream_tool, failing)
+    agent = _prebuilt(slug)
+
+    expected = intent_router.dispatch(agent, message)
+    stream = await intent_router.astream(agent, message)
+
+    assert (None if stream is None else "".join([chunk async for chunk in stream])) == expected
+
+
+async def test_streaming_tool_error_response_is_sent_as_one_chunk(monkeypatch):
+    async def failing(**_params):
+        raise RuntimeError("quota exceeded")
+        yield  # pragma: no cover
+
+    monkeypatch.setattr(prebuilt_agents, "_astream_quiz", failing)
+    quiz = intent_router.Intent(
+        "quiz", lambda _text: True, lambda _text: {}, intent_router.ToolCall("_generate_quiz"),
+        lambda _params, error: f"Quiz unavailable: {error}",
+    )
+    monkeypatch.setitem(intent_router.INTENTS_BY_SLUG, PREBUILT_AGENT_SLUGS["personal_tutor"], (quiz,))
+
+    stream = await intent_router.astream(_prebuilt("personal_tutor"), "Quiz me")
+
+    assert [chunk async for chunk in stream] == ["Quiz unavailable: quota exceeded"]
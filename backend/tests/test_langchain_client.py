@@ -0,0 +1,44 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app.core.config import settings
+from app.models.agent import Agent
+from app.services.langchain_client import LangchainAgentService
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "test-key")
+    return LangchainAgentService()
+
+
+@pytest.fixture
+def agent():
+    return Agent(name="Plain Agent", system_prompt="Be brief.", model="gemini-2.5-flash", temperature=0.2)
+
+
+async def test_agenerate_response_awaits_chain(service, agent, monkeypatch):
+    chain = MagicMock()
+    chain.ainvoke = AsyncMock(return_value=MagicMock(content="Async hello"))
+    monkeypatch.setattr(service, "_build_chain", lambda _agent: chain)
+
+    result = await service.agenerate_response(agent=agent, history=[], latest_input="Hi there")
+
+    assert result == "Async hello"
+    chain.ainvoke.assert_awaited_once()
+    chain.invoke.assert_not_called()
+    payload = chain.ainvoke.await_args.args[0]
+    assert payload["input"] == "Be brief.\n\nHi there"
+    assert payload["chat_history"] == []
+
+
+async def test_agenerate_response_returns_tool_output_without_chain(service, agent, monkeypatch):
+    monkeypatch.setattr(service, "_intercept_tools", lambda _agent, _input: "Tool output")
+    build_chain = MagicMock()
+    monkeypatch.setattr(service, "_build_chain", build_chain)
+
+    result = await service.agenerate_response(agent=agent, history=[], latest_input="Generate a quiz")
+
+    assert result == "Tool output"
+    build_chain.assert_not_called()
@@ -0,0 +1,74 @@
+from unittest.mock import patch
+
+import pytest
+
+from app.core.config import settings
+from app.models.agent import Agent
+from app.services.langchain_client import LangchainAgentService
+from app.services.llm_registry import LLMClientRegistry
+
+
+@pytest.fixture
+def gemini_key(monkeypatch):
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "test-key")
+
+
+@patch("app.services.llm_registry.genai")
+def test_chains_are_reused_per_model_and_temperature(mock_genai, gemini_key):
+    registry = LLMClientRegistry()
+
+    first = registry.chain("gemini-2.5-flash", 0.2)
+    assert registry.chain("gemini-2.5-flash", 0.2) is first
+    other = registry.chain("gemini-2.5-pro", 0.7)
+    assert other is not first
+
+    stats = registry.stats()
+    assert stats["chains"] == 2
+    assert stats["chat_models"] == 2
+    assert stats["shared_transport"] is True
+    mock_genai.configure.assert_called_once_with(api_key="test-key")
+
+
+@patch("app.services.llm_registry.genai")
+def test_chat_models_share_one_transport(mock_genai, gemini_key):
+    registry = LLMClientRegistry()
+
+    flash = registry.chat_model("gemini-2.5-flash", 0.2)
+    pro = registry.chat_model("gemini-2.5-pro", 0.7)
+
+    assert flash is not pro
+    assert pro.client is flash.client
+
+
+@patch("app.services.llm_registry.genai")
+def test_generative_models_keyed_by_generation_config(mock_genai, gemini_key):
+    registry = LLMClientRegistry(max_entries=2)
+
+    json_config = {"temperature": 0.4, "response_mime_type": "application/json"}
+    first = registry.generative_model("gemini-2.5-flash", json_config)
+    assert registry.generative_model("gemini-2.5-flash", dict(reversed(list(json_config.items())))) is first
+    registry.generative_model("gemini-2.5-flash", {"temperature": 0.9})
+    registry.generative_model("gemini-2.5-pro", {"temperature": 0.9})
+
+    stats = registry.stats()
+    assert mock_genai.GenerativeModel.call_count == 3
+    assert stats["generative_models"] == 2
+    assert stats["evictions"] == 1
+
+
+@patch("app.services.llm_registry.genai")
+def test_agent_service_uses_registry(mock_genai, gemini_key):
+    from app.services.llm_registry import llm_registry
+
+    agent = Agent(name="Registry Agent", model="gemini-2.5-flash", temperature=0.3)
+    first = LangchainAgentService()._build_chain(agent)
+    second = LangchainAgentService()._build_chain(agent)
+
+    assert first is second
+    assert llm_registry.stats()["hits"] >= 1
+
+
+def test_llm_health_reports_registry_stats(client):
+    response = client.get("/health/llm")
+    assert response.status_code == 200
+    assert response.json()["clients"]["chains"] == 0
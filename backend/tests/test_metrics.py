@@ -0,0 +1,75 @@
+import pytest
+from prometheus_client import REGISTRY
+
+from app.core.config import settings
+from app.core.metrics import sample_runtime, track_stream
+from app.models.agent import Agent
+from app.services.fake_llm import FakeGemini, LatencyProfile
+from app.services.llm_registry import llm_registry
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "")
+    llm_registry.use_backend(fake=FakeGemini(LatencyProfile(ttft_ms=0, tokens_per_second=0, output_tokens=30)))
+    yield
+    llm_registry.use_backend()
+
+
+@pytest.fixture
+def agent(db_session, test_user):
+    agent = Agent(user_id=test_user.id, name="Helper", system_prompt="Be helpful.", model="gemini-2.5-flash")
+    db_session.add(agent)
+    db_session.commit()
+    return agent
+
+
+def _value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_request_latency_is_labelled_by_route_template(client, auth_headers, agent, fake_backend):
+    labels = {"method": "POST", "route": "/api/v1/chat/{agent_id}", "status": "200"}
+    before = _value("http_request_duration_seconds_count", **labels)
+
+    response = client.post(f"/api/v1/chat/{agent.id}", json={"message": "Hello"}, headers=auth_headers)
+    assert response.status_code == 200
+
+    assert _value("http_request_duration_seconds_count", **labels) == before + 1
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain")
+    assert 'route="/api/v1/chat/{agent_id}"' in metrics.text
+    assert str(agent.id) not in metrics.text
+
+
+def test_llm_latency_ttft_and_tokens_by_model_and_agent(client, auth_headers, agent, fake_backend):
+    call = {"model": "gemini-2.5-flash", "agent": "none"}
+    calls_before = _value("llm_request_duration_seconds_count", outcome="ok", **call)
+    ttft_before = _value("llm_time_to_first_token_seconds_count", **call)
+    completion_before = _value("llm_tokens_total", kind="completion", **call)
+
+    response = client.post(f"/api/v1/chat/{agent.id}/stream", json={"message": "Hello"}, headers=auth_headers)
+    assert "[DONE]" in response.text
+
+    assert _value("llm_request_duration_seconds_count", outcome="ok", **call) == calls_before + 1
+    assert _value("llm_time_to_first_token_seconds_count", **call) == ttft_before + 1
+    assert _value("llm_tokens_total", kind="prompt", **call) > 0
+    assert _value("llm_tokens_total", kind="completion", **call) > completion_before
+
+
+async def test_streams_in_flight_and_runtime_gauges(db_session):
+    async def chunks():
+        yield "data: a\n\n"
+        yield "data: b\n\n"
+
+    before = _value("sse_streams_in_flight")
+    stream = track_stream(chunks())
+    await stream.__anext__()
+    assert _value("sse_streams_in_flight") == before + 1
+    async for _ in stream:
+        pass
+    assert _value("sse_streams_in_flight") == before
+
+    sample_runtime(db_session.get_bind().pool)
+    assert _value("threadpool_max_threads") > 0
@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+from app.services.model_router import ModelRouter, RoutePlan
+
+PRO, FLASH = "gemini-2.5-pro", "gemini-2.5-flash"
+
+
+def _router(budget: float = 0.05) -> ModelRouter:
+    return ModelRouter(fallback_models={PRO: FLASH}, budgets={}, default_budget_seconds=budget)
+
+
+class FakeModels:
+    """Async chunk streams with a per-model first-token delay."""
+
+    def __init__(self, delays, fail=()):
+        self.delays = delays
+        self.fail = set(fail)
+        self.started = []
+        self.cancelled = []
+
+    async def stream(self, model):
+        self.started.append(model)
+        try:
+            await asyncio.sleep(self.delays[model])
+            if model in self.fail:
+                raise RuntimeError(f"{model} unavailable")
+            yield f"{model}:"
+            await asyncio.sleep(0.01)
+            yield "done"
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+
+
+def test_plan_prefers_agent_then_model_budget():
+    router = ModelRouter(
+        fallback_models={PRO: FLASH},
+        budgets={"education.exam_prep_agent": 3.0, PRO: 8.0},
+        default_budget_seconds=0.0,
+    )
+
+    assert router.plan(PRO, "education.exam_prep_agent") == RoutePlan(PRO, FLASH, 3.0)
+    assert router.plan(PRO, "education.personal_tutor") == RoutePlan(PRO, FLASH, 8.0)
+    assert not router.plan(FLASH).hedges
+    assert not _router(budget=0).plan(PRO).hedges
+
+
+async def test_primary_within_budget_is_not_hedged():
+    router = _router(budget=0.2)
+    models = FakeModels({PRO: 0.01, FLASH: 0.01})
+
+    assert await router.arun(router.plan(PRO), models.stream) == f"{PRO}:done"
+    assert models.started == [PRO]
+    assert router.stats()[PRO]["within_budget"] == 1
+
+
+async def test_slow_primary_is_hedged_and_loser_cancelled():
+    router = _router(budget=0.02)
+    models = FakeModels({PRO: 0.5, FLASH: 0.01})
+
+    started = time.monotonic()
+    result = await router.arun(router.plan(PRO), models.stream)
+    await asyncio.sleep(0)
+
+    assert result == f"{FLASH}:done"
+    assert time.monotonic() - started < 0.3
+    assert models.cancelled == [PRO]
+    stats = router.stats()[PRO]
+    assert (stats["hedged"], stats["fallback_wins"], stats["primary_wins"]) == (1, 1, 0)
+
+
+async def test_hedged_primary_can_still_win():
+    router = _router(budget=0.02)
+    models = FakeModels({PRO: 0.03, FLASH: 0.3})
+
+    assert await router.arun(router.plan(PRO), models.stream) == f"{PRO}:done"
+    await asyncio.sleep(0)
+    assert models.cancelled == [FLASH]
+    assert router.stats()[PRO]["primary_wins"] == 1
+
+
+async def test_failed_fallback_waits_for_primary():
+    router = _router(budget=0.01)
+    models = FakeModels({PRO: 0.05, FLASH: 0.0}, fail={FLASH})
+
+    assert await router.arun(router.plan(PRO), models.stream) == f"{PRO}:done"
+    assert router.stats()[PRO]["fallback_errors"] == 1
+
+
+async def test_stream_switches_to_first_model_with_a_token():
+    router = _router(budget=0.02)
+    models = FakeModels({PRO: 0.5, FLASH: 0.01})
+
+    chunks = [chunk async for chunk in router.astream(router.plan(PRO), models.stream)]
+
+    assert chunks == [f"{FLASH}:", "done"]
+    assert models.cancelled == [PRO]
+
+
+def test_threaded_run_hedges_slow_primary():
+    router = _router(budget=0.02)
+
+    def stream(model):
+        time.sleep(0.3 if model == PRO else 0.01)
+        yield f"{model}:"
+        yield "done"
+
+    started = time.monotonic()
+    assert router.run(router.plan(PRO), stream) == f"{FLASH}:done"
+    assert time.monotonic() - started < 0.25
+    assert router.stats()[PRO]["fallback_wins"] == 1
+
+
+def test_unhedged_plan_uses_direct_call():
+    router = _router(budget=0)
+
+    assert router.run(router.plan(PRO), stream=lambda _m: iter(()), direct=lambda: "direct") == "direct"
+    assert router.stats()[PRO]["unhedged"] == 1
+
+
+async def test_gemini_client_routes_through_fallback(monkeypatch):
+    from app.core.config import settings
+    from app.services import gemini
+    from app.services.gemini import GeminiClient
+
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(gemini, "model_router", _router(budget=0.02))
+    models = FakeModels({PRO: 0.5, FLASH: 0.01})
+    client = GeminiClient()
+    monkeypatch.setattr(client, "_astream_chunks", lambda _s, _m, model, _t, _cached=False: models.stream(model))
+
+    result = await client.agenerate_response("Be brief.", [{"role": "user", "content": "Hi"}], model=PRO)
+
+    assert result == f"{FLASH}:done"
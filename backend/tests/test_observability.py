@@ -0,0 +1,89 @@
+import logging
+
+import pytest
+
+from app.core.config import settings
+from app.core.observability import StageTimer, _current_timer, count, stage, timed_stream
+from app.models.agent import Agent
+from app.services.fake_llm import FakeGemini, LatencyProfile
+from app.services.llm_registry import llm_registry
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "")
+    llm_registry.use_backend(fake=FakeGemini(LatencyProfile(ttft_ms=0, tokens_per_second=0, output_tokens=30)))
+    yield
+    llm_registry.use_backend()
+
+
+@pytest.fixture
+def agent(db_session, test_user):
+    agent = Agent(user_id=test_user.id, name="Helper", system_prompt="Be helpful.", model="gemini-2.5-flash")
+    db_session.add(agent)
+    db_session.commit()
+    return agent
+
+
+def _server_timing(header):
+    return {entry.split(";")[0]: float(entry.split("dur=")[1]) for entry in header.split(", ")}
+
+
+async def test_stages_accumulate_and_are_no_ops_outside_a_request():
+    with stage("llm"):
+        count(prompt_tokens=5)
+
+    timer = StageTimer()
+    token = _current_timer.set(timer)
+    try:
+        with stage("commit"):
+            pass
+        with stage("commit"):
+            pass
+        count(prompt_tokens=10)
+        count(prompt_tokens=5)
+
+        async def chunks():
+            yield "a"
+            yield "b"
+
+        assert [c async for c in timed_stream("llm", chunks())] == ["a", "b"]
+    finally:
+        _current_timer.reset(token)
+
+    assert set(timer.stages) == {"commit", "llm_ttft", "llm"}
+    assert timer.counts == {"prompt_tokens": 15}
+    assert "total;dur=12.50" in timer.server_timing(12.5)
+
+
+def test_chat_reports_stage_breakdown(client, auth_headers, agent, fake_backend, caplog):
+    with caplog.at_level(logging.INFO, logger="app.observability"):
+        response = client.post(f"/api/v1/chat/{agent.id}", json={"message": "Hello"}, headers=auth_headers)
+
+    assert response.status_code == 200
+    timing = _server_timing(response.headers["Server-Timing"])
+    assert {"auth", "agent", "history", "commit", "prompt", "llm", "total"} <= set(timing)
+    assert timing["llm"] <= timing["total"]
+
+    record = next(r for r in caplog.records if r.getMessage().startswith("request_timing"))
+    assert "llm_ms=" in record.getMessage() and "completion_chars=" in record.getMessage()
+    assert record.llm_calls == 1 and record.prompt_tokens > 0
+    assert record.completion_chars == len(response.json()["message"])
+
+
+def test_streamed_stages_are_logged_when_the_stream_ends(client, auth_headers, agent, fake_backend, caplog):
+    with caplog.at_level(logging.INFO, logger="app.observability"):
+        response = client.post(f"/api/v1/chat/{agent.id}/stream", json={"message": "Hello"}, headers=auth_headers)
+
+    assert response.status_code == 200 and "[DONE]" in response.text
+    # Headers leave before the body: only the stages before the stream are in them.
+    assert "llm;" not in response.headers["Server-Timing"]
+    assert "auth;" in response.headers["Server-Timing"]
+    record = next(r for r in caplog.records if r.getMessage().startswith("request_timing"))
+    assert {"llm_ttft", "llm", "commit"} <= set(record.stages_ms)
+    assert record.completion_chars > 0
+    assert record.bytes_sent == len(response.content)
+    headers_ms = float(record.getMessage().split("headers_ms=")[1].split()[0])
+    duration_ms = float(record.getMessage().split("duration_ms=")[1].split()[0])
+    # Timed to the last byte of the stream, not to the headers.
+    assert headers_ms <= duration_ms and record.stages_ms["llm"] <= duration_ms
@@ -0,0 +1,186 @@
+import asyncio
+import re
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from app.core.config import settings
+from app.services.llm_metrics import llm_call, track_prompt_usage
+from app.tools import prebuilt_agents
+
+
+def _questions(prefix: str, count: int) -> str:
+    return "".join(
+        f"**Question {i}:** {prefix} question number {i} about cell biology?\n"
+        f"A) one\nB) two\nC) three\nD) four\n**Answer:** B\n\n"
+        for i in range(1, count + 1)
+    )
+
+
+class FakeGemini:
+    """Answers section prompts with distinct questions; tracks concurrency."""
+
+    def __init__(self, duplicate_in_section: int = 0):
+        self.duplicate_in_section = duplicate_in_section
+        self.prompts = []
+        self.active = 0
+        self.peak = 0
+        self.streamed_sections = 0
+        self.lock = threading.Lock()
+
+    def _enter(self, prompt):
+        with self.lock:
+            self.prompts.append(prompt)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def _leave(self):
+        with self.lock:
+            self.active -= 1
+
+    def generate_response(self, system_prompt, messages, model, temperature):
+        self._enter(messages[0]["content"])
+        time.sleep(0.02)
+        self._leave()
+        return self._reply(messages[0]["content"])
+
+    async def agenerate_response(self, system_prompt, messages, model, temperature):
+        self._enter(messages[0]["content"])
+        await asyncio.sleep(0.02)
+        self._leave()
+        return self._reply(messages[0]["content"])
+
+    async def astream(self, system_prompt, messages, model, temperature):
+        self._enter(messages[0]["content"])
+        try:
+            reply = self._reply(messages[0]["content"])
+            for piece in re.split(r"(?=\*\*Question)", reply):
+                await asyncio.sleep(0.005)
+                yield piece
+            self.streamed_sections += 1
+        finally:
+            self._leave()
+
+    def _reply(self, prompt):
+        count = int(re.search(r"Generate ALL (\d+) questions", prompt).group(1))
+        section = re.search(r"SECTION (\d+) OF", prompt)
+        if section is None:
+            return _questions("Extra", count)
+        index = int(section.group(1))
+        if index == self.duplicate_in_section:
+            # Repeats section 1's first question (modulo case) in place of one of its own.
+            return "Here you go!\n\n" + _questions("section 1", 1) + _questions(f"Section {index}", count - 1)
+        return f"Here you go!\n\n{_questions(f'Section {index}', count)}Good luck!\nSee you soon\nBye\nMore"
+
+
+def test_section_sizes_are_balanced_and_at_least_ten():
+    assert prebuilt_agents._exam_section_sizes(50, 20) == [17, 17, 16]
+    assert prebuilt_agents._exam_section_sizes(100, 20) == [20] * 5
+    assert prebuilt_agents._exam_section_sizes(21, 20) == [11, 10]
+    assert prebuilt_agents._exam_section_sizes(15, 20) == [15]
+    assert prebuilt_agents._exam_section_sizes(30, 5) == [10, 10, 10]
+
+
+def test_large_exam_is_generated_in_parallel_sections(monkeypatch):
+    monkeypatch.setattr(settings, "EXAM_SECTION_SIZE", 20)
+    monkeypatch.setattr(settings, "EXAM_SECTION_CONCURRENCY", 2)
+    fake = FakeGemini()
+
+    with patch("app.services.gemini.GeminiClient", return_value=fake):
+        exam = prebuilt_agents._create_practice_exam("SAT", "Biology", num_questions=50)
+
+    numbers = [int(n) for n in re.findall(r"\*\*Question (\d+):\*\*", exam)]
+    assert numbers == list(range(1, 51))
+    assert len(fake.prompts) == 3
+    assert fake.peak == 2
+    assert exam.startswith("**Question 1:** Section 1 question number 1")
+    assert exam.endswith("**Answer:** B")
+    assert "Here you go" not in exam
+    assert "Good luck" not in exam
+
+
+def test_section_calls_are_counted_in_the_callers_prompt_usage(monkeypatch):
+    monkeypatch.setattr(settings, "EXAM_SECTION_SIZE", 20)
+
+    class Instrumented(FakeGemini):
+        def generate_response(self, system_prompt, messages, model, temperature):
+            with llm_call(model, None, 10) as call:
+                return call.finished(super().generate_response(system_prompt, messages, model, temperature))
+
+    with patch("app.services.gemini.GeminiClient", return_value=Instrumented()):
+        with track_prompt_usage() as usage:
+            prebuilt_agents._create_practice_exam("SAT", "Biology", num_questions=50)
+
+    assert (usage.llm_calls, usage.prompt_tokens) == (3, 30)
+
+
+def test_duplicates_across_sections_are_dropped_and_topped_up(monkeypatch):
+    monkeypatch.setattr(settings, "EXAM_SECTION_SIZE", 10)
+    fake = FakeGemini(duplicate_in_section=2)
+
+    with patch("app.services.gemini.GeminiClient", return_value=fake):
+        exam = prebuilt_agents._create_practice_exam("SAT", "Biology", num_questions=20)
+
+    stems = re.findall(r"\*\*Question \d+:\*\* (.*)\n", exam)
+    assert len(stems) == 20
+    assert len({stem.lower() for stem in stems}) == 20
+    assert any(prompt.startswith("Create") and "ADDITIONAL QUESTIONS" in prompt for prompt in fake.prompts)
+
+
+def test_failed_sections_are_replaced_and_total_failure_reports_error(monkeypatch):
+    monkeypatch.setattr(settings, "EXAM_SECTION_SIZE", 10)
+
+    class Flaky(FakeGemini):
+        def generate_response(self, system_prompt, messages, model, temperature):
+            if "SECTION 2 OF" in messages[0]["content"]:
+                raise RuntimeError("deadline exceeded")
+            return super().generate_response(system_prompt, messages, model, temperature)
+
+    with patch("app.services.gemini.GeminiClient", return_value=Flaky()):
+        exam = prebuilt_agents._create_practice_exam("SAT", "Biology", num_questions=20)
+    assert len(re.findall(r"\*\*Question \d+:\*\*", exam)) == 20
+
+    class Down(FakeGemini):
+        def generate_response(self, *args, **kwargs):
+            raise RuntimeError("service unavailable")
+
+    with patch("app.services.gemini.GeminiClient", return_value=Down()):
+        exam = prebuilt_agents._create_practice_exam("SAT", "Biology", num_questions=20)
+    assert exam == "Error creating practice exam: service unavailable. Please try again."
+
+
+async def test_streamed_large_exam_streams_section_one_then_sends_the_rest(monkeypatch):
+    monkeypatch.setattr(settings, "EXAM_SECTION_SIZE", 20)
+    monkeypatch.setattr(settings, "EXAM_SECTION_CONCURRENCY", 2)
+    fake = FakeGemini()
+
+    with patch("app.services.gemini.GeminiClient", return_value=fake):
+        stream = prebuilt_agents._astream_practice_exam("SAT", "Biology", num_questions=50)
+        first = await stream.__anext__()
+        assert first.startswith("**Question 1:** Section 1 question number 1")
+        assert fake.streamed_sections == 0
+        chunks = [first] + [chunk async for chunk in stream]
+
+    assert len(chunks) > 3
+    exam = "".join(chunks)
+    numbers = [int(n) for n in re.findall(r"\*\*Question (\d+):\*\*", exam)]
+    assert numbers == list(range(1, 51))
+    sections = [int(n) for n in re.findall(r"Section (\d+) question", exam)]
+    assert sections == sorted(sections) and sections[0] == 1 and sections[-1] == 3
+    assert fake.peak == 2
+    assert "Here you go" not in exam and "Good luck" not in exam
+    assert exam.endswith("**Answer:** B")
+
+
+@pytest.mark.parametrize("section_size, questions", [(0, 50), (20, 15)])
+def test_small_exams_and_disabled_sectioning_use_one_call(monkeypatch, section_size, questions):
+    monkeypatch.setattr(settings, "EXAM_SECTION_SIZE", section_size)
+    fake = FakeGemini()
+
+    with patch("app.services.gemini.GeminiClient", return_value=fake):
+        prebuilt_agents._create_practice_exam("SAT", "Biology", num_questions=questions)
+
+    assert len(fake.prompts) == 1
+    assert "SECTION" not in fake.prompts[0]
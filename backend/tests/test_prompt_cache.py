@@ -0,0 +1,146 @@
+from unittest.mock import MagicMock, patch
+
+from app.core.config import settings
+from app.models.agent import Agent
+from app.services.context_window import estimate_tokens
+from app.services.langchain_client import LangchainAgentService
+from app.services.prompt_cache import LocalPrefixBackend, PromptPrefixCache
+
+LONG_PROMPT = "You are a patient biology tutor who explains every step. " * 40
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _cache(clock, backend=None, **kwargs):
+    return PromptPrefixCache(
+        backend or LocalPrefixBackend(clock),
+        ttl_seconds=600,
+        refresh_margin_seconds=60,
+        min_tokens=100,
+        retry_after_seconds=120,
+        clock=clock,
+        **kwargs,
+    )
+
+
+def test_only_registered_long_prompts_are_cached():
+    clock = FakeClock()
+    backend = LocalPrefixBackend(clock)
+    cache = _cache(clock, backend)
+
+    assert cache.prefix("gemini-2.5-pro", LONG_PROMPT) is None
+    assert backend.created == 0
+    assert cache.register([("gemini-2.5-pro", LONG_PROMPT), ("gemini-2.5-flash", "Be brief.")]) == 1
+
+    first = cache.prefix("gemini-2.5-pro", LONG_PROMPT)
+    assert first.tokens == estimate_tokens(LONG_PROMPT)
+    assert cache.prefix("gemini-2.5-pro", LONG_PROMPT) is first
+    assert cache.prefix("gemini-2.5-flash", "Be brief.") is None
+    assert cache.prefix("gemini-2.5-flash", LONG_PROMPT) is None
+    stats = cache.stats()
+    assert (stats["created"], stats["prefixes"], stats["too_short"]) == (1, 1, 1)
+    assert _cache(clock, enabled=False).register([("gemini-2.5-pro", LONG_PROMPT)]) == 0
+
+
+def test_lookups_never_call_the_provider():
+    clock = FakeClock()
+    backend = MagicMock(wraps=LocalPrefixBackend(clock))
+    cache = _cache(clock, backend)
+    cache.register([("gemini-2.5-pro", LONG_PROMPT)])
+    backend.reset_mock()
+
+    clock.now += 550
+    assert cache.prefix("gemini-2.5-pro", LONG_PROMPT) is not None
+    clock.now += 100
+    assert cache.prefix("gemini-2.5-pro", LONG_PROMPT) is None
+    backend.create.assert_not_called()
+    backend.extend.assert_not_called()
+
+
+def test_refresh_extends_near_expiry_and_recreates_lost_prefixes():
+    clock = FakeClock()
+    backend = LocalPrefixBackend(clock)
+    cache = _cache(clock, backend)
+    cache.register([("gemini-2.5-pro", LONG_PROMPT)])
+    first = cache.prefix("gemini-2.5-pro", LONG_PROMPT)
+
+    clock.now += 550
+    assert cache.refresh_due() == 1
+    extended = cache.prefix("gemini-2.5-pro", LONG_PROMPT)
+    assert extended.name == first.name
+    assert extended.expires_at == clock.now + 600
+
+    backend.prompts.clear()
+    clock.now += 550
+    assert cache.refresh_due() == 1
+    assert cache.prefix("gemini-2.5-pro", LONG_PROMPT).name != first.name
+    stats = cache.stats()
+    assert (stats["created"], stats["refreshed"], stats["errors"]) == (2, 1, 0)
+
+
+def test_failed_registration_is_retried_by_the_refresh_after_backing_off():
+    clock = FakeClock()
+    backend = MagicMock()
+    backend.create.side_effect = RuntimeError("cached content too small")
+    cache = _cache(clock, backend)
+
+    assert cache.register([("gemini-2.5-pro", LONG_PROMPT)]) == 0
+    assert cache.prefix("gemini-2.5-pro", LONG_PROMPT) is None
+    assert cache.refresh_due() == 0
+    assert backend.create.call_count == 1
+
+    clock.now += 121
+    backend.create.side_effect = None
+    backend.create.return_value = LocalPrefixBackend(clock).create("gemini-2.5-pro", LONG_PROMPT, 600)
+    assert cache.refresh_due() == 1
+    assert cache.prefix("gemini-2.5-pro", LONG_PROMPT) is not None
+    assert cache.stats()["errors"] == 1
+
+
+def test_periodic_refresh_skips_idle_prefixes():
+    clock = FakeClock()
+    cache = _cache(clock)
+    cache.register([("gemini-2.5-pro", LONG_PROMPT), ("gemini-2.5-flash", LONG_PROMPT)])
+
+    clock.now += 530
+    cache.prefix("gemini-2.5-pro", LONG_PROMPT)
+    clock.now += 15
+    assert cache.refresh_due() == 2
+
+    # The flash prefix has not been used for a whole TTL: it is left to lapse.
+    clock.now += 555
+    assert cache.refresh_due() == 1
+    clock.now += 50
+    assert cache.stats()["prefixes"] == 1
+
+
+@patch("app.services.prompt_cache.genai")
+@patch("app.services.llm_registry.genai")
+def test_cached_agent_sends_only_the_handle_and_dynamic_content(
+    mock_registry_genai, mock_cache_genai, monkeypatch
+):
+    from app.services import gemini, langchain_client
+
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "test-key")
+    cache = PromptPrefixCache(LocalPrefixBackend(), min_tokens=100)
+    cache.register([("gemini-2.5-flash", LONG_PROMPT)])
+    monkeypatch.setattr(gemini, "prompt_cache", cache)
+    monkeypatch.setattr(langchain_client, "prompt_cache", cache)
+    model = mock_cache_genai.GenerativeModel.return_value
+    chat = model.start_chat.return_value
+    chat.send_message.return_value.text = "Cells divide by mitosis."
+    agent = Agent(name="Tutor", slug="tutor", system_prompt=LONG_PROMPT, model="gemini-2.5-flash")
+
+    result = LangchainAgentService().generate_response(agent, [], "How do cells divide?")
+
+    assert result == "Cells divide by mitosis."
+    assert mock_cache_genai.GenerativeModel.call_args.kwargs["system_instruction"] == LONG_PROMPT
+    assert chat.send_message.call_args.args[0] == "How do cells divide?"
+    mock_registry_genai.GenerativeModel.assert_not_called()
+    assert cache.stats()["tokens_saved"] == estimate_tokens(LONG_PROMPT)
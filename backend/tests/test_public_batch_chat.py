@@ -0,0 +1,159 @@
+import asyncio
+import uuid
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+
+from app.core.config import settings
+from app.models.agent import Agent
+from app.models.conversation import Conversation
+from app.models.message import Message
+
+
+@pytest.fixture
+def agent(db_session, test_user):
+    agent = Agent(
+        user_id=test_user.id, name="Tutor", slug="tutor", system_prompt="You are a tutor.", is_prebuilt=True
+    )
+    db_session.add(agent)
+    db_session.commit()
+    return agent
+
+
+def _api_key(client, auth_headers, limit=10):
+    response = client.post(
+        "/api/v1/api-keys",
+        json={"name": "Batch", "rate_limit_per_minute": limit},
+        headers=auth_headers,
+    )
+    return {"X-API-Key": response.json()["key"]}
+
+
+@patch("app.api.v1.public.LangchainAgentService")
+def test_batch_returns_per_item_results_and_charges_once(
+    mock_langchain_service, client, auth_headers, db_session, agent
+):
+    async def reply(agent, history, latest_input, summary=None):
+        if latest_input == "fail":
+            raise RuntimeError("model error")
+        return f"Answer to {latest_input}"
+
+    mock_instance = Mock()
+    mock_instance.agenerate_response = AsyncMock(side_effect=reply)
+    mock_langchain_service.return_value = mock_instance
+    headers = _api_key(client, auth_headers)
+
+    response = client.post(
+        "/api/v1/public/agents/tutor/chat:batch",
+        json={"items": [
+            {"message": "What is a cell?"},
+            {"message": "Hi", "conversation_id": str(uuid.uuid4())},
+            {"message": "fail"},
+        ]},
+        headers=headers,
+    )
+
+    assert response.status_code == 200
+    assert response.headers["X-RateLimit-Remaining"] == "7"
+    results = response.json()["results"]
+    assert [r["status_code"] for r in results] == [200, 404, 500]
+    assert results[0]["response"]["message"] == "Answer to What is a cell?"
+    assert results[1]["error"] == "Conversation not found"
+    assert "model error" in results[2]["error"]
+    # Only the successful item leaves a conversation behind.
+    assert db_session.query(Conversation).count() == 1
+    assert db_session.query(Message).count() == 2
+
+
+@patch("app.api.v1.public.LangchainAgentService")
+def test_item_that_fails_to_start_does_not_abort_the_batch(
+    mock_langchain_service, client, auth_headers, db_session, agent
+):
+    from app.api.v1 import public
+
+    start_turn = public._start_public_turn
+
+    def flaky_start(db, current_user, agent, item):
+        if item.message == "boom":
+            raise RuntimeError("database is locked")
+        return start_turn(db, current_user, agent, item)
+
+    mock_instance = Mock()
+    mock_instance.agenerate_response = AsyncMock(return_value="Answer")
+    mock_langchain_service.return_value = mock_instance
+
+    with patch.object(public, "_start_public_turn", side_effect=flaky_start):
+        response = client.post(
+            "/api/v1/public/agents/tutor/chat:batch",
+            json={"items": [{"message": "First"}, {"message": "boom"}, {"message": "Third"}]},
+            headers=_api_key(client, auth_headers),
+        )
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["status_code"] for r in results] == [200, 500, 200]
+    assert results[1]["error"] == "Error starting the conversation: database is locked"
+    # Both started turns were answered.
+    assert db_session.query(Conversation).count() == 2
+    assert db_session.query(Message).count() == 4
+
+
+@patch("app.api.v1.public.LangchainAgentService")
+def test_batch_generations_are_bounded(mock_langchain_service, client, auth_headers, agent, monkeypatch):
+    monkeypatch.setattr(settings, "PUBLIC_CHAT_BATCH_CONCURRENCY", 2)
+    running, peak = 0, 0
+
+    async def reply(agent, history, latest_input, summary=None):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return "ok"
+
+    mock_instance = Mock()
+    mock_instance.agenerate_response = AsyncMock(side_effect=reply)
+    mock_langchain_service.return_value = mock_instance
+
+    response = client.post(
+        "/api/v1/public/agents/tutor/chat:batch",
+        json={"items": [{"message": f"question {i}"} for i in range(5)]},
+        headers=_api_key(client, auth_headers),
+    )
+
+    assert [r["status_code"] for r in response.json()["results"]] == [200] * 5
+    assert peak == 2
+
+
+@patch("app.api.v1.public.LangchainAgentService")
+def test_batch_with_repeated_conversation_is_rejected(mock_langchain_service, client, auth_headers, agent):
+    headers = _api_key(client, auth_headers)
+    conversation_id = str(uuid.uuid4())
+
+    response = client.post(
+        "/api/v1/public/agents/tutor/chat:batch",
+        json={"items": [
+            {"message": "First", "conversation_id": conversation_id},
+            {"message": "New conversation"},
+            {"message": "Second", "conversation_id": conversation_id},
+        ]},
+        headers=headers,
+    )
+
+    assert response.status_code == 422
+    assert response.json()["detail"] == "A batch can contain at most one message per conversation"
+    mock_langchain_service.assert_not_called()
+    assert client.get("/api/v1/public/agents", headers=headers).headers["X-RateLimit-Remaining"] == "9"
+
+
+def test_oversized_or_over_limit_batches_are_rejected(client, auth_headers, agent, monkeypatch):
+    monkeypatch.setattr(settings, "PUBLIC_CHAT_BATCH_MAX_ITEMS", 3)
+    headers = _api_key(client, auth_headers, limit=2)
+    items = [{"message": "hi"}] * 3
+
+    oversized = client.post("/api/v1/public/agents/tutor/chat:batch", json={"items": items * 2}, headers=headers)
+    assert oversized.status_code == 422
+
+    limited = client.post("/api/v1/public/agents/tutor/chat:batch", json={"items": items}, headers=headers)
+    assert limited.status_code == 429
+    assert client.get("/api/v1/public/agents", headers=headers).status_code == 200
@@ -0,0 +1,100 @@
+import uuid
+
+import pytest
+
+from app.core.rate_limit import DatabaseRateLimiter, InMemoryRateLimiter
+from app.models.api_key import ApiKey
+from tests.conftest import TestingSessionLocal
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_in_memory_limiter_allows_burst_then_refills():
+    clock = FakeClock()
+    limiter = InMemoryRateLimiter(period_seconds=60, clock=clock)
+    key_id = uuid.uuid4()
+
+    decisions = [limiter.hit(key_id, limit=3) for _ in range(3)]
+    assert all(d.allowed for d in decisions)
+    assert [d.remaining for d in decisions] == [2, 1, 0]
+
+    denied = limiter.hit(key_id, limit=3)
+    assert not denied.allowed
+    assert denied.retry_after == pytest.approx(20)
+    assert denied.headers()["Retry-After"] == "20"
+
+    # One token refills every period/limit seconds.
+    clock.now += 20
+    assert limiter.hit(key_id, limit=3).allowed
+    assert not limiter.hit(key_id, limit=3).allowed
+
+
+def test_in_memory_limiter_charges_cost_and_expires_idle_keys():
+    clock = FakeClock()
+    limiter = InMemoryRateLimiter(period_seconds=60, max_keys=2, clock=clock)
+    first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+
+    assert limiter.hit(first, limit=10, cost=8).remaining == 2
+    assert not limiter.hit(first, limit=10, cost=3).allowed
+
+    limiter.hit(second, limit=10)
+    limiter.hit(third, limit=10)
+    assert len(limiter) == 2
+
+    clock.now += 61
+    limiter.hit(third, limit=10)
+    assert len(limiter) == 1
+
+
+def test_database_limiter_shares_budget_through_api_key_row(db_session, test_user):
+    api_key = ApiKey(user_id=test_user.id, key_hash="hash", name="Shared", rate_limit_per_minute=2)
+    db_session.add(api_key)
+    db_session.commit()
+
+    # Two limiter instances stand in for two workers sharing the database.
+    worker_a = DatabaseRateLimiter(session_factory=TestingSessionLocal)
+    worker_b = DatabaseRateLimiter(session_factory=TestingSessionLocal)
+
+    assert worker_a.hit(api_key.id, limit=2).allowed
+    assert worker_b.hit(api_key.id, limit=2).allowed
+    denied = worker_a.hit(api_key.id, limit=2)
+    assert not denied.allowed
+    assert denied.retry_after > 0
+
+    db_session.refresh(api_key)
+    assert api_key.rate_limit_window_start is not None
+    assert api_key.rate_limit_window_count == 2
+
+
+def test_public_api_returns_rate_limit_headers(client, auth_headers):
+    response = client.post(
+        "/api/v1/api-keys",
+        json={"name": "Limited", "rate_limit_per_minute": 2},
+        headers=auth_headers,
+    )
+    headers = {"X-API-Key": response.json()["key"]}
+
+    first = client.get("/api/v1/public/agents", headers=headers)
+    assert first.status_code == 200
+    assert first.headers["X-RateLimit-Limit"] == "2"
+    assert first.headers["X-RateLimit-Remaining"] == "1"
+
+    assert client.get("/api/v1/public/agents", headers=headers).status_code == 200
+
+    limited = client.get("/api/v1/public/agents", headers=headers)
+    assert limited.status_code == 429
+    assert limited.headers["X-RateLimit-Remaining"] == "0"
+    assert int(limited.headers["Retry-After"]) >= 1
+
+
+def test_remaining_is_stable_for_large_clock_values():
+    """Float error in (now + interval) - now must not drop a request from Remaining."""
+    for start in (1000.0, 65506.903247973816, 524264.83238839026, 4194301.702283257):
+        limiter = InMemoryRateLimiter(period_seconds=60, clock=lambda start=start: start)
+        assert limiter.hit(uuid.uuid4(), limit=2).remaining == 1
@@ -0,0 +1,199 @@
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from app.services.concurrency_limiter import UpstreamOverloaded
+from app.services.resilience import CircuitOpen, GeminiError, ResilientCaller, is_retryable, resilience
+
+PRO, FLASH = "gemini-2.5-pro", "gemini-2.5-flash"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    async def async_sleep(self, seconds):
+        self.sleep(seconds)
+
+
+def _caller(clock, **kwargs):
+    options = dict(
+        fallback_models={PRO: FLASH},
+        max_attempts=3,
+        base_delay_seconds=1.0,
+        max_delay_seconds=1.5,
+        deadline_seconds=30.0,
+        failure_threshold=3,
+        open_seconds=10.0,
+    )
+    options.update(kwargs)
+    return ResilientCaller(clock=clock, sleep=clock.sleep, async_sleep=clock.async_sleep, **options)
+
+
+def _flaky(*outcomes):
+    calls = []
+
+    def fn(model):
+        calls.append(model)
+        outcome = outcomes[len(calls) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return fn, calls
+
+
+def test_errors_are_classified_as_retryable_or_fatal():
+    assert is_retryable(google_exceptions.ServiceUnavailable("overloaded"))
+    assert is_retryable(google_exceptions.TooManyRequests("slow down"))
+    assert is_retryable(TimeoutError())
+    try:
+        try:
+            raise google_exceptions.DeadlineExceeded("deadline")
+        except Exception as e:
+            raise RuntimeError("wrapped") from e
+    except RuntimeError as wrapped:
+        assert is_retryable(wrapped)
+
+    assert not is_retryable(google_exceptions.InvalidArgument("bad request"))
+    assert not is_retryable(ValueError("response was blocked"))
+    assert not is_retryable(UpstreamOverloaded(PRO, 1, "queue full"))
+    assert is_retryable(GeminiError("failed", PRO, retryable=True))
+
+
+def test_transient_failures_are_retried_with_capped_jittered_backoff():
+    clock = FakeClock()
+    caller = _caller(clock)
+    fn, calls = _flaky(google_exceptions.ServiceUnavailable("503"), TimeoutError(), "ok")
+
+    assert caller.call(PRO, fn) == "ok"
+
+    assert calls == [PRO, PRO, PRO]
+    assert len(clock.sleeps) == 2
+    assert 0 <= clock.sleeps[0] <= 1.0 and 0 <= clock.sleeps[1] <= 1.5
+    stats = caller.stats()[PRO]
+    assert (stats["retries"], stats["failures"], stats["successes"], stats["state"]) == (2, 2, 1, "closed")
+
+
+def test_fatal_errors_and_spent_deadlines_are_not_retried():
+    clock = FakeClock()
+    fn, calls = _flaky(google_exceptions.InvalidArgument("bad request"))
+    with pytest.raises(google_exceptions.InvalidArgument):
+        _caller(clock).call(PRO, fn)
+    assert len(calls) == 1
+
+    fn, calls = _flaky(google_exceptions.ServiceUnavailable("503"), "ok")
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        _caller(clock, base_delay_seconds=50, max_delay_seconds=50, deadline_seconds=0.001).call(PRO, fn)
+    assert len(calls) == 1 and clock.sleeps == []
+
+
+def test_breaker_opens_reroutes_then_fails_fast_and_recovers():
+    clock = FakeClock()
+    caller = _caller(clock, max_attempts=1, fallback_models={PRO: FLASH})
+    down = google_exceptions.ServiceUnavailable("503")
+
+    for _ in range(3):
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            caller.call(PRO, _flaky(down)[0])
+    assert caller.stats()[PRO]["state"] == "open"
+    assert caller.open_circuits() == 1
+
+    # Open: the call goes to the fallback model without touching the primary.
+    fn, calls = _flaky("fallback answer")
+    assert caller.call(PRO, fn) == "fallback answer"
+    assert calls == [FLASH]
+
+    # Once the fallback is down too, calls fail fast with a Retry-After.
+    for _ in range(3):
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            caller.call(FLASH, _flaky(down)[0])
+    clock.now += 4
+    with pytest.raises(CircuitOpen) as excinfo:
+        caller.call(PRO, _flaky("never")[0])
+    assert excinfo.value.retry_after == 6
+    assert caller.stats()[PRO]["rejected"] == 1
+
+    # After the open period one probe is let through; its success closes the breaker.
+    clock.now += 6
+    fn, calls = _flaky("recovered")
+    assert caller.call(PRO, fn) == "recovered"
+    assert calls == [PRO]
+    assert caller.stats()[PRO]["state"] == "closed"
+
+
+def test_failed_probe_reopens_the_breaker():
+    clock = FakeClock()
+    caller = _caller(clock, max_attempts=1, failure_threshold=1, fallback_models={})
+    down = google_exceptions.ServiceUnavailable("503")
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        caller.call(PRO, _flaky(down)[0])
+
+    clock.now += 10
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        caller.call(PRO, _flaky(down)[0])
+
+    with pytest.raises(CircuitOpen):
+        caller.call(PRO, _flaky("never")[0])
+    assert caller.stats()[PRO]["opened"] == 2
+
+
+async def test_streams_are_only_retried_before_the_first_chunk():
+    clock = FakeClock()
+    caller = _caller(clock)
+    attempts = []
+
+    async def stream(model):
+        attempts.append(model)
+        if len(attempts) == 1:
+            raise google_exceptions.ServiceUnavailable("503")
+        yield "Hello"
+        if len(attempts) == 2:
+            raise google_exceptions.ServiceUnavailable("503")
+        yield " world"
+
+    chunks = []
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        async for chunk in caller.astream(PRO, stream):
+            chunks.append(chunk)
+
+    assert chunks == ["Hello"]
+    assert len(attempts) == 2
+
+
+def test_gemini_client_raises_typed_errors(monkeypatch):
+    from app.core.config import settings
+    from app.services.gemini import GeminiClient
+
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(resilience, "_sleep", lambda _seconds: None)
+    client = GeminiClient()
+
+    def unavailable(*_args):
+        raise google_exceptions.ServiceUnavailable("model overloaded")
+
+    monkeypatch.setattr(client, "_build_request", unavailable)
+    with pytest.raises(GeminiError) as excinfo:
+        client.generate_response("Be brief.", [{"role": "user", "content": "Hi"}], model=PRO)
+
+    assert excinfo.value.retryable and excinfo.value.model == PRO
+    assert resilience.stats()[PRO]["retries"] == 2
+
+
+def test_health_reports_open_breakers(client, monkeypatch):
+    monkeypatch.setattr(resilience, "_failure_threshold", 1)
+    monkeypatch.setattr(resilience, "_max_attempts", 1)
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        resilience.call(FLASH, _flaky(google_exceptions.ServiceUnavailable("503"))[0])
+
+    body = client.get("/health/llm").json()
+
+    assert body["status"] == "degraded"
+    assert body["circuit_breakers"][FLASH]["state"] == "open"
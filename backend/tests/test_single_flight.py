@@ -0,0 +1,152 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.core.config import settings
+from app.models.agent import Agent
+from app.services.langchain_client import LangchainAgentService
+from app.services.single_flight import SingleFlight, SingleFlightTimeout, request_key
+
+
+def _run_concurrently(pool: ThreadPoolExecutor, flight: SingleFlight, fn, callers: int):
+    """Start ``callers`` threads on the same key once the leader is inside ``fn``."""
+    futures = [pool.submit(flight.do, "key", fn)]
+    while flight.stats()["in_flight"] == 0:
+        pass
+    futures += [pool.submit(flight.do, "key", fn) for _ in range(callers - 1)]
+    while flight.stats()["followers"] < callers - 1:
+        pass
+    return futures
+
+
+def test_concurrent_threads_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "quiz"
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        futures = _run_concurrently(pool, flight, fn, callers=5)
+        release.set()
+        assert [f.result() for f in futures] == ["quiz"] * 5
+
+    assert len(calls) == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "followers": 4, "follower_timeouts": 0}
+
+
+def test_leader_error_reaches_every_follower_and_is_not_remembered():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise RuntimeError("quota exceeded")
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = _run_concurrently(pool, flight, fn, callers=3)
+        release.set()
+        for future in futures:
+            with pytest.raises(RuntimeError, match="quota exceeded"):
+                future.result()
+    assert flight.do("key", lambda: "recovered") == "recovered"
+
+
+def test_follower_times_out_without_cancelling_leader():
+    flight = SingleFlight(follower_timeout=0.05)
+    release = threading.Event()
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        leader = pool.submit(flight.do, "key", lambda: release.wait(5) and "done")
+        while flight.stats()["in_flight"] == 0:
+            pass
+        with pytest.raises(SingleFlightTimeout):
+            flight.do("key", lambda: "unused")
+        release.set()
+        assert leader.result() == "done"
+    assert flight.stats()["follower_timeouts"] == 1
+
+
+async def test_concurrent_coroutines_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "exam"
+
+    results = await asyncio.gather(*(flight.ado("key", fn) for _ in range(5)))
+
+    assert results == ["exam"] * 5
+    assert len(calls) == 1
+
+
+async def test_async_errors_and_timeouts_propagate():
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("bad request")
+
+    flight = SingleFlight()
+    results = await asyncio.gather(*(flight.ado("a", failing) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+
+    flight = SingleFlight(follower_timeout=0.01)
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "late"
+
+    leader, follower = await asyncio.gather(flight.ado("b", slow), flight.ado("b", slow), return_exceptions=True)
+    assert leader == "late"
+    assert isinstance(follower, SingleFlightTimeout)
+
+
+async def test_disabled_single_flight_calls_every_time():
+    flight = SingleFlight(enabled=False)
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return "x"
+
+    await asyncio.gather(*(flight.ado("key", fn) for _ in range(3)))
+    assert len(calls) == 3
+
+
+def test_request_key_depends_on_model_temperature_and_prompt():
+    base = request_key("chain", "gemini-2.5-pro", 0.7, "quiz on cells")
+    assert base == request_key("chain", "gemini-2.5-pro", 0.7, "quiz on cells")
+    assert base != request_key("chain", "gemini-2.5-flash", 0.7, "quiz on cells")
+    assert base != request_key("chain", "gemini-2.5-pro", 0.2, "quiz on cells")
+    assert base != request_key("chain", "gemini-2.5-pro", 0.7, "quiz on atoms")
+
+
+async def test_identical_chat_requests_share_one_chain_call(monkeypatch):
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "test-key")
+    service = LangchainAgentService()
+    agent = Agent(name="Plain Agent", system_prompt="Be brief.", model="gemini-2.5-flash", temperature=0.2)
+
+    async def ainvoke(_payload):
+        await asyncio.sleep(0.05)
+        return MagicMock(content="Shared answer")
+
+    chain = MagicMock()
+    chain.ainvoke = MagicMock(side_effect=ainvoke)
+    monkeypatch.setattr(service, "_build_chain", lambda _agent: chain)
+
+    results = await asyncio.gather(
+        service.agenerate_response(agent=agent, history=[], latest_input="Explain osmosis"),
+        service.agenerate_response(agent=agent, history=[], latest_input="Explain osmosis"),
+        service.agenerate_response(agent=agent, history=[], latest_input="Explain diffusion"),
+    )
+
+    assert results == ["Shared answer"] * 3
+    assert chain.ainvoke.call_count == 2
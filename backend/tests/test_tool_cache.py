@@ -0,0 +1,170 @@
+from unittest.mock import Mock
+
+import pytest
+
+from app.models.agent import Agent
+from app.models.tool_output_cache import ToolOutputCacheEntry
+from app.services import intent_router
+from app.services.tool_cache import ToolOutputCache
+from app.tools import prebuilt_agents
+from app.tools.prebuilt_agents import PREBUILT_AGENT_SLUGS, get_tools_for_agent_slug
+from tests.conftest import TestingSessionLocal
+
+TUTOR = PREBUILT_AGENT_SLUGS["personal_tutor"]
+QUIZ = "**Question 1:** What do plants make?\nA) Sugar\nB) Salt\nC) Sand\nD) Steel\n**Answer:** A\n" * 4
+
+
+class Clock:
+    def __init__(self, now: float = 1_000_000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _cache(**kwargs) -> ToolOutputCache:
+    kwargs.setdefault("agent_slugs", [TUTOR])
+    kwargs.setdefault("shared", False)
+    return ToolOutputCache(**kwargs)
+
+
+def _quiz(cache: ToolOutputCache, produce, topic: str = "Photosynthesis", **params) -> str:
+    params = {"topic": topic, "difficulty": "medium", "num_questions": 5, **params}
+    return cache.call(TUTOR, "_generate_quiz", params, produce)
+
+
+def test_normalized_parameters_share_an_entry():
+    cache = _cache()
+    produce = Mock(return_value=QUIZ)
+
+    assert _quiz(cache, produce) == QUIZ
+    assert _quiz(cache, produce, topic="  photosynthesis ", difficulty="MEDIUM", num_questions="5") == QUIZ
+    # Clamped the same way the tool clamps it.
+    _quiz(cache, produce, num_questions=50)
+    _quiz(cache, produce, num_questions=20)
+
+    assert produce.call_count == 2
+    assert cache.stats()["hits"] == 2
+
+
+def test_agents_must_opt_in():
+    cache = _cache(agent_slugs=[])
+    produce = Mock(return_value=QUIZ)
+
+    _quiz(cache, produce)
+    _quiz(cache, produce)
+
+    assert produce.call_count == 2
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.parametrize(
+    "output",
+    [
+        "Error generating quiz: quota. Please try again.",
+        "**Question 1:** [Question text]\nA) Option A\nB) Option B" * 10,
+        "Too short",
+        "A long answer without any numbered questions. " * 10,
+    ],
+)
+def test_errors_and_fallbacks_are_not_cached(output):
+    cache = _cache()
+    produce = Mock(return_value=output)
+
+    _quiz(cache, produce)
+    _quiz(cache, produce)
+
+    assert produce.call_count == 2
+    assert cache.stats()["rejected"] == 2
+
+
+def test_entries_expire_after_ttl():
+    clock = Clock()
+    cache = _cache(ttl_seconds=60, clock=clock)
+    produce = Mock(return_value=QUIZ)
+
+    _quiz(cache, produce)
+    clock.now += 59
+    _quiz(cache, produce)
+    clock.now += 2
+    _quiz(cache, produce)
+
+    assert produce.call_count == 2
+
+
+def test_lru_respects_entry_and_byte_limits():
+    cache = _cache(max_entries=2)
+    produce = Mock(return_value=QUIZ)
+    for topic in ("a", "b", "a", "c"):
+        _quiz(cache, produce, topic=topic)
+    _quiz(cache, produce, topic="a")
+    _quiz(cache, produce, topic="b")
+
+    # "b" was least recently used when "c" arrived.
+    assert produce.call_count == 4
+    assert cache.stats()["evictions"] == 2
+
+    small = _cache(max_bytes=len(QUIZ.encode()) * 2)
+    for topic in ("a", "b", "c"):
+        _quiz(small, produce, topic=topic)
+    assert small.stats()["entries"] == 2
+    assert small.stats()["bytes"] <= len(QUIZ.encode()) * 2
+
+
+def test_variants_fill_up_then_rotate(monkeypatch):
+    cache = _cache(variants=3)
+    outputs = iter([QUIZ + "v1", QUIZ + "v2", QUIZ + "v3", QUIZ + "v4"])
+    produce = Mock(side_effect=lambda: next(outputs))
+
+    first = {_quiz(cache, produce) for _ in range(3)}
+    served = {_quiz(cache, produce) for _ in range(30)}
+
+    assert first == {QUIZ + "v1", QUIZ + "v2", QUIZ + "v3"}
+    assert produce.call_count == 3
+    assert served == first
+
+
+def test_shared_tier_is_visible_to_other_workers(db_session):
+    clock = Clock()
+    worker_a = _cache(shared=True, session_factory=TestingSessionLocal, clock=clock, ttl_seconds=60)
+    worker_b = _cache(shared=True, session_factory=TestingSessionLocal, clock=clock, ttl_seconds=60)
+    produce = Mock(return_value=QUIZ)
+
+    _quiz(worker_a, produce)
+    assert _quiz(worker_b, produce) == QUIZ
+    assert produce.call_count == 1
+    assert db_session.query(ToolOutputCacheEntry).count() == 1
+
+    # Expired rows are ignored, replaced on the next store and purged.
+    clock.now += 120
+    _quiz(worker_b, Mock(return_value=QUIZ))
+    clock.now += 120
+    assert worker_a.purge_expired() == 1
+    assert db_session.query(ToolOutputCacheEntry).count() == 0
+
+
+def test_dispatch_serves_cached_tool_output(monkeypatch):
+    quiz = Mock(return_value=QUIZ)
+    monkeypatch.setattr(prebuilt_agents, "_generate_quiz", quiz)
+    monkeypatch.setattr(intent_router, "tool_cache", _cache())
+    agent = Agent(name="Tutor", is_prebuilt=True, slug=TUTOR)
+
+    first = intent_router.dispatch(agent, "Generate a quiz about Photosynthesis with 5 questions")
+    second = intent_router.dispatch(agent, "generate a quiz about photosynthesis with 5 questions")
+
+    assert first == second == QUIZ
+    quiz.assert_called_once()
+
+
+def test_langchain_tools_are_wrapped_for_opted_in_agents(monkeypatch):
+    from app.services import tool_cache as tool_cache_module
+
+    quiz = Mock(return_value=QUIZ, __name__="_generate_quiz")
+    monkeypatch.setattr(prebuilt_agents, "_generate_quiz", quiz)
+    monkeypatch.setattr(tool_cache_module, "tool_cache", _cache())
+
+    generate_quiz = next(tool for tool in get_tools_for_agent_slug(TUTOR) if tool.name == "generate_quiz")
+    generate_quiz.func("Cells")
+    generate_quiz.func("cells")
+
+    quiz.assert_called_once_with("Cells")
@@ -0,0 +1,157 @@
+import time
+from unittest.mock import patch
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.tools import StructuredTool
+
+from app.core.config import settings
+from app.models.agent import Agent
+from app.services import tool_calling as tool_calling_module
+from app.services.langchain_client import LangchainAgentService
+from app.services.llm_metrics import llm_call, track_prompt_usage
+from app.services.llm_registry import llm_registry
+from app.services.tool_calling import NO_TOOL_CALLS, ToolCallingLoop
+from app.tools import PREBUILT_AGENT_SLUGS, get_structured_tools_for_agent_slug
+
+SLUG = PREBUILT_AGENT_SLUGS["exam_prep_agent"]
+
+
+def _lookup(topic: str) -> str:
+    time.sleep(0.2)
+    return f"notes on {topic}"
+
+
+def _broken(topic: str) -> str:
+    raise RuntimeError("index unavailable")
+
+
+def _stuck(topic: str) -> str:
+    time.sleep(0.5)
+    return "too late"
+
+
+FAKE_TOOLS = tuple(
+    StructuredTool.from_function(func=func, name=name, description=name)
+    for name, func in (("lookup", _lookup), ("broken", _broken), ("stuck", _stuck))
+)
+
+
+class ScriptedModel:
+    """Returns the scripted responses in order and records what it was sent."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def invoke(self, messages, **kwargs):
+        self.calls.append((list(messages), kwargs))
+        return self.responses.pop(0)
+
+    async def ainvoke(self, messages, **kwargs):
+        return self.invoke(messages, **kwargs)
+
+
+def _calls(*names):
+    return AIMessage(
+        content="",
+        tool_calls=[{"name": name, "args": {"topic": f"topic {i}"}, "id": f"call-{i}"} for i, name in enumerate(names)],
+    )
+
+
+def _loop(monkeypatch, model, **kwargs):
+    monkeypatch.setattr(tool_calling_module, "get_structured_tools_for_agent_slug", lambda slug: FAKE_TOOLS)
+    monkeypatch.setattr(llm_registry, "tool_model", lambda *args: model)
+    return ToolCallingLoop(agent_slugs=[SLUG], **kwargs)
+
+
+def test_structured_tools_are_built_once_per_slug():
+    tools = get_structured_tools_for_agent_slug(SLUG)
+
+    assert tools is get_structured_tools_for_agent_slug(SLUG)
+    practice_exam = next(tool for tool in tools if tool.name == "create_practice_exam")
+    assert {"exam_type", "subject", "num_questions"} <= set(practice_exam.args)
+
+
+async def test_tool_calls_of_one_step_run_concurrently(monkeypatch):
+    model = ScriptedModel(_calls("lookup", "lookup"), AIMessage(content="Both topics are covered."))
+    loop = _loop(monkeypatch, model)
+    agent = Agent(name="Exam Prep", slug=SLUG)
+
+    started = time.monotonic()
+    result = await loop.arun(agent, [HumanMessage(content="Compare the topics")])
+
+    assert time.monotonic() - started < 0.35
+    assert result.output.content == "Both topics are covered."
+    assert [t.name for t in result.steps[0].tool_calls] == ["lookup", "lookup"]
+    assert all(t.seconds >= 0.2 for t in result.steps[0].tool_calls)
+    assert len(result.steps) == 2 and not result.max_steps_reached
+    sent = model.calls[1][0]
+    assert [m.content for m in sent if isinstance(m, ToolMessage)] == ["notes on topic 0", "notes on topic 1"]
+    assert loop.stats()["tool_calls"] == 2
+
+
+def test_threaded_tool_calls_run_concurrently(monkeypatch):
+    model = ScriptedModel(_calls("lookup", "lookup", "lookup"), AIMessage(content="done"))
+    loop = _loop(monkeypatch, model)
+
+    started = time.monotonic()
+    loop.run(Agent(name="Exam Prep", slug=SLUG), [HumanMessage(content="hi")])
+
+    assert time.monotonic() - started < 0.5
+
+
+def test_errors_and_timeouts_are_returned_to_the_model(monkeypatch):
+    model = ScriptedModel(_calls("broken", "stuck", "missing"), _calls("missing"), AIMessage(content="Sorry."))
+    loop = _loop(monkeypatch, model, max_steps=2, tool_timeout_seconds=0.05)
+
+    result = loop.run(Agent(name="Exam Prep", slug=SLUG), [HumanMessage(content="hi")])
+
+    first_results = [m.content for m in model.calls[1][0] if isinstance(m, ToolMessage)]
+    assert "index unavailable" in first_results[0]
+    assert "did not finish within 0.05 seconds" in first_results[1]
+    assert "Unknown tool: missing" in first_results[2]
+    # The step cap was reached: the last call may not ask for more tools.
+    assert model.calls[2][1] == {"tool_config": NO_TOOL_CALLS}
+    assert result.max_steps_reached and result.output.content == "Sorry."
+    stats = loop.stats()
+    assert (stats["tool_errors"], stats["tool_timeouts"], stats["max_steps_reached"]) == (3, 1, 1)
+
+
+async def test_llm_calls_inside_tools_count_towards_the_turn_on_both_paths(monkeypatch):
+    def _summarize(topic: str) -> str:
+        with llm_call("gemini-2.5-pro", None, 7) as call:
+            return call.finished(f"summary of {topic}")
+
+    agent = Agent(name="Exam Prep", slug=SLUG, model="gemini-2.5-flash")
+    usages = []
+    for threaded in (True, False):
+        loop = _loop(monkeypatch, ScriptedModel(_calls("summarize", "summarize"), AIMessage(content="done")))
+        monkeypatch.setattr(
+            tool_calling_module, "get_structured_tools_for_agent_slug",
+            lambda slug: (StructuredTool.from_function(func=_summarize, name="summarize", description="summarize"),),
+        )
+        with track_prompt_usage() as usage:
+            if threaded:
+                loop.run(agent, [HumanMessage(content="hi")])
+            else:
+                await loop.arun(agent, [HumanMessage(content="hi")])
+        usages.append(usage.llm_calls)
+
+    # Two model steps and one call per tool.
+    assert usages == [4, 4]
+
+
+async def test_function_calling_agents_skip_the_regex_intents(monkeypatch):
+    from app.services import langchain_client
+
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "test-key")
+    model = ScriptedModel(_calls("lookup"), AIMessage(content="Here is your review."))
+    monkeypatch.setattr(langchain_client, "tool_calling", _loop(monkeypatch, model))
+    agent = Agent(name="Exam Prep", slug=SLUG, system_prompt="You coach exams.")
+
+    with patch("app.services.intent_router.dispatch") as dispatch:
+        result = await LangchainAgentService().agenerate_response(agent, [], "Generate a quiz on cells")
+
+    assert result == "Here is your review."
+    dispatch.assert_not_called()
+    assert model.calls[0][0][0].content == "You coach exams.\n\nGenerate a quiz on cells"
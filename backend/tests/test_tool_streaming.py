@@ -0,0 +1,104 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.core.config import settings
+from app.models.agent import Agent
+from app.services.langchain_client import LangchainAgentService
+from app.tools import prebuilt_agents
+from app.tools.prebuilt_agents import PREBUILT_AGENT_SLUGS
+
+QUIZ = (
+    "Sure! Here is your quiz:\n\n"
+    + "".join(
+        f"**Question {i}:** What is {i} + {i}?\nA) {i}\nB) {2 * i}\nC) {3 * i}\nD) 0\n**Answer:** B\n\n"
+        for i in range(1, 6)
+    )
+    + "Good luck with your studies!"
+)
+
+
+def _chunks(text: str, size: int):
+    async def astream(**_kwargs):
+        for start in range(0, len(text), size):
+            yield text[start:start + size]
+    return astream
+
+
+async def _collect(stream) -> str:
+    return "".join([chunk async for chunk in stream])
+
+
+@pytest.mark.parametrize("size", [1, 7, 64, 10_000])
+async def test_streamed_quiz_matches_batch_cleanup(size):
+    with patch("app.services.gemini.GeminiClient") as gemini:
+        gemini.return_value.generate_response.return_value = QUIZ
+        gemini.return_value.astream = _chunks(QUIZ, size)
+
+        streamed = await _collect(prebuilt_agents._astream_quiz("Arithmetic", "easy", 5))
+        batch = prebuilt_agents._generate_quiz("Arithmetic", "easy", 5)
+
+    assert streamed == batch
+    assert streamed.startswith("**Question 1:**")
+    assert streamed.endswith("**Answer:** B")
+    assert "Good luck" not in streamed
+
+
+async def test_exam_streams_first_question_before_generation_finishes():
+    finish = asyncio.Event()
+
+    async def astream(**_kwargs):
+        yield "**Question 1:** First?\nA) a\nB) b\nC) c\nD) d\n**Answer:** A\n\n**Question 2:** Second?\n"
+        await finish.wait()
+        yield "A) a\nB) b\nC) c\nD) d\n**Answer:** C\n"
+
+    with patch("app.services.gemini.GeminiClient") as gemini:
+        gemini.return_value.astream = astream
+        # Below EXAM_SECTION_SIZE: one streamed call.
+        stream = prebuilt_agents._astream_practice_exam("SAT", "Math", 15)
+
+        first = await asyncio.wait_for(stream.__anext__(), timeout=1)
+        assert first.startswith("**Question 1:** First?")
+        finish.set()
+        rest = await _collect(stream)
+
+    assert (first + rest).endswith("**Answer:** C\n")
+
+
+async def test_failed_stream_raises_instead_of_writing_an_error():
+    async def astream(**_kwargs):
+        raise RuntimeError("quota exceeded")
+        yield  # pragma: no cover
+
+    with patch("app.services.gemini.GeminiClient") as gemini:
+        gemini.return_value.astream = astream
+        with pytest.raises(RuntimeError, match="quota exceeded"):
+            await _collect(prebuilt_agents._astream_micro_lesson("Atoms", 5))
+
+
+async def test_stream_response_routes_tool_intents(monkeypatch):
+    monkeypatch.setattr(settings, "GEMINI_API_KEY", "test-key")
+    service = LangchainAgentService()
+    build_llm = MagicMock()
+    monkeypatch.setattr(service, "_build_llm", build_llm)
+    calls = []
+
+    async def fake_exam(**params):
+        calls.append(params)
+        yield "**Question 1:** ..."
+        yield "\n**Answer:** A"
+
+    monkeypatch.setattr(prebuilt_agents, "_astream_practice_exam", fake_exam)
+    agent = Agent(name="Exam Prep", is_prebuilt=True, slug=PREBUILT_AGENT_SLUGS["exam_prep_agent"])
+
+    chunks = [
+        chunk
+        async for chunk in service.stream_response(
+            agent=agent, history=[], latest_input="Create a practice exam for SAT with 50 questions"
+        )
+    ]
+
+    assert chunks == ["**Question 1:** ...", "\n**Answer:** A"]
+    assert calls[0]["num_questions"] == 50
+    build_llm.assert_not_called()
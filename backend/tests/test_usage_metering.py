@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.usage_metering import UsageMeter, usage_meter
+from app.models.api_key import ApiKey
+from app.models.api_key_usage_daily import ApiKeyUsageDaily
+from tests.conftest import TestingSessionLocal
+
+
+@pytest.fixture
+def stored_key(db_session, test_user):
+    api_key = ApiKey(user_id=test_user.id, key_hash="hash", name="Metered")
+    db_session.add(api_key)
+    db_session.commit()
+    db_session.refresh(api_key)
+    return api_key
+
+
+def test_flush_upserts_daily_counts_and_totals(db_session, stored_key):
+    meter = UsageMeter()
+    now = datetime.utcnow()
+    for _ in range(3):
+        meter.record(stored_key.id, now)
+    meter.record(stored_key.id, now - timedelta(days=1))
+
+    assert meter.flush(TestingSessionLocal) == 4
+    assert meter.pending() == 0
+
+    meter.record(stored_key.id, now, count=2)
+    assert meter.flush(TestingSessionLocal) == 2
+
+    rows = {
+        row.usage_date: row.request_count
+        for row in db_session.query(ApiKeyUsageDaily).filter(ApiKeyUsageDaily.api_key_id == stored_key.id)
+    }
+    assert rows == {now.date(): 5, (now - timedelta(days=1)).date(): 1}
+
+    db_session.refresh(stored_key)
+    assert stored_key.total_requests == 6
+    assert stored_key.last_used_at == now
+
+
+def test_failed_flush_keeps_counts_for_retry(stored_key):
+    meter = UsageMeter()
+    meter.record(stored_key.id)
+
+    def broken_session():
+        raise RuntimeError("database unavailable")
+
+    with pytest.raises(RuntimeError):
+        meter.flush(broken_session)
+    assert meter.pending() == 1
+    assert meter.flush(TestingSessionLocal) == 1
+
+
+def test_public_requests_are_metered_without_db_writes(client, auth_headers, db_session):
+    response = client.post("/api/v1/api-keys", json={"name": "Metered"}, headers=auth_headers)
+    key = response.json()
+    usage_meter.flush(TestingSessionLocal)
+
+    for _ in range(2):
+        assert client.get("/api/v1/public/agents", headers={"X-API-Key": key["key"]}).status_code == 200
+    assert db_session.query(ApiKeyUsageDaily).count() == 0
+
+    usage_meter.flush(TestingSessionLocal)
+    usage = client.get(f"/api/v1/api-keys/{key['id']}/usage", headers=auth_headers).json()
+    assert usage["total_requests"] == 2
+    assert usage["requests_today"] == 2
+    assert usage["requests_this_month"] == 2
+    assert usage["last_used_at"] is not None